@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+"""
+Benchmark för kedjan inspelning → konvertering → uppladdning.
+
+Syntetiserar WAV-filer (1 min till 8 h), kör konvertering/DSP/kodning i
+olika varianter och laddar upp mot en lokal stub-server (HTTP, n8n och
+S3-kompatibel). Varje fall körs i en egen process så att CPU-tid och
+högsta RSS mäts per fall. Resultatet skrivs som JSON för att kunna jämföra
+versioner över tid.
+
+Exempel:
+    python3 benchmarks/bench_pipeline.py --durations 1m,10m
+    python3 benchmarks/bench_pipeline.py --durations 8h --cases encode
+    python3 benchmarks/bench_pipeline.py --compare benchmarks/results/förra.json
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import wave
+import shutil
+import argparse
+import platform
+import resource
+import threading
+import subprocess
+import statistics
+from pathlib import Path
+from datetime import datetime
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+SAMPLE_RATE = 16000
+BLOCK_FRAMES = 1024              # Samma blockstorlek som LevelMonitor
+DEFAULT_WORKDIR = Path(os.getenv("BENCH_WORKDIR", "/tmp/meetrec-bench"))
+DEFAULT_RESULTS = ROOT / "benchmarks" / "results"
+
+# Fallgrupper: namn -> lista med (fallnamn, parametrar)
+CASES = {
+    "encode": [
+        ("encode:flac", {"codec": "flac", "gain": 1.0}),
+        ("encode:flac:gain2", {"codec": "flac", "gain": 2.0}),
+        ("encode:opus", {"codec": "opus", "gain": 1.0}),
+    ],
+    "dsp": [
+        ("dsp:level_meter:1ch", {"channels": 1}),
+        ("dsp:level_meter:6ch", {"channels": 6}),
+    ],
+    "capture": [
+        ("capture:synthetic:6ch48k", {"channels": 6, "samplerate": 48000}),
+        ("capture:synthetic:6ch48k:xruns", {"channels": 6, "samplerate": 48000, "xrun_rate": 0.01}),
+    ],
+    "resample": [
+        ("resample:48k-16k", {"from_rate": 48000}),
+        ("resample:44k1-16k", {"from_rate": 44100}),
+    ],
+    "encrypt": [
+        ("encrypt:none", {"cipher": None}),
+        ("encrypt:aes-gcm", {"cipher": "aes-gcm"}),
+        ("encrypt:chacha20", {"cipher": "chacha20"}),
+    ],
+    "upload": [
+        ("upload:http", {"target": "http"}),
+        ("upload:n8n", {"target": "n8n"}),
+        ("upload:s3", {"target": "s3"}),
+    ],
+}
+
+
+# ========= Syntetiskt ljud =========
+def parse_duration(text: str) -> int:
+    """Tolka '90s', '1m', '8h' till sekunder"""
+    text = text.strip().lower()
+    units = {"s": 1, "m": 60, "h": 3600}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def synth_block(rng: np.random.Generator, start: int, frames: int, channels: int = 1) -> np.ndarray:
+    """
+    Talliknande signal: brus med stavelserytm (~4 Hz) och pauser.
+
+    Deterministisk för ett givet frö så att filstorlek och kodningstid
+    går att jämföra mellan körningar.
+    """
+    t = (start + np.arange(frames)) / SAMPLE_RATE
+    envelope = np.clip(np.sin(2 * np.pi * 4.0 * t), 0.0, None) * (np.sin(2 * np.pi * 0.2 * t) > -0.3)
+    noise = rng.standard_normal((frames, channels)).astype(np.float32)
+    signal = noise * (0.02 + 0.3 * envelope[:, None])
+    return np.clip(signal * 32767, -32768, 32767).astype(np.int16)
+
+
+def synth_wav(path: Path, seconds: int) -> Path:
+    """Skriv syntetisk WAV (mono, 16 kHz, 16 bit) i block; återanvänds om den finns"""
+    if path.exists() and path.stat().st_size >= seconds * SAMPLE_RATE * 2:
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seconds)
+    chunk = SAMPLE_RATE * 60
+    tmp = path.with_suffix(".tmp")
+    with wave.open(str(tmp), "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        written = 0
+        total = seconds * SAMPLE_RATE
+        while written < total:
+            frames = min(chunk, total - written)
+            w.writeframes(synth_block(rng, written, frames).tobytes())
+            written += frames
+    os.replace(tmp, path)
+    return path
+
+
+# ========= Stub-server för uppladdning =========
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def stub_app(environ, start_response):
+    """
+    Tar emot uppladdningar och slänger datat.
+
+    Hanterar multipart-POST (HTTP/n8n) och den delmängd av S3-API:t som
+    boto3 använder vid upload_file (PUT samt multipart upload).
+    """
+    length = int(environ.get("CONTENT_LENGTH") or 0)
+    body = environ["wsgi.input"]
+    remaining = length
+    while remaining > 0:
+        chunk = body.read(min(remaining, 1 << 20))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+
+    method = environ["REQUEST_METHOD"]
+    query = environ.get("QUERY_STRING", "")
+    xml = [("Content-Type", "application/xml")]
+    if method == "POST" and query.startswith("uploads"):
+        bucket, _, key = environ["PATH_INFO"].lstrip("/").partition("/")
+        start_response("200 OK", xml)
+        return [(
+            "<InitiateMultipartUploadResult><Bucket>%s</Bucket><Key>%s</Key>"
+            "<UploadId>%s</UploadId></InitiateMultipartUploadResult>" % (bucket, key, uuid.uuid4().hex)
+        ).encode()]
+    if method == "POST" and "uploadId=" in query:
+        start_response("200 OK", xml)
+        return [b'<CompleteMultipartUploadResult><ETag>"bench"</ETag></CompleteMultipartUploadResult>']
+    if method == "PUT":
+        start_response("200 OK", [("ETag", '"%s"' % uuid.uuid4().hex), ("Content-Length", "0")])
+        return [b""]
+    start_response("200 OK", [("Content-Type", "application/json")])
+    return [b'{"ok": true}']
+
+
+def start_stub_server():
+    server = make_server("127.0.0.1", 0, stub_app, server_class=ThreadingWSGIServer, handler_class=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+# ========= Fall (körs i underprocess) =========
+# Varje fall förbereds först (importer, testdata, stub-server) och returnerar
+# sedan en funktion som utför själva arbetet; bara den mäts. Ett fall som
+# inte kan köras här returnerar {"skipped": orsak}.
+def prepare_encode(wav: Path, params: dict, workdir: Path):
+    from pipeline import encode_audio
+    if not shutil.which("ffmpeg"):
+        return {"skipped": "ffmpeg saknas"}
+    # Hårdlänka WAV-filen så att varje fall får en egen utdatafil
+    case_wav = workdir / f"{wav.stem}-{params['codec']}-{params['gain']}.wav"
+    if not case_wav.exists():
+        try:
+            os.link(wav, case_wav)
+        except OSError:
+            shutil.copy(wav, case_wav)
+
+    def run():
+        ok, out_path, msg = encode_audio(case_wav, gain=params["gain"], codec=params["codec"])
+        if not ok:
+            return {"ok": False, "error": msg}
+        return {"ok": True, "output": str(out_path), "output_bytes": out_path.stat().st_size}
+    return run
+
+
+def prepare_dsp(wav: Path, params: dict, workdir: Path):
+    import queue
+    from audio_source import SyntheticSource
+    from recorder import LevelMonitor
+    channels = params["channels"]
+    monitor = LevelMonitor(num_channels=channels, source=SyntheticSource(channels=channels, samplerate=SAMPLE_RATE))
+    rng = np.random.default_rng(0)
+    # Några förberäknade block återanvänds; det är callbacken som mäts
+    blocks = [synth_block(rng, i * BLOCK_FRAMES, BLOCK_FRAMES, channels) for i in range(16)]
+    calls = wav_frames(wav) // BLOCK_FRAMES
+
+    def run():
+        for i in range(calls):
+            monitor._audio_callback(blocks[i % len(blocks)], BLOCK_FRAMES, None, None)
+            if i % 64 == 0:
+                monitor.q = queue.Queue()
+        return {"ok": True, "callbacks": calls, "input_bytes": calls * BLOCK_FRAMES * channels * 2}
+    return run
+
+
+def prepare_capture(wav: Path, params: dict, workdir: Path):
+    from audio_source import SyntheticSource, SourceCapture
+    from recorder import LevelMonitor
+    seconds = wav_frames(wav) // SAMPLE_RATE
+    channels, rate = params["channels"], params["samplerate"]
+    # Emulerad enhet i full fart: inspelning och nivåmätning från samma källa
+    source = SyntheticSource(channels=channels, samplerate=rate, speed=0, duration=seconds,
+                             xrun_rate=params.get("xrun_rate", 0.0))
+    monitor = LevelMonitor(num_channels=channels, source=source)
+    out = workdir / f"capture-{channels}ch-{rate}-{seconds}s.wav"
+
+    def on_block(indata, frames, time_info, status):
+        monitor._audio_callback(indata, frames, time_info, status)
+        monitor.read_levels(timeout=0)
+
+    def run():
+        capture = SourceCapture(source, out, on_block=on_block)
+        source.finished.wait()
+        capture.terminate()
+        capture.wait()
+        return {
+            "ok": True, "frames": capture.frames_written, "xruns": source.xruns,
+            "input_bytes": seconds * rate * channels * 2,
+        }
+    return run
+
+
+def prepare_resample(wav: Path, params: dict, workdir: Path):
+    from resample import resample_wav
+    rate = params["from_rate"]
+    # Indata i enhetens frekvens skapas en gång (mäts inte)
+    source = workdir / f"{wav.stem}-{rate}.wav"
+    if not source.exists():
+        resample_wav(wav, source, rate)
+    out = workdir / f"{source.stem}-{SAMPLE_RATE}.wav"
+
+    def run():
+        resample_wav(source, out, SAMPLE_RATE)
+        return {"ok": True, "output_bytes": out.stat().st_size, "input_bytes": source.stat().st_size}
+    return run
+
+
+def prepare_encrypt(wav: Path, params: dict, workdir: Path):
+    from pipeline import ENCODE_CHUNK
+    from integrity import HashingWriter
+    from encryption import CRYPTOGRAPHY_AVAILABLE, Encryptor, EncryptingWriter
+    cipher = params["cipher"]
+    if cipher and not CRYPTOGRAPHY_AVAILABLE:
+        return {"skipped": "cryptography saknas"}
+    # Samma skrivväg som encode_audio (block från ffmpeg → kryptering → hash → disk);
+    # encrypt:none är referensen utan kryptering
+    flac = workdir / f"{wav.stem}-flac-1.0.flac"
+    path = flac if flac.exists() else wav
+    out = workdir / f"{path.name}.{cipher or 'plain'}"
+    key = os.urandom(32)
+
+    def run():
+        writer = HashingWriter(out)
+        if cipher:
+            writer = EncryptingWriter(writer, Encryptor(key, cipher))
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(ENCODE_CHUNK), b""):
+                writer.write(chunk)
+        digest = writer.commit()
+        return {"ok": True, "output_bytes": digest.size, "input_bytes": path.stat().st_size}
+    return run
+
+
+def prepare_upload(wav: Path, params: dict, workdir: Path):
+    from pipeline import upload_file
+    target = params["target"]
+    module = "boto3" if target == "s3" else "requests"
+    try:
+        __import__(module)
+    except ImportError:
+        return {"skipped": f"{module} saknas"}
+    # Ladda upp FLAC om den kodats i samma körning (realistisk storlek), annars WAV
+    flac = workdir / f"{wav.stem}-flac-1.0.flac"
+    path = flac if flac.exists() else wav
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+    _server, url = start_stub_server()
+    settings = {
+        "upload_target": target,
+        "http_upload_url": f"{url}/upload",
+        "n8n_webhook_url": f"{url}/webhook",
+        "s3_bucket": "bench",
+        "s3_endpoint_url": url,
+    }
+
+    # Servern stängs inte: shutdown() väntar på nästa poll (0,5 s) och skulle
+    # hamna i mätningen; processen avslutas ändå efter fallet
+    def run():
+        ok, info = upload_file(path, settings=settings)
+        return {"ok": ok, "info": info, "file": path.name, "input_bytes": path.stat().st_size}
+    return run
+
+
+PREPARERS = {"encode": prepare_encode, "dsp": prepare_dsp, "capture": prepare_capture,
+             "resample": prepare_resample, "encrypt": prepare_encrypt, "upload": prepare_upload}
+
+
+def wav_frames(path: Path) -> int:
+    with wave.open(str(path), "rb") as w:
+        return w.getnframes()
+
+
+def run_case_in_process(group: str, name: str, params: dict, wav: Path, workdir: Path) -> dict:
+    """Kör ett fall och mät tid/CPU/RSS (anropas i underprocess)"""
+    duration_s = wav_frames(wav) // SAMPLE_RATE
+    run = PREPARERS[group](wav, params, workdir)
+    if isinstance(run, dict):
+        return {**run, "case": name, "duration_s": duration_s}
+
+    self_before = resource.getrusage(resource.RUSAGE_SELF)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    wall_start = time.perf_counter()
+    result = run()
+    wall = time.perf_counter() - wall_start
+    self_after = resource.getrusage(resource.RUSAGE_SELF)
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    cpu = sum(getattr(a, f) - getattr(b, f)
+              for a, b in ((self_after, self_before), (children_after, children_before))
+              for f in ("ru_utime", "ru_stime"))
+    input_bytes = result.pop("input_bytes", wav.stat().st_size)
+    # ru_maxrss är i kB på Linux (byte på macOS)
+    rss_scale = 1 if sys.platform == "darwin" else 1024
+    result.update({
+        "case": name,
+        "duration_s": duration_s,
+        "wall_s": wall,
+        "cpu_s": cpu,
+        "peak_rss_bytes": self_after.ru_maxrss * rss_scale,
+        "peak_child_rss_bytes": children_after.ru_maxrss * rss_scale,
+        "input_bytes": input_bytes,
+        "bytes_per_s": input_bytes / wall if wall > 0 else None,
+    })
+    return result
+
+
+# ========= Rapport =========
+def git_version() -> str:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty", "--tags"], cwd=ROOT,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def ffmpeg_version() -> str:
+    try:
+        out = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True).stdout
+        return out.splitlines()[0] if out else "unknown"
+    except OSError:
+        return "saknas"
+
+
+def summarize(runs: list) -> dict:
+    """Slå ihop upprepningar: median för tider, max för RSS"""
+    done = [r for r in runs if "wall_s" in r and not r.get("skipped")]
+    summary = dict(runs[-1])
+    if len(done) > 1:
+        for key in ("wall_s", "cpu_s", "bytes_per_s"):
+            values = [r[key] for r in done if r.get(key) is not None]
+            if values:
+                summary[key] = statistics.median(values)
+                summary[f"{key}_min"] = min(values)
+        for key in ("peak_rss_bytes", "peak_child_rss_bytes"):
+            summary[key] = max(r[key] for r in done)
+    summary["repeats"] = len(runs)
+    return summary
+
+
+def compare(report: dict, baseline_path: Path):
+    baseline = json.loads(baseline_path.read_text())
+    previous = {(r["case"], r.get("duration_s")): r for r in baseline.get("results", [])}
+    print(f"\nJämförelse mot {baseline.get('version')} ({baseline_path.name}):")
+    for r in report["results"]:
+        old = previous.get((r["case"], r.get("duration_s")))
+        if not old or not old.get("wall_s") or not r.get("wall_s"):
+            continue
+        ratio = r["wall_s"] / old["wall_s"]
+        flag = "  <-- långsammare" if ratio > 1.10 else ""
+        print(f"  {r['case']:<24} {r['duration_s']:>6}s  {old['wall_s']:8.2f}s → {r['wall_s']:8.2f}s  ({ratio:5.2f}x){flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--durations", default="1m,10m,1h", help="Längder att syntetisera, t.ex. 1m,10m,1h,8h")
+    parser.add_argument("--cases", default="encode,dsp,capture,upload", help="Fallgrupper: " + ",".join(CASES))
+    parser.add_argument("--repeat", type=int, default=1, help="Antal upprepningar per fall")
+    parser.add_argument("--workdir", type=Path, default=DEFAULT_WORKDIR, help="Katalog för syntetiska filer")
+    parser.add_argument("--output", type=Path, help="JSON-rapport (standard: benchmarks/results/)")
+    parser.add_argument("--compare", type=Path, help="Tidigare rapport att jämföra med")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        spec = json.loads(args.run_case)
+        result = run_case_in_process(spec["group"], spec["name"], spec["params"], Path(spec["wav"]), args.workdir)
+        print(json.dumps(result))
+        return
+
+    groups = [g.strip() for g in args.cases.split(",") if g.strip()]
+    unknown = [g for g in groups if g not in CASES]
+    if unknown:
+        parser.error(f"Okända fallgrupper: {', '.join(unknown)}")
+
+    args.workdir.mkdir(parents=True, exist_ok=True)
+    results = []
+    for seconds in [parse_duration(d) for d in args.durations.split(",")]:
+        print(f"Syntetiserar {seconds} s WAV…", flush=True)
+        wav = synth_wav(args.workdir / f"synth-{seconds}s.wav", seconds)
+        for group in groups:
+            for name, params in CASES[group]:
+                runs = []
+                for _ in range(args.repeat):
+                    spec = json.dumps({"group": group, "name": name, "params": params, "wav": str(wav)})
+                    proc = subprocess.run(
+                        [sys.executable, __file__, "--workdir", str(args.workdir), "--run-case", spec],
+                        capture_output=True, text=True,
+                    )
+                    if proc.returncode != 0:
+                        runs.append({"case": name, "duration_s": seconds, "ok": False, "error": proc.stderr.strip()[-500:]})
+                    else:
+                        runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+                result = summarize(runs)
+                results.append(result)
+                if result.get("skipped"):
+                    print(f"  {name:<24} hoppas över: {result['skipped']}")
+                elif "wall_s" in result:
+                    print(f"  {name:<24} {result['wall_s']:8.2f}s vägg  {result['cpu_s']:8.2f}s CPU  "
+                          f"{result['peak_rss_bytes'] / 2**20:7.1f} MiB  {result['bytes_per_s'] / 2**20:8.1f} MiB/s"
+                          + ("" if result.get("ok", True) else f"  FEL: {result.get('error') or result.get('info')}"))
+                else:
+                    print(f"  {name:<24} FEL: {result.get('error')}")
+
+    report = {
+        "version": git_version(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "host": {
+            "machine": platform.machine(),
+            "system": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "ffmpeg": ffmpeg_version(),
+        },
+        "results": results,
+    }
+    output = args.output or DEFAULT_RESULTS / f"bench-{report['version']}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    print(f"\nRapport: {output}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
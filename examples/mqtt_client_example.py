@@ -6,6 +6,7 @@ Detta exempel visar:
 1. Hur man skickar kommandon till inspelaren
 2. Hur man lyssnar på status-uppdateringar
 3. Hur man uppdaterar konfiguration
+4. Hur man matchar kommandokvittenser via MQTT v5 (response topic + correlation data)
 
 Fungerar med både lokala MQTT-brokers och HiveMQ Cloud.
 
@@ -17,6 +18,7 @@ import json
 import time
 import sys
 import ssl
+import uuid
 
 # MQTT-konfiguration (ändra efter behov)
 # För lokal broker:
@@ -32,14 +34,21 @@ MQTT_USE_TLS = False
 MQTT_USERNAME = None  # Sätt om broker kräver autentisering (KRÄVS för HiveMQ Cloud)
 MQTT_PASSWORD = None
 DEVICE_TOPIC_PREFIX = "meetrec/device1"  # Ändra till din enhets topic prefix
+MQTT_USE_V5 = False  # Sätt till True om enheten kör med MQTT_PROTOCOL=5
+RESPONSE_TOPIC = f"meetrec-controller/{uuid.uuid4().hex[:8]}/acks"
 
-def on_connect(client, userdata, flags, rc):
+# Skickade kommandon som väntar på kvittens: correlation id -> sändtid
+pending_commands = {}
+
+def on_connect(client, userdata, flags, rc, properties=None):
     """Callback när anslutning upprättas"""
     if rc == 0:
         print(f"✓ Ansluten till MQTT-broker {MQTT_BROKER}")
         # Prenumerera på alla topics från enheten
         client.subscribe(f"{DEVICE_TOPIC_PREFIX}/#")
         print(f"✓ Prenumererar på {DEVICE_TOPIC_PREFIX}/#")
+        if MQTT_USE_V5:
+            client.subscribe(RESPONSE_TOPIC)
     else:
         print(f"✗ Anslutning misslyckades med kod {rc}")
 
@@ -48,6 +57,15 @@ def on_message(client, userdata, msg):
     topic = msg.topic
     payload = msg.payload.decode('utf-8')
     
+    # Matcha kvittens mot skickat kommando via correlation data
+    correlation = getattr(getattr(msg, "properties", None), "CorrelationData", None)
+    if correlation is not None:
+        sent = pending_commands.pop(correlation.decode("utf-8"), None)
+        if sent is not None:
+            rtt_ms = (time.monotonic() - sent) * 1000.0
+            print(f"\n✅ Kvittens ({rtt_ms:.1f} ms tur och retur): {payload}")
+            return
+    
     print(f"\n📨 Meddelande från enhet:")
     print(f"   Topic: {topic}")
     
@@ -62,7 +80,17 @@ def send_command(client, command):
     """Skicka kommando till enheten"""
     topic = f"{DEVICE_TOPIC_PREFIX}/command"
     print(f"\n📤 Skickar kommando: {command}")
-    client.publish(topic, command)
+    if MQTT_USE_V5:
+        from paho.mqtt.properties import Properties
+        from paho.mqtt.packettypes import PacketTypes
+        correlation_id = uuid.uuid4().hex
+        props = Properties(PacketTypes.PUBLISH)
+        props.ResponseTopic = RESPONSE_TOPIC
+        props.CorrelationData = correlation_id.encode("utf-8")
+        pending_commands[correlation_id] = time.monotonic()
+        client.publish(topic, command, qos=1, properties=props)
+    else:
+        client.publish(topic, command)
     print(f"   Till topic: {topic}")
 
 def update_config(client, config_updates):
@@ -81,7 +109,10 @@ def main():
     print("="*60)
     
     # Skapa MQTT-klient
-    client = mqtt.Client()
+    if MQTT_USE_V5:
+        client = mqtt.Client(protocol=mqtt.MQTTv5)
+    else:
+        client = mqtt.Client()
     client.on_connect = on_connect
     client.on_message = on_message
     
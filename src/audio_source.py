@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+"""
+Utbytbara ljudkällor för nivåmätning och inspelning.
+
+- SoundDeviceSource: riktig ljudenhet via sounddevice (standard)
+- SyntheticSource: genererat, talliknande flerkanalsljud
+- FileSource: uppspelning av en WAV-fil
+
+Alla källor levererar int16-block till en callback med samma signatur som
+sounddevice.InputStream (indata, frames, time_info, status), så att
+nivåmätning och inspelning kan köras utan hårdvara - i CI, på utvecklares
+datorer och i belastningstester snabbare än realtid. Syntetiska källor och
+filkällor kan injicera xruns (tappade block) och klippning.
+
+Källa väljs med AUDIO_SOURCE=device|synthetic|file (se create_audio_source).
+"""
+import os
+import time
+import wave
+import queue
+import logging
+import threading
+import subprocess
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+
+try:
+    import sounddevice as sd
+    SOUNDDEVICE_AVAILABLE = True
+except (ImportError, OSError):
+    # OSError: PortAudio saknas på systemet
+    SOUNDDEVICE_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+AUDIO_SOURCE            = os.getenv("AUDIO_SOURCE", "device").lower()  # "device" | "synthetic" | "file"
+AUDIO_SOURCE_FILE       = os.getenv("AUDIO_SOURCE_FILE")
+AUDIO_SOURCE_CHANNELS   = int(os.getenv("AUDIO_SOURCE_CHANNELS", "6"))
+AUDIO_SOURCE_RATE       = int(os.getenv("AUDIO_SOURCE_RATE", "0"))      # 0 = samma som inspelningen
+AUDIO_SOURCE_SPEED      = float(os.getenv("AUDIO_SOURCE_SPEED", "1.0"))  # 0 = så snabbt som möjligt
+AUDIO_SOURCE_XRUN_RATE  = float(os.getenv("AUDIO_SOURCE_XRUN_RATE", "0"))
+AUDIO_SOURCE_CLIP_RATE  = float(os.getenv("AUDIO_SOURCE_CLIP_RATE", "0"))
+AUDIO_SOURCE_SEED       = int(os.getenv("AUDIO_SOURCE_SEED", "0"))
+
+BLOCKSIZE = 1024
+
+# Ljudets hastighet och mikrofonradie för ReSpeaker 4-Mic Array (syntetiska fördröjningar)
+SPEED_OF_SOUND = 343.0
+MIC_RADIUS = 0.032
+
+Callback = Callable[[np.ndarray, int, Optional[dict], "SourceStatus"], None]
+
+
+class SourceStatus:
+    """Motsvarighet till sounddevice.CallbackFlags för emulerade källor"""
+
+    def __init__(self, input_overflow: bool = False):
+        self.input_overflow = input_overflow
+
+    def __bool__(self):
+        return self.input_overflow
+
+    def __repr__(self):
+        return "input overflow" if self.input_overflow else ""
+
+
+class AudioSource:
+    """Basklass: levererar block med int16-ljud (frames, channels) till en callback"""
+
+    def __init__(self, channels: int, samplerate: int, blocksize: int = BLOCKSIZE):
+        self.channels = channels
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.running = False
+
+    def start(self, callback: Callback):
+        raise NotImplementedError
+
+    def stop(self):
+        raise NotImplementedError
+
+
+class SoundDeviceSource(AudioSource):
+    """Riktig ljudenhet via sounddevice/PortAudio"""
+
+    def __init__(self, device=None, samplerate: int = 16000, channels: Optional[int] = None,
+                 blocksize: int = BLOCKSIZE):
+        self.device = device
+        super().__init__(channels or self._get_device_channels(device), samplerate, blocksize)
+        self.stream = None
+
+    @staticmethod
+    def _get_device_channels(device, fallback: int = 4) -> int:
+        """Hämta enhetens maximala antal ingångskanaler"""
+        if not SOUNDDEVICE_AVAILABLE:
+            return fallback
+        try:
+            if device is None:
+                # Använd standardenhet
+                device_info = sd.query_devices(kind='input')
+            else:
+                device_info = sd.query_devices(device)
+            # För ReSpeaker 4-Mic Array v2.0 har ofta 6 kanaler (4 mic + 2 ref)
+            # Öppna med alla tillgängliga kanaler för att fånga alla mikrofoner
+            return device_info.get('max_input_channels', fallback)
+        except Exception:
+            # Om det inte går att hämta info, använd fallback
+            return fallback
+
+    def start(self, callback: Callback):
+        if not SOUNDDEVICE_AVAILABLE:
+            raise RuntimeError("sounddevice saknas; sätt AUDIO_SOURCE=synthetic eller file")
+        self.stream = sd.InputStream(
+            channels=self.channels,
+            samplerate=self.samplerate,
+            dtype="int16",
+            device=self.device,
+            callback=callback,
+            blocksize=self.blocksize,
+        )
+        self.stream.start()
+        self.running = True
+
+    def stop(self):
+        self.running = False
+        try:
+            if self.stream:
+                self.stream.stop()
+                self.stream.close()
+        finally:
+            self.stream = None
+
+
+class _GeneratedSource(AudioSource):
+    """
+    Gemensam logik för emulerade källor: blockklocka i egen tråd,
+    uppspelningshastighet och injicerade fel.
+    """
+
+    def __init__(self, channels: int, samplerate: int, blocksize: int = BLOCKSIZE,
+                 speed: float = 1.0, duration: Optional[float] = None,
+                 xrun_rate: float = 0.0, clip_rate: float = 0.0, seed: int = 0):
+        """
+        Args:
+            speed: Uppspelningshastighet relativt realtid (0 = så snabbt som möjligt)
+            duration: Sekunder ljud att leverera (None = tills stop())
+            xrun_rate: Sannolikhet per block att blocket tappas (överspill)
+            clip_rate: Sannolikhet per block att blocket överstyrs till klippning
+            seed: Frö för deterministiska signaler och fel
+        """
+        super().__init__(channels, samplerate, blocksize)
+        self.speed = speed
+        self.duration = duration
+        self.xrun_rate = xrun_rate
+        self.clip_rate = clip_rate
+        self.rng = np.random.default_rng(seed)
+        self.position = 0            # Antal genererade ramar (inklusive tappade)
+        self.xruns = 0
+        self.clipped_blocks = 0
+        self.finished = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, callback: Callback):
+        if self.running:
+            return
+        self.running = True
+        self.finished.clear()
+        self._thread = threading.Thread(target=self._run, args=(callback,), name="audio-source", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.running = False
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2)
+        self._thread = None
+
+    def _next_block(self, frames: int) -> Optional[np.ndarray]:
+        """Nästa block (frames, channels) som int16, eller None vid slut"""
+        raise NotImplementedError
+
+    def _run(self, callback: Callback):
+        started = time.perf_counter()
+        start_position = self.position
+        overflow = False
+        limit = int(self.duration * self.samplerate) if self.duration else None
+        try:
+            while self.running:
+                frames = self.blocksize if limit is None else min(self.blocksize, limit - self.position)
+                if frames <= 0:
+                    break
+                block = self._next_block(frames)
+                if block is None:
+                    break
+                self.position += len(block)
+
+                if self.xrun_rate and self.rng.random() < self.xrun_rate:
+                    # Blocket hinner inte läsas: tappas och nästa block flaggas
+                    self.xruns += 1
+                    overflow = True
+                    continue
+                if self.clip_rate and self.rng.random() < self.clip_rate:
+                    self.clipped_blocks += 1
+                    block = np.clip(block.astype(np.int32) * 16, -32768, 32767).astype(np.int16)
+
+                if self.speed > 0:
+                    # Ett block finns tillgängligt när det är "inspelat"; takten
+                    # räknas mot en fast startpunkt så att fördröjningar inte ackumuleras
+                    due = started + (self.position - start_position) / self.samplerate / self.speed
+                    delay = due - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                callback(block, len(block), None, SourceStatus(overflow))
+                overflow = False
+        except Exception as e:
+            logger.error(f"Fel i emulerad ljudkälla: {e}")
+        finally:
+            self.running = False
+            self.finished.set()
+
+
+class SyntheticSource(_GeneratedSource):
+    """
+    Talliknande flerkanalsljud från en talare som byter riktning.
+
+    Varje kanal är samma talsignal fördröjd enligt en cirkulär
+    mikrofongruppering (som ReSpeaker 4-Mic) plus eget brus, så att
+    nivåmätning och riktningsestimering får realistisk indata.
+    """
+
+    def __init__(self, channels: int = 6, samplerate: int = 48000, turn_seconds: float = 10.0, **kwargs):
+        super().__init__(channels, samplerate, **kwargs)
+        self.turn_seconds = turn_seconds
+        self.mic_angles = np.arange(channels) * (2 * np.pi / channels)
+        self._history = np.zeros(64, dtype=np.float32)  # Tidigare talsampel för fördröjningar
+
+    def _delays(self, angle: float) -> np.ndarray:
+        """Fördröjning i sampel per kanal för en talare i given riktning"""
+        seconds = MIC_RADIUS * (1 - np.cos(angle - self.mic_angles)) / SPEED_OF_SOUND
+        return np.round(seconds * self.samplerate).astype(int)
+
+    def talker_angle(self, position: int) -> float:
+        """Talarens riktning (radianer) vid en given sampelposition"""
+        turn = int(position / (self.turn_seconds * self.samplerate))
+        return (turn * 2.4) % (2 * np.pi)
+
+    def _next_block(self, frames: int) -> np.ndarray:
+        t = (self.position + np.arange(frames)) / self.samplerate
+        # Stavelserytm ~4 Hz med pauser mellan fraser
+        envelope = np.clip(np.sin(2 * np.pi * 4.0 * t), 0.0, None) * (np.sin(2 * np.pi * 0.2 * t) > -0.3)
+        speech = (self.rng.standard_normal(frames) * (0.02 + 0.3 * envelope)).astype(np.float32)
+
+        signal = np.concatenate([self._history, speech])
+        offset = len(self._history)
+        delays = self._delays(self.talker_angle(self.position))
+        block = np.empty((frames, self.channels), dtype=np.float32)
+        for ch, delay in enumerate(delays):
+            block[:, ch] = signal[offset - delay:offset - delay + frames]
+        block += self.rng.standard_normal((frames, self.channels)).astype(np.float32) * 0.003
+        self._history = signal[-len(self._history):]
+        return np.clip(block * 32767, -32768, 32767).astype(np.int16)
+
+
+class FileSource(_GeneratedSource):
+    """Spelar upp en 16-bitars WAV-fil som ljudkälla"""
+
+    def __init__(self, path, loop: bool = False, **kwargs):
+        self.path = Path(path)
+        self.loop = loop
+        self._wav = None
+        with wave.open(str(self.path), "rb") as w:
+            if w.getsampwidth() != 2:
+                raise ValueError(f"Endast 16-bitars WAV stöds: {self.path}")
+            channels, samplerate = w.getnchannels(), w.getframerate()
+        super().__init__(channels, samplerate, **kwargs)
+
+    def start(self, callback: Callback):
+        if not self.running:
+            self._wav = wave.open(str(self.path), "rb")
+            self.position = 0
+        super().start(callback)
+
+    def stop(self):
+        super().stop()
+        if self._wav:
+            self._wav.close()
+            self._wav = None
+
+    def _next_block(self, frames: int) -> Optional[np.ndarray]:
+        data = self._wav.readframes(frames)
+        if not data and self.loop:
+            self._wav.rewind()
+            data = self._wav.readframes(frames)
+        if not data:
+            return None
+        return np.frombuffer(data, dtype=np.int16).reshape(-1, self.channels)
+
+
+def create_audio_source(device=None, samplerate: int = 16000, channels: Optional[int] = None,
+                        kind: Optional[str] = None, **kwargs) -> AudioSource:
+    """
+    Skapa ljudkälla enligt AUDIO_SOURCE-inställningarna.
+
+    Args:
+        device: Ljudenhet för "device"
+        samplerate: Önskad samplingsfrekvens (AUDIO_SOURCE_RATE har företräde för emulerade källor)
+        channels: Antal kanaler (None = enhetens/inställningens)
+        kind: "device", "synthetic" eller "file" (None = AUDIO_SOURCE)
+        **kwargs: Övriga argument till emulerade källor (speed, duration, ...)
+
+    Returns:
+        AudioSource
+    """
+    kind = (kind or AUDIO_SOURCE).lower()
+    if kind == "device":
+        return SoundDeviceSource(device=device, samplerate=samplerate, channels=channels)
+
+    options = {
+        "speed": AUDIO_SOURCE_SPEED,
+        "xrun_rate": AUDIO_SOURCE_XRUN_RATE,
+        "clip_rate": AUDIO_SOURCE_CLIP_RATE,
+        "seed": AUDIO_SOURCE_SEED,
+    }
+    options.update(kwargs)
+    if kind == "synthetic":
+        return SyntheticSource(
+            channels=channels or AUDIO_SOURCE_CHANNELS,
+            samplerate=AUDIO_SOURCE_RATE or samplerate,
+            **options,
+        )
+    if kind == "file":
+        if not AUDIO_SOURCE_FILE:
+            raise ValueError("AUDIO_SOURCE_FILE saknas")
+        return FileSource(AUDIO_SOURCE_FILE, loop=True, **options)
+    raise ValueError(f"Okänd AUDIO_SOURCE: {kind}")
+
+
+class SourceCapture:
+    """
+    Spelar in från en AudioSource till en WAV-fil.
+
+    Används i stället för arecord när källan inte är en ALSA-enhet. Har
+    samma metoder som subprocess.Popen (terminate/wait/kill/poll) så att
+    inspelningskärnan kan hantera båda på samma sätt. Skrivningen sker i
+    egen tråd så att ljud-callbacken aldrig väntar på disken.
+    """
+
+    def __init__(self, source: AudioSource, path: Path, channel: Optional[int] = 0,
+                 on_block: Optional[Callback] = None, on_overflow: Optional[Callable[[], None]] = None):
+        """
+        Args:
+            source: Ljudkälla
+            path: WAV-fil att skriva (källans samplingsfrekvens)
+            channel: Kanal att spela in (som arecord -c 1), None = alla kanaler
+            on_block: Anropas med varje block (t.ex. nivåmätning under inspelning)
+            on_overflow: Anropas vid varje överspill (från ljud-callbacken)
+        """
+        self.source = source
+        self.path = Path(path)
+        self.channel = channel
+        self.on_block = on_block
+        self.on_overflow = on_overflow
+        self.returncode: Optional[int] = None
+        self.frames_written = 0
+        self.overflows = 0
+        self.cpu_s = 0.0   # CPU-tid i ljud-callbacken och skrivtråden
+        self._queue: "queue.Queue" = queue.Queue()
+        self._wav = wave.open(str(self.path), "wb")
+        self._frame_bytes = 2 * (source.channels if channel is None else 1)
+        self._wav.setnchannels(self._frame_bytes // 2)
+        self._wav.setsampwidth(2)
+        self._wav.setframerate(source.samplerate)
+        self._writer = threading.Thread(target=self._write_loop, name="source-capture", daemon=True)
+        self._writer.start()
+        source.start(self._callback)
+
+    def _callback(self, indata, frames, time_info, status):
+        start = time.thread_time()
+        if status:
+            self.overflows += 1
+            if self.on_overflow:
+                self.on_overflow()
+        samples = indata if self.channel is None else indata[:, self.channel]
+        self._queue.put(np.ascontiguousarray(samples).tobytes())
+        if self.on_block:
+            self.on_block(indata, frames, time_info, status)
+        self.cpu_s += time.thread_time() - start
+
+    def _write_loop(self):
+        try:
+            while True:
+                data = self._queue.get()
+                if data is None:
+                    break
+                start = time.thread_time()
+                self._wav.writeframes(data)
+                self.frames_written += len(data) // self._frame_bytes
+                self.cpu_s += time.thread_time() - start
+        finally:
+            self._wav.close()
+            self.returncode = 0
+
+    @property
+    def bytes_written(self) -> int:
+        return self.frames_written * self._frame_bytes
+
+    def poll(self) -> Optional[int]:
+        return self.returncode
+
+    def terminate(self):
+        self.source.stop()
+        self._queue.put(None)
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[int]:
+        self._writer.join(timeout)
+        if self._writer.is_alive():
+            raise subprocess.TimeoutExpired("source-capture", timeout)
+        if self.overflows:
+            logger.warning(f"{self.overflows} överspill (xruns) under inspelning av {self.path.name}")
+        return self.returncode
+
+    def kill(self):
+        self.terminate()
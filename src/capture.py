@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Inspelningsströmmar: en eller flera ljudenheter i samma process.
+
+Med AUDIO_DEVICES spelas flera USB-mikrofonmatriser på samma Pi in
+samtidigt, t.ex. AUDIO_DEVICES="nord=hw:1,0;syd=hw:2,0". Varje ström har
+egen enhet, fil, gain och efterbearbetningsjobb; jobben körs i
+inspelningskärnans gemensamma arbetspool. Per ström mäts CPU-tid och
+överspill (xruns), så att en överbelastad enhet syns i status och spårning.
+"""
+import os
+import re
+import time
+import logging
+import threading
+import subprocess
+from pathlib import Path
+from typing import Optional, List, Tuple, Dict, Any, Callable
+
+from audio_source import AUDIO_SOURCE, create_audio_source, SourceCapture
+from priority import raise_capture_priority
+
+logger = logging.getLogger(__name__)
+
+# "namn=enhet;namn=enhet" (tom = en ström på standardenheten)
+AUDIO_DEVICES = os.getenv("AUDIO_DEVICES", "")
+
+_NAME = re.compile(r"^[A-Za-z0-9_]+$")
+
+
+def parse_devices(value: str, default_device: Optional[str] = None) -> List[Tuple[str, Optional[str]]]:
+    """
+    Tolka AUDIO_DEVICES.
+
+    Semikolon skiljer strömmar åt eftersom ALSA-namn innehåller komma.
+    Utan namn (bara enhet) numreras strömmarna mic1, mic2, …
+
+    Returns:
+        [(namn, enhet)], eller [("main", default_device)] om värdet är tomt
+
+    Raises:
+        ValueError: Vid ogiltigt eller dubblerat namn
+    """
+    streams: List[Tuple[str, Optional[str]]] = []
+    for part in (value or "").split(";"):
+        part = part.strip()
+        if not part:
+            continue
+        name, sep, device = part.partition("=")
+        if not sep:
+            name, device = f"mic{len(streams) + 1}", part
+        name = name.strip()
+        if not _NAME.match(name):
+            raise ValueError(f"Ogiltigt strömnamn: {name!r} (bokstäver, siffror och _)")
+        if any(name == existing for existing, _ in streams):
+            raise ValueError(f"Strömnamnet {name} förekommer flera gånger")
+        streams.append((name, device.strip() or None))
+    return streams or [("main", default_device)]
+
+
+class CaptureStream:
+    """En ljudenhet som spelas in till en egen fil"""
+
+    def __init__(self, name: str, device: Optional[str] = None,
+                 on_xrun: Optional[Callable[[], None]] = None):
+        """
+        Args:
+            on_xrun: Anropas vid varje överspill (t.ex. för att pausa kodningsjobb)
+        """
+        self.name = name
+        self.on_xrun = on_xrun
+        self.device = device
+        self.gain = 1.0
+        self.channels = 1
+        self.proc = None          # arecord-process eller SourceCapture
+        self.wav: Optional[Path] = None
+        self.started: Optional[float] = None
+        self._xruns = 0
+
+    @property
+    def active(self) -> bool:
+        return self.proc is not None
+
+    def start(self, wav: Path, capture_rate: int, fmt: str, channels: int, gain: float = 1.0, tap=None):
+        """
+        Starta inspelning till wav.
+
+        Args:
+            tap: Redan öppen källa (pre-roll) att spela in från i stället för enheten
+
+        Raises:
+            Exception: Om enheten inte kan öppnas
+        """
+        if tap is not None:
+            proc = SourceCapture(tap, wav, channel=None if channels > 1 else 0, on_overflow=self._xrun)
+        elif AUDIO_SOURCE == "device":
+            cmd = ["arecord", "-f", fmt, "-r", str(capture_rate), "-c", str(channels), str(wav)]
+            if self.device:
+                cmd = ["arecord", "-D", self.device, "-f", fmt, "-r", str(capture_rate), "-c", str(channels), str(wav)]
+            proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            raise_capture_priority(proc.pid)
+            threading.Thread(target=self._watch_arecord, args=(proc,), name=f"arecord-{self.name}",
+                             daemon=True).start()
+        else:
+            # Emulerad källa: spela in i Python med samma gränssnitt som arecord-processen
+            source = create_audio_source(device=self.device, samplerate=capture_rate,
+                                         channels=channels if channels > 1 else None)
+            proc = SourceCapture(source, wav, channel=None if channels > 1 else 0, on_overflow=self._xrun)
+        self.proc = proc
+        self.wav = Path(wav)
+        self.channels = channels
+        self.gain = gain
+        self.started = time.time()
+        self._xruns = 0
+
+    def _watch_arecord(self, proc: subprocess.Popen):
+        """Läs arecords stderr (så att röret aldrig blir fullt) och räkna överspill"""
+        for line in proc.stderr:
+            if b"overrun" in line:
+                self._xruns += 1
+                self._xrun()
+            elif line.strip() and not line.startswith(b"Recording"):
+                logger.debug(f"arecord ({self.name}): {line.decode(errors='replace').strip()}")
+
+    def _xrun(self):
+        if self.on_xrun:
+            self.on_xrun()
+
+    @property
+    def overflows(self) -> int:
+        if isinstance(self.proc, SourceCapture):
+            return self.proc.overflows
+        return self._xruns
+
+    def bytes_written(self) -> Optional[int]:
+        """Byte inspelade hittills i aktuell fil (None om okänt)"""
+        if isinstance(self.proc, SourceCapture):
+            return self.proc.bytes_written
+        if self.proc is None or self.wav is None:
+            return None
+        try:
+            return self.wav.stat().st_size
+        except OSError:
+            return None
+
+    def cpu_seconds(self) -> Optional[float]:
+        """CPU-tid för inspelningen hittills (None om okänd)"""
+        if isinstance(self.proc, SourceCapture):
+            return self.proc.cpu_s
+        if self.proc is None:
+            return None
+        try:
+            with open(f"/proc/{self.proc.pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            # utime och stime (fält 14 och 15) i klockslag
+            return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def metrics(self) -> Dict[str, Any]:
+        cpu = self.cpu_seconds()
+        return {
+            "name": self.name,
+            "device": self.device,
+            "recording": self.active,
+            "filename": self.wav.name if self.active and self.wav else None,
+            "gain": self.gain,
+            "overflows": self.overflows,
+            "cpu_s": round(cpu, 3) if cpu is not None else None,
+        }
+
+    def stop(self) -> Dict[str, Any]:
+        """
+        Stoppa inspelningen; arecord avslutas och skriver klart WAV-huvudet.
+
+        Returns:
+            Mätvärden för inspelningen (se metrics)
+        """
+        # arecords CPU-tid läses innan processen försvinner
+        metrics = self.metrics()
+        proc = self.proc
+        try:
+            proc.terminate()
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        finally:
+            self.proc = None
+            self.started = None
+        if isinstance(proc, SourceCapture):
+            # Inklusive de sista blocken som skrevs efter terminate()
+            metrics.update(overflows=proc.overflows, cpu_s=round(proc.cpu_s, 3))
+        else:
+            metrics["overflows"] = self._xruns
+            if self._xruns:
+                logger.warning(f"{self._xruns} överspill (xruns) under inspelning av {self.wav.name}")
+        metrics["recording"] = False
+        return metrics
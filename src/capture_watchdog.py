@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Vakthund för inspelningsströmmarna.
+
+Om USB-mikrofonen glappar kan arecord avslutas eller hänga utan att
+inspelningskärnan märker det förrän vid stopp. Vakthunden kontrollerar
+varje aktiv ström var WATCHDOG_INTERVAL sekund:
+
+- att processen lever (arecord eller SourceCapture),
+- att filen växer (byte per sekund; ingen tillväxt på WATCHDOG_STALL_SECONDS
+  räknas som hängd),
+- att enheten finns kvar (/proc/asound/cards, för hw:/plughw:-enheter),
+- antal överspill per minut (rapporteras över WATCHDOG_XRUN_LIMIT).
+
+Vid avbrott anropas on_failure: inspelningskärnan avslutar segmentet
+(det efterbearbetas som vanligt) och vakthunden försöker sedan starta
+strömmen igen via on_retry, så snart enheten finns, till ett nytt segment
+(<inspelning>-seg2.wav, …). Luckan beskrivs i <segment>.gap.json som
+laddas upp bredvid segmentet. Varje kontroll är en stat() och några
+jämförelser, så vakthunden kan köras hela tiden.
+"""
+import os
+import re
+import json
+import time
+import logging
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Optional, Set, Dict, Any, Callable, List
+
+logger = logging.getLogger(__name__)
+
+WATCHDOG_ENABLED = os.getenv("WATCHDOG_ENABLED", "true").lower() in ("true", "1", "yes")
+# Sekunder mellan kontroller och utan tillväxt innan en ström räknas som hängd
+WATCHDOG_INTERVAL = float(os.getenv("WATCHDOG_INTERVAL", "2"))
+WATCHDOG_STALL_SECONDS = float(os.getenv("WATCHDOG_STALL_SECONDS", "5"))
+# Överspill per minut som rapporteras som incident (0 = av)
+WATCHDOG_XRUN_LIMIT = int(os.getenv("WATCHDOG_XRUN_LIMIT", "10"))
+# Lyckade omstarter per ström och inspelning innan vakthunden ger upp
+WATCHDOG_MAX_RESTARTS = int(os.getenv("WATCHDOG_MAX_RESTARTS", "5"))
+# Längsta väntan mellan misslyckade startförsök (väntan fördubblas per försök)
+WATCHDOG_RETRY_MAX = 60.0
+
+GAP_SUFFIX = ".gap.json"
+FORMAT_VERSION = 1
+ASOUND_CARDS = "/proc/asound/cards"
+XRUN_WINDOW_S = 60.0
+
+# " 1 [ArrayUAC10     ]: USB-Audio - ReSpeaker 4 Mic Array (UAC1.0)"
+_CARD_LINE = re.compile(r"^\s*(\d+)\s+\[(\S+)\s*\]")
+_CARD_NAME = re.compile(r"CARD=([^,]+)")
+_HW_CARD = re.compile(r"^(?:plug)?hw:([^,]+)")
+
+
+def parse_card(device: Optional[str]) -> Optional[str]:
+    """
+    Kortet i ett ALSA-enhetsnamn: "hw:1,0" -> "1", "plughw:CARD=Array,DEV=0" -> "Array"
+
+    Returns:
+        Kortets nummer eller id, None för enheter utan eget kort (default, pulse, …)
+    """
+    if not device:
+        return None
+    match = _CARD_NAME.search(device) or _HW_CARD.match(device)
+    return match.group(1) if match else None
+
+
+def alsa_cards(path: str = ASOUND_CARDS) -> Optional[Set[str]]:
+    """Nummer och id för anslutna ljudkort (None om ALSA saknas)"""
+    try:
+        with open(path) as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    cards: Set[str] = set()
+    for line in lines:
+        match = _CARD_LINE.match(line)
+        if match:
+            cards.update(match.groups())
+    return cards
+
+
+def device_present(device: Optional[str]) -> Optional[bool]:
+    """True/False om enheten är ansluten, None om det inte kan avgöras"""
+    card = parse_card(device)
+    if card is None:
+        return None
+    cards = alsa_cards()
+    if cards is None:
+        return None
+    return card in cards
+
+
+def retry_delay(failures: int, interval: float = WATCHDOG_INTERVAL) -> float:
+    """
+    Väntan efter failures misslyckade startförsök i rad.
+
+    Enheter som inte syns i /proc/asound/cards (default, pulse, …) kan inte
+    kontrolleras innan start, så försöken glesas ut i stället.
+    """
+    return min(WATCHDOG_RETRY_MAX, interval * 2 ** (failures - 1))
+
+
+def gap_path(wav_path: Path) -> Path:
+    return wav_path.with_name(wav_path.stem + GAP_SUFFIX)
+
+
+def gap_sidecars(wav_path: Path) -> Dict[str, Path]:
+    """Luckmarkering för ett segment om den finns: {"gap": ...}"""
+    path = gap_path(Path(wav_path))
+    return {"gap": path} if path.exists() else {}
+
+
+def write_gap_marker(wav_path: Path, gap: Dict[str, Any]) -> Path:
+    """Skriv <segment>.gap.json som beskriver luckan före segmentet"""
+    path = gap_path(Path(wav_path))
+    tmp = Path(f"{path}.tmp")
+    tmp.write_text(json.dumps({"format": "meetrec-gap", "version": FORMAT_VERSION, **gap}, indent=2))
+    os.replace(tmp, path)
+    return path
+
+
+class StreamHealth:
+    """Mätvärden för en ströms aktuella segment"""
+
+    def __init__(self, stream, now: float):
+        self.wav = stream.wav
+        self.bytes = stream.bytes_written() or 0
+        self.checked_at = now
+        self.progress_at = now               # Senaste tillväxt (monotont)
+        self.progress_wall = time.time()     # Samma tidpunkt som Unix-tid (luckans början)
+        self.bytes_per_s = 0.0
+        self.overflows = stream.overflows
+        self.xruns: deque = deque()          # (tid, antal) inom XRUN_WINDOW_S
+        self.xrun_reported_at = 0.0
+
+    @property
+    def xruns_per_min(self) -> int:
+        return sum(count for _, count in self.xruns)
+
+    def to_dict(self, now: float) -> Dict[str, Any]:
+        return {
+            "bytes_per_s": round(self.bytes_per_s),
+            "idle_s": round(now - self.progress_at, 1),
+            "xruns_per_min": self.xruns_per_min,
+        }
+
+
+class CaptureWatchdog:
+    """
+    Kontrollerar inspelningsströmmar i en egen tråd.
+
+    on_failure(stream, reason, gap_start, details) anropas en gång per
+    avbrott med reason "exited", "stalled" eller "device_missing";
+    därefter anropas on_retry(stream) varje kontroll (när enheten finns)
+    tills den returnerar True (omstartad eller uppgiven).
+    on_incident(stream, reason, details) rapporterar sådant som inte
+    kräver omstart (för många överspill).
+    """
+
+    def __init__(self, on_failure: Callable, on_retry: Callable[[Any], bool],
+                 on_incident: Optional[Callable] = None, interval: float = WATCHDOG_INTERVAL,
+                 stall_s: float = WATCHDOG_STALL_SECONDS, xrun_limit: int = WATCHDOG_XRUN_LIMIT):
+        self.on_failure = on_failure
+        self.on_retry = on_retry
+        self.on_incident = on_incident
+        self.interval = interval
+        self.stall_s = stall_s
+        self.xrun_limit = xrun_limit
+        self._streams: List[Any] = []
+        self._health: Dict[str, StreamHealth] = {}
+        self._pending: Set[str] = set()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, streams: List[Any]):
+        """Börja bevaka strömmarna (vid inspelningsstart)"""
+        self.stop()
+        self._streams = list(streams)
+        self._health.clear()
+        self._pending.clear()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, args=(self._stop,), name="capture-watchdog",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Sluta bevaka (väntar inte in tråden; kan anropas under inspelningskärnans lås)"""
+        self._stop.set()
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Hälsa per ström, t.ex. för status"""
+        now = time.monotonic()
+        result = {name: health.to_dict(now) for name, health in list(self._health.items())}
+        for name in list(self._pending):
+            result[name] = {"recovering": True}
+        return result
+
+    def _loop(self, stop: threading.Event):
+        while not stop.wait(self.interval):
+            for stream in self._streams:
+                if stop.is_set():
+                    return
+                try:
+                    self.check(stream, time.monotonic())
+                except Exception:
+                    logger.exception(f"Vakthunden kunde inte kontrollera {stream.name}")
+
+    def check(self, stream, now: float):
+        if stream.name in self._pending:
+            if stream.active:
+                self._pending.discard(stream.name)
+            elif device_present(stream.device) is not False and self.on_retry(stream):
+                self._pending.discard(stream.name)
+            return
+        if not stream.active:
+            return
+        health = self._health.get(stream.name)
+        if health is None or health.wav != stream.wav:
+            # Nytt segment: mät från början
+            self._health[stream.name] = StreamHealth(stream, now)
+            return
+
+        size = stream.bytes_written()
+        if size is not None and size > health.bytes:
+            health.bytes_per_s = (size - health.bytes) / max(now - health.checked_at, 1e-3)
+            health.bytes = size
+            health.progress_at = now
+            health.progress_wall = time.time()
+        else:
+            health.bytes_per_s = 0.0
+        health.checked_at = now
+
+        overflows = stream.overflows
+        if overflows > health.overflows:
+            health.xruns.append((now, overflows - health.overflows))
+        health.overflows = overflows
+        while health.xruns and now - health.xruns[0][0] > XRUN_WINDOW_S:
+            health.xruns.popleft()
+        if (self.xrun_limit and health.xruns_per_min >= self.xrun_limit
+                and now - health.xrun_reported_at > XRUN_WINDOW_S and self.on_incident):
+            health.xrun_reported_at = now
+            self.on_incident(stream, "xruns", {"xruns_per_min": health.xruns_per_min})
+
+        details: Dict[str, Any] = {}
+        returncode = stream.proc.poll() if stream.proc is not None else None
+        if returncode is not None:
+            reason = "exited"
+            details["returncode"] = returncode
+        elif device_present(stream.device) is False:
+            reason = "device_missing"
+        elif now - health.progress_at >= self.stall_s:
+            reason = "stalled"
+            details["idle_s"] = round(now - health.progress_at, 1)
+        else:
+            return
+        details["bytes"] = health.bytes
+        logger.warning(f"Ström {stream.name} avbruten ({reason}): {stream.wav.name}")
+        self._pending.add(stream.name)
+        del self._health[stream.name]
+        self.on_failure(stream, reason, health.progress_wall, details)
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Lokal katalog över inspelningar (SQLite).
+
+Varje inspelning får en rad som uppdateras av inspelningskärnan när den
+startar, stoppas och när efterbearbetningen är klar (fil, storlek, hash,
+uppladdningsmål och -resultat, status och tider per steg). Katalogen kan
+frågas via MQTT (list_recordings) och HTTP (/api/catalog), så att verktyg
+kan lista och stämma av tusentals inspelningar utan att läsa katalogen på
+disk.
+
+Databasen körs i WAL-läge med synchronous=NORMAL: skrivningar är
+atomiska och läsningar blockeras inte av pågående jobb, utan en fsync per
+uppdatering (skonsamt mot SD-kort).
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+
+logger = logging.getLogger(__name__)
+
+CATALOG_DB = os.path.expanduser(os.getenv("CATALOG_DB", "~/.meetrec/catalog.db"))
+
+# Största antal rader per fråga
+MAX_LIMIT = 1000
+DEFAULT_LIMIT = 100
+
+# Status för en inspelning
+STATUSES = ("recording", "processing", "uploaded", "error", "local")
+
+COLUMNS = {
+    "name": "TEXT PRIMARY KEY",       # inspelningens namn utan filändelse
+    "room": "TEXT",
+    "started_at": "REAL",
+    "stopped_at": "REAL",
+    "duration_s": "REAL",
+    "gain": "REAL",
+    "codec": "TEXT",
+    "wav_bytes": "INTEGER",
+    "file": "TEXT",                   # kodad fil (t.ex. meeting-….flac)
+    "size": "INTEGER",
+    "sha256": "TEXT",
+    "upload_target": "TEXT",
+    "upload_result": "TEXT",          # URL eller svar från mottagaren
+    "status": "TEXT",
+    "error": "TEXT",
+    "trace_id": "TEXT",               # efterbearbetningsjobbets spårnings-id (tracing.py)
+    "timings": "TEXT",                # JSON: steg -> sekunder
+    "updated_at": "REAL",
+}
+
+# Filter som kan användas i frågor: namn -> (typ, SQL)
+FILTERS = {
+    "status": (str, "status = ?"),
+    "room": (str, "room = ?"),
+    "codec": (str, "codec = ?"),
+    "sha256": (str, "sha256 = ?"),
+    "upload_target": (str, "upload_target = ?"),
+    "since": (float, "started_at >= ?"),
+    "until": (float, "started_at < ?"),
+}
+
+
+def parse_query(query: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Validera en katalogfråga.
+
+    Tidsfilter (since/until) kan anges som Unix-tid eller ISO 8601.
+
+    Raises:
+        ValueError: Vid okänt filter eller ogiltigt värde
+    """
+    if query is None:
+        return {}
+    if not isinstance(query, dict):
+        raise ValueError("query måste vara ett objekt")
+    clean: Dict[str, Any] = {}
+    for key, value in query.items():
+        if value is None or value == "":
+            continue
+        if key in ("limit", "offset"):
+            try:
+                clean[key] = int(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"Ogiltigt värde för {key}: {value!r}")
+            if clean[key] < 0:
+                raise ValueError(f"{key} får inte vara negativt")
+        elif key == "name":
+            clean[key] = str(value)
+        elif key in FILTERS:
+            kind = FILTERS[key][0]
+            if kind is float:
+                clean[key] = _parse_time(value)
+            else:
+                clean[key] = str(value)
+        else:
+            raise ValueError(f"Okänt filter: {key}")
+    if "status" in clean and clean["status"] not in STATUSES:
+        raise ValueError(f"Okänd status: {clean['status']} (giltiga: {', '.join(STATUSES)})")
+    clean["limit"] = min(clean.get("limit", DEFAULT_LIMIT), MAX_LIMIT)
+    return clean
+
+
+def _parse_time(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        raise ValueError(f"Ogiltig tidpunkt: {value!r}")
+
+
+def started_from_name(name: str) -> Optional[float]:
+    """meeting-YYYYmmdd-HHMMSS[-ström] -> Unix-tid (None om namnet inte följer mönstret)"""
+    try:
+        return datetime.strptime("".join(name.split("-")[1:3]), "%Y%m%d%H%M%S").timestamp()
+    except ValueError:
+        return None
+
+
+class Catalog:
+    """Inspelningskatalog i en SQLite-databas (trådsäker)"""
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = Path(path or CATALOG_DB)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        created = not self.path.exists()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            columns = ", ".join(f"{name} {kind}" for name, kind in COLUMNS.items())
+            self._db.execute(f"CREATE TABLE IF NOT EXISTS recordings ({columns})")
+            for column in ("status", "started_at", "room", "sha256"):
+                self._db.execute(f"CREATE INDEX IF NOT EXISTS idx_recordings_{column} ON recordings ({column})")
+        self.created = created
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    # ---------- Skrivning ----------
+    def upsert(self, name: str, **fields):
+        """Skapa eller uppdatera en inspelning (bara angivna fält ändras)"""
+        unknown = set(fields) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Okända fält: {', '.join(sorted(unknown))}")
+        if isinstance(fields.get("timings"), dict):
+            fields["timings"] = json.dumps(fields["timings"])
+        fields["updated_at"] = time.time()
+        names = list(fields)
+        placeholders = ", ".join("?" for _ in names)
+        updates = ", ".join(f"{column} = excluded.{column}" for column in names)
+        sql = (f"INSERT INTO recordings (name, {', '.join(names)}) VALUES (?, {placeholders}) "
+               f"ON CONFLICT(name) DO UPDATE SET {updates}")
+        with self._lock, self._db:
+            self._db.execute(sql, [name] + [fields[column] for column in names])
+
+    def record_job(self, record: Dict[str, Any]):
+        """
+        Uppdatera en inspelning från ett avslutat efterbearbetningsjobb
+        (JobTrace.finish), med fil, hash, uppladdning och tider per steg.
+        """
+        fields: Dict[str, Any] = {
+            "status": "uploaded" if record.get("status") == "ok" else "error",
+            "error": record.get("error"),
+            "trace_id": record.get("trace_id"),
+            "timings": {},
+        }
+        for span in record.get("spans", []):
+            if span.get("duration_s") is not None:
+                fields["timings"][span["name"]] = round(span["duration_s"], 3)
+            if span["name"] == "encoding" and span.get("status") == "ok":
+                fields.update({k: span[k] for k in ("file", "sha256") if span.get(k)})
+                if span.get("bytes"):
+                    fields["size"] = int(span["bytes"])
+            elif span["name"] == "uploading":
+                fields["upload_target"] = span.get("backend")
+                if span.get("result"):
+                    fields["upload_result"] = span["result"]
+        self.upsert(record["job_id"], **fields)
+
+    def import_directory(self, audio_dir: Path) -> int:
+        """
+        Lägg till inspelningar som finns på disk men saknas i katalogen
+        (används en gång när katalogen skapas).
+
+        Returns:
+            Antal tillagda inspelningar
+        """
+        audio_dir = Path(audio_dir)
+        if not audio_dir.exists():
+            return 0
+        found: Dict[str, Dict[str, Any]] = {}
+        for path in audio_dir.iterdir():
+            if not path.is_file() or not path.name.startswith("meeting-"):
+                continue
+            name = path.name.split(".", 1)[0]
+            entry = found.setdefault(name, {"status": "local", "started_at": started_from_name(name)})
+            stat = path.stat()
+            if path.suffix == ".wav":
+                entry["wav_bytes"] = stat.st_size
+            elif path.suffix in (".flac", ".opus"):
+                entry.update(file=path.name, size=stat.st_size, codec=path.suffix[1:])
+            elif path.suffix == ".enc":
+                # Krypterad kodad fil (meeting-….flac.enc)
+                entry.update(file=path.name, size=stat.st_size, codec=Path(path.stem).suffix[1:])
+        existing = {row["name"] for row in self._select("SELECT name FROM recordings", [])}
+        added = 0
+        for name, entry in found.items():
+            if name not in existing:
+                self.upsert(name, **entry)
+                added += 1
+        return added
+
+    # ---------- Läsning ----------
+    def _select(self, sql: str, params: List[Any]) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _row(row: sqlite3.Row) -> Dict[str, Any]:
+        item = dict(row)
+        if item.get("timings"):
+            item["timings"] = json.loads(item["timings"])
+        return item
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        rows = self._select("SELECT * FROM recordings WHERE name = ?", [name])
+        return self._row(rows[0]) if rows else None
+
+    def query(self, **query) -> Dict[str, Any]:
+        """
+        Lista inspelningar, nyaste först.
+
+        Args:
+            **query: Filter enligt FILTERS samt limit/offset (se parse_query)
+
+        Returns:
+            {"total": antal träffar, "items": [...]}
+        """
+        query = parse_query(query)
+        if "name" in query:
+            item = self.get(query["name"])
+            return {"total": int(item is not None), "items": [item] if item else []}
+        where, params = [], []
+        for key, (_, clause) in FILTERS.items():
+            if key in query:
+                where.append(clause)
+                params.append(query[key])
+        condition = f" WHERE {' AND '.join(where)}" if where else ""
+        total = self._select(f"SELECT COUNT(*) FROM recordings{condition}", params)[0][0]
+        rows = self._select(
+            f"SELECT * FROM recordings{condition} ORDER BY started_at DESC, name DESC LIMIT ? OFFSET ?",
+            params + [query["limit"], query.get("offset", 0)],
+        )
+        return {"total": total, "items": [self._row(row) for row in rows]}
+
+    def summary(self) -> Dict[str, Any]:
+        """Antal och storlek per status"""
+        rows = self._select(
+            "SELECT status, COUNT(*) AS count, COALESCE(SUM(size), 0) AS bytes, "
+            "COALESCE(SUM(duration_s), 0) AS seconds FROM recordings GROUP BY status", [])
+        return {row["status"]: {"count": row["count"], "bytes": row["bytes"], "seconds": row["seconds"]}
+                for row in rows}
+
+
+def open_catalog(audio_dir: Optional[Path] = None) -> Optional[Catalog]:
+    """
+    Öppna katalogen; importera befintliga filer första gången.
+
+    Returns:
+        Catalog, eller None om databasen inte kan öppnas
+    """
+    try:
+        catalog = Catalog()
+    except (OSError, sqlite3.Error) as e:
+        logger.error(f"Kunde inte öppna inspelningskatalog {CATALOG_DB}: {e}")
+        return None
+    if catalog.created and audio_dir:
+        added = catalog.import_directory(audio_dir)
+        if added:
+            logger.info(f"Inspelningskatalog skapad, {added} befintliga inspelningar importerade")
+    return catalog
@@ -6,34 +6,237 @@ Hanterar:
 - Lagring och laddning av konfiguration
 - Uppdatering av konfigurationsparametrar
 - WiFi-inställningar (säker lagring)
+- Atomiska, fördröjda och batchade skrivningar (skonsamt mot SD-kort)
+- Typat schema med validering och ändringsnotiser (hot-reload)
 """
 import os
 import json
+import atexit
+import tempfile
+import threading
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Callable, Iterable, List, Tuple
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Standardfördröjning (sekunder) innan ändringar skrivs till disk, så att
+# en skur av config/set-meddelanden resulterar i en enda skrivning
+DEFAULT_SAVE_DELAY = float(os.getenv("CONFIG_SAVE_DELAY", "1.0"))
+
+
+class ConfigField:
+    """Beskrivning av en konfigurationsparameter i schemat"""
+    
+    def __init__(self, kind: type, default: Any = None, env: Optional[str] = None,
+                 choices: Optional[Iterable[Any]] = None,
+                 min_value: Optional[float] = None, max_value: Optional[float] = None,
+                 secret: bool = False, multiple: bool = False):
+        """
+        Args:
+            kind: Typ (str, int, float eller bool)
+            default: Standardvärde om miljövariabeln saknas
+            env: Miljövariabel som ger standardvärdet
+            choices: Tillåtna värden
+            min_value: Minsta tillåtna värde (numeriska typer)
+            max_value: Största tillåtna värde (numeriska typer)
+            secret: Maskeras vid publicering (get_all)
+            multiple: Kommaseparerad lista där varje värde är ett av choices
+        """
+        self.kind = kind
+        self.default = default
+        self.env = env
+        self.choices = tuple(choices) if choices is not None else None
+        self.min_value = min_value
+        self.max_value = max_value
+        self.secret = secret
+        self.multiple = multiple
+    
+    def default_value(self) -> Any:
+        """Standardvärde, från miljövariabel om den är satt"""
+        if self.env and os.getenv(self.env) not in (None, ""):
+            try:
+                return self.coerce(os.getenv(self.env))
+            except ValueError as e:
+                logger.warning(f"Ogiltigt värde i {self.env}: {e}")
+        return self.default
+    
+    def coerce(self, value: Any) -> Any:
+        """
+        Konvertera och validera ett värde.
+        
+        Raises:
+            ValueError: Om värdet är ogiltigt
+        """
+        if value is None:
+            if self.kind is str:
+                return ""
+            raise ValueError("värde saknas")
+        if self.kind is bool:
+            if isinstance(value, bool):
+                result = value
+            elif str(value).strip().lower() in ("true", "1", "yes"):
+                result = True
+            elif str(value).strip().lower() in ("false", "0", "no"):
+                result = False
+            else:
+                raise ValueError(f"förväntade true/false, fick {value!r}")
+        elif self.kind in (int, float):
+            if isinstance(value, bool):
+                raise ValueError(f"förväntade tal, fick {value!r}")
+            try:
+                result = self.kind(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"förväntade {self.kind.__name__}, fick {value!r}")
+            if self.min_value is not None and result < self.min_value:
+                raise ValueError(f"minsta värde är {self.min_value}")
+            if self.max_value is not None and result > self.max_value:
+                raise ValueError(f"största värde är {self.max_value}")
+        else:
+            if not isinstance(value, str):
+                raise ValueError(f"förväntade text, fick {type(value).__name__}")
+            result = value.strip()
+        if self.multiple:
+            items = [item.strip() for item in result.split(",") if item.strip()]
+            invalid = [item for item in items if self.choices is not None and item not in self.choices]
+            if not items or invalid:
+                raise ValueError(f"tillåtna värden (kommaseparerade): {', '.join(map(str, self.choices))}")
+            return ",".join(dict.fromkeys(items))
+        if self.choices is not None and result not in self.choices:
+            raise ValueError(f"tillåtna värden: {', '.join(map(str, self.choices))}")
+        return result
+
+
+# Schema för alla konfigurationsparametrar som kan sättas via fil eller MQTT
+CONFIG_SCHEMA: Dict[str, ConfigField] = {
+    # Enhet
+    "room": ConfigField(str, "", env="DEVICE_ROOM"),
+    "email": ConfigField(str, "", env="DEVICE_EMAIL"),
+    "webhook_url": ConfigField(str, "", env="DEVICE_WEBHOOK_URL"),
+    # Ljud
+    "gain": ConfigField(float, 1.0, env="DEFAULT_GAIN", min_value=0.1, max_value=5.0),
+    "codec": ConfigField(str, "flac", env="AUDIO_CODEC", choices=("flac", "opus")),
+    "max_hours": ConfigField(float, 8.0, env="MAX_HOURS", min_value=0.1, max_value=24.0),
+    "sample_rate": ConfigField(int, 16000, env="SAMPLE_RATE", choices=(8000, 16000, 22050, 24000, 32000, 44100, 48000)),
+    "capture_rate": ConfigField(int, 0, env="CAPTURE_RATE", min_value=0, max_value=192000),
+    "sample_format": ConfigField(str, "S16_LE", env="SAMPLE_FORMAT", choices=("S16_LE", "S32_LE")),
+    "capture_channels": ConfigField(int, 1, env="CAPTURE_CHANNELS", min_value=1, max_value=16),
+    "output_channel": ConfigField(int, 0, env="OUTPUT_CHANNEL", min_value=0, max_value=15),
+    "features_enabled": ConfigField(bool, False, env="FEATURES_ENABLED"),
+    "preroll_seconds": ConfigField(float, 0.0, env="PREROLL_SECONDS", min_value=0.0, max_value=120.0),
+    "auto_record": ConfigField(bool, False, env="AUTO_RECORD"),
+    "auto_start_speech_s": ConfigField(float, 3.0, env="AUTO_START_SPEECH_S", min_value=0.5, max_value=60.0),
+    "auto_stop_silence_s": ConfigField(float, 300.0, env="AUTO_STOP_SILENCE_S", min_value=10.0, max_value=7200.0),
+    "auto_rearm_silence_s": ConfigField(float, 60.0, env="AUTO_REARM_SILENCE_S", min_value=0.0, max_value=3600.0),
+    # Uppladdning
+    "upload_target": ConfigField(str, "n8n", env="UPLOAD_TARGET", choices=("s3", "http", "n8n"), multiple=True),
+    "n8n_webhook_url": ConfigField(str, "", env="N8N_WEBHOOK_URL"),
+    "n8n_auth_header": ConfigField(str, "", env="N8N_AUTH_HEADER", secret=True),
+    "http_upload_url": ConfigField(str, "", env="HTTP_UPLOAD_URL"),
+    "http_auth_header": ConfigField(str, "", env="HTTP_AUTH_HEADER", secret=True),
+    "s3_bucket": ConfigField(str, "", env="S3_BUCKET"),
+    "s3_endpoint_url": ConfigField(str, "", env="S3_ENDPOINT_URL"),
+    "aws_region": ConfigField(str, "eu-north-1", env="AWS_REGION"),
+    # MQTT
+    "mqtt_broker": ConfigField(str, "localhost", env="MQTT_BROKER"),
+    "mqtt_port": ConfigField(int, 1883, env="MQTT_PORT", min_value=1, max_value=65535),
+    "mqtt_username": ConfigField(str, "", env="MQTT_USERNAME"),
+    "mqtt_password": ConfigField(str, "", env="MQTT_PASSWORD", secret=True),
+    "mqtt_topic_prefix": ConfigField(str, "meetrec/device", env="MQTT_TOPIC_PREFIX"),
+    "mqtt_use_tls": ConfigField(bool, False, env="MQTT_USE_TLS"),
+    "mqtt_tls_insecure": ConfigField(bool, False, env="MQTT_TLS_INSECURE"),
+    # WiFi (lagras även separat, se set_wifi_credentials)
+    "wifi_ssid": ConfigField(str, ""),
+    "wifi_password": ConfigField(str, "", secret=True),
+}
+
+# Nycklar per delsystem, för lyssnare som bara bryr sig om en del av konfigurationen
+UPLOAD_KEYS = ("upload_target", "n8n_webhook_url", "n8n_auth_header", "http_upload_url",
+               "http_auth_header", "s3_bucket", "s3_endpoint_url", "aws_region")
+MQTT_KEYS = ("mqtt_broker", "mqtt_port", "mqtt_username", "mqtt_password",
+             "mqtt_topic_prefix", "mqtt_use_tls", "mqtt_tls_insecure")
+PREROLL_KEYS = ("preroll_seconds", "sample_rate", "capture_rate", "capture_channels")
+# Röststyrd inspelning lyssnar på pre-roll-källan och startas om med den
+AUTO_KEYS = ("auto_record", "auto_start_speech_s", "auto_stop_silence_s", "auto_rearm_silence_s")
+
+
+def write_json_atomic(path: Path, data: Any, mode: Optional[int] = None):
+    """
+    Skriv JSON atomiskt: temporär fil -> fsync -> rename -> fsync av katalog.
+    
+    Ett strömavbrott mitt i skrivningen lämnar antingen den gamla eller den
+    nya filen intakt, aldrig en trunkerad JSON.
+    
+    Args:
+        path: Målfil
+        data: JSON-serialiserbar data
+        mode: Filrättigheter (t.ex. 0o600); sätts innan innehållet skrivs
+        
+    Raises:
+        OSError: Vid skrivfel
+    """
+    path = Path(path)
+    fd, tmp_name = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=str(path.parent))
+    try:
+        if mode is not None:
+            os.fchmod(fd, mode)
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
+    
+    # Säkerställ att själva rename-operationen är beständig
+    try:
+        dir_fd = os.open(str(path.parent), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass
+
 
 class ConfigManager:
     """Hanterar konfiguration för mötesinspelaren"""
     
-    def __init__(self, config_path: Optional[Path] = None):
+    def __init__(self, config_path: Optional[Path] = None, save_delay: Optional[float] = None):
         """
         Initiera konfigurationshanterare.
         
         Args:
             config_path: Sökväg till konfigurationsfil (default: ~/.meetrec/config.json)
+            save_delay: Sekunder att vänta innan ändringar skrivs (0 = skriv direkt,
+                default: CONFIG_SAVE_DELAY eller 1.0)
         """
         if config_path is None:
             config_path = Path.home() / ".meetrec" / "config.json"
         
         self.config_path = config_path
         self.config_path.parent.mkdir(parents=True, exist_ok=True)
+        self.save_delay = DEFAULT_SAVE_DELAY if save_delay is None else save_delay
+        
+        # Skrivtillstånd: osparade ändringar, fördröjd skrivning och transaktionsdjup
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._save_timer: Optional[threading.Timer] = None
+        self._transaction_depth = 0
+        
+        # Ändringslyssnare: (callback, nycklar eller None för alla)
+        self._listeners: List[Tuple[Callable[[Dict[str, Tuple[Any, Any]]], None], Optional[frozenset]]] = []
         
         # Ladda konfiguration från fil eller skapa standardkonfiguration
         self.config = self._load_config()
+        
+        # Skriv osparade ändringar vid avslut
+        atexit.register(self.flush)
     
     def _load_config(self) -> Dict[str, Any]:
         """
@@ -42,22 +245,26 @@ class ConfigManager:
         Returns:
             Dictionary med konfiguration
         """
-        # Standardkonfiguration från miljövariabler
-        default_config = {
-            "room": os.getenv("DEVICE_ROOM", ""),
-            "email": os.getenv("DEVICE_EMAIL", ""),
-            "webhook_url": os.getenv("DEVICE_WEBHOOK_URL", ""),
-            "upload_target": os.getenv("UPLOAD_TARGET", "n8n"),
-            "n8n_webhook_url": os.getenv("N8N_WEBHOOK_URL", ""),
-        }
+        # Standardkonfiguration från schemat (miljövariabler eller standardvärden)
+        self.defaults = {key: field.default_value() for key, field in CONFIG_SCHEMA.items()}
+        default_config = dict(self.defaults)
+        # Okända eller ogiltiga nycklar från filen: används inte, men skrivs tillbaka
+        # oförändrade så att de inte försvinner vid nästa sparning
+        self._unrecognized: Dict[str, Any] = {}
         
         # Försök ladda från fil
         if self.config_path.exists():
             try:
                 with open(self.config_path, 'r') as f:
                     loaded_config = json.load(f)
-                # Sammanfoga med standardvärden (laddat tar prioritet)
-                default_config.update(loaded_config)
+                # Sammanfoga med standardvärden (laddat tar prioritet, ogiltiga värden ignoreras)
+                valid, errors = self.validate(loaded_config)
+                for key, error in errors.items():
+                    logger.warning(f"Ignorerar ogiltig konfiguration {key} i {self.config_path} "
+                                   f"(behålls i filen): {error}")
+                if isinstance(loaded_config, dict):
+                    self._unrecognized = {key: loaded_config[key] for key in errors}
+                default_config.update(valid)
                 logger.info(f"Konfiguration laddad från {self.config_path}")
             except Exception as e:
                 logger.warning(f"Kunde inte ladda konfiguration från {self.config_path}: {e}")
@@ -66,19 +273,137 @@ class ConfigManager:
     
     def save_config(self) -> bool:
         """
-        Spara nuvarande konfiguration till fil.
+        Spara nuvarande konfiguration till fil direkt (atomiskt).
         
         Returns:
             True om lyckades, False annars
         """
+        with self._lock:
+            self._cancel_timer()
+            try:
+                # Spara bara värden som skiljer sig från standard, så att ändrade
+                # miljövariabler slår igenom för allt som inte satts explicit
+                overrides = {k: v for k, v in self.config.items() if self.defaults.get(k, object()) != v}
+                write_json_atomic(self.config_path, {**self._unrecognized, **overrides})
+                self._dirty = False
+                logger.info(f"Konfiguration sparad till {self.config_path}")
+                return True
+            except Exception as e:
+                logger.error(f"Kunde inte spara konfiguration: {e}")
+                return False
+    
+    def flush(self) -> bool:
+        """
+        Skriv osparade ändringar direkt (t.ex. vid avslut).
+        
+        Returns:
+            True om lyckades eller inget behövde sparas, False annars
+        """
+        with self._lock:
+            if not self._dirty:
+                return True
+            return self.save_config()
+    
+    @contextmanager
+    def transaction(self):
+        """
+        Samla flera ändringar till en enda skrivning.
+        
+        Exempel:
+            with config_manager.transaction():
+                config_manager.set("room", "A")
+                config_manager.update({"email": "a@example.com"})
+        
+        Ändringarna sparas när det yttersta blocket avslutas. Transaktioner
+        kan nästlas.
+        """
+        with self._lock:
+            self._transaction_depth += 1
         try:
-            with open(self.config_path, 'w') as f:
-                json.dump(self.config, f, indent=2)
-            logger.info(f"Konfiguration sparad till {self.config_path}")
-            return True
-        except Exception as e:
-            logger.error(f"Kunde inte spara konfiguration: {e}")
-            return False
+            yield self
+        finally:
+            with self._lock:
+                self._transaction_depth -= 1
+                if self._transaction_depth == 0 and self._dirty:
+                    self._schedule_save()
+    
+    def _mark_dirty(self) -> bool:
+        """
+        Markera konfigurationen som ändrad och schemalägg skrivning.
+        
+        Returns:
+            True om ändringen sparats eller schemalagts, False vid skrivfel
+        """
+        with self._lock:
+            self._dirty = True
+            if self._transaction_depth > 0:
+                return True
+            return self._schedule_save()
+    
+    def _schedule_save(self) -> bool:
+        """Skriv direkt (save_delay == 0) eller starta/förläng fördröjd skrivning"""
+        if self.save_delay <= 0:
+            return self.save_config()
+        self._cancel_timer()
+        self._save_timer = threading.Timer(self.save_delay, self.flush)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+        return True
+    
+    def _cancel_timer(self):
+        if self._save_timer is not None:
+            self._save_timer.cancel()
+            self._save_timer = None
+    
+    @staticmethod
+    def validate(updates: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        """
+        Validera konfigurationsvärden mot CONFIG_SCHEMA.
+        
+        Args:
+            updates: Dictionary med värden att validera
+            
+        Returns:
+            Tuple med (giltiga värden konverterade till rätt typ, fel per nyckel)
+        """
+        valid, errors = {}, {}
+        if not isinstance(updates, dict):
+            return valid, {"*": "konfigurationen måste vara ett JSON-objekt"}
+        for key, value in updates.items():
+            field = CONFIG_SCHEMA.get(key)
+            if field is None:
+                errors[key] = "okänd parameter"
+                continue
+            try:
+                valid[key] = field.coerce(value)
+            except ValueError as e:
+                errors[key] = str(e)
+        return valid, errors
+    
+    def add_listener(self, callback: Callable[[Dict[str, Tuple[Any, Any]]], None],
+                     keys: Optional[Iterable[str]] = None):
+        """
+        Registrera lyssnare för konfigurationsändringar.
+        
+        Callbacken anropas (i den tråd som gjorde ändringen) med en dict
+        nyckel -> (gammalt värde, nytt värde) för de nycklar som ändrats.
+        
+        Args:
+            callback: Funktion att anropa vid ändring
+            keys: Nycklar att bevaka (None = alla)
+        """
+        self._listeners.append((callback, frozenset(keys) if keys is not None else None))
+    
+    def _notify(self, changes: Dict[str, Tuple[Any, Any]]):
+        """Anropa lyssnare för ändrade nycklar (utanför låset)"""
+        for callback, keys in list(self._listeners):
+            relevant = changes if keys is None else {k: v for k, v in changes.items() if k in keys}
+            if not relevant:
+                continue
+            try:
+                callback(relevant)
+            except Exception as e:
+                logger.error(f"Fel i konfigurationslyssnare: {e}")
     
     def get(self, key: str, default: Any = None) -> Any:
         """
@@ -91,11 +416,12 @@ class ConfigManager:
         Returns:
             Konfigurationsvärde
         """
-        return self.config.get(key, default)
+        with self._lock:
+            return self.config.get(key, default)
     
     def set(self, key: str, value: Any) -> bool:
         """
-        Sätt konfigurationsvärde och spara.
+        Sätt konfigurationsvärde och spara (fördröjt, se save_delay).
         
         Args:
             key: Nyckel för värdet
@@ -104,21 +430,37 @@ class ConfigManager:
         Returns:
             True om lyckades, False annars
         """
-        self.config[key] = value
-        return self.save_config()
+        return self.update({key: value})
     
     def update(self, updates: Dict[str, Any]) -> bool:
         """
-        Uppdatera flera konfigurationsvärden samtidigt.
+        Uppdatera flera konfigurationsvärden samtidigt (en skrivning).
+        
+        Värdena valideras mot CONFIG_SCHEMA; ogiltiga värden loggas och
+        ignoreras medan giltiga värden tillämpas.
         
         Args:
             updates: Dictionary med uppdateringar
             
         Returns:
-            True om lyckades, False annars
+            True om lyckades, False vid valideringsfel eller skrivfel
         """
-        self.config.update(updates)
-        return self.save_config()
+        valid, errors = self.validate(updates)
+        for key, error in errors.items():
+            logger.warning(f"Ogiltig konfiguration {key}: {error}")
+        
+        with self._lock:
+            changes = {k: (self.config.get(k), v) for k, v in valid.items() if self.config.get(k) != v}
+            self.config.update(valid)
+            # Ett giltigt värde ersätter det ogiltiga som behölls från filen
+            replaced = [key for key in valid if key in self._unrecognized]
+            for key in replaced:
+                del self._unrecognized[key]
+            saved = self._mark_dirty() if changes or replaced else True
+        
+        if changes:
+            self._notify(changes)
+        return saved and not errors
     
     def get_all(self) -> Dict[str, Any]:
         """
@@ -128,10 +470,12 @@ class ConfigManager:
             Dictionary med all konfiguration
         """
         # Skapa en kopia och filtrera bort känsliga uppgifter
-        safe_config = self.config.copy()
-        # Ta bort WiFi-lösenord om det finns
-        if "wifi_password" in safe_config:
-            safe_config["wifi_password"] = "***"
+        with self._lock:
+            safe_config = self.config.copy()
+        # Maskera hemliga värden (WiFi-lösenord, auth-headers m.m.) om de är satta
+        for key, field in CONFIG_SCHEMA.items():
+            if field.secret and safe_config.get(key):
+                safe_config[key] = "***"
         return safe_config
     
     def set_wifi_credentials(self, ssid: str, password: str) -> bool:
@@ -153,11 +497,9 @@ class ConfigManager:
                 "ssid": ssid,
                 "password": password
             }
-            with open(wifi_config_path, 'w') as f:
-                json.dump(wifi_config, f, indent=2)
-            
-            # Sätt restriktiva filrättigheter (endast läsbar av ägare)
-            wifi_config_path.chmod(0o600)
+            # Atomisk skrivning med restriktiva filrättigheter (endast läsbar av ägare)
+            # redan innan lösenordet hamnar på disk
+            write_json_atomic(wifi_config_path, wifi_config, mode=0o600)
             
             logger.info(f"WiFi-uppgifter sparade för SSID: {ssid}")
             return True
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Strömmande kryptering av inspelningar (vila och överföring).
+
+Med ENCRYPTION_ENABLED=true krypteras den kodade filen medan ffmpeg
+skriver den (samma svep som hashningen i integrity.py), så ingen extra
+läsning eller skrivning av hela filen behövs. På disk och hos mottagaren
+finns då bara <inspelning>.flac.enc; WAV-filen tas bort när kodningen
+lyckats.
+
+Format (liknar age/STREAM):
+
+    MRENC | version | chiffer | nyckel-id (8) | wrap-nonce (12) |
+    inslagen filnyckel (32 + 16) | nonce-prefix (7) | blockstorlek (uint32)
+    block: chiffertext + tagg (16), ENCRYPTION_CHUNK byte klartext per block
+
+Varje inspelning får en slumpad filnyckel som slås in (AEAD) med
+enhetsnyckeln i DEVICE_KEY_FILE. Blockens nonce är prefix + blocknummer +
+en flagga för sista blocket, och huvudet är associerad data, så att
+omkastade, ändrade eller avkapade filer upptäcks vid dekryptering.
+
+Chiffer: "aes-gcm" (standard) eller "chacha20" (ChaCha20-Poly1305, snabbare
+på Raspberry Pi 4 som saknar AES-instruktioner). Kräver paketet
+cryptography.
+
+Verktyg:
+    python src/encryption.py keygen             # skapa/visa enhetsnyckeln
+    python src/encryption.py decrypt in.enc out  # dekryptera (t.ex. på servern)
+    python src/encryption.py bench --mb 64       # genomströmning per chiffer
+"""
+import os
+import sys
+import time
+import struct
+import hashlib
+import logging
+import argparse
+from pathlib import Path
+from typing import BinaryIO
+
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+    from cryptography.exceptions import InvalidTag
+    CRYPTOGRAPHY_AVAILABLE = True
+except ImportError:
+    CRYPTOGRAPHY_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+ENCRYPTION_ENABLED = os.getenv("ENCRYPTION_ENABLED", "false").lower() in ("true", "1", "yes")
+ENCRYPTION_CIPHER = os.getenv("ENCRYPTION_CIPHER", "aes-gcm").lower()
+# Klartext per block; större block ger något lägre overhead (16 byte tagg per block)
+ENCRYPTION_CHUNK = int(os.getenv("ENCRYPTION_CHUNK", str(64 * 1024)))
+DEVICE_KEY_FILE = os.path.expanduser(os.getenv("DEVICE_KEY_FILE", "~/.meetrec/device.key"))
+
+ENCRYPTED_SUFFIX = ".enc"
+MAGIC = b"MRENC"
+FORMAT_VERSION = 1
+CIPHERS = {"aes-gcm": 1, "chacha20": 2}
+KEY_SIZE = 32
+TAG_SIZE = 16
+NONCE_PREFIX_SIZE = 7
+_PREFIX = struct.Struct(">5sBB8s12s")      # magic, version, chiffer, nyckel-id, wrap-nonce
+_SUFFIX = struct.Struct(">7sI")            # nonce-prefix, blockstorlek
+HEADER_SIZE = _PREFIX.size + KEY_SIZE + TAG_SIZE + _SUFFIX.size
+
+
+def _aead(cipher: str, key: bytes):
+    if not CRYPTOGRAPHY_AVAILABLE:
+        raise RuntimeError("Kryptering kräver cryptography (pip install cryptography)")
+    if cipher == "aes-gcm":
+        return AESGCM(key)
+    if cipher == "chacha20":
+        return ChaCha20Poly1305(key)
+    raise ValueError(f"Okänt chiffer: {cipher} (aes-gcm eller chacha20)")
+
+
+def key_id(device_key: bytes) -> bytes:
+    """Kort identitet för enhetsnyckeln (står i huvudet, avslöjar inte nyckeln)"""
+    return hashlib.sha256(b"meetrec-device-key" + device_key).digest()[:8]
+
+
+def load_device_key(path: str = DEVICE_KEY_FILE, create: bool = True) -> bytes:
+    """
+    Läs enhetsnyckeln (hex), eller skapa en ny med rättigheter 0600.
+
+    Raises:
+        FileNotFoundError: Om nyckeln saknas och create=False
+        ValueError: Om filen inte innehåller en 256-bitars nyckel
+    """
+    path = Path(path)
+    if not path.exists():
+        if not create:
+            raise FileNotFoundError(f"Enhetsnyckel saknas: {path}")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        key = os.urandom(KEY_SIZE)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(key.hex() + "\n")
+        logger.info(f"Ny enhetsnyckel skapad: {path} (id {key_id(key).hex()})")
+        return key
+    key = bytes.fromhex(path.read_text().strip())
+    if len(key) != KEY_SIZE:
+        raise ValueError(f"Enhetsnyckeln i {path} måste vara {KEY_SIZE} byte (hex)")
+    return key
+
+
+def encrypted_path(path: Path) -> Path:
+    return Path(f"{path}{ENCRYPTED_SUFFIX}")
+
+
+def encrypted_size(plain_size: int, chunk_size: int = ENCRYPTION_CHUNK) -> int:
+    """Storlek på den krypterade filen (känd i förväg, t.ex. för Content-Length)"""
+    chunks = max(1, -(-plain_size // chunk_size))
+    return HEADER_SIZE + plain_size + chunks * TAG_SIZE
+
+
+def _nonce(prefix: bytes, counter: int, last: bool) -> bytes:
+    return prefix + struct.pack(">IB", counter, 1 if last else 0)
+
+
+class Encryptor:
+    """Krypterar en ström block för block; header skrivs först"""
+
+    def __init__(self, device_key: bytes, cipher: str = ENCRYPTION_CIPHER, chunk_size: int = ENCRYPTION_CHUNK):
+        if cipher not in CIPHERS:
+            raise ValueError(f"Okänt chiffer: {cipher} (aes-gcm eller chacha20)")
+        self.chunk_size = chunk_size
+        file_key = os.urandom(KEY_SIZE)
+        wrap_nonce = os.urandom(12)
+        prefix = _PREFIX.pack(MAGIC, FORMAT_VERSION, CIPHERS[cipher], key_id(device_key), wrap_nonce)
+        wrapped = _aead(cipher, device_key).encrypt(wrap_nonce, file_key, prefix)
+        self._nonce_prefix = os.urandom(NONCE_PREFIX_SIZE)
+        self.header = prefix + wrapped + _SUFFIX.pack(self._nonce_prefix, chunk_size)
+        self._aead = _aead(cipher, file_key)
+        self._buffer = bytearray()
+        self._counter = 0
+
+    def _seal(self, data: bytes, last: bool) -> bytes:
+        sealed = self._aead.encrypt(_nonce(self._nonce_prefix, self._counter, last), data, self.header)
+        self._counter += 1
+        return sealed
+
+    def update(self, data: bytes) -> bytes:
+        """Kryptera hela block; ett block hålls kvar tills det är känt om det är det sista"""
+        self._buffer += data
+        out = bytearray()
+        while len(self._buffer) > self.chunk_size:
+            out += self._seal(bytes(self._buffer[:self.chunk_size]), last=False)
+            del self._buffer[:self.chunk_size]
+        return bytes(out)
+
+    def finalize(self) -> bytes:
+        last = self._seal(bytes(self._buffer), last=True)
+        self._buffer.clear()
+        return last
+
+
+class EncryptingWriter:
+    """
+    Krypterar framför en annan skrivare (t.ex. integrity.HashingWriter).
+
+    Samma gränssnitt som HashingWriter; size är antal byte klartext, och
+    hashen från commit() gäller den krypterade filen (det som laddas upp).
+    """
+
+    def __init__(self, inner, encryptor: Encryptor):
+        self.inner = inner
+        self.path = inner.path
+        self.size = 0
+        self._encryptor = encryptor
+        inner.write(encryptor.header)
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        sealed = self._encryptor.update(data)
+        if sealed:
+            self.inner.write(sealed)
+
+    def commit(self):
+        self.inner.write(self._encryptor.finalize())
+        return self.inner.commit()
+
+    def abort(self):
+        self.inner.abort()
+
+
+def decrypt_stream(src: BinaryIO, dst: BinaryIO, device_key: bytes) -> int:
+    """
+    Dekryptera en ström.
+
+    Returns:
+        Antal byte klartext
+
+    Raises:
+        ValueError: Vid fel nyckel, ändrad eller avkapad fil
+    """
+    header = src.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE or not header.startswith(MAGIC):
+        raise ValueError("Inte en krypterad inspelning")
+    magic, version, cipher_id, kid, wrap_nonce = _PREFIX.unpack_from(header)
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Okänd formatversion: {version}")
+    cipher = next((name for name, value in CIPHERS.items() if value == cipher_id), None)
+    if cipher is None:
+        raise ValueError(f"Okänt chiffer: {cipher_id}")
+    if kid != key_id(device_key):
+        raise ValueError(f"Filen är krypterad med en annan enhetsnyckel (id {kid.hex()})")
+    wrapped = header[_PREFIX.size:_PREFIX.size + KEY_SIZE + TAG_SIZE]
+    nonce_prefix, chunk_size = _SUFFIX.unpack_from(header, _PREFIX.size + KEY_SIZE + TAG_SIZE)
+    try:
+        file_key = _aead(cipher, device_key).decrypt(wrap_nonce, wrapped, header[:_PREFIX.size])
+        aead = _aead(cipher, file_key)
+        total = 0
+        counter = 0
+        block = src.read(chunk_size + TAG_SIZE)
+        while True:
+            following = src.read(chunk_size + TAG_SIZE)
+            last = not following
+            dst.write(aead.decrypt(_nonce(nonce_prefix, counter, last), block, header))
+            total += len(block) - TAG_SIZE
+            if last:
+                return total
+            block = following
+            counter += 1
+    except InvalidTag:
+        raise ValueError("Dekryptering misslyckades: filen är ändrad, avkapad eller nyckeln fel")
+
+
+def benchmark(megabytes: int = 64, chunk_size: int = ENCRYPTION_CHUNK) -> dict:
+    """Genomströmning (MB/s) per chiffer för kryptering i minnet"""
+    data = os.urandom(1024 * 1024)
+    key = os.urandom(KEY_SIZE)
+    results = {}
+    for cipher in CIPHERS:
+        encryptor = Encryptor(key, cipher, chunk_size)
+        start = time.perf_counter()
+        for _ in range(megabytes):
+            encryptor.update(data)
+        encryptor.finalize()
+        results[cipher] = round(megabytes / (time.perf_counter() - start), 1)
+    return results
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="Kryptering av inspelningar")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("keygen", help="Skapa enhetsnyckeln om den saknas och visa dess id")
+    decrypt = sub.add_parser("decrypt", help="Dekryptera en .enc-fil")
+    decrypt.add_argument("input")
+    decrypt.add_argument("output")
+    decrypt.add_argument("--key-file", default=DEVICE_KEY_FILE)
+    bench = sub.add_parser("bench", help="Mät genomströmning per chiffer")
+    bench.add_argument("--mb", type=int, default=64)
+    args = parser.parse_args()
+
+    if args.command == "keygen":
+        key = load_device_key()
+        print(f"{DEVICE_KEY_FILE}: id {key_id(key).hex()}")
+    elif args.command == "decrypt":
+        key = load_device_key(args.key_file, create=False)
+        with open(args.input, "rb") as src, open(args.output, "wb") as dst:
+            try:
+                size = decrypt_stream(src, dst, key)
+            except ValueError as e:
+                print(e, file=sys.stderr)
+                sys.exit(1)
+        print(f"{args.output}: {size} byte")
+    else:
+        for cipher, rate in benchmark(args.mb).items():
+            print(f"{cipher:<10} {rate:>8} MB/s")
+
+
+if __name__ == "__main__":
+    main()
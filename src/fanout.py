@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Uppladdning till flera mål med en enda läsning av filen.
+
+Med t.ex. UPLOAD_TARGET=s3,n8n läser fan_out() den kodade filen en gång
+från disk och delar ut varje block till en TeeStream per mål. Målen
+laddar upp samtidigt i egna trådar och läser sin ström som en vanlig fil.
+Köerna är begränsade, så minnet hålls konstant och det långsammaste målet
+bestämmer takten. Ett mål som misslyckas eller redan har filen stänger
+sin ström och kopplas bort utan att påverka de andra; ett mål som slutar
+läsa utan att stänga håller upp de andra tills dess timeout löper ut.
+"""
+import queue
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Läsblock från disk och antal block som buffras per mål (~4 MB)
+FANOUT_CHUNK = 256 * 1024
+FANOUT_QUEUE = 16
+
+
+class TeeStream:
+    """
+    Läsände för ett mål: fil-liknande (read) med känd storlek.
+
+    Har ingen seek/tell, så att t.ex. boto3 behandlar den som en
+    icke-sökbar ström och läser den i ordning.
+    """
+
+    def __init__(self, size: int, maxsize: int = FANOUT_QUEUE):
+        self.size = size
+        self.closed = False
+        self._queue: "queue.Queue" = queue.Queue(maxsize)
+        self._buffer = bytearray()
+        self._eof = False
+
+    def _put(self, item) -> bool:
+        """Lämna ett block (None = slut, Exception = läsfel); False om strömmen stängts"""
+        while not self.closed:
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._eof and (size is None or size < 0 or len(self._buffer) < size):
+            item = self._queue.get()
+            if item is None:
+                self._eof = True
+            elif isinstance(item, Exception):
+                raise IOError(f"Läsfel vid uppladdning: {item}")
+            else:
+                self._buffer += item
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def readable(self) -> bool:
+        return True
+
+    def close(self):
+        self.closed = True
+
+
+Upload = Callable[[str, TeeStream], Tuple[bool, str]]
+
+
+def fan_out(path: Path, targets: List[str], upload: Upload,
+            chunk_size: int = FANOUT_CHUNK) -> Dict[str, Tuple[bool, str]]:
+    """
+    Ladda upp en fil till flera mål samtidigt med en läsning.
+
+    Args:
+        path: Fil att ladda upp
+        targets: Målnamn
+        upload: upload(mål, ström) -> (ok, info), anropas i en tråd per mål
+
+    Returns:
+        Resultat per mål
+    """
+    size = Path(path).stat().st_size
+    streams = {target: TeeStream(size) for target in targets}
+    results: Dict[str, Tuple[bool, str]] = {}
+
+    def worker(target: str):
+        try:
+            results[target] = upload(target, streams[target])
+        except Exception as e:
+            results[target] = (False, f"{target}-fel: {e}")
+        finally:
+            # Kopplar bort målet från läsningen även om det slutade i förtid
+            streams[target].close()
+
+    threads = [threading.Thread(target=worker, args=(target,), name=f"upload-{target}", daemon=True)
+               for target in targets]
+    for thread in threads:
+        thread.start()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                delivered = [stream._put(chunk) for stream in streams.values() if not stream.closed]
+                if not any(delivered):
+                    break
+        for stream in streams.values():
+            stream._put(None)
+    except OSError as e:
+        logger.error(f"Kunde inte läsa {path}: {e}")
+        for stream in streams.values():
+            stream._put(e)
+    for thread in threads:
+        thread.join()
+    return results
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Features för talaruppdelning (diarisering), beräknade på enheten.
+
+Från den färdiga WAV-filen räknas kompakta värden per ram fram:
+
+- energi per kanal (dBFS)
+- talaktivitet (VAD) från energi över ett adaptivt brusgolv och andelen
+  energi i talbandet
+- riktning (DOA) med GCC-PHAT mellan mikrofonparen när inspelningen har
+  flera mikrofonkanaler (t.ex. ReSpeaker med CAPTURE_CHANNELS=6)
+
+Resultatet sparas som <inspelning>.features.json.gz och laddas upp
+bredvid ljudfilen, så att servern kan hoppa över egen VAD och få en
+första talarindelning från riktningen i stället för att analysera hela
+mötet från början. Filen läses i block och varje block beräknas
+vektoriserat, så minnesanvändningen är konstant även för långa möten.
+"""
+import os
+import gzip
+import json
+import wave
+import logging
+from pathlib import Path
+from typing import Optional, List, Dict, Any
+
+import numpy as np
+
+from resample import read_frames
+
+logger = logging.getLogger(__name__)
+
+FEATURES_ENABLED = os.getenv("FEATURES_ENABLED", "false").lower() in ("true", "1", "yes")
+FEATURES_FRAME_MS = int(os.getenv("FEATURES_FRAME_MS", "50"))
+# Mikrofonkanaler för riktningsskattning (ReSpeaker 4-Mic v2.0: kanal 1-4)
+FEATURES_MIC_CHANNELS = os.getenv("FEATURES_MIC_CHANNELS", "1,2,3,4")
+# Mikrofonerna antas sitta jämnt fördelade på en cirkel med denna radie (meter)
+FEATURES_MIC_RADIUS = float(os.getenv("FEATURES_MIC_RADIUS", "0.032"))
+
+SIDECAR_SUFFIX = ".features.json.gz"
+FORMAT_VERSION = 1
+
+SPEED_OF_SOUND = 343.0
+# Ramar per läsblock (50 ms-ramar => 60 s per block)
+BLOCK_FRAMES = 1200
+# VAD: marginal över brusgolvet, fönster för brusgolvet och minsta längder
+VAD_MARGIN_DB = 9.0
+VAD_FLOOR_SECONDS = 10.0
+VAD_MIN_SPEECH_S = 0.2
+VAD_HANGOVER_S = 0.3
+# Talband för VAD (grundton och formanter) och för riktning (korta våglängder)
+SPEECH_BAND = (100.0, 4000.0)
+DOA_BAND = (300.0, 3400.0)
+# Interpolation av korskorrelationen för riktning med subsampelupplösning
+GCC_INTERP = 8
+
+
+def parse_channels(value: str) -> List[int]:
+    """'1,2,3,4' -> [1, 2, 3, 4]"""
+    return [int(part) for part in value.split(",") if part.strip()]
+
+
+def circular_array(count: int, radius: float) -> np.ndarray:
+    """Mikrofonpositioner (count, 2) jämnt fördelade på en cirkel"""
+    angles = 2 * np.pi * np.arange(count) / count
+    return np.stack([np.cos(angles), np.sin(angles)], axis=1) * radius
+
+
+class DOAEstimator:
+    """
+    Riktningsskattning per ram med GCC-PHAT.
+
+    Tidsskillnaden mellan varje mikrofonpar skattas ur den fasnormerade
+    korskorrelationen, och riktningen löses med minsta kvadrat ur alla par
+    samtidigt. Alla ramar i ett block beräknas i samma FFT-anrop.
+    """
+
+    def __init__(self, positions: np.ndarray, samplerate: int, frame_len: int):
+        self.samplerate = samplerate
+        count = len(positions)
+        self.pairs = np.array([(i, j) for i in range(count) for j in range(i + 1, count)])
+        baselines = positions[self.pairs[:, 0]] - positions[self.pairs[:, 1]]   # (P, 2)
+        # Närmare mikrofon hörs först: tdoa = -baselines @ riktning / c
+        self._solve = -np.linalg.pinv(baselines) * SPEED_OF_SOUND               # (2, P)
+        self.nfft = 1 << int(np.ceil(np.log2(2 * frame_len)))
+        max_delay = np.linalg.norm(baselines, axis=1).max() / SPEED_OF_SOUND
+        self.max_lag = int(np.ceil(max_delay * samplerate * GCC_INTERP)) + 1
+        self._window = np.hanning(frame_len).astype(np.float32)
+        # Korskorrelationen behövs bara för fysiskt möjliga fördröjningar, och
+        # bara talbandet används; då räcker en matrismultiplikation i stället
+        # för en lång (interpolerad) invers FFT per par och ram
+        freqs = np.fft.rfftfreq(self.nfft, 1.0 / samplerate)
+        self._bins = np.flatnonzero((freqs >= DOA_BAND[0]) & (freqs <= DOA_BAND[1]))
+        lags = np.arange(-self.max_lag, self.max_lag + 1) / float(samplerate * GCC_INTERP)
+        self._lags = lags
+        self._steering = np.exp(2j * np.pi * np.outer(freqs[self._bins], lags)).astype(np.complex64)
+
+    def estimate(self, frames: np.ndarray) -> np.ndarray:
+        """
+        Args:
+            frames: Array (n, frame_len, mics)
+
+        Returns:
+            Azimut i grader (0-360) per ram
+        """
+        spectra = np.fft.rfft(frames * self._window[None, :, None], n=self.nfft, axis=1)[:, self._bins]
+        cross = spectra[:, :, self.pairs[:, 0]] * np.conj(spectra[:, :, self.pairs[:, 1]])
+        cross /= np.abs(cross) + 1e-12
+        cc = np.einsum("nkp,kl->npl", cross.astype(np.complex64), self._steering, optimize=True).real
+        tdoa = self._lags[np.argmax(cc, axis=2)]                                 # (n, P)
+        direction = tdoa @ self._solve.T                                         # (n, 2)
+        return np.degrees(np.arctan2(direction[:, 1], direction[:, 0])) % 360.0
+
+
+def _speech_ratio(frames: np.ndarray, samplerate: int) -> np.ndarray:
+    """Andel av energin i talbandet per ram (frames: (n, frame_len))"""
+    power = np.abs(np.fft.rfft(frames, axis=1)) ** 2
+    freqs = np.fft.rfftfreq(frames.shape[1], 1.0 / samplerate)
+    band = (freqs >= SPEECH_BAND[0]) & (freqs <= SPEECH_BAND[1])
+    return power[:, band].sum(axis=1) / (power.sum(axis=1) + 1e-9)
+
+
+def detect_speech(energy_db: np.ndarray, speech_ratio: np.ndarray, frame_s: float) -> np.ndarray:
+    """
+    Energibaserad VAD med adaptivt brusgolv.
+
+    Brusgolvet är den 10:e percentilen av energin i fönster om
+    VAD_FLOOR_SECONDS. Korta avbrott fylls igen (hangover) och korta
+    utbrott tas bort.
+    """
+    n = len(energy_db)
+    if n == 0:
+        return np.zeros(0, dtype=bool)
+    window = max(1, int(VAD_FLOOR_SECONDS / frame_s))
+    padded = np.pad(energy_db, (0, -n % window), mode="edge").reshape(-1, window)
+    floors = np.percentile(padded, 10, axis=1)
+    centers = np.arange(len(floors)) * window + window / 2.0
+    floor = np.interp(np.arange(n), centers, floors)
+    active = (energy_db > floor + VAD_MARGIN_DB) & (speech_ratio > 0.5)
+
+    # Hangover: fyll luckor kortare än VAD_HANGOVER_S, ta bort utbrott kortare än VAD_MIN_SPEECH_S
+    active = _fill_runs(active, False, int(VAD_HANGOVER_S / frame_s))
+    return _fill_runs(active, True, int(VAD_MIN_SPEECH_S / frame_s))
+
+
+def _fill_runs(mask: np.ndarray, value: bool, max_len: int) -> np.ndarray:
+    """Vänd inre sekvenser av `value` som är högst max_len ramar långa"""
+    if max_len <= 0 or not len(mask):
+        return mask
+    edges = np.flatnonzero(np.diff(mask.astype(np.int8))) + 1
+    bounds = np.concatenate([[0], edges, [len(mask)]])
+    starts, ends = bounds[:-1], bounds[1:]
+    inner = (starts > 0) & (ends < len(mask))
+    flip = (mask[starts] == value) & (ends - starts <= max_len) & inner
+    out = mask.copy()
+    for start, end in zip(starts[flip], ends[flip]):
+        out[start:end] = not value
+    return out
+
+
+def segments(mask: np.ndarray) -> List[List[int]]:
+    """Bool per ram -> [[första, sista+1], ...] för sammanhängande sanna sekvenser"""
+    padded = np.concatenate([[0], mask.astype(np.int8), [0]])
+    edges = np.flatnonzero(np.diff(padded))
+    return edges.reshape(-1, 2).tolist()
+
+
+def extract_features(wav_path: Path, frame_ms: int = FEATURES_FRAME_MS,
+                     mic_channels: Optional[List[int]] = None,
+                     mic_radius: float = FEATURES_MIC_RADIUS,
+                     reference_channel: int = 0) -> Dict[str, Any]:
+    """
+    Beräkna features för en inspelning.
+
+    Args:
+        wav_path: WAV-fil (valfritt antal kanaler)
+        frame_ms: Ramlängd i millisekunder
+        mic_channels: Kanaler för riktningsskattning (None = FEATURES_MIC_CHANNELS)
+        mic_radius: Mikrofoncirkelns radie i meter
+        reference_channel: Kanal för VAD (samma som den uppladdade)
+
+    Returns:
+        Dict redo att serialiseras som JSON
+    """
+    if mic_channels is None:
+        mic_channels = parse_channels(FEATURES_MIC_CHANNELS)
+
+    with wave.open(str(wav_path), "rb") as w:
+        rate, channels = w.getframerate(), w.getnchannels()
+        frame_len = max(1, rate * frame_ms // 1000)
+        reference_channel = min(reference_channel, channels - 1)
+        mics = [c for c in mic_channels if c < channels]
+        doa = None
+        if len(mics) >= 2:
+            doa = DOAEstimator(circular_array(len(mics), mic_radius), rate, frame_len)
+
+        energy, ratio, azimuth = [], [], []
+        while True:
+            block = read_frames(w, BLOCK_FRAMES * frame_len)
+            count = len(block) // frame_len
+            if count == 0:
+                break
+            frames = block[:count * frame_len].reshape(count, frame_len, channels) / 32768.0
+            power = np.mean(frames ** 2, axis=1)                                  # (n, channels)
+            energy.append(10 * np.log10(power + 1e-10))
+            ratio.append(_speech_ratio(frames[:, :, reference_channel], rate))
+            if doa:
+                azimuth.append(doa.estimate(frames[:, :, mics]))
+
+    frame_s = frame_len / float(rate)
+    energy_db = np.concatenate(energy) if energy else np.zeros((0, channels))
+    speech = detect_speech(energy_db[:, reference_channel],
+                           np.concatenate(ratio) if ratio else np.zeros(0), frame_s)
+
+    result = {
+        "version": FORMAT_VERSION,
+        "recording": wav_path.stem,
+        "samplerate": rate,
+        "frame_ms": round(frame_s * 1000, 3),
+        "frames": len(energy_db),
+        "channels": channels,
+        "reference_channel": reference_channel,
+        "energy_dbfs": np.clip(np.rint(energy_db), -100, 0).astype(int).T.tolist(),
+        "speech": [],
+        "doa": None,
+    }
+    angles = np.concatenate(azimuth) if azimuth else None
+    power_ref = 10 ** (energy_db[:, reference_channel] / 10)
+    for start, end in segments(speech):
+        segment = {"start": round(start * frame_s, 3), "end": round(end * frame_s, 3)}
+        if angles is not None:
+            # Cirkulärt medelvärde av riktningen, viktat med energin så att
+            # pauser inne i segmentet inte drar iväg skattningen
+            rad = np.radians(angles[start:end])
+            weight = power_ref[start:end]
+            mean = np.arctan2((np.sin(rad) * weight).sum(), (np.cos(rad) * weight).sum())
+            segment["azimuth"] = int(round(np.degrees(mean) % 360))
+        result["speech"].append(segment)
+    if angles is not None:
+        # Riktning per ram bara under tal; annars null
+        result["doa"] = {
+            "mic_channels": mics,
+            "mic_radius": mic_radius,
+            "azimuth_deg": [int(round(a)) if s else None for a, s in zip(angles, speech)],
+        }
+    return result
+
+
+def write_sidecar(wav_path: Path, **kwargs) -> Path:
+    """Beräkna features och skriv <inspelning>.features.json.gz bredvid WAV-filen"""
+    features = extract_features(wav_path, **kwargs)
+    path = wav_path.with_name(wav_path.stem + SIDECAR_SUFFIX)
+    tmp = Path(f"{path}.tmp")
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        json.dump(features, f, separators=(",", ":"))
+    os.replace(tmp, path)
+    speech_s = sum(seg["end"] - seg["start"] for seg in features["speech"])
+    logger.info(f"Features: {features['frames']} ramar, {len(features['speech'])} talsegment "
+                f"({speech_s:.0f} s tal) → {path.name}")
+    return path
@@ -0,0 +1,522 @@
+#!/usr/bin/env python3
+"""
+Lokalt HTTP- och WebSocket-API för styrning och livestatus.
+
+Komplement till MQTT för surfplattor i rummet och tester: fungerar på
+LAN:et även när molnbrokern ligger nere. Endast standardbiblioteket används.
+
+Endpoints:
+- GET  /api/status      - aktuellt tillstånd
+- POST /api/start       - starta inspelning (JSON-kropp: gain, gains, room, codec, max_duration)
+- POST /api/stop        - stoppa inspelning
+- POST /api/test        - starta/stoppa nivåtest
+- GET  /api/recordings  - senaste inspelningarna
+- GET  /api/catalog     - inspelningskatalogen (?status=&room=&since=&until=&limit=&offset=)
+- GET  /api/catalog/summary  - antal och storlek per status
+- GET  /api/catalog/<namn>   - en inspelning
+- GET  /api/traces      - senaste efterbearbetningsjobben med spann
+                          (?format=otel för OpenTelemetry-liknande JSON)
+- GET  /metrics         - mätvärden i Prometheus textformat
+- GET  /ws              - WebSocket med händelser (status, nivåer, inspelning);
+                          klienten kan skicka {"command": "start", "params": {...}}
+"""
+import os
+import json
+import time
+import queue
+import base64
+import socket
+import struct
+import hmac
+import hashlib
+import logging
+import ipaddress
+import threading
+from collections import deque
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from typing import Callable, Optional, Dict, Any, List, Tuple
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from scheduler import normalize_result, validate_params
+from tracing import REGISTRY, otel_json
+
+logger = logging.getLogger(__name__)
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# WebSocket-opcodes
+OP_TEXT = 0x1
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+# Max antal köade händelser per WebSocket-klient innan gamla kastas
+WS_QUEUE_SIZE = 256
+# Största tillåtna begäran (JSON-kropp eller WebSocket-ram)
+MAX_BODY = 64 * 1024
+# Antal inspelningar som visas i /api/recordings
+RECENT_RECORDINGS = 20
+
+
+def is_loopback(host: str) -> bool:
+    """Sant om adressen bara nås från den egna maskinen"""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class WebSocketClient:
+    """En ansluten WebSocket-klient med egen sändkö"""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.queue: "queue.Queue" = queue.Queue(maxsize=WS_QUEUE_SIZE)
+        self.closed = False
+        self._send_lock = threading.Lock()
+
+    def enqueue(self, message: Dict[str, Any]):
+        """Köa meddelande (blockerar aldrig; äldsta kastas vid full kö)"""
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            try:
+                self.queue.get_nowait()
+                self.queue.put_nowait(message)
+            except (queue.Empty, queue.Full):
+                pass
+
+    def send_frame(self, opcode: int, payload: bytes = b""):
+        header = bytes([0x80 | opcode])
+        length = len(payload)
+        if length < 126:
+            header += bytes([length])
+        elif length < 65536:
+            header += bytes([126]) + struct.pack("!H", length)
+        else:
+            header += bytes([127]) + struct.pack("!Q", length)
+        with self._send_lock:
+            self.sock.sendall(header + payload)
+
+    def send_json(self, message: Dict[str, Any]):
+        self.send_frame(OP_TEXT, json.dumps(message).encode("utf-8"))
+
+    def read_frame(self) -> Tuple[int, bytes]:
+        """Läs en ram från klienten (klientramar är alltid maskerade)"""
+        first, second = self._recv_exact(2)
+        opcode = first & 0x0F
+        length = second & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", self._recv_exact(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", self._recv_exact(8))[0]
+        if length > MAX_BODY:
+            raise ValueError("WebSocket-ram för stor")
+        mask = self._recv_exact(4) if second & 0x80 else b"\x00\x00\x00\x00"
+        data = self._recv_exact(length)
+        return opcode, bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+
+    def _recv_exact(self, size: int) -> bytes:
+        buf = b""
+        while len(buf) < size:
+            chunk = self.sock.recv(size - len(buf))
+            if not chunk:
+                raise ConnectionError("Anslutningen stängd")
+            buf += chunk
+        return buf
+
+
+class APIServer:
+    """HTTP/WebSocket-server med samma callbacks som MQTTClient"""
+
+    def __init__(self, config: Dict[str, Any]):
+        """
+        Args:
+            config: Dictionary med host, port, token, origins och audio_dir
+        """
+        self.host = config.get("host", "127.0.0.1")
+        self.port = int(config.get("port", 8080))
+        self.token = config.get("token") or None
+        # Webbsidor (Origin) som får anropa API:t från en webbläsare
+        self.origins = set(config.get("origins") or ())
+        self.audio_dir = Path(config["audio_dir"]) if config.get("audio_dir") else None
+
+        # Callbacks (samma som MQTTClient.set_callbacks)
+        self.on_start_callback: Optional[Callable] = None
+        self.on_stop_callback: Optional[Callable] = None
+        self.on_test_callback: Optional[Callable] = None
+        self.status_provider: Optional[Callable[[], Dict[str, Any]]] = None
+        self.catalog_provider: Optional[Callable] = None
+
+        self._clients: List[WebSocketClient] = []
+        self._clients_lock = threading.Lock()
+        self._recent = deque(maxlen=RECENT_RECORDINGS)
+        self._httpd: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def set_callbacks(self,
+                      on_start: Optional[Callable] = None,
+                      on_stop: Optional[Callable] = None,
+                      on_test: Optional[Callable] = None,
+                      status: Optional[Callable[[], Dict[str, Any]]] = None,
+                      catalog: Optional[Callable] = None):
+        """
+        Sätt callback-funktioner för kommandohantering.
+
+        Samma kommandocallbacks som MQTTClient.set_callbacks, så att båda
+        kanalerna styr inspelningskärnan på samma sätt.
+
+        Args:
+            status: Funktion som returnerar aktuellt tillstånd för /api/status
+            catalog: Funktion som besvarar katalogfrågor, (ok, resultat)
+        """
+        if on_start:
+            self.on_start_callback = on_start
+        if on_stop:
+            self.on_stop_callback = on_stop
+        if on_test:
+            self.on_test_callback = on_test
+        if status:
+            self.status_provider = status
+        if catalog:
+            self.catalog_provider = catalog
+
+    def start(self):
+        """Starta servern i en bakgrundstråd"""
+        if not self.token and not is_loopback(self.host):
+            raise ValueError(f"HTTP_API_TOKEN krävs när HTTP-API:t lyssnar på {self.host}")
+        handler = type("BoundAPIHandler", (APIRequestHandler,), {"api": self})
+        self._httpd = ThreadingHTTPServer((self.host, self.port), handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="http-api", daemon=True)
+        self._thread.start()
+        logger.info(f"HTTP-API lyssnar på {self.host}:{self.port}")
+
+    def stop(self):
+        """Stoppa servern och stäng WebSocket-klienter"""
+        with self._clients_lock:
+            clients = list(self._clients)
+        for client in clients:
+            client.closed = True
+            try:
+                client.send_frame(OP_CLOSE)
+            except OSError:
+                pass
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    # ---------- Händelser ----------
+    def broadcast(self, event: str, data: Optional[Dict[str, Any]] = None):
+        """Skicka händelse till alla WebSocket-klienter (blockerar inte)"""
+        data = data or {}
+        if event == "recording_complete":
+            self._recent.appendleft({**data, "timestamp": datetime.now().isoformat()})
+        message = {"event": event, "data": data}
+        with self._clients_lock:
+            clients = list(self._clients)
+        for client in clients:
+            client.enqueue(message)
+
+    def _add_client(self, client: WebSocketClient):
+        with self._clients_lock:
+            self._clients.append(client)
+
+    def _remove_client(self, client: WebSocketClient):
+        with self._clients_lock:
+            if client in self._clients:
+                self._clients.remove(client)
+
+    # ---------- Kommandon ----------
+    def run_command(self, command: str, params: Any = None) -> Tuple[bool, Any]:
+        """
+        Kör kommando via callbacks.
+
+        Returns:
+            Tuple med (ok, resultat)
+        """
+        callbacks = {
+            "start": self.on_start_callback,
+            "stop": self.on_stop_callback,
+            "test": self.on_test_callback,
+        }
+        if command not in callbacks:
+            return False, f"Okänt kommando: {command}"
+        callback = callbacks[command]
+        if callback is None:
+            return False, "Kommandot stöds inte av enheten"
+        logger.info(f"HTTP-kommando: {command}")
+        try:
+            if command == "start":
+                return normalize_result(callback(validate_params(params)))
+            return normalize_result(callback())
+        except ValueError as e:
+            return False, str(e)
+        except Exception as e:
+            logger.error(f"Fel vid körning av HTTP-kommando {command}: {e}")
+            return False, str(e)
+
+    def status(self) -> Dict[str, Any]:
+        if self.status_provider:
+            return self.status_provider()
+        return {}
+
+    def catalog(self, query: Dict[str, Any]) -> Tuple[bool, Any]:
+        if self.catalog_provider is None:
+            return False, "Inspelningskatalogen är inte tillgänglig"
+        return normalize_result(self.catalog_provider(query))
+
+    def recordings(self) -> List[Dict[str, Any]]:
+        """Senaste inspelningar: uppladdningsresultat från händelser + filer i ljudkatalogen"""
+        uploaded = {item["filename"]: item for item in self._recent}
+        result = []
+        if self.audio_dir and self.audio_dir.exists():
+            files = sorted(
+                (p for p in self.audio_dir.iterdir() if p.is_file()),
+                key=lambda p: p.stat().st_mtime, reverse=True,
+            )
+            for path in files[:RECENT_RECORDINGS]:
+                stat = path.stat()
+                entry = {
+                    "filename": path.name,
+                    "size": stat.st_size,
+                    "modified": datetime.fromtimestamp(stat.st_mtime).isoformat(),
+                }
+                if path.name in uploaded:
+                    entry["upload_result"] = uploaded[path.name].get("upload_result")
+                result.append(entry)
+        else:
+            result = list(self._recent)
+        return result
+
+
+class APIRequestHandler(BaseHTTPRequestHandler):
+    """HTTP-hanterare; `api` sätts på en underklass per server"""
+
+    api: APIServer = None
+    # Keep-alive så att surfplattor slipper ny TCP-anslutning per kommando
+    protocol_version = "HTTP/1.1"
+    server_version = "meetrec"
+
+    def setup(self):
+        super().setup()
+        # Små svar ska inte vänta på Nagle
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    # ---------- Hjälpare ----------
+    def _send_json(self, status: int, payload: Any):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self._send_cors_headers()
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_text(self, status: int, text: str, content_type: str = "text/plain; charset=utf-8"):
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _origin_allowed(self) -> bool:
+        """Webbläsare skickar Origin; andra klienter (curl, appar) gör det inte"""
+        origin = self.headers.get("Origin")
+        if not origin:
+            return True
+        return origin in self.api.origins or urlsplit(origin).netloc == self.headers.get("Host")
+
+    def _send_cors_headers(self):
+        origin = self.headers.get("Origin")
+        if origin and origin in self.api.origins:
+            self.send_header("Access-Control-Allow-Origin", origin)
+            self.send_header("Vary", "Origin")
+
+    def _authorized(self) -> bool:
+        if not self.api.token:
+            return True
+        expected = self.api.token.encode("utf-8")
+        header = self.headers.get("Authorization", "").encode("utf-8", errors="replace")
+        if hmac.compare_digest(header, b"Bearer " + expected):
+            return True
+        path, _, query = self.path.partition("?")
+        if path != "/ws":
+            return False
+        # Webbläsare kan inte sätta headers på WebSocket; där (och bara där) tillåts ?token=
+        token = dict(parse_qsl(query)).get("token", "")
+        return hmac.compare_digest(token.encode("utf-8", errors="replace"), expected)
+
+    def _read_json(self) -> Any:
+        content_type = self.headers.get("Content-Type", "").partition(";")[0].strip().lower()
+        if content_type != "application/json":
+            raise TypeError("Content-Type måste vara application/json")
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY:
+            raise ValueError("För stor begäran")
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length).decode("utf-8"))
+
+    # ---------- HTTP ----------
+    def do_OPTIONS(self):
+        self.send_response(204)
+        if self.headers.get("Origin") in self.api.origins:
+            self._send_cors_headers()
+            self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
+            self.send_header("Access-Control-Allow-Headers", "Authorization, Content-Type")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        if not self._authorized():
+            return self._send_json(401, {"ok": False, "result": "Ej behörig"})
+        path = self.path.partition("?")[0]
+        if path == "/api/status":
+            return self._send_json(200, self.api.status())
+        if path == "/api/recordings":
+            return self._send_json(200, self.api.recordings())
+        if path == "/api/catalog" or path.startswith("/api/catalog/"):
+            return self._handle_catalog(path[len("/api/catalog/"):])
+        if path == "/api/traces":
+            traces = REGISTRY.traces()
+            if "format=otel" in self.path.partition("?")[2].split("&"):
+                return self._send_json(200, otel_json(traces))
+            return self._send_json(200, traces)
+        if path == "/metrics":
+            return self._send_text(200, REGISTRY.prometheus_text(), "text/plain; version=0.0.4; charset=utf-8")
+        if path == "/ws" and self.headers.get("Upgrade", "").lower() == "websocket":
+            return self._handle_websocket()
+        self._send_json(404, {"ok": False, "result": "Okänd sökväg"})
+
+    def do_POST(self):
+        if not self._authorized():
+            return self._send_json(401, {"ok": False, "result": "Ej behörig"})
+        if not self._origin_allowed():
+            return self._send_json(403, {"ok": False, "result": "Otillåten Origin"})
+        path = self.path.partition("?")[0]
+        if not path.startswith("/api/"):
+            return self._send_json(404, {"ok": False, "result": "Okänd sökväg"})
+        started = time.monotonic()
+        try:
+            params = self._read_json()
+        except TypeError as e:
+            return self._send_json(415, {"ok": False, "result": str(e)})
+        except (ValueError, UnicodeDecodeError) as e:
+            return self._send_json(400, {"ok": False, "result": f"Ogiltig JSON: {e}"})
+        ok, result = self.api.run_command(path[len("/api/"):], params)
+        self._send_json(200 if ok else 409, {
+            "ok": ok,
+            "result": result,
+            "latency_ms": round((time.monotonic() - started) * 1000.0, 2),
+        })
+
+    # ---------- WebSocket ----------
+    def _handle_catalog(self, name: str):
+        query = {k: v for k, v in parse_qsl(self.path.partition("?")[2]) if k != "token"}
+        if name == "summary":
+            query = {"summary": True}
+        elif name:
+            query = {"name": unquote(name)}
+        ok, result = self.api.catalog(query)
+        if not ok:
+            return self._send_json(400, {"ok": False, "result": result})
+        if name and name != "summary":
+            if not result["items"]:
+                return self._send_json(404, {"ok": False, "result": f"Okänd inspelning: {query['name']}"})
+            return self._send_json(200, result["items"][0])
+        self._send_json(200, result)
+
+    def _handle_websocket(self):
+        # Webbläsare tillämpar inte same-origin på WebSocket; utan kontrollen
+        # kan vilken webbsida som helst på LAN:et styra inspelningen
+        if not self._origin_allowed():
+            return self._send_json(403, {"ok": False, "result": "Otillåten Origin"})
+        key = self.headers.get("Sec-WebSocket-Key")
+        if not key:
+            return self._send_json(400, {"ok": False, "result": "Sec-WebSocket-Key saknas"})
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode("ascii")).digest()).decode("ascii")
+        self.send_response(101, "Switching Protocols")
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.wfile.flush()
+        self.close_connection = True
+
+        client = WebSocketClient(self.connection)
+        self.api._add_client(client)
+        reader = threading.Thread(target=self._ws_reader, args=(client,), name="ws-reader", daemon=True)
+        reader.start()
+        try:
+            client.send_json({"event": "status", "data": self.api.status()})
+            while not client.closed:
+                try:
+                    message = client.queue.get(timeout=1.0)
+                except queue.Empty:
+                    continue
+                client.send_json(message)
+        except OSError:
+            pass
+        finally:
+            client.closed = True
+            self.api._remove_client(client)
+
+    def _ws_reader(self, client: WebSocketClient):
+        """Ta emot kommandon, ping och close från klienten"""
+        try:
+            while not client.closed:
+                opcode, payload = client.read_frame()
+                if opcode == OP_CLOSE:
+                    client.send_frame(OP_CLOSE)
+                    break
+                if opcode == OP_PING:
+                    client.send_frame(OP_PONG, payload)
+                elif opcode == OP_TEXT:
+                    self._ws_command(client, payload)
+        except (OSError, ConnectionError, ValueError):
+            pass
+        finally:
+            client.closed = True
+
+    def _ws_command(self, client: WebSocketClient, payload: bytes):
+        started = time.monotonic()
+        try:
+            request = json.loads(payload.decode("utf-8"))
+            command = request["command"]
+        except (ValueError, KeyError, TypeError):
+            client.send_json({"event": "response", "data": {"ok": False, "result": "Ogiltigt kommando"}})
+            return
+        ok, result = self.api.run_command(command, request.get("params"))
+        client.send_json({"event": "response", "data": {
+            "id": request.get("id"),
+            "command": command,
+            "ok": ok,
+            "result": result,
+            "latency_ms": round((time.monotonic() - started) * 1000.0, 2),
+        }})
+
+
+def get_http_config_from_env() -> Dict[str, Any]:
+    """
+    Läs konfiguration för HTTP-API:t från miljövariabler.
+
+    Returns:
+        Dictionary med HTTP-konfiguration
+    """
+    return {
+        "enabled": os.getenv("HTTP_API_ENABLED", "false").lower() in ("true", "1", "yes"),
+        "host": os.getenv("HTTP_API_HOST", "127.0.0.1"),
+        "port": int(os.getenv("HTTP_API_PORT", "8080")),
+        "token": os.getenv("HTTP_API_TOKEN") or None,
+        "origins": [o.strip() for o in os.getenv("HTTP_API_ORIGINS", "").split(",") if o.strip()],
+    }
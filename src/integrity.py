@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Innehållsadressering och integritetskontroll för uppladdningar.
+
+Varje kodad inspelning hashas (SHA-256 och MD5) medan ffmpeg skriver den,
+så att ingen extra läsning av filen behövs. Hashen skickas med vid
+uppladdning som idempotensnyckel, Content-MD5 och S3-checksumma, och
+levererade hashar sparas i ett lokalt index så att omförsök och jobb som
+köas om hoppar över innehåll som redan finns hos mottagaren.
+"""
+import os
+import json
+import fcntl
+import time
+import base64
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, Dict, Any, Tuple
+
+from config_manager import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_INDEX = os.path.expanduser(os.getenv("UPLOAD_INDEX", "~/.meetrec/uploads.json"))
+# Antal levererade filer som indexet kommer ihåg (äldst tas bort först)
+UPLOAD_INDEX_MAX = int(os.getenv("UPLOAD_INDEX_MAX", "2000"))
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class Digest:
+    """Hashar och storlek för en fil"""
+
+    __slots__ = ("sha256", "md5", "size")
+
+    def __init__(self, sha256: str, md5: bytes, size: int):
+        self.sha256 = sha256   # hex
+        self.md5 = md5         # rå bytes
+        self.size = size
+
+    @property
+    def content_md5(self) -> str:
+        """MD5 i base64 (Content-MD5-headern)"""
+        return base64.b64encode(self.md5).decode("ascii")
+
+    @property
+    def sha256_base64(self) -> str:
+        """SHA-256 i base64 (S3 ChecksumSHA256)"""
+        return base64.b64encode(bytes.fromhex(self.sha256)).decode("ascii")
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"sha256": self.sha256, "md5": self.md5.hex(), "size": self.size}
+
+    def __repr__(self):
+        return f"Digest(sha256={self.sha256[:12]}…, size={self.size})"
+
+
+class HashingWriter:
+    """
+    Skriver en fil och hashar innehållet samtidigt.
+
+    Skrivs till <fil>.tmp och byter namn först vid commit(), så att en
+    avbruten kodning aldrig lämnar en halv fil med det slutliga namnet.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._tmp = Path(f"{self.path}.tmp")
+        self._file = open(self._tmp, "wb")
+        self._sha256 = hashlib.sha256()
+        self._md5 = hashlib.md5()
+        self.size = 0
+
+    def write(self, data: bytes):
+        self._file.write(data)
+        self._sha256.update(data)
+        self._md5.update(data)
+        self.size += len(data)
+
+    def commit(self) -> Digest:
+        """Stäng, byt namn till slutligt namn och kom ihåg hashen"""
+        self._file.close()
+        os.replace(self._tmp, self.path)
+        digest = Digest(self._sha256.hexdigest(), self._md5.digest(), self.size)
+        remember_digest(self.path, digest)
+        return digest
+
+    def abort(self):
+        """Stäng och ta bort den temporära filen"""
+        self._file.close()
+        try:
+            self._tmp.unlink()
+        except OSError:
+            pass
+
+
+# Hashar för filer som skrivits av denna process: sökväg -> (storlek, mtime_ns, Digest)
+_digests: Dict[str, Tuple[int, int, Digest]] = {}
+_digests_lock = threading.Lock()
+
+
+def remember_digest(path: Path, digest: Digest):
+    st = Path(path).stat()
+    with _digests_lock:
+        _digests[str(path)] = (st.st_size, st.st_mtime_ns, digest)
+
+
+def digest_for(path: Path) -> Digest:
+    """
+    Hash för en fil; från kodningen om filen är oförändrad sedan dess,
+    annars läses filen (t.ex. för jobb som köats om efter omstart).
+    """
+    path = Path(path)
+    st = path.stat()
+    with _digests_lock:
+        cached = _digests.get(str(path))
+    if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+        return cached[2]
+    sha256, md5 = hashlib.sha256(), hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha256.update(chunk)
+            md5.update(chunk)
+    digest = Digest(sha256.hexdigest(), md5.digest(), st.st_size)
+    remember_digest(path, digest)
+    return digest
+
+
+class UploadIndex:
+    """
+    Lokalt index över levererat innehåll: (mål, sha256) -> uppladdningsinfo.
+
+    Sparas atomiskt som JSON; nyckeln innehåller målet så att samma fil
+    kan levereras till flera mål. Flera processer (tjänsten och
+    meetrec_backlog.py) kan dela filen: den läses om när den ändrats och
+    skrivningar sker under fillås.
+    """
+
+    def __init__(self, path: Optional[Path] = None, max_entries: int = UPLOAD_INDEX_MAX):
+        self.path = Path(path or UPLOAD_INDEX)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: Optional[Dict[str, Dict[str, Any]]] = None
+        self._mtime: Optional[int] = None
+
+    @staticmethod
+    def _key(target: str, sha256: str) -> str:
+        return f"{target}:{sha256}"
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except OSError:
+            mtime = None
+        if self._entries is None or mtime != self._mtime:
+            self._entries = {}
+            self._mtime = mtime
+            try:
+                with open(self.path, "r") as f:
+                    self._entries = json.load(f)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning(f"Kunde inte läsa uppladdningsindex {self.path}: {e}")
+        return self._entries
+
+    @contextmanager
+    def _file_lock(self):
+        """Lås mellan processer under läs-ändra-skriv"""
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            lock = open(f"{self.path}.lock", "a")
+        except OSError as e:
+            logger.warning(f"Kunde inte låsa uppladdningsindex {self.path}: {e}")
+            yield
+            return
+        with lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def lookup(self, target: str, sha256: str) -> Optional[Dict[str, Any]]:
+        """Tidigare leverans av samma innehåll till målet, eller None"""
+        with self._lock:
+            return self._load().get(self._key(target, sha256))
+
+    def add(self, target: str, digest: Digest, filename: str, info: str):
+        with self._file_lock(), self._lock:
+            entries = self._load()
+            entries[self._key(target, digest.sha256)] = {
+                "filename": filename,
+                "size": digest.size,
+                "info": info,
+                "uploaded_at": time.time(),
+            }
+            if len(entries) > self.max_entries:
+                oldest = sorted(entries, key=lambda k: entries[k].get("uploaded_at", 0))
+                for key in oldest[:len(entries) - self.max_entries]:
+                    del entries[key]
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                write_json_atomic(self.path, entries)
+                self._mtime = self.path.stat().st_mtime_ns
+            except OSError as e:
+                logger.warning(f"Kunde inte spara uppladdningsindex {self.path}: {e}")
+
+
+# Delat index för processen
+UPLOADS = UploadIndex()
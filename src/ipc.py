@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Lokal styrning av meetrec_daemon över en Unix-socket.
+
+Protokollet är radbaserad JSON (en begäran/ett svar per rad):
+
+    -> {"id": 1, "cmd": "start", "params": {"room": "Styrelserum"}}
+    <- {"id": 1, "ok": true, "result": {"filename": "meeting-....wav"}}
+
+Kommandon: start, stop, test, set_gain, status. En anslutning som skickar
+{"cmd": "subscribe"} får i stället alla händelser från inspelningskärnan
+som {"event": ..., "data": ...}, t.ex. för GUI:t på pekskärmen.
+"""
+import os
+import json
+import queue
+import socket
+import logging
+import itertools
+import threading
+from pathlib import Path
+from typing import Callable, Optional, Dict, Any, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET_PATH = os.path.expanduser(os.getenv("MEETREC_SOCKET", "~/.meetrec/meetrec.sock"))
+
+# Max antal köade händelser per prenumerant innan gamla kastas
+SUBSCRIBER_QUEUE_SIZE = 256
+
+
+def _send(sock: socket.socket, message: Dict[str, Any]):
+    sock.sendall((json.dumps(message) + "\n").encode("utf-8"))
+
+
+class IPCServer:
+    """Unix-socket-server som exponerar en Recorder lokalt"""
+
+    def __init__(self, recorder, path: Optional[str] = None):
+        """
+        Args:
+            recorder: Recorder-instans att styra
+            path: Sökväg till socketen
+        """
+        self.recorder = recorder
+        self.path = Path(path or DEFAULT_SOCKET_PATH)
+        self._sock: Optional[socket.socket] = None
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+    def start(self):
+        """Börja lyssna på socketen"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.path.exists():
+            self.path.unlink()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(str(self.path))
+        # Endast användaren själv får styra inspelningen
+        os.chmod(self.path, 0o600)
+        self._sock.listen(8)
+        self._running = True
+        self._thread = threading.Thread(target=self._accept_loop, name="ipc-server", daemon=True)
+        self._thread.start()
+        logger.info(f"IPC-server lyssnar på {self.path}")
+
+    def stop(self):
+        """Sluta lyssna och ta bort socketen"""
+        self._running = False
+        if self._sock:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def _accept_loop(self):
+        while self._running:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle_connection, args=(conn,), name="ipc-conn", daemon=True).start()
+
+    def _handle_connection(self, conn: socket.socket):
+        with conn:
+            reader = conn.makefile("r", encoding="utf-8")
+            for line in reader:
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                except json.JSONDecodeError:
+                    _send(conn, {"id": None, "ok": False, "result": "Ogiltig JSON"})
+                    continue
+                if request.get("cmd") == "subscribe":
+                    self._stream_events(conn)
+                    return
+                ok, result = self._dispatch(request.get("cmd"), request.get("params") or {})
+                try:
+                    _send(conn, {"id": request.get("id"), "ok": ok, "result": result})
+                except OSError:
+                    return
+
+    def _dispatch(self, cmd: str, params: Dict[str, Any]) -> Tuple[bool, Any]:
+        try:
+            if cmd == "start":
+                return self.recorder.start(params)
+            if cmd == "stop":
+                return self.recorder.stop()
+            if cmd == "test":
+                return self.recorder.toggle_test()
+            if cmd == "set_gain":
+                return self.recorder.set_gain(params["gain"])
+            if cmd == "status":
+                return True, self.recorder.status()
+            return False, f"Okänt kommando: {cmd}"
+        except Exception as e:
+            logger.error(f"Fel vid IPC-kommando {cmd}: {e}")
+            return False, str(e)
+
+    def _stream_events(self, conn: socket.socket):
+        """Skicka händelser till en prenumerant tills anslutningen stängs"""
+        events: "queue.Queue" = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+        def listener(event, data):
+            # Lyssnare anropas från inspelningskärnans trådar och får inte blockera
+            try:
+                events.put_nowait((event, data))
+            except queue.Full:
+                try:
+                    events.get_nowait()
+                    events.put_nowait((event, data))
+                except (queue.Empty, queue.Full):
+                    pass
+
+        self.recorder.add_listener(listener)
+        try:
+            _send(conn, {"event": "status", "data": self.recorder.status()})
+            while self._running:
+                try:
+                    event, data = events.get(timeout=1.0)
+                except queue.Empty:
+                    continue
+                _send(conn, {"event": event, "data": data})
+        except OSError:
+            pass
+        finally:
+            self.recorder.remove_listener(listener)
+
+
+class RemoteRecorder:
+    """
+    Klient med samma gränssnitt som Recorder, för GUI:t när inspelningen
+    körs i meetrec_daemon.
+    """
+
+    def __init__(self, path: Optional[str] = None, timeout: float = 10.0):
+        self.path = str(path or DEFAULT_SOCKET_PATH)
+        self.timeout = timeout
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+        self._closed = False
+
+        self._sock = self._connect()
+        self._reader = self._sock.makefile("r", encoding="utf-8")
+        self._events_sock: Optional[socket.socket] = None
+        self._events_thread: Optional[threading.Thread] = None
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.path)
+        return sock
+
+    def _call(self, cmd: str, params: Optional[Dict[str, Any]] = None) -> Tuple[bool, Any]:
+        with self._lock:
+            request_id = next(self._ids)
+            try:
+                _send(self._sock, {"id": request_id, "cmd": cmd, "params": params or {}})
+                line = self._reader.readline()
+            except OSError as e:
+                return False, f"Ingen kontakt med meetrec_daemon: {e}"
+        if not line:
+            return False, "meetrec_daemon stängde anslutningen"
+        response = json.loads(line)
+        return bool(response.get("ok")), response.get("result")
+
+    # ---------- Samma gränssnitt som Recorder ----------
+    def start(self, params=None) -> Tuple[bool, Any]:
+        return self._call("start", params)
+
+    def stop(self) -> Tuple[bool, Any]:
+        return self._call("stop")
+
+    def toggle_test(self) -> Tuple[bool, Any]:
+        return self._call("test")
+
+    def set_gain(self, gain) -> Tuple[bool, Any]:
+        return self._call("set_gain", {"gain": float(gain)})
+
+    def status(self) -> Dict[str, Any]:
+        ok, result = self._call("status")
+        return result if ok and isinstance(result, dict) else {}
+
+    def add_listener(self, callback: Callable[[str, Dict[str, Any]], None]):
+        with self._lock:
+            self._listeners.append(callback)
+            if self._events_thread is None:
+                self._events_thread = threading.Thread(target=self._event_loop, name="ipc-events", daemon=True)
+                self._events_thread.start()
+
+    def remove_listener(self, callback: Callable[[str, Dict[str, Any]], None]):
+        with self._lock:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def shutdown(self):
+        """Stäng anslutningarna; inspelningen i daemonen fortsätter"""
+        self._closed = True
+        for sock in (self._sock, self._events_sock):
+            if sock:
+                try:
+                    sock.close()
+                except OSError:
+                    pass
+
+    def _event_loop(self):
+        try:
+            self._events_sock = self._connect()
+            self._events_sock.settimeout(None)
+            _send(self._events_sock, {"cmd": "subscribe"})
+            for line in self._events_sock.makefile("r", encoding="utf-8"):
+                message = json.loads(line)
+                with self._lock:
+                    listeners = list(self._listeners)
+                for callback in listeners:
+                    try:
+                        callback(message["event"], message.get("data") or {})
+                    except Exception as e:
+                        logger.error(f"Fel i lyssnare för {message.get('event')}: {e}")
+        except (OSError, ValueError) as e:
+            if not self._closed:
+                logger.error(f"Händelseström från meetrec_daemon avbruten: {e}")
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Töm eftersläpningen: konvertera och ladda upp inspelningar som ligger kvar.
+
+Efter ett avbrott (nät, moln eller ström) ligger inspelningar kvar i
+AUDIO_DIR som aldrig laddades upp. Verktyget går igenom katalogen, tar
+reda på vad som saknas och kör samma steg som inspelningskärnan
+(resampling, kodning, uppladdning till alla mål) parallellt:
+
+- bara WAV: resamplas, kodas och laddas upp
+- kodad fil men inte uppladdad enligt katalogen: laddas upp (mål som
+  redan har innehållet hoppas över via uppladdningsindexet)
+- uppladdad, pågående eller nyss ändrad: hoppas över
+
+Resultatet förs in i inspelningskatalogen precis som för vanliga jobb.
+
+Exempel:
+    python src/meetrec_backlog.py --dry-run
+    python src/meetrec_backlog.py --workers 4 --rate 20
+    python src/meetrec_backlog.py --processes --workers 2 --limit 10
+"""
+import sys
+import time
+import wave
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+
+from catalog import open_catalog
+from encryption import ENCRYPTED_SUFFIX
+from features import FEATURES_ENABLED, write_sidecar
+from integrity import digest_for
+from pipeline import AUDIO_DIR, AUDIO_CODEC, AUDIO_CODECS, encode_audio, upload_sidecars, upload_to_targets, upload_summary
+from priority import lower_thread_priority
+from recorder import SAMPLE_RATE, OUTPUT_CHANNEL, POSTPROCESS_WORKERS
+from resample import ensure_samplerate
+from tracing import JobTrace
+
+try:
+    from config_manager import ConfigManager, UPLOAD_KEYS
+    CONFIG_SUPPORT = True
+except ImportError:
+    CONFIG_SUPPORT = False
+
+logger = logging.getLogger("meetrec_backlog")
+
+# WAV-filer som ändrats senare än så (sekunder) antas fortfarande spelas in
+MIN_AGE = 120
+# Katalograder i "recording"/"processing" räknas som pågående så här länge (sekunder)
+ACTIVE_TIMEOUT = 6 * 3600
+
+_ENCODED_SUFFIXES = tuple(suffix for suffix, _, _, _ in AUDIO_CODECS.values())
+
+
+def scan(audio_dir: Path) -> Dict[str, Dict[str, Path]]:
+    """
+    Inspelningar på disk: namn -> {"wav": ..., "encoded": ...}
+
+    Sidofiler (features, toppar) och halvskrivna .tmp-filer räknas inte.
+    """
+    found: Dict[str, Dict[str, Path]] = {}
+    for path in sorted(Path(audio_dir).iterdir()):
+        if not path.is_file() or not path.name.startswith("meeting-") or path.suffix == ".tmp":
+            continue
+        name, _, extension = path.name.partition(".")
+        extension = f".{extension}"
+        if extension == ".wav":
+            found.setdefault(name, {})["wav"] = path
+        elif extension in _ENCODED_SUFFIXES or extension[:-len(ENCRYPTED_SUFFIX)] in _ENCODED_SUFFIXES:
+            found.setdefault(name, {})["encoded"] = path
+    return found
+
+
+def plan(found: Dict[str, Dict[str, Path]], catalog=None, force: bool = False,
+         min_age: float = MIN_AGE) -> List[Dict[str, Any]]:
+    """
+    Vad som ska göras per inspelning.
+
+    Returns:
+        [{"name", "action" ("encode"/"upload"/"skip"), "reason", "wav", "encoded", "gain", "codec"}]
+    """
+    now = time.time()
+    items = []
+    for name, files in found.items():
+        row = catalog.get(name) if catalog else None
+        item = {
+            "name": name,
+            "wav": str(files["wav"]) if "wav" in files else None,
+            "encoded": str(files["encoded"]) if "encoded" in files else None,
+            "gain": (row or {}).get("gain") or 1.0,
+            "codec": (row or {}).get("codec") or AUDIO_CODEC,
+        }
+        status = (row or {}).get("status")
+        if not force and status in ("recording", "processing") and now - (row.get("updated_at") or 0) < ACTIVE_TIMEOUT:
+            item.update(action="skip", reason=status)
+        elif not force and status == "uploaded":
+            item.update(action="skip", reason="uploaded")
+        elif item["encoded"]:
+            item.update(action="upload", reason="ej uppladdad")
+        elif not force and now - files["wav"].stat().st_mtime < min_age:
+            item.update(action="skip", reason="skrivs")
+        else:
+            item.update(action="encode", reason="ej kodad")
+        items.append(item)
+    return items
+
+
+def _wav_channels(path: Path) -> int:
+    try:
+        with wave.open(str(path), "rb") as w:
+            return w.getnchannels()
+    except (wave.Error, OSError, EOFError):
+        return 1
+
+
+def process(item: Dict[str, Any], settings: Optional[Dict[str, Any]] = None,
+            features: bool = FEATURES_ENABLED) -> Dict[str, Any]:
+    """
+    Efterbearbeta en inspelning (körs i arbetstråd eller -process).
+
+    Returns:
+        Jobbets spårning (JobTrace.finish), som kan föras in i katalogen
+    """
+    name = item["name"]
+    trace = JobTrace(name, {"codec": item["codec"], "gain": item["gain"], "source": "backlog"})
+    try:
+        if item["action"] == "encode":
+            wav = Path(item["wav"])
+            if features:
+                with trace.span("features") as span:
+                    try:
+                        sidecar = write_sidecar(wav, reference_channel=OUTPUT_CHANNEL)
+                        span.set(bytes=sidecar.stat().st_size)
+                    except Exception as e:
+                        logger.warning(f"Features kunde inte beräknas för {name}: {e}")
+                        span.end("error")
+            with trace.span("resampling", rate=SAMPLE_RATE) as span:
+                original = ensure_samplerate(wav, SAMPLE_RATE)
+                if original:
+                    span.set(from_rate=original)
+            channel = OUTPUT_CHANNEL if _wav_channels(wav) > 1 else None
+            with trace.span("encoding", codec=item["codec"], bytes_in=wav.stat().st_size) as span:
+                ok, encoded, msg = encode_audio(wav, gain=float(item["gain"]), codec=item["codec"], channel=channel)
+                if not ok:
+                    span.end("error")
+                    return trace.finish("error", msg)
+                digest = digest_for(encoded)
+                span.set(bytes=digest.size, sha256=digest.sha256, file=encoded.name)
+            if encoded.suffix == ENCRYPTED_SUFFIX:
+                # Som i inspelningskärnan: ingen okrypterad kopia kvar
+                wav.unlink()
+        else:
+            encoded = Path(item["encoded"])
+            # Katalogen ska få fil och hash även när bara uppladdningen körs
+            digest = digest_for(encoded)
+            trace.event("encoding", bytes=digest.size, sha256=digest.sha256, file=encoded.name)
+
+        backend = (settings or {}).get("upload_target")
+        with trace.span("uploading", backend=backend, bytes=encoded.stat().st_size) as span:
+            targets = upload_to_targets(encoded, settings=settings)
+            ok, info = upload_summary(targets)
+            span.set(result=info, targets=targets)
+            if not ok:
+                span.end("error")
+                return trace.finish("error", f"Uppladdning misslyckades: {info}")
+        # Samma sidofiler som i inspelningskärnan, även om WAV-filen inte finns kvar
+        upload_sidecars(encoded.with_name(f"{name}.wav"), trace, settings=settings)
+        return trace.finish("ok")
+    except Exception as e:
+        logger.exception(f"Efterbearbetning av {name} misslyckades")
+        return trace.finish("error", str(e))
+
+
+class RateLimiter:
+    """Högst `per_minute` starter per minut, jämnt fördelade (0 = obegränsat)"""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next = 0.0
+
+    def wait(self):
+        now = time.monotonic()
+        if now < self._next:
+            time.sleep(self._next - now)
+        self._next = max(now, self._next) + self.interval
+
+
+def _human_bytes(size: float) -> str:
+    for unit in ("B", "kB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def run(items: List[Dict[str, Any]], workers: int = POSTPROCESS_WORKERS, processes: bool = False,
+        rate: float = 0.0, settings: Optional[Dict[str, Any]] = None, catalog=None, out=sys.stdout) -> int:
+    """
+    Kör jobben parallellt med löpande förlopp.
+
+    Returns:
+        Antal misslyckade jobb
+    """
+    total = len(items)
+    if not total:
+        print("Inget att göra.", file=out)
+        return 0
+    limiter = RateLimiter(rate)
+    if processes:
+        pool = ProcessPoolExecutor(max_workers=max(1, workers), initializer=lower_thread_priority)
+    else:
+        pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="backlog",
+                                  initializer=lower_thread_priority)
+    started = time.monotonic()
+    pending = {}
+    queue = list(items)
+    done = failed = 0
+    sent = 0
+    try:
+        while queue or pending:
+            # Högst ett jobb per arbetare i kön, så att takten och Ctrl-C gäller direkt
+            while queue and len(pending) < max(1, workers):
+                limiter.wait()
+                item = queue.pop(0)
+                pending[pool.submit(process, item, settings)] = item
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                item = pending.pop(future)
+                done += 1
+                try:
+                    record = future.result()
+                except Exception as e:   # t.ex. en arbetsprocess som dog
+                    record = {"job_id": item["name"], "status": "error", "error": str(e), "spans": []}
+                if catalog:
+                    try:
+                        catalog.record_job(record)
+                    except Exception as e:
+                        logger.error(f"Kunde inte uppdatera inspelningskatalogen: {e}")
+                upload = next((s for s in record["spans"] if s["name"] == "uploading"), {})
+                if record["status"] == "ok":
+                    sent += upload.get("bytes") or 0
+                    result = f"ok → {upload.get('result')}"
+                else:
+                    failed += 1
+                    result = f"FEL: {record['error']}"
+                elapsed = time.monotonic() - started
+                eta = elapsed / done * (total - done)
+                print(f"[{done}/{total}] {item['name']} ({item['action']}): {result} "
+                      f"({record.get('duration_s', 0):.1f} s, kvar ~{eta:.0f} s)", file=out, flush=True)
+    except KeyboardInterrupt:
+        print("Avbryter; pågående jobb får bli klara…", file=out, flush=True)
+        pool.shutdown(wait=True, cancel_futures=True)
+        raise
+    pool.shutdown(wait=True)
+    elapsed = time.monotonic() - started
+    # Filer som målen redan hade räknas med (de hoppades över av uppladdningsindexet)
+    print(f"Klart: {done - failed} ok, {failed} fel, {_human_bytes(sent)} behandlat på {elapsed:.0f} s "
+          f"({_human_bytes(sent / elapsed if elapsed else 0)}/s)", file=out)
+    return failed
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Konvertera och ladda upp inspelningar som ligger kvar i AUDIO_DIR")
+    parser.add_argument("--dir", type=Path, default=AUDIO_DIR, help=f"Inspelningskatalog (standard {AUDIO_DIR})")
+    parser.add_argument("--workers", type=int, default=POSTPROCESS_WORKERS,
+                        help=f"Parallella jobb (standard POSTPROCESS_WORKERS={POSTPROCESS_WORKERS})")
+    parser.add_argument("--processes", action="store_true", help="Kör jobben i processer i stället för trådar")
+    parser.add_argument("--rate", type=float, default=0.0, help="Högst så många jobbstarter per minut (0 = obegränsat)")
+    parser.add_argument("--limit", type=int, default=0, help="Högst så många inspelningar (äldst först)")
+    parser.add_argument("--only", choices=("encode", "upload"), help="Bara kodning+uppladdning eller bara uppladdning")
+    parser.add_argument("--min-age", type=float, default=MIN_AGE,
+                        help=f"Hoppa över WAV-filer ändrade senaste N sekunderna (standard {MIN_AGE})")
+    parser.add_argument("--force", action="store_true",
+                        help="Ta med inspelningar som katalogen anger som uppladdade eller pågående")
+    parser.add_argument("--dry-run", action="store_true", help="Visa vad som skulle göras")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Logga på INFO-nivå")
+    args = parser.parse_args()
+    if args.verbose:
+        logging.getLogger().setLevel(logging.INFO)
+
+    catalog = open_catalog(args.dir)
+    items = plan(scan(args.dir), catalog, force=args.force, min_age=args.min_age)
+    skipped = [item for item in items if item["action"] == "skip"]
+    todo = [item for item in items if item["action"] != "skip" and (not args.only or item["action"] == args.only)]
+    if args.limit:
+        todo = todo[:args.limit]
+
+    print(f"{len(items)} inspelningar i {args.dir}: {sum(i['action'] == 'encode' for i in todo)} att koda, "
+          f"{sum(i['action'] == 'upload' for i in todo)} att ladda upp, {len(skipped)} hoppas över")
+    if args.dry_run:
+        for item in todo + skipped:
+            print(f"  {item['action']:<7} {item['name']} ({item['reason']})")
+        return
+
+    settings = None
+    if CONFIG_SUPPORT:
+        # Samma uppladdningsmål som enheten (konfigurerade via MQTT eller miljövariabler)
+        config = ConfigManager()
+        settings = {key: config.get(key) for key in UPLOAD_KEYS}
+    try:
+        failed = run(todo, workers=args.workers, processes=args.processes, rate=args.rate,
+                     settings=settings, catalog=catalog)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    finally:
+        if catalog:
+            catalog.close()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Huvudlös inspelningstjänst (utan Tkinter/skärm).
+
+Kör inspelningskärnan som en systemd-tjänst och styrs via MQTT och/eller
+den lokala Unix-socketen (se ipc.py) samt det lokala HTTP-API:t
+(se http_api.py). GUI:t kan köras ovanpå tjänsten med
+MEETREC_DAEMON_SOCKET satt, men behövs inte för att spela in.
+"""
+import signal
+import logging
+import threading
+
+from recorder import Recorder, MQTT_SUPPORT
+from ipc import IPCServer, DEFAULT_SOCKET_PATH
+
+if MQTT_SUPPORT:
+    from config_manager import ConfigManager
+
+# Konfigurera logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("meetrec_daemon")
+
+
+def main():
+    stop_event = threading.Event()
+
+    def handle_signal(signum, frame):
+        logger.info(f"Signal {signum} mottagen, avslutar")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    recorder = Recorder(ConfigManager() if MQTT_SUPPORT else None)
+    recorder.start_mqtt()
+    recorder.start_api()
+    recorder.start_preroll()
+    server = IPCServer(recorder, DEFAULT_SOCKET_PATH)
+    server.start()
+    logger.info("meetrec_daemon igång")
+
+    try:
+        stop_event.wait()
+    finally:
+        server.stop()
+        recorder.shutdown()
+        logger.info("meetrec_daemon avslutad")
+
+
+if __name__ == "__main__":
+    main()
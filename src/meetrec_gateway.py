@@ -0,0 +1,602 @@
+#!/usr/bin/env python3
+"""
+Uppladdningsgateway för flera inspelare på samma LAN.
+
+I stället för att varje Pi laddar upp direkt till S3/n8n över internet
+(med egen TLS-uppkoppling och egna omförsök) pekar inspelarna sitt
+http-mål mot gatewayen:
+
+    UPLOAD_TARGET=http
+    HTTP_UPLOAD_URL=http://gateway.lan:8090/upload
+
+Gatewayen tar emot multipart-uppladdningar (med Content-Length eller
+chunked överföring) och skriver filen direkt till disk medan den hashas,
+kontrollerar SHA-256/Content-MD5, sparar varje innehåll en gång
+(deduplicering på SHA-256) och svarar så fort filen ligger lokalt.
+Vidarebefordran till molnet sker i bakgrunden i omgångar om
+GATEWAY_BATCH_SIZE filer med högst GATEWAY_CONCURRENCY samtidiga
+uppladdningar, till målen i gatewayens egen UPLOAD_TARGET (t.ex. "s3,n8n").
+Misslyckade filer ligger kvar och försöks igen med ökande väntetid, även
+efter omstart.
+
+Endpoints:
+- POST /upload       - ta emot en fil (fältet file, valfritt fält sha256)
+- GET  /api/status   - antal filer och byte per status
+
+Lokalt test utan molnkonton:
+
+    python src/meetrec_gateway.py --stub
+
+startar en stub-mottagare på 127.0.0.1 som gatewayen vidarebefordrar till.
+"""
+import os
+import re
+import sys
+import hmac
+import json
+import time
+import uuid
+import signal
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Iterator, Tuple
+
+from config_manager import write_json_atomic
+from http_api import is_loopback
+from integrity import HashingWriter, remember_digest
+from pipeline import upload_to_targets, upload_summary
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("meetrec_gateway")
+
+GATEWAY_HOST = os.getenv("GATEWAY_HOST", "0.0.0.0")
+GATEWAY_PORT = int(os.getenv("GATEWAY_PORT", "8090"))
+GATEWAY_TOKEN = os.getenv("GATEWAY_TOKEN") or None
+GATEWAY_DIR = os.path.expanduser(os.getenv("GATEWAY_DIR", "~/.meetrec/gateway"))
+# Vidarebefordran: filer per omgång, samtidiga uppladdningar och väntan mellan omgångar (s)
+GATEWAY_BATCH_SIZE = int(os.getenv("GATEWAY_BATCH_SIZE", "10"))
+GATEWAY_CONCURRENCY = int(os.getenv("GATEWAY_CONCURRENCY", "2"))
+GATEWAY_BATCH_INTERVAL = float(os.getenv("GATEWAY_BATCH_INTERVAL", "5"))
+# Väntetid före nytt försök (fördubblas per försök, högst en timme)
+GATEWAY_RETRY_DELAY = float(os.getenv("GATEWAY_RETRY_DELAY", "30"))
+GATEWAY_RETRY_MAX = 3600.0
+# Största fil som tas emot och hur länge vidarebefordrade filer sparas lokalt
+GATEWAY_MAX_BYTES = int(os.getenv("GATEWAY_MAX_BYTES", str(4 * 1024 ** 3)))
+GATEWAY_RETAIN_DAYS = float(os.getenv("GATEWAY_RETAIN_DAYS", "7"))
+
+# Läsblock från klienten, största textfält och största header-block per del
+READ_CHUNK = 256 * 1024
+MAX_FIELD = 64 * 1024
+MAX_PART_HEADERS = 16 * 1024
+
+_DISPOSITION = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+_SAFE_NAME = re.compile(r"[^A-Za-z0-9._-]")
+
+
+# ========= Mottagning =========
+class LimitedReader:
+    """Läser högst length byte (kropp med Content-Length)"""
+
+    def __init__(self, stream, length: int):
+        self.stream = stream
+        self.remaining = length
+
+    def read(self, size: int) -> bytes:
+        if self.remaining <= 0:
+            return b""
+        data = self.stream.read(min(size, self.remaining))
+        self.remaining -= len(data)
+        return data
+
+
+class ChunkedReader:
+    """Avkodar Transfer-Encoding: chunked"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._left = 0
+        self._done = False
+
+    def read(self, size: int) -> bytes:
+        if self._done:
+            return b""
+        if self._left == 0:
+            line = self.stream.readline(1024)
+            try:
+                self._left = int(line.split(b";")[0].strip(), 16)
+            except ValueError:
+                raise ValueError("Ogiltig chunked-kodning")
+            if self._left == 0:
+                # Avslutande (tomma) trailers
+                while self.stream.readline(1024) not in (b"\r\n", b"\n", b""):
+                    pass
+                self._done = True
+                return b""
+        data = self.stream.read(min(size, self._left))
+        if not data:
+            raise ValueError("Oväntat slut på chunked-data")
+        self._left -= len(data)
+        if self._left == 0:
+            self.stream.readline(1024)   # CRLF efter varje chunk
+        return data
+
+
+class MultipartReader:
+    """Strömmande tolkning av multipart/form-data, del för del"""
+
+    def __init__(self, stream, boundary: str, chunk_size: int = READ_CHUNK):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.delimiter = b"\r\n--" + boundary.encode("latin-1")
+        self.buffer = b""
+
+    def _fill(self):
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            raise ValueError("Oväntat slut på multipart-data")
+        self.buffer += chunk
+
+    def parts(self) -> Iterator[Tuple[Dict[str, str], Iterator[bytes]]]:
+        """
+        Delarna i ordning som (headers, data-iterator).
+
+        Data som inte läses av anroparen hoppas över innan nästa del.
+        """
+        first = self.delimiter[2:]
+        while first not in self.buffer:
+            if len(self.buffer) > MAX_PART_HEADERS:
+                raise ValueError("multipart-gräns saknas")
+            self._fill()
+        self.buffer = self.buffer[self.buffer.index(first) + len(first):]
+        while True:
+            while len(self.buffer) < 2:
+                self._fill()
+            if self.buffer.startswith(b"--"):
+                return
+            if not self.buffer.startswith(b"\r\n"):
+                raise ValueError("Ogiltig multipart-gräns")
+            while b"\r\n\r\n" not in self.buffer:
+                if len(self.buffer) > MAX_PART_HEADERS:
+                    raise ValueError("För stora del-headers")
+                self._fill()
+            raw, self.buffer = self.buffer[2:].split(b"\r\n\r\n", 1)
+            headers = {}
+            for line in raw.decode("utf-8", errors="replace").split("\r\n"):
+                key, sep, value = line.partition(":")
+                if sep:
+                    headers[key.strip().lower()] = value.strip()
+            data = self._data()
+            yield headers, data
+            for _ in data:
+                pass
+
+    def _data(self) -> Iterator[bytes]:
+        keep = len(self.delimiter) - 1
+        while True:
+            index = self.buffer.find(self.delimiter)
+            if index >= 0:
+                if index:
+                    yield self.buffer[:index]
+                self.buffer = self.buffer[index + len(self.delimiter):]
+                return
+            if len(self.buffer) > keep:
+                # Slutet kan vara början på gränsen; spara det till nästa varv
+                yield self.buffer[:-keep]
+                self.buffer = self.buffer[-keep:]
+            self._fill()
+
+
+def parse_disposition(value: str) -> Dict[str, str]:
+    """'form-data; name="file"; filename="a.flac"' -> {"name": "file", "filename": "a.flac"}"""
+    return {key.lower(): re.sub(r"\\(.)", r"\1", val) for key, val in _DISPOSITION.findall(value)}
+
+
+def safe_filename(name: str) -> str:
+    name = _SAFE_NAME.sub("_", Path(name.replace("\\", "/")).name).lstrip(".")
+    return name or "upload.bin"
+
+
+# ========= Lokalt lager =========
+class Spool:
+    """
+    Mottagna filer: en katalog per innehåll (<sha256>/<filnamn> + meta.json).
+
+    Metadata skrivs atomiskt, så kön överlever omstart. Vidarebefordrade
+    filer tas bort efter GATEWAY_RETAIN_DAYS men metadata behålls, så att
+    samma innehåll inte vidarebefordras igen.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.incoming = self.root / "incoming"
+        self.incoming.mkdir(parents=True, exist_ok=True)
+        for leftover in self.incoming.iterdir():
+            # Avbrutna mottagningar från förra körningen
+            leftover.unlink()
+        self._lock = threading.Lock()
+        self._items: Dict[str, Dict[str, Any]] = {}
+        self._in_flight: set = set()
+        for meta in self.root.glob("*/meta.json"):
+            try:
+                with open(meta) as f:
+                    item = json.load(f)
+                self._items[item["sha256"]] = item
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Ogiltig metadata {meta}: {e}")
+        pending = sum(1 for item in self._items.values() if item["status"] == "pending")
+        logger.info(f"Lager {self.root}: {len(self._items)} filer, {pending} väntar på vidarebefordran")
+
+    def path_for(self, item: Dict[str, Any]) -> Path:
+        return self.root / item["sha256"] / item["filename"]
+
+    def _save(self, item: Dict[str, Any]):
+        write_json_atomic(self.root / item["sha256"] / "meta.json", item)
+
+    def receive(self, filename: str, data: Iterator[bytes], content_md5: Optional[str] = None):
+        """
+        Skriv en fil till incoming/ medan den hashas.
+
+        Returns:
+            (temporär sökväg, Digest)
+
+        Raises:
+            ValueError: Vid för stor fil eller fel Content-MD5
+        """
+        tmp = self.incoming / f"{uuid.uuid4().hex}-{filename}"
+        writer = HashingWriter(tmp)
+        try:
+            for chunk in data:
+                writer.write(chunk)
+                if writer.size > GATEWAY_MAX_BYTES:
+                    raise ValueError(f"Filen är större än {GATEWAY_MAX_BYTES} byte")
+        except BaseException:
+            writer.abort()
+            raise
+        digest = writer.commit()
+        if content_md5 and content_md5 != digest.content_md5:
+            tmp.unlink()
+            raise ValueError("Content-MD5 stämmer inte")
+        return tmp, digest
+
+    def add(self, tmp: Path, filename: str, digest, source: str) -> Dict[str, Any]:
+        """Lägg en mottagen fil i kön (eller kasta den om innehållet redan finns)"""
+        with self._lock:
+            existing = self._items.get(digest.sha256)
+            if existing:
+                tmp.unlink()
+                return {"ok": True, "duplicate": True, "sha256": digest.sha256, "status": existing["status"]}
+            (self.root / digest.sha256).mkdir(exist_ok=True)
+            item = {
+                "sha256": digest.sha256,
+                "md5": digest.md5.hex(),
+                "size": digest.size,
+                "filename": filename,
+                "source": source,
+                "received_at": time.time(),
+                "status": "pending",
+                "attempts": 0,
+                "next_attempt": 0.0,
+            }
+            final = self.path_for(item)
+            os.replace(tmp, final)
+            # Hashen behöver inte räknas om vid vidarebefordran
+            remember_digest(final, digest)
+            self._save(item)
+            self._items[digest.sha256] = item
+        return {"ok": True, "duplicate": False, "sha256": digest.sha256, "size": digest.size}
+
+    def due(self, limit: int) -> List[Dict[str, Any]]:
+        """Väntande filer vars väntetid gått ut, äldst först (markeras som pågående)"""
+        now = time.time()
+        with self._lock:
+            items = sorted((item for item in self._items.values()
+                            if item["status"] == "pending" and item["next_attempt"] <= now
+                            and item["sha256"] not in self._in_flight),
+                           key=lambda item: item["received_at"])[:limit]
+            self._in_flight.update(item["sha256"] for item in items)
+            return [dict(item) for item in items]
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return sum(1 for item in self._items.values() if item["status"] == "pending")
+
+    def update(self, sha256: str, **fields):
+        with self._lock:
+            item = self._items[sha256]
+            item.update(fields)
+            self._in_flight.discard(sha256)
+            self._save(item)
+
+    def prune(self, retain_s: float) -> int:
+        """Ta bort vidarebefordrade filer äldre än retain_s (metadata behålls)"""
+        cutoff = time.time() - retain_s
+        removed = 0
+        with self._lock:
+            for item in self._items.values():
+                if item["status"] == "forwarded" and not item.get("pruned") and item.get("forwarded_at", 0) < cutoff:
+                    try:
+                        self.path_for(item).unlink()
+                    except FileNotFoundError:
+                        pass
+                    item["pruned"] = True
+                    self._save(item)
+                    removed += 1
+        return removed
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            result: Dict[str, Any] = {}
+            for item in self._items.values():
+                entry = result.setdefault(item["status"], {"count": 0, "bytes": 0})
+                entry["count"] += 1
+                entry["bytes"] += item["size"]
+            return {"items": result, "in_flight": len(self._in_flight)}
+
+
+# ========= Vidarebefordran =========
+class Forwarder:
+    """Vidarebefordrar väntande filer i omgångar med begränsad samtidighet"""
+
+    def __init__(self, spool: Spool, settings: Optional[Dict[str, Any]] = None,
+                 batch_size: int = GATEWAY_BATCH_SIZE, concurrency: int = GATEWAY_CONCURRENCY,
+                 interval: float = GATEWAY_BATCH_INTERVAL):
+        """
+        Args:
+            settings: Uppladdningsinställningar (None = gatewayens miljövariabler)
+        """
+        self.spool = spool
+        self.settings = settings
+        self.batch_size = max(1, batch_size)
+        self.interval = interval
+        self._pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="forward")
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="forwarder", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def notify(self):
+        """Ny fil mottagen: starta en omgång direkt om den blivit full"""
+        if self.spool.pending_count() >= self.batch_size:
+            self._wake.set()
+
+    def _loop(self):
+        last_prune = 0.0
+        while not self._stop.is_set():
+            try:
+                forwarded = self.forward_batch()
+            except Exception as e:
+                logger.error(f"Fel vid vidarebefordran: {e}")
+                forwarded = 0
+            if time.time() - last_prune > 3600:
+                last_prune = time.time()
+                removed = self.spool.prune(GATEWAY_RETAIN_DAYS * 86400)
+                if removed:
+                    logger.info(f"{removed} vidarebefordrade filer borttagna lokalt")
+            if forwarded < self.batch_size:
+                # Full omgång: fortsätt direkt med nästa
+                self._wake.wait(self.interval)
+                self._wake.clear()
+
+    def forward_batch(self) -> int:
+        """Vidarebefordra en omgång och vänta tills den är klar"""
+        batch = self.spool.due(self.batch_size)
+        if batch:
+            wait([self._pool.submit(self._forward, item) for item in batch])
+        return len(batch)
+
+    def _forward(self, item: Dict[str, Any]):
+        attempts = item["attempts"] + 1
+        try:
+            results = upload_to_targets(self.spool.path_for(item), settings=self.settings)
+            ok, info = upload_summary(results)
+        except Exception as e:
+            results, ok, info = {}, False, str(e)
+        if ok:
+            self.spool.update(item["sha256"], status="forwarded", forwarded_at=time.time(),
+                              attempts=attempts, result=info, error=None)
+            logger.info(f"Vidarebefordrad: {item['filename']} ({item['source']}) → {info}")
+        else:
+            delay = min(GATEWAY_RETRY_MAX, GATEWAY_RETRY_DELAY * 2 ** (attempts - 1))
+            self.spool.update(item["sha256"], attempts=attempts, error=info,
+                              next_attempt=time.time() + delay)
+            logger.warning(f"Vidarebefordran av {item['filename']} misslyckades (försök {attempts}, "
+                           f"nytt försök om {delay:g} s): {info}")
+
+
+# ========= HTTP =========
+class GatewayRequestHandler(BaseHTTPRequestHandler):
+    """HTTP-hanterare; `spool`, `forwarder` och `token` sätts på en underklass per server"""
+
+    spool: Spool = None
+    forwarder: Forwarder = None
+    token: Optional[str] = None
+    protocol_version = "HTTP/1.1"
+    server_version = "meetrec-gateway"
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _send_json(self, status: int, payload: Any):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if status >= 400:
+            # Resten av kroppen läses inte; stäng i stället för att tolka den som nästa begäran
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self) -> bool:
+        if not self.token:
+            return True
+        header = self.headers.get("Authorization", "").encode("utf-8", errors="replace")
+        return hmac.compare_digest(header, f"Bearer {self.token}".encode("utf-8"))
+
+    def do_GET(self):
+        if not self._authorized():
+            return self._send_json(401, {"ok": False, "result": "Ej behörig"})
+        if self.path.partition("?")[0] == "/api/status":
+            return self._send_json(200, self.spool.summary())
+        self._send_json(404, {"ok": False, "result": "Okänd sökväg"})
+
+    def do_POST(self):
+        if not self._authorized():
+            return self._send_json(401, {"ok": False, "result": "Ej behörig"})
+        if self.path.partition("?")[0] != "/upload":
+            return self._send_json(404, {"ok": False, "result": "Okänd sökväg"})
+        match = re.search(r'boundary="?([^";]+)"?', self.headers.get("Content-Type", ""))
+        if not self.headers.get("Content-Type", "").startswith("multipart/form-data") or not match:
+            return self._send_json(415, {"ok": False, "result": "Förväntade multipart/form-data"})
+        if "chunked" in self.headers.get("Transfer-Encoding", "").lower():
+            body = ChunkedReader(self.rfile)
+        else:
+            length = int(self.headers.get("Content-Length") or 0)
+            if length > GATEWAY_MAX_BYTES + MAX_FIELD:
+                return self._send_json(413, {"ok": False, "result": "För stor fil"})
+            body = LimitedReader(self.rfile, length)
+        try:
+            result = self._receive(MultipartReader(body, match.group(1)))
+        except ValueError as e:
+            return self._send_json(400, {"ok": False, "result": str(e)})
+        self._send_json(200, result)
+        if not result["duplicate"]:
+            self.forwarder.notify()
+
+    def _receive(self, reader: MultipartReader) -> Dict[str, Any]:
+        fields: Dict[str, str] = {}
+        received = None
+        for headers, data in reader.parts():
+            disposition = parse_disposition(headers.get("content-disposition", ""))
+            if "filename" in disposition and received is None:
+                filename = safe_filename(disposition["filename"])
+                received = (filename, *self.spool.receive(filename, data, headers.get("content-md5")))
+            elif "name" in disposition:
+                value = b""
+                for chunk in data:
+                    value += chunk
+                    if len(value) > MAX_FIELD:
+                        raise ValueError(f"Fältet {disposition['name']} är för stort")
+                fields[disposition["name"]] = value.decode("utf-8", errors="replace")
+        if received is None:
+            raise ValueError("Fil saknas")
+        filename, tmp, digest = received
+        expected = (self.headers.get("X-Content-SHA256") or fields.get("sha256") or "").lower()
+        if expected and expected != digest.sha256:
+            tmp.unlink()
+            raise ValueError("SHA-256 stämmer inte")
+        return self.spool.add(tmp, filename, digest, self.client_address[0])
+
+
+# ========= Stub-mottagare för lokala tester =========
+class StubBackendHandler(BaseHTTPRequestHandler):
+    """Tar emot uppladdningar, räknar byte och slänger datat"""
+
+    protocol_version = "HTTP/1.1"
+    received: List[Dict[str, Any]] = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        remaining = int(self.headers.get("Content-Length") or 0)
+        size = remaining
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, READ_CHUNK))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+        self.received.append({"path": self.path, "bytes": size, "sha256": self.headers.get("X-Content-SHA256")})
+        logger.info(f"Stub tog emot {size} byte på {self.path}")
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_stub_backend() -> Tuple[ThreadingHTTPServer, str]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubBackendHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub-backend", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/stub"
+
+
+# ========= Tjänst =========
+def create_gateway(root: Path = Path(GATEWAY_DIR), host: str = GATEWAY_HOST, port: int = GATEWAY_PORT,
+                   settings: Optional[Dict[str, Any]] = None,
+                   token: Optional[str] = GATEWAY_TOKEN) -> Tuple[ThreadingHTTPServer, Forwarder]:
+    """
+    Skapa lager, vidarebefordrare och HTTP-server (startas av anroparen).
+
+    Raises:
+        ValueError: Om servern skulle nås från nätet utan token; vem som
+            helst på LAN:et kunde annars ladda upp via gatewayens molnkonton
+    """
+    if not token and not is_loopback(host):
+        raise ValueError(f"GATEWAY_TOKEN krävs när gatewayen lyssnar på {host}")
+    spool = Spool(root)
+    forwarder = Forwarder(spool, settings=settings)
+    handler = type("BoundGatewayHandler", (GatewayRequestHandler,),
+                   {"spool": spool, "forwarder": forwarder, "token": token})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server, forwarder
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Uppladdningsgateway för meetrec-inspelare på LAN:et")
+    parser.add_argument("--stub", action="store_true",
+                        help="Vidarebefordra till en lokal stub-mottagare i stället för molnet")
+    args = parser.parse_args()
+
+    settings = None
+    if args.stub:
+        _stub, url = start_stub_backend()
+        settings = {"upload_target": "http", "http_upload_url": url, "http_auth_header": ""}
+        logger.info(f"Stub-mottagare: {url}")
+
+    try:
+        server, forwarder = create_gateway(settings=settings)
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(1)
+    forwarder.start()
+    threading.Thread(target=server.serve_forever, name="gateway-http", daemon=True).start()
+    logger.info(f"meetrec_gateway lyssnar på {GATEWAY_HOST}:{GATEWAY_PORT}, lager {GATEWAY_DIR}")
+
+    stop_event = threading.Event()
+
+    def handle_signal(signum, frame):
+        logger.info(f"Signal {signum} mottagen, avslutar")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+    try:
+        stop_event.wait()
+    finally:
+        server.shutdown()
+        server.server_close()
+        forwarder.stop()
+        logger.info("meetrec_gateway avslutad")
+
+
+if __name__ == "__main__":
+    main()
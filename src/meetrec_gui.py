@@ -1,243 +1,34 @@
 #!/usr/bin/env python3
-import os, sys, time, subprocess, threading, queue, logging
-from pathlib import Path
-from datetime import datetime
+import os, sys, time, queue, logging
 
 import tkinter as tk
 from tkinter import ttk
 
 import numpy as np
-import sounddevice as sd
 
-# Import MQTT och konfigurationshantering
-try:
-    from mqtt_client import MQTTClient, get_mqtt_config_from_env
+from pipeline import human_duration
+from recorder import Recorder, CHANNELS_TEST, MQTT_SUPPORT
+
+if MQTT_SUPPORT:
     from config_manager import ConfigManager
-    MQTT_SUPPORT = True
-except ImportError as e:
-    MQTT_SUPPORT = False
-    logging.warning(f"MQTT-stöd ej tillgängligt: {e}")
 
 # Konfigurera logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
-# ========= Konfig =========
-AUDIO_DIR     = Path.home() / "meet_recordings"
-AUDIO_DIR.mkdir(exist_ok=True)
-
-SAMPLE_RATE   = 16000         # Räcker fint för tal
-FORMAT        = "S16_LE"      # 16-bit PCM
-CHANNELS_TEST = 4             # Antal kanaler att visa i "Testa nivåer" (ändra vid behov)
-ALSA_DEVICE   = None          # None => standard. Eller t.ex. "hw:1,0" för ReSpeaker
-MAX_HOURS     = 8
-
-# Uppladdning (miljövariabler)
-UPLOAD_TARGET = os.getenv("UPLOAD_TARGET", "n8n").lower()
-AWS_REGION    = os.getenv("AWS_REGION", "eu-north-1")
-S3_BUCKET     = os.getenv("S3_BUCKET")
-S3_ENDPOINT   = os.getenv("S3_ENDPOINT_URL")
-HTTP_UPLOAD_URL   = os.getenv("HTTP_UPLOAD_URL")
-HTTP_AUTH_HEADER  = os.getenv("HTTP_AUTH_HEADER")
-N8N_WEBHOOK_URL   = os.getenv("N8N_WEBHOOK_URL")
-N8N_AUTH_HEADER   = os.getenv("N8N_AUTH_HEADER")
-
-# MQTT konfiguration
-MQTT_BROKER       = os.getenv("MQTT_BROKER")
-MQTT_PORT         = int(os.getenv("MQTT_PORT", "8883"))
-MQTT_USERNAME     = os.getenv("MQTT_USERNAME")
-MQTT_PASSWORD     = os.getenv("MQTT_PASSWORD")
-MQTT_TOPIC        = os.getenv("MQTT_TOPIC", "recordings/meetings")
-MQTT_USE_TLS      = os.getenv("MQTT_USE_TLS", "true").lower() in ("true", "1", "yes")
-
-# ---- Google Drive ----
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-from google.oauth2.service_account import Credentials as SACredentials
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials as OAuthCredentials
-
-DRIVE_AUTH_TYPE = os.getenv("DRIVE_AUTH_TYPE", "service_account").lower()  # "service_account" | "oauth"
-DRIVE_FOLDER_ID = os.getenv("DRIVE_FOLDER_ID", "")
-DRIVE_SERVICE_ACCOUNT_JSON = os.getenv("DRIVE_SERVICE_ACCOUNT_JSON")  # path till SA.json
-DRIVE_CLIENT_SECRETS = os.getenv("DRIVE_CLIENT_SECRETS")              # path till OAuth client_secret.json
-DRIVE_TOKEN_PATH = os.getenv("DRIVE_TOKEN_PATH", str(Path.home()/ "meetrec" / "token.json"))
-DRIVE_SCOPES = ["https://www.googleapis.com/auth/drive.file"]
-_drive_service = None   # cachead klient
-
-def get_drive_service():
-    global _drive_service
-    if _drive_service:
-        return _drive_service
-
-    if DRIVE_AUTH_TYPE == "service_account":
-        if not DRIVE_SERVICE_ACCOUNT_JSON or not Path(DRIVE_SERVICE_ACCOUNT_JSON).exists():
-            raise RuntimeError("Saknar service account JSON (DRIVE_SERVICE_ACCOUNT_JSON).")
-        creds = SACredentials.from_service_account_file(
-            DRIVE_SERVICE_ACCOUNT_JSON, scopes=DRIVE_SCOPES
-        )
-        _drive_service = build("drive", "v3", credentials=creds)
-        return _drive_service
-
-    elif DRIVE_AUTH_TYPE == "oauth":
-        creds = None
-        if Path(DRIVE_TOKEN_PATH).exists():
-            creds = OAuthCredentials.from_authorized_user_file(DRIVE_TOKEN_PATH, DRIVE_SCOPES)
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-            else:
-                from google_auth_oauthlib.flow import InstalledAppFlow
-                if not DRIVE_CLIENT_SECRETS or not Path(DRIVE_CLIENT_SECRETS).exists():
-                    raise RuntimeError("Saknar CLIENT_SECRETS (DRIVE_CLIENT_SECRETS).")
-                flow = InstalledAppFlow.from_client_secrets_file(DRIVE_CLIENT_SECRETS, DRIVE_SCOPES)
-                creds = flow.run_console()  # visar URL i terminalen
-            Path(DRIVE_TOKEN_PATH).parent.mkdir(parents=True, exist_ok=True)
-            with open(DRIVE_TOKEN_PATH, "w") as f:
-                f.write(creds.to_json())
-        _drive_service = build("drive", "v3", credentials=creds)
-        return _drive_service
-
-    else:
-        raise RuntimeError(f"Okänt DRIVE_AUTH_TYPE: {DRIVE_AUTH_TYPE}")
-
-# ========= Hjälp =========
-def ts_name():
-    return datetime.now().strftime("%Y%m%d-%H%M%S")
-
-def human_duration(sec):
-    m, s = divmod(int(sec), 60)
-    h, m = divmod(m, 60)
-    return f"{h:02d}:{m:02d}:{s:02d}"
-
-def wav_to_flac(wav_path: Path, gain: float = 1.0):
-    """
-    Konvertera WAV till FLAC med ljudförbättringar.
-    
-    Ljudförbättringar:
-    - Högpassfilter (150 Hz) för att reducera eko och lågfrekvent brus
-    - Volymförstärkning baserat på gain-parameter
-    - Ljudnormalisering för att optimera ljudnivån
-    
-    Args:
-        wav_path: Sökväg till WAV-filen
-        gain: Volymförstärkning (1.0 = normal, 2.0 = dubbel, etc.)
-    
-    Returns:
-        Tuple med (ok, flac_path, meddelande)
-    """
-    flac_path = wav_path.with_suffix(".flac")
-    
-    # Bygg ffmpeg-filter för ljudförbättring
-    audio_filters = []
-    
-    # Högpassfilter för att reducera eko och lågfrekvent brus (150 Hz cutoff)
-    # Detta hjälper till att ta bort rumsakustik och eko
-    audio_filters.append("highpass=f=150")
-    
-    # Volymförstärkning om gain != 1.0
-    if gain != 1.0:
-        audio_filters.append(f"volume={gain}")
-    
-    # Normalisering för att optimera ljudnivån utan klippning
-    # loudnorm är en standardbaserad ljudnormalisering (EBU R128)
-    # I=-16: Målnivå för integrerad ljudstyrka (-16 LUFS, bra för tal)
-    # TP=-1.5: True Peak max nivå (-1.5 dB, förhindrar klippning)
-    # LRA=11: Loudness Range (11 LU, lämpligt för talat innehåll)
-    audio_filters.append("loudnorm=I=-16:TP=-1.5:LRA=11")
-    
-    filter_chain = ",".join(audio_filters)
-    
-    cmd = [
-        "ffmpeg", "-y",
-        "-i", str(wav_path),
-        "-af", filter_chain,
-        "-compression_level", "5",
-        str(flac_path)
-    ]
-    
-    r = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    if r.returncode != 0:
-        return False, None, "Konvertering WAV->FLAC misslyckades"
-    # Verifiera att FLAC-filen faktiskt skapades
-    if not flac_path.exists():
-        return False, None, f"FLAC-filen skapades inte: {flac_path}"
-    if flac_path.stat().st_size == 0:
-        return False, None, f"FLAC-filen är tom: {flac_path}"
-    return True, flac_path, "ok"
-
-def upload_file(flac_path: Path):
-    # Verifiera att filen existerar innan upload (gäller alla metoder)
-    if not flac_path.exists():
-        return False, f"Uppladdningsfel: Filen finns inte: {flac_path}"
-    if flac_path.stat().st_size == 0:
-        return False, f"Uppladdningsfel: Filen är tom: {flac_path}"
-    
-    if UPLOAD_TARGET == "s3":
-        try:
-            import boto3
-            session = boto3.session.Session(region_name=AWS_REGION)
-            if S3_ENDPOINT:
-                s3 = session.client("s3", endpoint_url=S3_ENDPOINT)
-            else:
-                s3 = session.client("s3")
-            key = f"meetings/{flac_path.name}"
-            s3.upload_file(str(flac_path), S3_BUCKET, key)
-            return True, f"s3://{S3_BUCKET}/{key}"
-        except Exception as e:
-            return False, f"S3-fel: {e}"
-
-    elif UPLOAD_TARGET == "http":
-        try:
-            import requests
-            headers = {}
-            if HTTP_AUTH_HEADER:
-                headers["Authorization"] = HTTP_AUTH_HEADER
-            with open(flac_path, "rb") as f:
-                r = requests.post(HTTP_UPLOAD_URL, files={"file": (flac_path.name, f, "audio/flac")}, headers=headers, timeout=180)
-            if r.status_code // 100 == 2:
-                return True, f"HTTP {r.status_code}"
-            else:
-                return False, f"HTTP {r.status_code}: {r.text[:200]}"
-        except Exception as e:
-            return False, f"HTTP-fel: {e}"
-
-    elif UPLOAD_TARGET == "n8n":
-        try:
-            if not N8N_WEBHOOK_URL:
-                return False, "N8N_WEBHOOK_URL saknas"
-            import requests
-            headers = {}
-            if N8N_AUTH_HEADER:
-                headers["Authorization"] = N8N_AUTH_HEADER
-            with open(flac_path, "rb") as f:
-                files = {"file": (flac_path.name, f, "audio/flac")}
-                r = requests.post(N8N_WEBHOOK_URL, files=files, headers=headers, timeout=180)
-            if r.status_code // 100 == 2:
-                return True, f"n8n webhook {r.status_code} → {flac_path.name}"
-            else:
-                return False, f"n8n webhook {r.status_code}: {r.text[:200]}"
-        except Exception as e:
-            return False, f"n8n-fel: {e}"
-    else:
-        return False, f"Okänt UPLOAD_TARGET: {UPLOAD_TARGET}"
+# Sökväg till en körande meetrec_daemon; om satt blir GUI:t en fjärrkontroll
+# för tjänsten i stället för att spela in själv
+DAEMON_SOCKET = os.path.expanduser(os.getenv("MEETREC_DAEMON_SOCKET", ""))
 
 # ========= Ljudnivåmätning (Testläge) =========
 class LevelMeter:
-    def __init__(self, canvas: tk.Canvas, num_channels=4, samplerate=SAMPLE_RATE, device=ALSA_DEVICE, gain=1.0):
+    """Ritar nivåstaplar på en Canvas utifrån RMS-värden från inspelningskärnan"""
+
+    def __init__(self, canvas: tk.Canvas, num_channels=4):
         self.canvas = canvas
         self.w = int(canvas["width"])
         self.h = int(canvas["height"])
         self.bars = []
         self.num_channels = num_channels  # Antal kanaler att visa i GUI
-        self.running = False
-        self.stream = None
-        self.samplerate = samplerate
-        self.device = device
-        self.q = queue.Queue()
-        self.gain = gain  # Volymförstärkning (1.0 = normal, 2.0 = dubbel, etc.)
-        
-        # Försök hitta enhetens faktiska kanalantal för att fånga alla mikrofoner
-        self.device_channels = self._get_device_channels()
 
         margin = 10
         gap = 8
@@ -265,104 +56,33 @@ class LevelMeter:
             t = self.canvas.create_text((x0+x1)//2, y1+20, text="0%", anchor="n", font=("TkDefaultFont", 9), fill="#aaa")
             self.value_labels.append(t)
 
-    def _get_device_channels(self):
-        """Hämta enhetens maximala antal ingångskanaler"""
-        try:
-            if self.device is None:
-                # Använd standardenhet
-                device_info = sd.query_devices(kind='input')
-            else:
-                device_info = sd.query_devices(self.device)
+    def update(self, rms):
+        """Rita nya RMS-värden (anropas i Tkinter-tråden)"""
+        # Visa endast de första num_channels kanalerna i GUI:t
+        # även om enheten har fler kanaler (t.ex. 6 kanaler men visa bara 4)
+        for i in range(min(self.num_channels, len(rms))):
+            rect, (x0,y0,x1,y1) = self.bars[i]
+            height = int((y1 - y0) * (1.0 - rms[i]))
+            new_top = y0 + height
+            self.canvas.coords(rect, x0, new_top, x1, y1)
             
-            max_channels = device_info.get('max_input_channels', self.num_channels)
-            # För ReSpeaker 4-Mic Array v2.0 har ofta 6 kanaler (4 mic + 2 ref)
-            # Öppna med alla tillgängliga kanaler för att fånga alla mikrofoner
-            return max_channels
-        except Exception as e:
-            # Om det inte går att hämta info, använd num_channels som fallback
-            return self.num_channels
-
-    def _audio_callback(self, indata, frames, time_info, status):
-        if status:
-            pass
-        # Normalisera int16 data (-32768 till 32767) till float (-1.0 till 1.0)
-        # indata har form (frames, channels) där channels = device_channels
-        normalized = indata.astype(np.float32) / 32768.0
-        # Applicera gain
-        normalized = normalized * self.gain
-        # Beräkna RMS per kanal (axis=0 ger en RMS-värde per kanal)
-        # Detta beräknar RMS för ALLA kanaler från enheten
-        with np.errstate(invalid='ignore'):
-            rms = np.sqrt(np.mean(np.square(normalized), axis=0))
-        # Klipp till 0.0-1.0 efter gain är applicerad
-        rms = np.clip(rms, 0.0, 1.0)
-        self.q.put(rms)
-
-    def start(self):
-        if self.running:
-            return
-        self.running = True
-        try:
-            # Öppna stream med alla tillgängliga kanaler från enheten
-            # Detta säkerställer att alla mikrofoner fångas, även om de är
-            # mappade till högre kanalnummer (t.ex. kanal 4-5 på ReSpeaker)
-            self.stream = sd.InputStream(
-                channels=self.device_channels,
-                samplerate=self.samplerate,
-                dtype="int16",
-                device=self.device,
-                callback=self._audio_callback,
-                blocksize=1024
-            )
-            self.stream.start()
-        except Exception as e:
-            self.running = False
-            raise e
-
-        self._tick()
-
-    def stop(self):
-        self.running = False
-        try:
-            if self.stream:
-                self.stream.stop()
-                self.stream.close()
-        finally:
-            self.stream = None
+            # Uppdatera värdelabel
+            percent = int(rms[i] * 100)
+            # Beräkna dB (20 * log10(rms)), men undvik log(0)
+            if rms[i] > 0.001:
+                db = 20 * np.log10(rms[i])
+                self.canvas.itemconfig(self.value_labels[i], text=f"{percent}% ({db:.0f}dB)")
+            else:
+                self.canvas.itemconfig(self.value_labels[i], text=f"{percent}%")
 
-    def _tick(self):
-        try:
-            while True:
-                rms = self.q.get_nowait()
-                # Visa endast de första num_channels kanalerna i GUI:t
-                # även om enheten har fler kanaler (t.ex. 6 kanaler men visa bara 4)
-                for i in range(min(self.num_channels, len(rms))):
-                    rect, (x0,y0,x1,y1) = self.bars[i]
-                    height = int((y1 - y0) * (1.0 - rms[i]))
-                    new_top = y0 + height
-                    self.canvas.coords(rect, x0, new_top, x1, y1)
-                    
-                    # Uppdatera värdelabel
-                    percent = int(rms[i] * 100)
-                    # Beräkna dB (20 * log10(rms)), men undvik log(0)
-                    if rms[i] > 0.001:
-                        db = 20 * np.log10(rms[i])
-                        self.canvas.itemconfig(self.value_labels[i], text=f"{percent}% ({db:.0f}dB)")
-                    else:
-                        self.canvas.itemconfig(self.value_labels[i], text=f"{percent}%")
-        except queue.Empty:
-            pass
-        if self.running:
-            self.canvas.after(50, self._tick)
-    
-    def set_gain(self, gain):
-        """Uppdatera gain-värdet"""
-        self.gain = max(0.1, min(10.0, gain))
-
-# ========= GUI-app =========
+
+# ========= GUI =========
 class App(tk.Tk):
-    def __init__(self):
+    """Pekskärmsgränssnitt; en tunn vy ovanpå Recorder (lokal eller via daemon)"""
+
+    def __init__(self, recorder):
         super().__init__()
+        self.recorder = recorder
         self.title("Mötesinspelare")
         self.geometry("800x480")
         self.configure(bg="#111")
@@ -447,7 +167,7 @@ class App(tk.Tk):
         )
         self.gain_slider.pack(side="left", fill="x", expand=True, padx=10)
         
-        self.meter = LevelMeter(self.canvas, num_channels=CHANNELS_TEST, samplerate=SAMPLE_RATE, device=ALSA_DEVICE, gain=1.0)
+        self.meter = LevelMeter(self.canvas, num_channels=CHANNELS_TEST)
 
         # Stor röd REC-indikator + timer i mitten
         self.rec_var = tk.StringVar(value="")
@@ -459,210 +179,99 @@ class App(tk.Tk):
         self.rec_label.lower()
         self._blink_on = True
 
-        # Internt tillstånd
-        self.record_proc = None
         self.record_start = None
-        self.current_wav = None
         self._timer_job = None
-        self.test_active = False
-        self.recording_gain = 1.0  # Sparar gain-värdet som användes vid inspelning
-        
-        # Konfigurationshanterare
-        self.config_manager = ConfigManager() if MQTT_SUPPORT else None
-        
-        # MQTT-klient
-        self.mqtt_client = None
-        if MQTT_SUPPORT:
-            try:
-                mqtt_config = get_mqtt_config_from_env()
-                if mqtt_config.get("enabled"):
-                    self.mqtt_client = MQTTClient(mqtt_config)
-                    self.mqtt_client.set_callbacks(
-                        on_start=self.mqtt_on_start,
-                        on_stop=self.mqtt_on_stop,
-                        on_test=self.mqtt_on_test,
-                        on_config_update=self.mqtt_on_config_update
-                    )
-                    self.mqtt_client.connect()
-                    # Publicera initial konfiguration
-                    self.mqtt_client.publish_config(self.config_manager.get_all())
-                    logging.info("MQTT-klient initialiserad och ansluten")
-            except Exception as e:
-                logging.error(f"Kunde inte initiera MQTT-klient: {e}")
-                self.mqtt_client = None
 
-    # ---------- Handlers ----------
-    def on_gain_change(self, value):
-        """Hantera ändring av gain-slider"""
-        gain = float(value)
-        self.gain_value_label.configure(text=f"{gain:.1f}x")
-        self.meter.set_gain(gain)
-    
-    # ---------- MQTT Callbacks ----------
-    def mqtt_on_start(self):
-        """Hantera start-kommando från MQTT"""
-        # Schemalägg kommando i main thread (Tkinter är inte trådsäker)
-        self.after(0, self.on_start)
-    
-    def mqtt_on_stop(self):
-        """Hantera stopp-kommando från MQTT"""
-        self.after(0, self.on_stop)
-    
-    def mqtt_on_test(self):
-        """Hantera test-kommando från MQTT"""
-        self.after(0, self.on_test_levels)
-    
-    def mqtt_on_config_update(self, config_updates):
-        """Hantera konfigurationsuppdatering från MQTT"""
-        if not self.config_manager:
-            return
-        
-        # Uppdatera konfiguration
-        self.config_manager.update(config_updates)
-        
-        # Hantera speciella konfigurationer
-        if "wifi_ssid" in config_updates and "wifi_password" in config_updates:
-            self.config_manager.set_wifi_credentials(
-                config_updates["wifi_ssid"],
-                config_updates["wifi_password"]
-            )
-        
-        # Publicera uppdaterad konfiguration
-        if self.mqtt_client:
-            self.mqtt_client.publish_config(self.config_manager.get_all())
-        
-        logging.info(f"Konfiguration uppdaterad via MQTT: {list(config_updates.keys())}")
-    
-    def on_test_levels(self):
-        if self.record_proc is not None:
-            self.flash_status("Kan inte testa nivåer under inspelning", warn=True)
-            return
-        try:
-            if not self.test_active:
-                self.meter.start()
-                self.test_active = True
-                # Visa information om hur många kanaler som fångas vs visas
-                if self.meter.device_channels != self.meter.num_channels:
-                    self.status_var.set(f"Testläge: {self.meter.device_channels} ch fångade, {self.meter.num_channels} visas")
-                else:
-                    self.status_var.set(f"Testläge: visa nivåer ({self.meter.num_channels} ch)")
-                self.btn_test.configure(text="Stoppa test")
-            else:
-                self.meter.stop()
-                self.test_active = False
-                self.status_var.set("Klar")
-                self.btn_test.configure(text="Testa nivåer")
-        except Exception as e:
-            self.flash_status(f"Testfel: {e}", warn=True)
+        # Händelser från inspelningskärnan kommer från andra trådar;
+        # de köas och hanteras i Tkinter-tråden
+        self._events = queue.Queue()
+        self.recorder.add_listener(self._on_recorder_event)
 
-    def on_start(self):
-        if self.record_proc is not None:
-            return
-        if self.test_active:
-            self.meter.stop()
-            self.test_active = False
-            self.btn_test.configure(text="Testa nivåer")
-
-        fname = f"meeting-{ts_name()}.wav"
-        self.current_wav = AUDIO_DIR / fname
-        
-        # Spara gain-värdet som ska användas vid konvertering
-        self.recording_gain = self.gain_var.get()
+        state = self.recorder.status()
+        self._set_gain_widgets(state.get("gain", 1.0))
+        if state.get("recording"):
+            self._on_recording({"active": True, "started_at": state.get("started_at")})
+        self.after(50, self._poll_events)
 
-        cmd = ["arecord", "-f", FORMAT, "-r", str(SAMPLE_RATE), "-c", "1", str(self.current_wav)]
-        if ALSA_DEVICE:
-            cmd = ["arecord", "-D", ALSA_DEVICE, "-f", FORMAT, "-r", str(SAMPLE_RATE), "-c", "1", str(self.current_wav)]
+    # ---------- Händelser från inspelningskärnan ----------
+    def _on_recorder_event(self, event, data):
+        self._events.put((event, data))
 
+    def _poll_events(self):
         try:
-            self.record_proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
-            self.record_start = time.time()
-            self.status_var.set(f"Inspelning pågår → {self.current_wav.name}")
+            while True:
+                event, data = self._events.get_nowait()
+                self._handle_event(event, data)
+        except queue.Empty:
+            pass
+        self.after(50, self._poll_events)
+
+    def _handle_event(self, event, data):
+        if event == "message":
+            if data.get("flash"):
+                self.flash_status(data["text"], warn=data.get("warn", False))
+            else:
+                self.status_var.set(data["text"])
+        elif event == "recording":
+            self._on_recording(data)
+        elif event == "test":
+            self.btn_test.configure(text="Stoppa test" if data.get("active") else "Testa nivåer")
+        elif event == "levels":
+            self.meter.update(data["rms"])
+        elif event == "gain":
+            self._set_gain_widgets(data["gain"])
+
+    def _on_recording(self, data):
+        if data.get("active"):
+            self.record_start = data.get("started_at") or time.time()
             self.rec_label.lift()
             self._blink_on = True
-            self.tick_timer()
-            # Publicera status till MQTT
-            if self.mqtt_client:
-                room = self.config_manager.get("room", "") if self.config_manager else ""
-                self.mqtt_client.publish_status("recording", {"filename": self.current_wav.name, "room": room})
-        except Exception as e:
-            self.record_proc = None
-            self.flash_status(f"Kunde inte starta inspelning: {e}", warn=True)
-
-    def on_stop(self):
-        if self.record_proc is None:
-            return
-        self.status_var.set("Stoppar inspelning…")
-        self.stop_recording()
-        self.rec_var.set("")
-        self.rec_label.lower()
-        # Publicera status till MQTT
-        if self.mqtt_client:
-            self.mqtt_client.publish_status("processing")
-        threading.Thread(target=self._convert_and_upload, daemon=True).start()
-
-    def stop_recording(self):
-        try:
-            self.record_proc.terminate()
-            try:
-                self.record_proc.wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                self.record_proc.kill()
-        finally:
-            self.record_proc = None
+            if self._timer_job is None:
+                self.tick_timer()
+        else:
             self.record_start = None
             if self._timer_job:
                 self.after_cancel(self._timer_job)
                 self._timer_job = None
+            self.time_var.set("00:00:00")
+            self.rec_var.set("")
+            self.rec_label.lower()
 
-    def _convert_and_upload(self):
-        wav = self.current_wav
-        gain = self.recording_gain  # Hämta gain-värdet som sparades vid inspelningsstart
-        self.current_wav = None
-        if not wav or not wav.exists():
-            self.flash_status("Fil saknas efter stopp", warn=True)
-            if self.mqtt_client:
-                self.mqtt_client.publish_status("error", {"message": "Fil saknas efter stopp"})
-            return
-
-        self.status_var.set("Komprimerar och förbättrar ljud (WAV→FLAC)…")
-        if self.mqtt_client:
-            self.mqtt_client.publish_status("converting")
-        
-        ok, flac_path, msg = wav_to_flac(wav, gain=gain)
+    # ---------- Handlers ----------
+    def on_gain_change(self, value):
+        """Hantera ändring av gain-slider"""
+        gain = float(value)
+        self.gain_value_label.configure(text=f"{gain:.1f}x")
+        self.recorder.set_gain(gain)
+
+    def _set_gain_widgets(self, gain):
+        """Visa gain utan att skicka tillbaka värdet till inspelningskärnan"""
+        self.gain_var.set(gain)
+        self.gain_value_label.configure(text=f"{gain:.1f}x")
+
+    def on_test_levels(self):
+        self.recorder.toggle_test()
+
+    def on_start(self):
+        ok, msg = self.recorder.start()
         if not ok:
-            self.flash_status(msg, warn=True)
-            if self.mqtt_client:
-                self.mqtt_client.publish_status("error", {"message": msg})
-            return
-
-        self.status_var.set("Laddar upp…")
-        if self.mqtt_client:
-            self.mqtt_client.publish_status("uploading")
-        
-        ok, info = upload_file(flac_path)
-        if ok:
-            self.flash_status(f"Klar! Uppladdad: {info}")
-            if self.mqtt_client:
-                self.mqtt_client.publish_status("ready")
-                self.mqtt_client.publish_recording_complete(flac_path.name, info)
-        else:
-            self.flash_status(f"Uppladdning misslyckades: {info}", warn=True)
-            if self.mqtt_client:
-                self.mqtt_client.publish_status("error", {"message": f"Uppladdning misslyckades: {info}"})
+            self.flash_status(str(msg), warn=True)
+
+    def on_stop(self):
+        ok, msg = self.recorder.stop()
+        if not ok:
+            self.flash_status(str(msg), warn=True)
 
     def tick_timer(self):
-        if self.record_proc is not None and self.record_start is not None:
+        if self.record_start is not None:
             elapsed = time.time() - self.record_start
-            if elapsed > MAX_HOURS * 3600:
-                self.on_stop()
-                return
-
             self.time_var.set(human_duration(elapsed))
             symbol = "●" if self._blink_on else "○"
             self._blink_on = not self._blink_on
             self.rec_var.set(f"{symbol}  REC  {human_duration(elapsed)}")
             self._timer_job = self.after(500, self.tick_timer)
         else:
+            self._timer_job = None
             self.time_var.set("00:00:00")
             self.rec_var.set("")
 
@@ -674,22 +283,36 @@ class App(tk.Tk):
         else:
             self.configure(bg="#112211")
             self.after(400, lambda: self.configure(bg="#111"))
-    
+
     def cleanup(self):
         """Städa upp resurser vid avslut"""
-        if self.mqtt_client:
-            try:
-                self.mqtt_client.disconnect()
-                logging.info("MQTT-klient frånkopplad")
-            except Exception as e:
-                logging.error(f"Fel vid frånkoppling av MQTT: {e}")
+        self.recorder.remove_listener(self._on_recorder_event)
+        self.recorder.shutdown()
+
+def create_recorder():
+    """Lokal inspelningskärna, eller fjärrkontroll mot meetrec_daemon om MEETREC_DAEMON_SOCKET är satt"""
+    if DAEMON_SOCKET:
+        from ipc import RemoteRecorder
+        logging.info(f"Ansluter till meetrec_daemon via {DAEMON_SOCKET}")
+        return RemoteRecorder(DAEMON_SOCKET)
+    recorder = Recorder(ConfigManager() if MQTT_SUPPORT else None)
+    recorder.start_mqtt()
+    recorder.start_api()
+    recorder.start_preroll()
+    return recorder
 
 def main():
     try:
-        app = App()
+        recorder = create_recorder()
+    except OSError as exc:
+        print("Kunde inte ansluta till meetrec_daemon:", exc, file=sys.stderr)
+        sys.exit(1)
+    try:
+        app = App(recorder)
         # Registrera cleanup vid avslut
         app.protocol("WM_DELETE_WINDOW", lambda: (app.cleanup(), app.destroy()))
     except tk.TclError as exc:
+        recorder.shutdown()
         print("Kunde inte starta GUI:", exc, file=sys.stderr)
         if not os.environ.get("DISPLAY"):
             print("Miljövariabeln DISPLAY saknas. Kör i en miljö med grafikstöd eller sätt DISPLAY.", file=sys.stderr)
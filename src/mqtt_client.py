@@ -3,25 +3,44 @@
 MQTT Client för fjärrstyrning av mötesinspelaren.
 
 Tillhandahåller:
-- Kommandomottagning via MQTT (start, stop, test levels)
-- Statuspublicering
+- Kommandomottagning via MQTT (start, stop, test levels) som text eller JSON
+- Schemalagd start/stopp (`start_at`/`stop_at`) och kalenderflöde via MQTT
+- Kommandokvittenser (MQTT v5 response topic + correlation data)
+- Frågor mot inspelningskatalogen (list_recordings)
+- Statuspublicering (buffras offline och skickas vid återanslutning)
+- Incidentrapporter när en inspelningsström avbryts eller startas om
+- Återanslutning i bakgrunden med exponentiell backoff och jitter
 - Konfigurationshantering via MQTT
 """
 import os
 import json
+import time
+import hashlib
+import random
 import logging
-from typing import Callable, Optional, Dict, Any
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Callable, Optional, Dict, Any, Tuple
 from pathlib import Path
 
+from scheduler import CommandScheduler, normalize_result, parse_timestamp, validate_params
+
+# Kalenderhändelser som redan startats, så att de inte startas igen efter återanslutning eller omstart
+CALENDAR_STATE = os.path.expanduser(os.getenv("CALENDAR_STATE", "~/.meetrec/calendar.json"))
+# Startade händelser glöms så här länge efter sitt slut (sekunder)
+CALENDAR_STATE_TTL = 7 * 24 * 3600
+
 try:
     import paho.mqtt.client as mqtt
+    from paho.mqtt.properties import Properties
+    from paho.mqtt.packettypes import PacketTypes
     MQTT_AVAILABLE = True
 except ImportError:
     MQTT_AVAILABLE = False
 
 logger = logging.getLogger(__name__)
 
-
 class MQTTClient:
     """MQTT-klient för fjärrstyrning av mötesinspelaren"""
     
@@ -81,6 +100,63 @@ class MQTTClient:
             raise RuntimeError("paho-mqtt är inte installerat. Installera med: pip install paho-mqtt")
         
         self.enabled = config.get("enabled", False)
+        self._apply_settings(config)
+        self.client_id = config.get("client_id", None)
+        # MQTT-protokollversion: "5" (response topic + correlation data) eller "3.1.1"
+        self.protocol = str(config.get("protocol", "3.1.1"))
+        self.use_v5 = self.protocol in ("5", "5.0", "v5")
+        self.keepalive = int(config.get("keepalive", 60))
+        
+        # Återanslutning: exponentiell backoff med jitter mellan min och max (sekunder)
+        self.reconnect_min_delay = float(config.get("reconnect_min_delay", 1.0))
+        self.reconnect_max_delay = float(config.get("reconnect_max_delay", 120.0))
+        # Max antal meddelanden som buffras medan enheten är offline
+        self.offline_buffer_size = int(config.get("offline_buffer_size", 100))
+        
+        # Callbacks
+        self.on_start_callback: Optional[Callable] = None
+        self.on_stop_callback: Optional[Callable] = None
+        self.on_test_callback: Optional[Callable] = None
+        self.on_config_update_callback: Optional[Callable[[Dict], None]] = None
+        self.on_catalog_callback: Optional[Callable] = None
+        
+        # Client (skapas bara om enabled)
+        self.client = None
+        self.connected = False
+        
+        # Lokal schemaläggare för start_at/stop_at och kalenderflöde
+        self.scheduler = CommandScheduler(on_change=self.publish_schedule)
+        # Kalender: hash av senast tillämpade flöde (i minnet; schemat byggs om efter omstart)
+        # och startade händelser (på disk)
+        self._calendar_lock = threading.Lock()
+        self._calendar_hash: Optional[str] = None
+        self._calendar_started: Dict[str, Dict[str, Any]] = self._load_calendar_state()
+        
+        # Nätverkstråd och offline-buffert
+        self._network_thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._connected_event = threading.Event()
+        self._socket_open = False
+        self._connect_attempt = 0
+        self._buffer_lock = threading.Lock()
+        self._offline_buffer: deque = deque()
+        self._dropped_messages = 0
+        # Senaste status (retained) som återpubliceras efter återanslutning
+        self._last_status_payload = json.dumps({"status": "ready"})
+        
+        if not self.enabled:
+            return
+        
+        self.client = self._create_client()
+    
+    def _apply_settings(self, config: Dict[str, Any]):
+        """
+        Sätt anslutningsinställningar och topics från konfiguration.
+        
+        Args:
+            config: Dictionary med MQTT-konfiguration (samma nycklar som
+                get_mqtt_config_from_env)
+        """
         self.broker = config.get("broker", "localhost")
         self.port = int(config.get("port", 1883))
         self.username = config.get("username")
@@ -96,95 +172,260 @@ class MQTTClient:
         
         self.use_tls = config.get("use_tls", False)
         self.tls_insecure = config.get("tls_insecure", False)
-        self.client_id = config.get("client_id", None)
         
         # MQTT topics (genereras från normaliserad prefix)
         self.topic_command = f"{self.topic_prefix}/command"
         self.topic_status = f"{self.topic_prefix}/status"
         self.topic_config = f"{self.topic_prefix}/config"
         self.topic_config_set = f"{self.topic_prefix}/config/set"
+        self.topic_config_response = f"{self.topic_prefix}/config/response"
         self.topic_recording = f"{self.topic_prefix}/recording"
-        
-        # Callbacks
-        self.on_start_callback: Optional[Callable] = None
-        self.on_stop_callback: Optional[Callable] = None
-        self.on_test_callback: Optional[Callable] = None
-        self.on_config_update_callback: Optional[Callable[[Dict], None]] = None
-        
-        # Client (skapas bara om enabled)
-        self.client = None
-        self.connected = False
-        
-        if not self.enabled:
-            return
-        
+        self.topic_incident = f"{self.topic_prefix}/incident"
+        # Standardtopic för kommandokvittenser när avsändaren inte angav response topic
+        self.topic_command_response = f"{self.topic_prefix}/command/response"
+        self.topic_schedule = f"{self.topic_prefix}/schedule"
+        self.topic_schedule_set = f"{self.topic_prefix}/schedule/set"
+    
+    def _settings(self) -> Dict[str, Any]:
+        """Nuvarande anslutningsinställningar (för reconfigure/återställning)"""
+        return {
+            "broker": self.broker,
+            "port": self.port,
+            "username": self.username,
+            "password": self.password,
+            "topic_prefix": self.topic_prefix,
+            "use_tls": self.use_tls,
+            "tls_insecure": self.tls_insecure,
+        }
+    
+    def _create_client(self):
+        """Skapa och konfigurera paho-klient utifrån nuvarande inställningar"""
         # Client (med custom client_id om angiven)
-        if self.client_id:
-            self.client = mqtt.Client(client_id=self.client_id)
+        client_kwargs = {"client_id": self.client_id or ""}
+        if self.use_v5:
+            client_kwargs["protocol"] = mqtt.MQTTv5
         else:
-            self.client = mqtt.Client()
+            client_kwargs["protocol"] = mqtt.MQTTv311
+        # paho-mqtt >= 2.0 kräver explicit callback-API-version
+        if hasattr(mqtt, "CallbackAPIVersion"):
+            client_kwargs["callback_api_version"] = mqtt.CallbackAPIVersion.VERSION1
+        client = mqtt.Client(**client_kwargs)
         
-        self.client.on_connect = self._on_connect
-        self.client.on_message = self._on_message
-        self.client.on_disconnect = self._on_disconnect
+        client.on_connect = self._on_connect
+        client.on_message = self._on_message
+        client.on_disconnect = self._on_disconnect
         
         # TLS/SSL för HiveMQ Cloud och andra säkra brokers
         if self.use_tls:
             import ssl
             if self.tls_insecure:
                 # För testning eller self-signed certifikat
-                self.client.tls_set(cert_reqs=ssl.CERT_NONE)
-                self.client.tls_insecure_set(True)
+                client.tls_set(cert_reqs=ssl.CERT_NONE)
+                client.tls_insecure_set(True)
                 logger.warning("MQTT TLS certificate verification är inaktiverad (insecure mode)")
             else:
                 # Säker TLS med certifikatverifiering
-                self.client.tls_set(cert_reqs=ssl.CERT_REQUIRED)
+                client.tls_set(cert_reqs=ssl.CERT_REQUIRED)
             logger.info("MQTT TLS/SSL aktiverad")
         
         if self.username and self.password:
-            self.client.username_pw_set(self.username, self.password)
-
+            client.username_pw_set(self.username, self.password)
+        return client
+    
+    def reconfigure(self, updates: Dict[str, Any], verify_timeout: float = 30.0) -> bool:
+        """
+        Byt anslutningsinställningar utan att starta om processen.
+        
+        Den gamla anslutningen stängs, en ny klient skapas och ansluts. Om
+        den nya anslutningen inte är uppe inom verify_timeout återställs de
+        tidigare inställningarna, så att en felaktig broker-adress via MQTT
+        inte gör enheten ostyrbar. Blockerar; anropa inte från nätverkstråden.
+        
+        Args:
+            updates: Ändrade inställningar (broker, port, username, password,
+                topic_prefix, use_tls, tls_insecure)
+            verify_timeout: Sekunder att vänta på anslutning (0 = vänta inte)
+            
+        Returns:
+            True om den nya anslutningen kom upp (eller inte verifierades)
+        """
+        if not self.enabled:
+            return False
+        
+        previous = self._settings()
+        self._restart_with(dict(previous, **updates))
+        if verify_timeout <= 0 or self._connected_event.wait(verify_timeout):
+            logger.info(f"MQTT omkonfigurerad: {self.broker}:{self.port} ({self.topic_prefix})")
+            return True
         
+        logger.error("Ny MQTT-konfiguration kunde inte ansluta, återställer tidigare inställningar")
+        self._restart_with(previous)
+        return False
+    
+    def _restart_with(self, settings: Dict[str, Any]):
+        """Stoppa nätverkstråden, byt inställningar och klient och anslut igen"""
+        self._stop_network()
+        self._apply_settings(settings)
+        self.client = self._create_client()
+        self._connect_attempt = 0
+        self.connect()
+    
     def connect(self):
-        """Anslut till MQTT-broker"""
+        """
+        Starta anslutning till MQTT-broker i bakgrunden.
+        
+        Returnerar direkt; DNS-uppslag, TLS-handskakning och eventuella
+        återförsök sker i nätverkstråden så att uppstarten inte fördröjs
+        när brokern är onåbar.
+        """
         if not self.enabled:
             logger.info("MQTT är inte aktiverat")
             return
-            
-        try:
-            logger.info(f"Ansluter till MQTT-broker {self.broker}:{self.port}")
-            self.client.connect(self.broker, self.port, 60)
-            self.client.loop_start()
-        except Exception as e:
-            logger.error(f"Kunde inte ansluta till MQTT-broker: {e}")
-            raise
+        if self._network_thread and self._network_thread.is_alive():
+            return
+        
+        logger.info(f"Ansluter till MQTT-broker {self.broker}:{self.port} (MQTT {self.protocol}) i bakgrunden")
+        # Schemalagda kommandon körs lokalt även när brokern är onåbar
+        self.scheduler.start()
+        self._stop_event.clear()
+        self._network_thread = threading.Thread(target=self._network_loop, name="mqtt-network", daemon=True)
+        self._network_thread.start()
     
     def disconnect(self):
         """Koppla från MQTT-broker"""
         if self.enabled and self.client:
-            self.client.loop_stop()
+            self.scheduler.stop()
+            self._stop_network()
+    
+    def _stop_network(self):
+        """Stäng anslutningen och vänta in nätverkstråden"""
+        self._stop_event.set()
+        try:
             self.client.disconnect()
-            self.connected = False
+        except Exception as e:
+            logger.debug(f"Fel vid frånkoppling: {e}")
+        if self._network_thread and self._network_thread is not threading.current_thread():
+            self._network_thread.join(timeout=5)
+        self._network_thread = None
+        self._socket_open = False
+        self.connected = False
+        self._connected_event.clear()
     
-    def _on_connect(self, client, userdata, flags, rc):
+    def _backoff_delay(self, attempt: int) -> float:
+        """
+        Beräkna väntetid före nästa anslutningsförsök.
+        
+        Exponentiell backoff med "full jitter" så att många enheter som
+        tappar nätet samtidigt inte återansluter i takt mot brokern.
+        
+        Args:
+            attempt: Antal misslyckade försök i rad (0 = första)
+            
+        Returns:
+            Väntetid i sekunder
+        """
+        ceiling = min(self.reconnect_max_delay, self.reconnect_min_delay * (2 ** min(attempt, 16)))
+        return random.uniform(self.reconnect_min_delay, max(self.reconnect_min_delay, ceiling))
+    
+    def _network_loop(self):
+        """Nätverkstråd: anslut, kör paho-loopen och återanslut vid avbrott"""
+        while not self._stop_event.is_set():
+            if not self._socket_open:
+                try:
+                    self.client.connect(self.broker, self.port, self.keepalive)
+                    self._socket_open = True
+                except Exception as e:
+                    delay = self._backoff_delay(self._connect_attempt)
+                    self._connect_attempt += 1
+                    logger.warning(f"Kunde inte ansluta till MQTT-broker ({e}), nytt försök om {delay:.1f} s")
+                    self._stop_event.wait(delay)
+                    continue
+            
+            rc = self.client.loop(timeout=1.0)
+            if rc != mqtt.MQTT_ERR_SUCCESS and not self._stop_event.is_set():
+                # Anslutningen bröts (eller nekades av brokern) - vänta och försök igen
+                self._socket_open = False
+                self.connected = False
+                self._connected_event.clear()
+                delay = self._backoff_delay(self._connect_attempt)
+                self._connect_attempt += 1
+                logger.warning(f"MQTT-anslutningen bröts (rc={rc}), återansluter om {delay:.1f} s")
+                self._stop_event.wait(delay)
+    
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
         """Callback när anslutning till broker upprättas"""
         if rc == 0:
             logger.info("Ansluten till MQTT-broker")
             self.connected = True
-            # Prenumerera på kommandotopics
-            client.subscribe(self.topic_command)
-            client.subscribe(self.topic_config_set)
-            # Publicera initial status
-            self.publish_status("ready")
+            self._connected_event.set()
+            self._connect_attempt = 0
+            # Prenumerera på kommandotopics (görs vid varje anslutning, även återanslutning)
+            client.subscribe(self.topic_command, qos=1)
+            client.subscribe(self.topic_config_set, qos=1)
+            client.subscribe(self.topic_schedule_set, qos=1)
+            # Återpublicera senaste status och skicka det som buffrats offline
+            self.client.publish(self.topic_status, self._last_status_payload, retain=True)
+            self._flush_offline_buffer()
         else:
             logger.error(f"Anslutning till MQTT-broker misslyckades med kod {rc}")
     
-    def _on_disconnect(self, client, userdata, rc):
+    def _on_disconnect(self, client, userdata, rc, properties=None):
         """Callback när anslutningen bryts"""
         self.connected = False
+        self._connected_event.clear()
         if rc != 0:
             logger.warning(f"Oväntad frånkoppling från MQTT-broker: {rc}")
     
+    def _publish(self, topic: str, payload: str, qos: int = 0, retain: bool = False,
+                 buffer: bool = True, properties=None):
+        """
+        Publicera meddelande, eller buffra det om enheten är offline.
+        
+        För retained topics behålls bara det senaste värdet i bufferten,
+        händelser (t.ex. färdiga inspelningar) behålls i ordning.
+        
+        Args:
+            topic: MQTT topic
+            payload: Meddelande
+            qos: QoS-nivå
+            retain: Om meddelandet ska sparas av brokern
+            buffer: Om meddelandet ska buffras när enheten är offline
+            properties: MQTT v5-egenskaper
+        """
+        if not self.enabled:
+            return
+        if self.connected:
+            info = self.client.publish(topic, payload, qos=qos, retain=retain, properties=properties)
+            if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                return
+        if not buffer:
+            return
+        
+        with self._buffer_lock:
+            if retain:
+                # Ersätt tidigare buffrat värde för samma retained topic
+                for entry in list(self._offline_buffer):
+                    if entry[0] == topic and entry[3]:
+                        self._offline_buffer.remove(entry)
+            if len(self._offline_buffer) >= self.offline_buffer_size:
+                self._offline_buffer.popleft()
+                self._dropped_messages += 1
+            self._offline_buffer.append((topic, payload, qos, retain))
+    
+    def _flush_offline_buffer(self):
+        """Skicka meddelanden som buffrats medan enheten var offline"""
+        with self._buffer_lock:
+            pending = list(self._offline_buffer)
+            self._offline_buffer.clear()
+            dropped, self._dropped_messages = self._dropped_messages, 0
+        
+        if dropped:
+            logger.warning(f"{dropped} MQTT-meddelanden kastades medan enheten var offline")
+        if pending:
+            logger.info(f"Skickar {len(pending)} buffrade MQTT-meddelanden")
+        for topic, payload, qos, retain in pending:
+            self.client.publish(topic, payload, qos=qos, retain=retain)
+    
     def _on_message(self, client, userdata, msg):
         """Callback när meddelande tas emot"""
         topic = msg.topic
@@ -194,30 +435,357 @@ class MQTTClient:
         
         try:
             if topic == self.topic_command:
-                self._handle_command(payload)
+                self._handle_command(payload, getattr(msg, "properties", None))
             elif topic == self.topic_config_set:
                 self._handle_config_set(payload)
+            elif topic == self.topic_schedule_set:
+                self._handle_schedule_set(payload)
         except Exception as e:
             logger.error(f"Fel vid hantering av MQTT-meddelande: {e}")
     
-    def _handle_command(self, payload: str):
-        """Hantera kommando från MQTT"""
-        command = payload.lower().strip()
-        
-        if command == "start":
-            logger.info("MQTT kommando: Start inspelning")
-            if self.on_start_callback:
-                self.on_start_callback()
-        elif command == "stop":
-            logger.info("MQTT kommando: Stoppa inspelning")
-            if self.on_stop_callback:
-                self.on_stop_callback()
-        elif command == "test":
-            logger.info("MQTT kommando: Testa nivåer")
-            if self.on_test_callback:
-                self.on_test_callback()
+    def _handle_command(self, payload: str, properties=None):
+        """
+        Hantera kommando från MQTT och skicka kvittens.
+        
+        Kommandot kan vara en enkel text ("start", "stop", "test") eller JSON:
+        
+            {"command": "start", "id": "abc", "params": {"gain": 1.5, "room": "A",
+             "codec": "flac", "max_duration": 3600},
+             "start_at": "2025-11-15T13:00:00+01:00", "stop_at": 1763211600}
+        
+        Kvittensen publiceras till avsändarens response topic (MQTT v5) med
+        samma correlation data, annars till {prefix}/command/response.
+        
+        Args:
+            payload: Kommandotext eller JSON
+            properties: MQTT v5-egenskaper från meddelandet (eller None)
+        """
+        received = time.monotonic()
+        received_at = datetime.now().isoformat()
+        command = "invalid"
+        request_id = None
+        
+        try:
+            request = self._parse_command(payload)
+            command = request["command"]
+            request_id = request.get("id")
+            ok, result = self._dispatch_command(request, properties)
+        except ValueError as e:
+            logger.warning(f"Ogiltigt MQTT kommando: {e}")
+            ok, result = False, str(e)
+        
+        self.publish_command_response(
+            command, ok, result,
+            received_at=received_at,
+            latency_ms=(time.monotonic() - received) * 1000.0,
+            properties=properties,
+            request_id=request_id,
+        )
+    
+    @staticmethod
+    def _parse_command(payload: str) -> Dict[str, Any]:
+        """
+        Tolka kommandopayload (text eller JSON) till ett kommandoobjekt.
+        
+        Raises:
+            ValueError: Vid ogiltig JSON eller saknat kommando
+        """
+        text = payload.strip()
+        if text.startswith("{"):
+            request = json.loads(text)  # JSONDecodeError är en ValueError
+            if not isinstance(request, dict):
+                raise ValueError("JSON-kommandot måste vara ett objekt")
         else:
+            request = {"command": text}
+        request["command"] = str(request.get("command", "")).lower().strip()
+        if not request["command"]:
+            raise ValueError("Kommando saknas")
+        return request
+    
+    def _dispatch_command(self, request: Dict[str, Any], properties=None) -> Tuple[bool, Any]:
+        """
+        Kör eller schemalägg ett tolkat kommando.
+        
+        Returns:
+            Tuple med (ok, resultat)
+            
+        Raises:
+            ValueError: Vid ogiltiga parametrar eller tidsstämplar
+        """
+        command = request["command"]
+        
+        if command == "schedule":
+            return self._apply_calendar(request)
+        if command == "cancel":
+            if request.get("all"):
+                return True, {"cancelled": self.scheduler.cancel_all()}
+            job_id = request.get("job_id")
+            if not job_id:
+                raise ValueError("job_id saknas")
+            return (True, {"cancelled": 1}) if self.scheduler.cancel(job_id) else (False, f"Okänt jobb: {job_id}")
+        if command == "list_schedule":
+            return True, {"jobs": self.scheduler.list_jobs()}
+        if command == "list_recordings":
+            if self.on_catalog_callback is None:
+                return False, "Kommandot stöds inte av enheten"
+            return normalize_result(self.on_catalog_callback(request.get("query")))
+        if command not in ("start", "stop", "test"):
             logger.warning(f"Okänt MQTT kommando: {command}")
+            return False, f"Okänt kommando: {command}"
+        
+        params = validate_params(request.get("params"))
+        start_at = parse_timestamp(request["start_at"]) if request.get("start_at") is not None else None
+        stop_at = parse_timestamp(request["stop_at"]) if request.get("stop_at") is not None else None
+        now = time.time()
+        
+        if command == "stop":
+            # "stop" med stop_at (eller start_at) schemaläggs
+            when = stop_at if stop_at is not None else start_at
+            if when is not None and when > now:
+                job = self._schedule_command("stop", when, {}, properties, request.get("id"))
+                return True, {"scheduled": [job.to_dict()]}
+            return self._run_command("stop", {})
+        
+        if command == "test":
+            return self._run_command("test", {})
+        
+        # start
+        if stop_at is not None and stop_at <= max(now, start_at or now):
+            raise ValueError("stop_at måste ligga efter start_at och i framtiden")
+        scheduled = []
+        if start_at is not None and start_at > now:
+            scheduled.append(self._schedule_command("start", start_at, params, properties, request.get("id")))
+            ok, result = True, None
+        else:
+            ok, result = self._run_command("start", params)
+        if ok and stop_at is not None:
+            scheduled.append(self._schedule_command("stop", stop_at, {}, properties, request.get("id")))
+        if scheduled:
+            result = {"result": result, "scheduled": [job.to_dict() for job in scheduled]}
+        return ok, result
+    
+    def _run_command(self, command: str, params: Dict[str, Any]) -> Tuple[bool, Any]:
+        """
+        Kör kommandocallback direkt.
+        
+        Returns:
+            Tuple med (ok, resultat)
+        """
+        callbacks = {
+            "start": ("Start inspelning", self.on_start_callback),
+            "stop": ("Stoppa inspelning", self.on_stop_callback),
+            "test": ("Testa nivåer", self.on_test_callback),
+        }
+        description, callback = callbacks[command]
+        logger.info(f"MQTT kommando: {description}")
+        if callback is None:
+            return False, "Kommandot stöds inte av enheten"
+        try:
+            if command == "start":
+                return normalize_result(callback(params))
+            return normalize_result(callback())
+        except Exception as e:
+            logger.error(f"Fel vid körning av MQTT kommando {command}: {e}")
+            return False, str(e)
+    
+    def _schedule_command(self, command: str, run_at: float, params: Dict[str, Any],
+                          properties=None, request_id: Optional[str] = None,
+                          source: str = "command", job_id: Optional[str] = None,
+                          on_done: Optional[Callable[[bool], None]] = None):
+        """
+        Schemalägg kommando; när det körs skickas en ny kvittens med job_id.
+        
+        Args:
+            on_done: Anropas med ok när kommandot har körts
+        
+        Returns:
+            Det schemalagda jobbet
+        """
+        job_holder = {}
+        
+        def action():
+            started = time.monotonic()
+            ok, result = self._run_command(command, params)
+            if on_done:
+                on_done(ok)
+            self.publish_command_response(
+                command, ok, result,
+                received_at=datetime.now().isoformat(),
+                latency_ms=(time.monotonic() - started) * 1000.0,
+                properties=properties,
+                request_id=request_id,
+                job_id=job_holder["job"].job_id,
+            )
+        
+        job = self.scheduler.schedule(run_at, action, command, source=source, params=params, job_id=job_id)
+        job_holder["job"] = job
+        return job
+    
+    def _apply_calendar(self, request: Dict[str, Any]) -> Tuple[bool, Any]:
+        """
+        Schemalägg inspelningar från ett kalenderflöde.
+        
+        Format: {"events": [{"id": "m1", "start_at": ..., "stop_at": ...,
+        "params": {...}}], "replace": true}. Med replace (standard) ersätts
+        tidigare kalenderjobb, så att flödet kan skickas om i sin helhet.
+        Pågående möten (start_at passerad, stop_at i framtiden) startas direkt;
+        en händelse utan stop_at kan bara schemaläggas i förväg och hoppas
+        över när start_at passerat. En händelse som redan startats (samma id,
+        start_at och stop_at) startas aldrig igen, även om den stoppats
+        manuellt; bara dess stopp schemaläggs på nytt.
+        
+        Returns:
+            Tuple med (ok, sammanfattning)
+        """
+        events = request.get("events")
+        if not isinstance(events, list):
+            raise ValueError("events måste vara en lista")
+        if request.get("replace", True):
+            self.scheduler.cancel_all(source="calendar")
+        
+        now = time.time()
+        scheduled, skipped = [], []
+        for index, event in enumerate(events):
+            try:
+                if not isinstance(event, dict) or event.get("start_at") is None:
+                    raise ValueError("start_at saknas")
+                event_id = str(event.get("id") or f"event{index}")
+                params = validate_params(event.get("params"))
+                start_at = parse_timestamp(event["start_at"])
+                stop_at = parse_timestamp(event["stop_at"]) if event.get("stop_at") is not None else None
+                if stop_at is not None and stop_at <= max(now, start_at):
+                    skipped.append({"id": event_id, "reason": "passerat"})
+                    continue
+                if stop_at is None and start_at <= now:
+                    # Utan stop_at går det inte att avgöra om mötet pågår
+                    skipped.append({"id": event_id, "reason": "passerat (saknar stop_at)"})
+                    continue
+                fingerprint = {"start_at": start_at, "stop_at": stop_at}
+                with self._calendar_lock:
+                    started = self._calendar_started.get(event_id) == fingerprint
+                jobs = []
+                if not started:
+                    jobs.append(self._schedule_command("start", max(start_at, now), params, source="calendar",
+                                                       job_id=f"{event_id}-start",
+                                                       on_done=self._calendar_started_callback(event_id, fingerprint)))
+                # Redan startat (och kanske stoppat manuellt): bara stoppet schemaläggs igen
+                if stop_at is not None:
+                    jobs.append(self._schedule_command("stop", stop_at, {},
+                                                       source="calendar", job_id=f"{event_id}-stop"))
+                scheduled.extend(job.to_dict() for job in jobs)
+            except ValueError as e:
+                skipped.append({"id": event.get("id") if isinstance(event, dict) else index, "reason": str(e)})
+        
+        logger.info(f"Kalender: {len(scheduled)} jobb schemalagda, {len(skipped)} händelser hoppades över")
+        return True, {"scheduled": scheduled, "skipped": skipped}
+    
+    def _calendar_started_callback(self, event_id: str, fingerprint: Dict[str, Any]) -> Callable[[bool], None]:
+        """on_done för en kalenderstart: kom ihåg att händelsen startats (sparas på disk)"""
+        def done(ok: bool):
+            if not ok:
+                return
+            with self._calendar_lock:
+                self._calendar_started[event_id] = fingerprint
+                self._save_calendar_state()
+        return done
+
+    @staticmethod
+    def _load_calendar_state() -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(CALENDAR_STATE) as f:
+                started = json.load(f).get("started", {})
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, AttributeError) as e:
+            logger.warning(f"Kunde inte läsa kalendertillstånd {CALENDAR_STATE}: {e}")
+            return {}
+        # Händelser som slutat för länge sedan behövs inte längre
+        cutoff = time.time() - CALENDAR_STATE_TTL
+        return {event_id: times for event_id, times in started.items()
+                if isinstance(times, dict) and (times.get("stop_at") or times.get("start_at") or 0) > cutoff}
+
+    def _save_calendar_state(self):
+        """Skriv startade händelser atomiskt (under _calendar_lock)"""
+        path = Path(CALENDAR_STATE)
+        tmp = Path(f"{path}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp.write_text(json.dumps({"started": self._calendar_started}, indent=2))
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Kunde inte spara kalendertillstånd {path}: {e}")
+
+    def _handle_schedule_set(self, payload: str):
+        """
+        Hantera kalenderflöde publicerat på {prefix}/schedule/set (gärna retained).
+        
+        Brokern levererar ett retained flöde igen vid varje återanslutning;
+        ett oförändrat flöde ignoreras då, eftersom jobben redan är schemalagda.
+        """
+        digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        if digest == self._calendar_hash:
+            logger.debug("Kalenderflödet är oförändrat, ignoreras")
+            return
+        try:
+            data = json.loads(payload) if payload.strip() else {"events": []}
+            if isinstance(data, list):
+                data = {"events": data}
+            self._apply_calendar(data)
+            self._calendar_hash = digest
+        except ValueError as e:
+            logger.error(f"Ogiltigt kalenderflöde i schedule/set: {e}")
+    
+    def publish_command_response(self, command: str, ok: bool, result: Any = None,
+                                 received_at: Optional[str] = None,
+                                 latency_ms: Optional[float] = None,
+                                 properties=None,
+                                 request_id: Optional[str] = None,
+                                 job_id: Optional[str] = None):
+        """
+        Publicera strukturerad kvittens för ett kommando.
+        
+        Args:
+            command: Kommandot som kvitteras
+            ok: True om kommandot accepterades
+            result: Resultat eller felmeddelande från callbacken
+            received_at: Tidpunkt då kommandot togs emot (ISO 8601)
+            latency_ms: Tid från mottagning till färdig hantering
+            properties: MQTT v5-egenskaper från kommandot (response topic, correlation data)
+            request_id: "id" från JSON-kommandot (korrelation utan MQTT v5)
+            job_id: ID för schemalagt jobb när kvittensen gäller en schemalagd körning
+        """
+        if not self.enabled:
+            return
+        
+        response_topic = getattr(properties, "ResponseTopic", None) or self.topic_command_response
+        correlation_data = getattr(properties, "CorrelationData", None)
+        
+        data = {
+            "command": command,
+            "status": "accepted" if ok else "rejected",
+            "result": result,
+            "received_at": received_at,
+            "latency_ms": round(latency_ms, 2) if latency_ms is not None else None,
+            "device": self.topic_prefix,
+        }
+        if request_id is not None:
+            data["id"] = request_id
+        if job_id is not None:
+            data["job_id"] = job_id
+        if correlation_data is not None:
+            # Spegla correlation data även i payload för klienter utan v5-stöd
+            data["correlation_id"] = correlation_data.decode("utf-8", errors="replace")
+        
+        publish_properties = None
+        if self.use_v5:
+            publish_properties = Properties(PacketTypes.PUBLISH)
+            publish_properties.ContentType = "application/json"
+            if correlation_data is not None:
+                publish_properties.CorrelationData = correlation_data
+        
+        payload = json.dumps(data, default=str)
+        # Kvittenser buffras inte - en sen kvittens är inte meningsfull
+        self._publish(response_topic, payload, qos=1, buffer=False, properties=publish_properties)
     
     def _handle_config_set(self, payload: str):
         """Hantera konfigurationsuppdatering från MQTT"""
@@ -237,7 +805,7 @@ class MQTTClient:
             status: Statustext (t.ex. "ready", "recording", "uploading")
             extra_data: Extra data att inkludera i statusmeddelandet
         """
-        if not self.enabled or not self.connected:
+        if not self.enabled:
             return
             
         data = {"status": status}
@@ -245,7 +813,8 @@ class MQTTClient:
             data.update(extra_data)
         
         payload = json.dumps(data)
-        self.client.publish(self.topic_status, payload, retain=True)
+        self._last_status_payload = payload
+        self._publish(self.topic_status, payload, qos=1, retain=True)
     
     def publish_recording_complete(self, filename: str, upload_result: str):
         """
@@ -255,16 +824,43 @@ class MQTTClient:
             filename: Namn på inspelad fil
             upload_result: Resultat från uppladdning
         """
-        if not self.enabled or not self.connected:
+        if not self.enabled:
             return
         
         data = {
             "filename": filename,
             "upload_result": upload_result,
-            "timestamp": None  # Kan läggas till om behövs
+            # Tidsstämpel sätts vid händelsen, inte vid (eventuellt fördröjd) leverans
+            "timestamp": datetime.now().isoformat()
         }
         payload = json.dumps(data)
-        self.client.publish(self.topic_recording, payload)
+        self._publish(self.topic_recording, payload, qos=1)
+    
+    def publish_incident(self, incident: Dict[str, Any]):
+        """
+        Publicera en incident för en inspelningsström (avbrott, omstart, överspill).
+
+        Args:
+            incident: {"stream", "device", "reason", ...} från inspelningskärnan
+        """
+        if not self.enabled:
+            return
+
+        data = {**incident, "timestamp": datetime.now().isoformat()}
+        self._publish(self.topic_incident, json.dumps(data), qos=1)
+
+    def publish_schedule(self, jobs):
+        """
+        Publicera aktuellt schema (retained).
+        
+        Args:
+            jobs: Lista med schemalagda jobb
+        """
+        if not self.enabled:
+            return
+        
+        payload = json.dumps({"jobs": jobs})
+        self._publish(self.topic_schedule, payload, qos=1, retain=True)
     
     def publish_config(self, config: Dict[str, Any]):
         """
@@ -273,25 +869,47 @@ class MQTTClient:
         Args:
             config: Dictionary med konfigurationsparametrar
         """
-        if not self.enabled or not self.connected:
+        if not self.enabled:
             return
         
         payload = json.dumps(config)
-        self.client.publish(self.topic_config, payload, retain=True)
+        self._publish(self.topic_config, payload, qos=1, retain=True)
+    
+    def publish_config_response(self, ok: bool, updated, errors: Dict[str, str]):
+        """
+        Publicera resultat av en konfigurationsuppdatering.
+        
+        Args:
+            ok: True om alla värden var giltiga
+            updated: Nycklar som tillämpades
+            errors: Valideringsfel per nyckel
+        """
+        if not self.enabled:
+            return
+        
+        payload = json.dumps({"ok": ok, "updated": list(updated), "errors": errors})
+        self._publish(self.topic_config_response, payload, qos=1, buffer=False)
     
     def set_callbacks(self, 
                      on_start: Optional[Callable] = None,
                      on_stop: Optional[Callable] = None, 
                      on_test: Optional[Callable] = None,
-                     on_config_update: Optional[Callable[[Dict], None]] = None):
+                     on_config_update: Optional[Callable[[Dict], None]] = None,
+                     on_catalog: Optional[Callable] = None):
         """
         Sätt callback-funktioner för kommandohantering.
         
+        Kommandocallbacks får returnera None, en bool eller (ok, resultat);
+        returvärdet skickas tillbaka i kommandokvittensen.
+        
         Args:
-            on_start: Funktion att anropa vid start-kommando
+            on_start: Funktion att anropa vid start-kommando, får en dict med
+                validerade parametrar (gain, gains, room, codec, max_duration)
             on_stop: Funktion att anropa vid stopp-kommando
             on_test: Funktion att anropa vid test-kommando
             on_config_update: Funktion att anropa vid konfigurationsuppdatering
+            on_catalog: Funktion som besvarar list_recordings, får frågeobjektet
+                och returnerar (ok, resultat)
         """
         if on_start:
             self.on_start_callback = on_start
@@ -301,6 +919,8 @@ class MQTTClient:
             self.on_test_callback = on_test
         if on_config_update:
             self.on_config_update_callback = on_config_update
+        if on_catalog:
+            self.on_catalog_callback = on_catalog
 
 
 def get_mqtt_config_from_env() -> Dict[str, Any]:
@@ -320,4 +940,8 @@ def get_mqtt_config_from_env() -> Dict[str, Any]:
         "use_tls": os.getenv("MQTT_USE_TLS", "false").lower() in ("true", "1", "yes"),
         "tls_insecure": os.getenv("MQTT_TLS_INSECURE", "false").lower() in ("true", "1", "yes"),
         "client_id": os.getenv("MQTT_CLIENT_ID"),
+        "protocol": os.getenv("MQTT_PROTOCOL", "3.1.1"),
+        "reconnect_min_delay": float(os.getenv("MQTT_RECONNECT_MIN_DELAY", "1")),
+        "reconnect_max_delay": float(os.getenv("MQTT_RECONNECT_MAX_DELAY", "120")),
+        "offline_buffer_size": int(os.getenv("MQTT_OFFLINE_BUFFER", "100")),
     }
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Strömmande multipart/form-data för HTTP- och n8n-uppladdningar.
+
+requests bygger hela kroppen i minnet när files= används, vilket för en
+lång inspelning innebär en allokering på flera hundra MB på en Pi med
+1–2 GB RAM. MultipartEncoder är i stället en fil-liknande kropp med känd
+längd (Content-Length) som läser filerna i block när den skickas, så att
+minnesanvändningen är konstant oavsett filens storlek.
+"""
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+# Läsblock från fil (och storlek på block som lämnas till http.client)
+UPLOAD_CHUNK = 64 * 1024
+
+# Fil-del: (filnamn, källa, MIME-typ, extra headers för delen). Källan är en
+# sökväg eller en ström med read() och attributet size (t.ex. fanout.TeeStream)
+FilePart = Tuple[str, Any, str, Optional[Dict[str, str]]]
+
+
+def _quote(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\r", "").replace("\n", "")
+
+
+class MultipartEncoder:
+    """
+    multipart/form-data-kropp som läses i block.
+
+    Skickas med requests.post(url, data=encoder, headers={"Content-Type":
+    encoder.content_type}); requests sätter Content-Length från len().
+    Fälten skrivs före filerna, i samma ordning som requests använder.
+    """
+
+    def __init__(self, fields: Optional[Dict[str, str]] = None, files: Optional[Dict[str, FilePart]] = None,
+                 boundary: Optional[str] = None, chunk_size: int = UPLOAD_CHUNK):
+        """
+        Args:
+            fields: Textfält (namn -> värde)
+            files: Filer (fältnamn -> (filnamn, sökväg, MIME-typ, headers))
+            boundary: Gräns mellan delar (slumpas om None)
+            chunk_size: Blockstorlek vid läsning
+        """
+        self.boundary = boundary or uuid.uuid4().hex
+        self.chunk_size = chunk_size
+        # Delar: bytes eller (källa, storlek) för filinnehåll
+        self._segments: List[Union[bytes, Tuple[Any, int]]] = []
+        for name, value in (fields or {}).items():
+            self._segments.append(self._header(name) + b"\r\n" + str(value).encode("utf-8") + b"\r\n")
+        for name, (filename, source, content_type, headers) in (files or {}).items():
+            if hasattr(source, "read"):
+                size = source.size
+            else:
+                source = Path(source)
+                size = source.stat().st_size
+            extra = {"Content-Type": content_type, **(headers or {})}
+            self._segments.append(self._header(name, filename, extra) + b"\r\n")
+            self._segments.append((source, size))
+            self._segments.append(b"\r\n")
+        self._segments.append(f"--{self.boundary}--\r\n".encode("ascii"))
+        self.length = sum(len(s) if isinstance(s, bytes) else s[1] for s in self._segments)
+        self._chunks = self._generate()
+        self._buffer = bytearray()
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def _header(self, name: str, filename: Optional[str] = None, headers: Optional[Dict[str, str]] = None) -> bytes:
+        disposition = f'form-data; name="{_quote(name)}"'
+        if filename is not None:
+            disposition += f'; filename="{_quote(filename)}"'
+        lines = [f"--{self.boundary}", f"Content-Disposition: {disposition}"]
+        lines += [f"{key}: {value}" for key, value in (headers or {}).items()]
+        return ("\r\n".join(lines) + "\r\n").encode("utf-8")
+
+    def _generate(self) -> Iterator[bytes]:
+        for segment in self._segments:
+            if isinstance(segment, bytes):
+                yield segment
+                continue
+            source, size = segment
+            if hasattr(source, "read"):
+                yield from self._read_exact(source, size, "ström")
+            else:
+                with open(source, "rb") as f:
+                    yield from self._read_exact(f, size, source)
+
+    def _read_exact(self, f, size: int, name) -> Iterator[bytes]:
+        remaining = size
+        while remaining > 0:
+            chunk = f.read(min(self.chunk_size, remaining))
+            if not chunk:
+                # Content-Length är redan skickat; en kortare kropp vore trasig
+                raise IOError(f"Filen ändrades under uppladdning: {name}")
+            remaining -= len(chunk)
+            yield chunk
+
+    def __len__(self) -> int:
+        return self.length
+
+    def read(self, size: int = -1) -> bytes:
+        """Läs högst size byte (-1 = resten; används inte av requests)"""
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def __iter__(self) -> Iterator[bytes]:
+        return iter(lambda: self.read(self.chunk_size), b"")
+
+    def close(self):
+        self._chunks.close()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Vågformstoppar och spektrogram för granskningsverktyg.
+
+Räknas fram under kodningen: ffmpeg delar det förbättrade ljudet
+(asplit) till en extra utgång med mono 16 bit i PEAKS_RATE Hz på ett
+eget rör, som läses av en tråd här medan den kodade filen skrivs. WAV-
+filen läses alltså bara en gång och topparna visar samma ljud som laddas
+upp (efter gain och normalisering).
+
+Med PEAKS_ENABLED=true (standard av) laddas resultatet upp bredvid
+inspelningen, som egna filer till samma mål:
+
+- <inspelning>.peaks.json.gz: min/max per pixel i flera upplösningar.
+  Varje nivå har samma format som audiowaveforms JSON (version 2,
+  8 bitar), så en nivå kan ges direkt till t.ex. peaks.js. En timmes
+  möte blir några hundra kB.
+- <inspelning>.spectrogram.png (PEAKS_SPECTROGRAM=true, kräver Pillow):
+  en liten översiktsbild av hela mötet, 0 till PEAKS_RATE/2 Hz.
+"""
+import os
+import gzip
+import json
+import wave
+import logging
+import threading
+from pathlib import Path
+from typing import Optional, List, Dict, Any
+
+import numpy as np
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+PEAKS_ENABLED = os.getenv("PEAKS_ENABLED", "false").lower() in ("true", "1", "yes")
+# Samplingsfrekvens för topparna, sampel per pixel i den finaste nivån och antal nivåer (×4 per nivå)
+PEAKS_RATE = int(os.getenv("PEAKS_RATE", "8000"))
+PEAKS_SAMPLES_PER_PIXEL = int(os.getenv("PEAKS_SAMPLES_PER_PIXEL", "256"))
+PEAKS_LEVELS = int(os.getenv("PEAKS_LEVELS", "4"))
+PEAKS_SPECTROGRAM = os.getenv("PEAKS_SPECTROGRAM", "false").lower() in ("true", "1", "yes")
+# Största bredd (hela FFT-block per kolumn) och höjd i pixlar
+SPECTROGRAM_WIDTH = int(os.getenv("SPECTROGRAM_WIDTH", "1024"))
+SPECTROGRAM_HEIGHT = int(os.getenv("SPECTROGRAM_HEIGHT", "128"))
+
+PEAKS_SUFFIX = ".peaks.json.gz"
+SPECTROGRAM_SUFFIX = ".spectrogram.png"
+FORMAT_VERSION = 1
+
+# Läsblock från ffmpeg (sampel à 2 byte), nivåfaktor och dynamik i spektrogrammet
+READ_CHUNK = 64 * 1024
+LEVEL_FACTOR = 4
+SPECTROGRAM_RANGE_DB = 80.0
+# Färgskala för spektrogrammet (svart → lila → orange → gul)
+_COLORMAP = np.array([[0, 0, 4], [80, 18, 123], [182, 54, 121], [251, 136, 97], [252, 253, 191]], dtype=float)
+
+
+class PeaksBuilder:
+    """Min/max per pixel, matas med int16-block i ordning"""
+
+    def __init__(self, samplerate: int = PEAKS_RATE, samples_per_pixel: int = PEAKS_SAMPLES_PER_PIXEL,
+                 levels: int = PEAKS_LEVELS):
+        self.samplerate = samplerate
+        self.samples_per_pixel = max(1, samples_per_pixel)
+        self.levels = max(1, levels)
+        self.samples = 0
+        self._pending = np.zeros(0, dtype=np.int16)
+        self._mins: List[np.ndarray] = []
+        self._maxs: List[np.ndarray] = []
+
+    def feed(self, samples: np.ndarray):
+        self.samples += len(samples)
+        data = np.concatenate([self._pending, samples]) if len(self._pending) else samples
+        whole = len(data) // self.samples_per_pixel * self.samples_per_pixel
+        if whole:
+            blocks = data[:whole].reshape(-1, self.samples_per_pixel)
+            self._mins.append(blocks.min(axis=1))
+            self._maxs.append(blocks.max(axis=1))
+        self._pending = data[whole:].copy()
+
+    @staticmethod
+    def _level(mins: np.ndarray, maxs: np.ndarray, samplerate: int, samples_per_pixel: int) -> Dict[str, Any]:
+        # 16 → 8 bitar; min och max varvas som i audiowaveform
+        data = np.empty(2 * len(mins), dtype=np.int8)
+        data[0::2] = mins >> 8
+        data[1::2] = maxs >> 8
+        return {
+            "version": 2,
+            "channels": 1,
+            "sample_rate": samplerate,
+            "samples_per_pixel": samples_per_pixel,
+            "bits": 8,
+            "length": len(mins),
+            "data": data.tolist(),
+        }
+
+    def result(self) -> Dict[str, Any]:
+        mins, maxs = list(self._mins), list(self._maxs)
+        if len(self._pending):
+            # Sista, ofullständiga pixeln
+            mins.append(self._pending.min(keepdims=True))
+            maxs.append(self._pending.max(keepdims=True))
+        mins = np.concatenate(mins) if mins else np.zeros(0, dtype=np.int16)
+        maxs = np.concatenate(maxs) if maxs else np.zeros(0, dtype=np.int16)
+        levels = []
+        spp = self.samples_per_pixel
+        for _ in range(self.levels):
+            levels.append(self._level(mins, maxs, self.samplerate, spp))
+            if len(mins) <= 1:
+                break
+            # Grövre nivå: min/max över LEVEL_FACTOR pixlar
+            pad = -len(mins) % LEVEL_FACTOR
+            mins = np.pad(mins, (0, pad), mode="edge").reshape(-1, LEVEL_FACTOR).min(axis=1)
+            maxs = np.pad(maxs, (0, pad), mode="edge").reshape(-1, LEVEL_FACTOR).max(axis=1)
+            spp *= LEVEL_FACTOR
+        return {
+            "format": "meetrec-peaks",
+            "version": FORMAT_VERSION,
+            "duration_s": round(self.samples / self.samplerate, 3),
+            "levels": levels,
+        }
+
+
+class SpectrogramBuilder:
+    """Medelvärdesbildat effektspektrum per kolumn; kolumnbredden bestäms av längden"""
+
+    def __init__(self, total_samples: int, width: int = SPECTROGRAM_WIDTH, height: int = SPECTROGRAM_HEIGHT):
+        self.fft_size = 2 * height
+        self.height = height
+        self.width = max(1, min(width, total_samples // self.fft_size))
+        # Hela FFT-block per kolumn, så att alla kolumner räknas lika
+        self.frames_per_column = max(1, -(-total_samples // (self.width * self.fft_size)))
+        self.column_samples = self.frames_per_column * self.fft_size
+        self._window = np.hanning(self.fft_size).astype(np.float32)
+        self._pending = np.zeros(0, dtype=np.int16)
+        self._columns: List[np.ndarray] = []
+
+    def _column(self, samples: np.ndarray):
+        frames = samples.reshape(-1, self.fft_size).astype(np.float32) * self._window
+        power = np.abs(np.fft.rfft(frames, axis=1)[:, :self.height]) ** 2
+        self._columns.append(10 * np.log10(power.mean(axis=0) + 1e-3))
+
+    def feed(self, samples: np.ndarray):
+        data = np.concatenate([self._pending, samples]) if len(self._pending) else samples
+        offset = 0
+        while len(data) - offset >= self.column_samples and len(self._columns) < self.width:
+            self._column(data[offset:offset + self.column_samples])
+            offset += self.column_samples
+        self._pending = data[offset:].copy() if len(self._columns) < self.width else self._pending[:0]
+
+    def write_png(self, path: Path) -> Optional[Path]:
+        usable = len(self._pending) // self.fft_size * self.fft_size
+        if usable and len(self._columns) < self.width:
+            self._column(self._pending[:usable])
+        if not self._columns:
+            return None
+        db = np.stack(self._columns, axis=1)[::-1]   # Låga frekvenser nederst
+        top = db.max()
+        level = np.clip((db - (top - SPECTROGRAM_RANGE_DB)) / SPECTROGRAM_RANGE_DB, 0.0, 1.0)
+        anchors = np.linspace(0.0, 1.0, len(_COLORMAP))
+        rgb = np.stack([np.interp(level, anchors, _COLORMAP[:, c]) for c in range(3)], axis=-1)
+        tmp = Path(f"{path}.tmp")
+        Image.fromarray(rgb.astype(np.uint8), "RGB").save(tmp, format="PNG", optimize=True)
+        os.replace(tmp, path)
+        return path
+
+
+def peaks_path(wav_path: Path) -> Path:
+    return wav_path.with_name(wav_path.stem + PEAKS_SUFFIX)
+
+
+def spectrogram_path(wav_path: Path) -> Path:
+    return wav_path.with_name(wav_path.stem + SPECTROGRAM_SUFFIX)
+
+
+def peaks_sidecars(wav_path: Path) -> Dict[str, Path]:
+    """Befintliga sidofiler för en inspelning: {"peaks": ..., "spectrogram": ...}"""
+    files = {"peaks": peaks_path(wav_path), "spectrogram": spectrogram_path(wav_path)}
+    return {kind: path for kind, path in files.items() if path.exists()}
+
+
+def _wav_samples(wav_path: Path, samplerate: int) -> int:
+    """Inspelningens längd i sampel vid samplerate (0 om okänd)"""
+    try:
+        with wave.open(str(wav_path), "rb") as w:
+            return int(w.getnframes() * samplerate / w.getframerate())
+    except (wave.Error, OSError, EOFError):
+        return 0
+
+
+class PeaksTap:
+    """
+    Läser ffmpeg:s extra utgång i en tråd och bygger toppar (och spektrogram).
+
+    Fel i beräkningen loggas men röret töms ändå, så att ffmpeg aldrig
+    blockeras och kodningen fortsätter.
+    """
+
+    def __init__(self, wav_path: Path, spectrogram: bool = PEAKS_SPECTROGRAM, samplerate: int = PEAKS_RATE):
+        self.wav_path = Path(wav_path)
+        self.samplerate = samplerate
+        self.peaks = PeaksBuilder(samplerate)
+        self.spectrogram = None
+        if spectrogram and not PIL_AVAILABLE:
+            logger.warning("PEAKS_SPECTROGRAM kräver Pillow (pip install pillow)")
+        elif spectrogram:
+            total = _wav_samples(self.wav_path, samplerate)
+            if total:
+                self.spectrogram = SpectrogramBuilder(total)
+        self.error: Optional[Exception] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def output_args(self, fd: int, label: str = "[peaks]") -> List[str]:
+        """ffmpeg-argument för den extra utgången till filbeskrivaren fd"""
+        return ["-map", label, "-ac", "1", "-ar", str(self.samplerate), "-f", "s16le", f"pipe:{fd}"]
+
+    def start(self, fd: int):
+        self._thread = threading.Thread(target=self._read, args=(fd,), name="peaks", daemon=True)
+        self._thread.start()
+
+    def _read(self, fd: int):
+        odd = b""
+        with os.fdopen(fd, "rb") as pipe:
+            for chunk in iter(lambda: pipe.read(READ_CHUNK), b""):
+                if self.error:
+                    continue
+                try:
+                    chunk = odd + chunk
+                    odd = chunk[len(chunk) & ~1:]
+                    samples = np.frombuffer(chunk[:len(chunk) & ~1], dtype="<i2")
+                    self.peaks.feed(samples)
+                    if self.spectrogram:
+                        self.spectrogram.feed(samples)
+                except Exception as e:
+                    self.error = e
+                    logger.warning(f"Vågformstoppar kunde inte beräknas: {e}")
+
+    def join(self):
+        if self._thread:
+            self._thread.join()
+
+    def write(self) -> List[Path]:
+        """Skriv sidofilerna bredvid inspelningen (efter join)"""
+        if self.error or not self.peaks.samples:
+            return []
+        path = peaks_path(self.wav_path)
+        tmp = Path(f"{path}.tmp")
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump(self.peaks.result(), f, separators=(",", ":"))
+        os.replace(tmp, path)
+        written = [path]
+        if self.spectrogram:
+            try:
+                png = self.spectrogram.write_png(spectrogram_path(self.wav_path))
+                if png:
+                    written.append(png)
+            except Exception as e:
+                logger.warning(f"Spektrogram kunde inte skapas: {e}")
+        logger.info(f"Vågformstoppar: {self.peaks.samples / self.samplerate:.0f} s → "
+                    f"{', '.join(p.name for p in written)}")
+        return written
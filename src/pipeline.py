@@ -0,0 +1,524 @@
+#!/usr/bin/env python3
+"""
+Efterbearbetning av inspelningar: konvertering och uppladdning.
+
+Fristående från GUI:t så att samma logik kan användas av den grafiska
+appen, den huvudlösa tjänsten (meetrec_daemon.py) och verktyg.
+"""
+import os, time, logging, threading, subprocess
+from pathlib import Path
+from datetime import datetime
+
+from integrity import HashingWriter, UPLOADS, digest_for
+from multipart import MultipartEncoder
+from fanout import fan_out
+from priority import THROTTLE, job_command, apply_job_priority
+from peaks import PEAKS_ENABLED, PeaksTap, peaks_sidecars
+from features import SIDECAR_SUFFIX
+from capture_watchdog import gap_sidecars
+from encryption import ENCRYPTION_ENABLED, Encryptor, EncryptingWriter, encrypted_path, load_device_key
+
+logger = logging.getLogger(__name__)
+
+# ========= Konfig =========
+AUDIO_DIR     = Path.home() / "meet_recordings"
+AUDIO_DIR.mkdir(exist_ok=True)
+
+AUDIO_CODEC   = os.getenv("AUDIO_CODEC", "flac").lower()  # "flac" | "opus"
+
+# Codecs som stöds vid konvertering: namn -> (filändelse, ffmpeg-argument, MIME-typ, ffmpeg-format)
+AUDIO_CODECS = {
+    "flac": (".flac", ["-compression_level", "5"], "audio/flac", "flac"),
+    "opus": (".opus", ["-c:a", "libopus", "-b:a", "32k", "-application", "voip"], "audio/ogg", "opus"),
+}
+
+# Läsblock från ffmpeg:s utdata
+ENCODE_CHUNK = 256 * 1024
+
+# MIME-typer för övriga filer som laddas upp bredvid ljudet (t.ex. features-filen)
+SIDECAR_TYPES = {".gz": "application/gzip", ".json": "application/json", ".png": "image/png"}
+
+# Uppladdning (miljövariabler)
+UPLOAD_TARGET = os.getenv("UPLOAD_TARGET", "n8n").lower()   # ett mål eller flera, t.ex. "s3,n8n"
+UPLOAD_TARGETS = ("s3", "http", "n8n")
+# Extra försök per mål som misslyckas, med fördubblad väntetid (sekunder)
+UPLOAD_RETRIES = int(os.getenv("UPLOAD_RETRIES", "2"))
+UPLOAD_RETRY_DELAY = float(os.getenv("UPLOAD_RETRY_DELAY", "5"))
+AWS_REGION    = os.getenv("AWS_REGION", "eu-north-1")
+S3_BUCKET     = os.getenv("S3_BUCKET")
+S3_ENDPOINT   = os.getenv("S3_ENDPOINT_URL")
+# Felkoder från head_object som betyder att objektet inte finns
+S3_NOT_FOUND  = ("404", "NoSuchKey", "NotFound")
+HTTP_UPLOAD_URL   = os.getenv("HTTP_UPLOAD_URL")
+HTTP_AUTH_HEADER  = os.getenv("HTTP_AUTH_HEADER")
+N8N_WEBHOOK_URL   = os.getenv("N8N_WEBHOOK_URL")
+N8N_AUTH_HEADER   = os.getenv("N8N_AUTH_HEADER")
+
+# ---- Google Drive ----
+DRIVE_AUTH_TYPE = os.getenv("DRIVE_AUTH_TYPE", "service_account").lower()  # "service_account" | "oauth"
+DRIVE_FOLDER_ID = os.getenv("DRIVE_FOLDER_ID", "")
+DRIVE_SERVICE_ACCOUNT_JSON = os.getenv("DRIVE_SERVICE_ACCOUNT_JSON")  # path till SA.json
+DRIVE_CLIENT_SECRETS = os.getenv("DRIVE_CLIENT_SECRETS")              # path till OAuth client_secret.json
+DRIVE_TOKEN_PATH = os.getenv("DRIVE_TOKEN_PATH", str(Path.home()/ "meetrec" / "token.json"))
+DRIVE_SCOPES = ["https://www.googleapis.com/auth/drive.file"]
+_drive_service = None   # cachead klient
+
+def get_drive_service():
+    global _drive_service
+    if _drive_service:
+        return _drive_service
+
+    # Importeras först när Drive används - google-biblioteken tar flera
+    # sekunder att ladda på en Raspberry Pi
+    from googleapiclient.discovery import build
+    from google.oauth2.service_account import Credentials as SACredentials
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials as OAuthCredentials
+
+    if DRIVE_AUTH_TYPE == "service_account":
+        if not DRIVE_SERVICE_ACCOUNT_JSON or not Path(DRIVE_SERVICE_ACCOUNT_JSON).exists():
+            raise RuntimeError("Saknar service account JSON (DRIVE_SERVICE_ACCOUNT_JSON).")
+        creds = SACredentials.from_service_account_file(
+            DRIVE_SERVICE_ACCOUNT_JSON, scopes=DRIVE_SCOPES
+        )
+        _drive_service = build("drive", "v3", credentials=creds)
+        return _drive_service
+
+    elif DRIVE_AUTH_TYPE == "oauth":
+        creds = None
+        if Path(DRIVE_TOKEN_PATH).exists():
+            creds = OAuthCredentials.from_authorized_user_file(DRIVE_TOKEN_PATH, DRIVE_SCOPES)
+        if not creds or not creds.valid:
+            if creds and creds.expired and creds.refresh_token:
+                creds.refresh(Request())
+            else:
+                from google_auth_oauthlib.flow import InstalledAppFlow
+                if not DRIVE_CLIENT_SECRETS or not Path(DRIVE_CLIENT_SECRETS).exists():
+                    raise RuntimeError("Saknar CLIENT_SECRETS (DRIVE_CLIENT_SECRETS).")
+                flow = InstalledAppFlow.from_client_secrets_file(DRIVE_CLIENT_SECRETS, DRIVE_SCOPES)
+                creds = flow.run_console()  # visar URL i terminalen
+            Path(DRIVE_TOKEN_PATH).parent.mkdir(parents=True, exist_ok=True)
+            with open(DRIVE_TOKEN_PATH, "w") as f:
+                f.write(creds.to_json())
+        _drive_service = build("drive", "v3", credentials=creds)
+        return _drive_service
+
+    else:
+        raise RuntimeError(f"Okänt DRIVE_AUTH_TYPE: {DRIVE_AUTH_TYPE}")
+
+# ========= Hjälp =========
+def ts_name():
+    return datetime.now().strftime("%Y%m%d-%H%M%S")
+
+def human_duration(sec):
+    m, s = divmod(int(sec), 60)
+    h, m = divmod(m, 60)
+    return f"{h:02d}:{m:02d}:{s:02d}"
+
+def mime_type_for(path: Path) -> str:
+    """MIME-typ för en kodad ljudfil utifrån filändelsen"""
+    for suffix, _, mime, _ in AUDIO_CODECS.values():
+        if path.suffix == suffix:
+            return mime
+    return SIDECAR_TYPES.get(path.suffix, "application/octet-stream")
+
+def wav_to_flac(wav_path: Path, gain: float = 1.0):
+    """
+    Konvertera WAV till FLAC med ljudförbättringar.
+    
+    Se encode_audio för detaljer.
+    """
+    return encode_audio(wav_path, gain=gain, codec="flac")
+
+def encode_audio(wav_path: Path, gain: float = 1.0, codec: str = "flac", channel: int = None,
+                 peaks: bool = PEAKS_ENABLED, encrypt: bool = ENCRYPTION_ENABLED):
+    """
+    Konvertera WAV till komprimerat format med ljudförbättringar.
+    
+    Ljudförbättringar:
+    - Högpassfilter (150 Hz) för att reducera eko och lågfrekvent brus
+    - Volymförstärkning baserat på gain-parameter
+    - Ljudnormalisering för att optimera ljudnivån
+    
+    Args:
+        wav_path: Sökväg till WAV-filen
+        gain: Volymförstärkning (1.0 = normal, 2.0 = dubbel, etc.)
+        codec: Codec enligt AUDIO_CODECS ("flac" eller "opus")
+        channel: Kanal att behålla från en flerkanalsinspelning (None = alla)
+        peaks: Skriv även vågformstoppar (och ev. spektrogram) i samma körning (se peaks.py)
+        encrypt: Kryptera filen medan den skrivs (<fil>.enc, se encryption.py)
+    
+    Returns:
+        Tuple med (ok, flac_path, meddelande)
+    """
+    if codec not in AUDIO_CODECS:
+        return False, None, f"Okänd codec: {codec}"
+    suffix, codec_args, _, muxer = AUDIO_CODECS[codec]
+    flac_path = wav_path.with_suffix(suffix)
+    encryptor = None
+    if encrypt:
+        # Klartexten skrivs aldrig till disk; hellre fel än okrypterad uppladdning
+        try:
+            encryptor = Encryptor(load_device_key())
+        except Exception as e:
+            return False, None, f"Kryptering misslyckades: {e}"
+        flac_path = encrypted_path(flac_path)
+    
+    # Bygg ffmpeg-filter för ljudförbättring
+    audio_filters = []
+    
+    # Flerkanalsinspelning: ladda upp en kanal (t.ex. ReSpeakers bearbetade kanal 0)
+    if channel is not None:
+        audio_filters.append(f"pan=mono|c0=c{int(channel)}")
+    
+    # Högpassfilter för att reducera eko och lågfrekvent brus (150 Hz cutoff)
+    # Detta hjälper till att ta bort rumsakustik och eko
+    audio_filters.append("highpass=f=150")
+    
+    # Volymförstärkning om gain != 1.0
+    if gain != 1.0:
+        audio_filters.append(f"volume={gain}")
+    
+    # Normalisering för att optimera ljudnivån utan klippning
+    # loudnorm är en standardbaserad ljudnormalisering (EBU R128)
+    # I=-16: Målnivå för integrerad ljudstyrka (-16 LUFS, bra för tal)
+    # TP=-1.5: True Peak max nivå (-1.5 dB, förhindrar klippning)
+    # LRA=11: Loudness Range (11 LU, lämpligt för talat innehåll)
+    audio_filters.append("loudnorm=I=-16:TP=-1.5:LRA=11")
+    
+    filter_chain = ",".join(audio_filters)
+    
+    # ffmpeg skriver till en pipe; filen skrivs och hashas här i samma svep
+    # (se integrity.py), så uppladdningen behöver inte läsa om den
+    cmd = [
+        "ffmpeg", "-y",
+        "-i", str(wav_path),
+        "-af", filter_chain,
+        *codec_args,
+        "-f", muxer, "pipe:1"
+    ]
+    
+    # Vågformstoppar: samma förbättrade ljud delas till ett extra rör som läses i en tråd
+    tap = PeaksTap(wav_path) if peaks else None
+    pass_fds = ()
+    if tap:
+        read_fd, write_fd = os.pipe()
+        pass_fds = (write_fd,)
+        cmd = [
+            "ffmpeg", "-y",
+            "-i", str(wav_path),
+            "-filter_complex", f"[0:a]{filter_chain},asplit=2[out][peaks]",
+            "-map", "[out]", *codec_args,
+            "-f", muxer, "pipe:1",
+            *tap.output_args(write_fd)
+        ]
+    
+    try:
+        # Lägre CPU- och I/O-prioritet än inspelningen (se priority.py)
+        proc = subprocess.Popen(job_command(cmd), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                pass_fds=pass_fds)
+    except FileNotFoundError:
+        if tap:
+            os.close(read_fd)
+        return False, None, "ffmpeg saknas (installera med: sudo apt install ffmpeg)"
+    finally:
+        if tap:
+            os.close(write_fd)
+    if tap:
+        tap.start(read_fd)
+    apply_job_priority(proc.pid)
+    writer = HashingWriter(flac_path)
+    if encryptor:
+        writer = EncryptingWriter(writer, encryptor)
+    try:
+        # Pausas av inspelningen vid överspill
+        with THROTTLE.running(proc):
+            for chunk in iter(lambda: proc.stdout.read(ENCODE_CHUNK), b""):
+                writer.write(chunk)
+            returncode = proc.wait()
+    except BaseException:
+        proc.kill()
+        proc.wait()
+        writer.abort()
+        raise
+    finally:
+        proc.stdout.close()
+        if tap:
+            tap.join()
+    if returncode != 0:
+        writer.abort()
+        return False, None, f"Konvertering WAV->{codec.upper()} misslyckades"
+    if writer.size == 0:
+        writer.abort()
+        return False, None, f"{codec.upper()}-filen är tom: {flac_path}"
+    writer.commit()
+    if tap:
+        try:
+            tap.write()
+        except Exception as e:
+            # Topparna är ett tillägg; kodningen räknas som lyckad ändå
+            logger.warning(f"Vågformstoppar kunde inte sparas: {e}")
+    return True, flac_path, "ok"
+
+def upload_settings_from_env() -> dict:
+    """Uppladdningsinställningar från miljövariabler (nycklar som i ConfigManager)"""
+    return {
+        "upload_target": UPLOAD_TARGET,
+        "aws_region": AWS_REGION,
+        "s3_bucket": S3_BUCKET,
+        "s3_endpoint_url": S3_ENDPOINT,
+        "http_upload_url": HTTP_UPLOAD_URL,
+        "http_auth_header": HTTP_AUTH_HEADER,
+        "n8n_webhook_url": N8N_WEBHOOK_URL,
+        "n8n_auth_header": N8N_AUTH_HEADER,
+    }
+
+def upload_destination(cfg: dict, target: str) -> str:
+    """Identitet för uppladdningsmålet (nyckel i uppladdningsindexet)"""
+    if target == "s3":
+        return f"s3://{cfg['s3_bucket']}"
+    if target == "http":
+        return cfg["http_upload_url"] or "http"
+    if target == "n8n":
+        return cfg["n8n_webhook_url"] or "n8n"
+    return target
+
+def integrity_headers(digest) -> dict:
+    """Idempotensnyckel och checksummor för HTTP-uppladdningar"""
+    return {
+        "Idempotency-Key": digest.sha256,
+        "X-Content-SHA256": digest.sha256,
+    }
+
+_sessions = threading.local()
+
+def http_session():
+    """
+    requests-session per tråd: anslutningen (och TLS-handskakningen) till
+    samma mottagare återanvänds mellan uppladdningar.
+    """
+    import requests
+    session = getattr(_sessions, "session", None)
+    if session is None:
+        session = _sessions.session = requests.Session()
+    return session
+
+def upload_body(path: Path, digest, stream=None) -> MultipartEncoder:
+    """
+    Multipart-kropp för HTTP/n8n som strömmas från disk (konstant minne
+    oavsett filstorlek) i stället för att byggas i minnet av requests.
+    
+    Args:
+        stream: Läs innehållet härifrån i stället för från path (vid fan-out)
+    """
+    return MultipartEncoder(
+        fields={"sha256": digest.sha256},
+        files={"file": (path.name, stream or path, mime_type_for(path), {"Content-MD5": digest.content_md5})},
+    )
+
+def parse_targets(value: str) -> list:
+    """"s3, n8n" -> ["s3", "n8n"] (ordningen behålls, dubbletter tas bort)"""
+    targets = []
+    for target in (value or "").lower().split(","):
+        target = target.strip()
+        if target and target not in targets:
+            targets.append(target)
+    return targets
+
+def upload_to_targets(flac_path: Path, settings: dict = None) -> dict:
+    """
+    Ladda upp fil till alla konfigurerade mål.
+    
+    Vid flera mål läses filen en gång och strömmas till målen samtidigt
+    (fanout.py). Mål som misslyckas försöks igen upp till UPLOAD_RETRIES
+    gånger, tillsammans med varandra men utan de mål som redan lyckats.
+    Innehåll som redan levererats till ett mål (enligt uppladdningsindexet)
+    laddas inte upp igen. Filens SHA-256 skickas som idempotensnyckel så att
+    mottagaren kan känna igen ett omförsök efter en timeout.
+    
+    Args:
+        flac_path: Fil att ladda upp
+        settings: Uppladdningsinställningar (t.ex. från ConfigManager); saknade
+            nycklar tas från miljövariablerna
+    
+    Returns:
+        Status per mål: {mål: {"ok": bool, "info": str, "attempts": int}}
+    """
+    cfg = upload_settings_from_env()
+    if settings:
+        cfg.update({k: v for k, v in settings.items() if k in cfg})
+    targets = parse_targets(cfg["upload_target"]) or [""]
+    
+    # Verifiera att filen existerar innan upload (gäller alla metoder)
+    error = None
+    if not flac_path.exists():
+        error = f"Uppladdningsfel: Filen finns inte: {flac_path}"
+    elif flac_path.stat().st_size == 0:
+        error = f"Uppladdningsfel: Filen är tom: {flac_path}"
+    if error:
+        return {target: {"ok": False, "info": error, "attempts": 0} for target in targets}
+    
+    digest = digest_for(flac_path)
+    results = {}
+    pending = []
+    for target in targets:
+        if target not in UPLOAD_TARGETS:
+            results[target] = {"ok": False, "info": f"Okänt UPLOAD_TARGET: {target}", "attempts": 0}
+            continue
+        previous = UPLOADS.lookup(upload_destination(cfg, target), digest.sha256)
+        if previous:
+            results[target] = {"ok": True, "info": f"Redan uppladdad ({previous['filename']}): {previous['info']}",
+                               "attempts": 0}
+        else:
+            pending.append(target)
+    
+    attempt = 0
+    while pending:
+        attempt += 1
+        if len(pending) == 1:
+            outcome = {pending[0]: _upload_to_target(flac_path, cfg, pending[0], digest)}
+        else:
+            outcome = fan_out(flac_path, pending,
+                              lambda target, stream: _upload_to_target(flac_path, cfg, target, digest, stream))
+        for target, (ok, info) in outcome.items():
+            results[target] = {"ok": ok, "info": info, "attempts": attempt}
+            if ok:
+                UPLOADS.add(upload_destination(cfg, target), digest, flac_path.name, info)
+        pending = [target for target in pending if not results[target]["ok"]]
+        if pending and attempt <= UPLOAD_RETRIES:
+            delay = UPLOAD_RETRY_DELAY * 2 ** (attempt - 1)
+            logger.warning(f"Uppladdning av {flac_path.name} misslyckades till {', '.join(pending)}, "
+                           f"försöker igen om {delay:g} s")
+            time.sleep(delay)
+        else:
+            break
+    # Samma ordning som i konfigurationen
+    return {target: results[target] for target in targets}
+
+def upload_summary(results: dict):
+    """
+    Sammanfatta status per mål.
+    
+    Returns:
+        Tuple med (ok, info); ok bara om alla mål lyckades
+    """
+    ok = bool(results) and all(r["ok"] for r in results.values())
+    if len(results) == 1:
+        return ok, next(iter(results.values()))["info"]
+    return ok, "; ".join(f"{target}: {r['info']}" for target, r in results.items())
+
+def upload_file(flac_path: Path, settings: dict = None):
+    """
+    Ladda upp fil till konfigurerade mål (se upload_to_targets).
+    
+    Returns:
+        Tuple med (ok, info)
+    """
+    return upload_summary(upload_to_targets(flac_path, settings))
+
+def recording_sidecars(wav_path: Path) -> dict:
+    """
+    Befintliga sidofiler för en inspelning: features, vågformstoppar,
+    spektrogram och luckmarkering. Hittas på inspelningens namn, så
+    WAV-filen behöver inte finnas kvar.
+    """
+    wav_path = Path(wav_path)
+    features = wav_path.with_name(wav_path.stem + SIDECAR_SUFFIX)
+    sidecars = {"features": features} if features.exists() else {}
+    sidecars.update(peaks_sidecars(wav_path))
+    # Segment efter ett avbrott: luckan före segmentet
+    sidecars.update(gap_sidecars(wav_path))
+    return sidecars
+
+def upload_sidecars(wav_path: Path, trace, settings: dict = None) -> dict:
+    """
+    Ladda upp inspelningens sidofiler, en spann per fil i jobbets spårning.
+
+    Sidofiler är tillägg: misslyckas en uppladdning loggas det, men
+    inspelningen räknas ändå som klar.
+
+    Returns:
+        {typ: filnamn} för de sidofiler som laddades upp
+    """
+    uploaded = {}
+    for kind, path in recording_sidecars(wav_path).items():
+        with trace.span(f"uploading_{kind}", bytes=path.stat().st_size) as span:
+            ok, info = upload_file(path, settings=settings)
+            if not ok:
+                span.end("error")
+                logger.warning(f"Uppladdning av {path.name} misslyckades: {info}")
+        if ok:
+            uploaded[kind] = path.name
+    return uploaded
+
+def _upload_to_target(flac_path: Path, cfg: dict, target: str, digest, stream=None):
+    if target == "s3":
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+            session = boto3.session.Session(region_name=cfg["aws_region"])
+            if cfg["s3_endpoint_url"]:
+                s3 = session.client("s3", endpoint_url=cfg["s3_endpoint_url"])
+            else:
+                s3 = session.client("s3")
+            key = f"meetings/{flac_path.name}"
+            # Redan levererad (t.ex. om svaret på förra försöket gick förlorat)?
+            # Fel med nätverk och inloggning avbryter här, med tydligare fel än vid själva uppladdningen
+            try:
+                head = s3.head_object(Bucket=cfg["s3_bucket"], Key=key)
+                if head.get("Metadata", {}).get("sha256") == digest.sha256:
+                    return True, f"s3://{cfg['s3_bucket']}/{key} (fanns redan)"
+            except ClientError as e:
+                code = str(e.response.get("Error", {}).get("Code", ""))
+                if code not in S3_NOT_FOUND:
+                    # T.ex. 403 när nyckeln bara får skriva: försök ladda upp ändå
+                    logger.warning(f"Kunde inte kontrollera s3://{cfg['s3_bucket']}/{key} ({code}): {e}")
+            # S3 verifierar checksumman vid mottagandet; sha256 sparas även som metadata
+            extra = {"ChecksumAlgorithm": "SHA256", "Metadata": {"sha256": digest.sha256}}
+            if stream is not None:
+                s3.upload_fileobj(stream, cfg["s3_bucket"], key, ExtraArgs=extra)
+            else:
+                s3.upload_file(str(flac_path), cfg["s3_bucket"], key, ExtraArgs=extra)
+            return True, f"s3://{cfg['s3_bucket']}/{key}"
+        except Exception as e:
+            return False, f"S3-fel: {e}"
+
+    elif target == "http":
+        try:
+            headers = integrity_headers(digest)
+            if cfg["http_auth_header"]:
+                headers["Authorization"] = cfg["http_auth_header"]
+            body = upload_body(flac_path, digest, stream)
+            headers["Content-Type"] = body.content_type
+            try:
+                r = http_session().post(cfg["http_upload_url"], data=body, headers=headers, timeout=180)
+            finally:
+                body.close()
+            if r.status_code // 100 == 2:
+                return True, f"HTTP {r.status_code}"
+            else:
+                return False, f"HTTP {r.status_code}: {r.text[:200]}"
+        except Exception as e:
+            return False, f"HTTP-fel: {e}"
+
+    elif target == "n8n":
+        try:
+            if not cfg["n8n_webhook_url"]:
+                return False, "N8N_WEBHOOK_URL saknas"
+            headers = integrity_headers(digest)
+            if cfg["n8n_auth_header"]:
+                headers["Authorization"] = cfg["n8n_auth_header"]
+            body = upload_body(flac_path, digest, stream)
+            headers["Content-Type"] = body.content_type
+            try:
+                r = http_session().post(cfg["n8n_webhook_url"], data=body, headers=headers, timeout=180)
+            finally:
+                body.close()
+            if r.status_code // 100 == 2:
+                return True, f"n8n webhook {r.status_code} → {flac_path.name}"
+            else:
+                return False, f"n8n webhook {r.status_code}: {r.text[:200]}"
+        except Exception as e:
+            return False, f"n8n-fel: {e}"
+    else:
+        return False, f"Okänt UPLOAD_TARGET: {target}"
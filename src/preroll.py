@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Pre-roll: ständigt pågående inspelning till en ringbuffert i minnet.
+
+Med PREROLL_SECONDS > 0 hålls ljudkällan öppen hela tiden och de senaste
+sekunderna sparas i en förallokerad int16-buffert. När en inspelning
+startar skrivs bufferten först i WAV-filen och därefter fortsätter samma
+ström utan glapp, så att de första orden inte går förlorade när ett
+MQTT-kommando kommer eller någon trycker sent på knappen.
+
+Kostnad:
+- Minne: sekunder × samplingsfrekvens × kanaler × 2 byte, allokerat en gång
+  (30 s mono 16 kHz ≈ 0,9 MB; 30 s, 6 kanaler, 16 kHz ≈ 5,5 MB;
+  30 s, 6 kanaler, 48 kHz ≈ 16,5 MB)
+- CPU: en kopiering per ljudblock (1024 ramar) in i bufferten, dvs.
+  samma storleksordning som att skriva ljudet till disk; ingen
+  allokering i ljud-callbacken
+
+Eftersom en ALSA hw-enhet bara kan öppnas av en process i taget spelas
+inspelningen (och nivåtestet) då in från samma källa via PrerollCapture.tap()
+i stället för med en separat arecord-process.
+"""
+import os
+import logging
+import threading
+from typing import Optional, List
+
+import numpy as np
+
+from audio_source import AudioSource, Callback
+
+logger = logging.getLogger(__name__)
+
+PREROLL_SECONDS = float(os.getenv("PREROLL_SECONDS", "0"))
+
+
+class RingBuffer:
+    """Förallokerad ringbuffert för int16-ljud (frames, channels)"""
+
+    def __init__(self, frames: int, channels: int):
+        self.data = np.zeros((frames, channels), dtype=np.int16)
+        self.capacity = frames
+        self.filled = 0
+        self._pos = 0   # Nästa skrivposition
+
+    def write(self, block: np.ndarray):
+        """Skriv ett block (högst två kopieringar; äldsta ljudet skrivs över)"""
+        frames = len(block)
+        if frames >= self.capacity:
+            self.data[:] = block[frames - self.capacity:]
+            self._pos = 0
+            self.filled = self.capacity
+            return
+        end = self._pos + frames
+        if end <= self.capacity:
+            self.data[self._pos:end] = block
+        else:
+            first = self.capacity - self._pos
+            self.data[self._pos:] = block[:first]
+            self.data[:end - self.capacity] = block[first:]
+        self._pos = end % self.capacity
+        self.filled = min(self.capacity, self.filled + frames)
+
+    def snapshot(self) -> np.ndarray:
+        """Innehållet i tidsordning (kopia)"""
+        if self.filled < self.capacity:
+            return self.data[:self.filled].copy()
+        return np.concatenate([self.data[self._pos:], self.data[:self._pos]])
+
+
+class PrerollTap(AudioSource):
+    """
+    Konsument av en PrerollCapture med AudioSource-gränssnitt.
+
+    start() levererar först ringbuffertens innehåll (om include_preroll)
+    som ett block och därefter varje nytt block från källan.
+    """
+
+    def __init__(self, capture: "PrerollCapture", include_preroll: bool = True):
+        source = capture.source
+        super().__init__(source.channels, source.samplerate, source.blocksize)
+        self.capture = capture
+        self.include_preroll = include_preroll
+        self.preroll_frames = 0
+        self._callback: Optional[Callback] = None
+
+    def start(self, callback: Callback):
+        self._callback = callback
+        self.preroll_frames = self.capture._attach(self)
+        self.running = True
+
+    def stop(self):
+        self.running = False
+        self.capture._detach(self)
+
+
+class PrerollCapture:
+    """Håller en ljudkälla öppen och de senaste sekunderna i en ringbuffert"""
+
+    def __init__(self, source: AudioSource, seconds: float = PREROLL_SECONDS):
+        """
+        Args:
+            source: Ljudkälla som hålls öppen så länge pre-roll är aktivt
+            seconds: Antal sekunder som sparas
+        """
+        self.source = source
+        self.seconds = seconds
+        self.ring = RingBuffer(max(1, int(seconds * source.samplerate)), source.channels)
+        self._lock = threading.Lock()
+        self._taps: List[PrerollTap] = []
+        self.overflows = 0
+
+    @property
+    def memory_bytes(self) -> int:
+        return self.ring.data.nbytes
+
+    def start(self):
+        self.source.start(self._callback)
+        logger.info(f"Pre-roll aktivt: {self.seconds:g} s, {self.source.channels} ch, "
+                    f"{self.source.samplerate} Hz ({self.memory_bytes / 1e6:.1f} MB)")
+
+    def stop(self):
+        self.source.stop()
+        with self._lock:
+            taps = list(self._taps)
+            self._taps.clear()
+        for tap in taps:
+            tap.running = False
+
+    def tap(self, include_preroll: bool = True) -> PrerollTap:
+        """Ny konsument, t.ex. för SourceCapture eller LevelMonitor"""
+        return PrerollTap(self, include_preroll)
+
+    def _attach(self, tap: PrerollTap) -> int:
+        # Under låset: ingen ram hamnar både i bufferten och i första live-blocket
+        with self._lock:
+            frames = 0
+            if tap.include_preroll and self.ring.filled:
+                block = self.ring.snapshot()
+                frames = len(block)
+                tap._callback(block, frames, None, None)
+            self._taps.append(tap)
+        return frames
+
+    def _detach(self, tap: PrerollTap):
+        with self._lock:
+            if tap in self._taps:
+                self._taps.remove(tap)
+
+    def _callback(self, indata, frames, time_info, status):
+        if status:
+            self.overflows += 1
+        with self._lock:
+            self.ring.write(indata)
+            for tap in self._taps:
+                tap._callback(indata, frames, time_info, status)
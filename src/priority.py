@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Prioritet och isolering mellan inspelning och bakgrundsjobb.
+
+När ett möte slutar och nästa börjar direkt konkurrerar kodningen av den
+förra inspelningen med den pågående inspelningen och GUI:t. Därför:
+
+- Efterbearbetningens trådar och ffmpeg körs med sänkt prioritet
+  (JOB_NICE), ffmpeg dessutom med idle-I/O-klass (ionice), och kan låsas
+  till vissa kärnor (JOB_CPUS, t.ex. "2,3").
+- arecord kan köras med realtidsprioritet (CAPTURE_RT_PRIORITY, kräver
+  CAP_SYS_NICE eller LimitRTPRIO i systemd) och låsas till egna kärnor
+  (CAPTURE_CPUS).
+- Rapporterar en inspelningsström överspill (xruns) pausas pågående
+  kodningsprocesser i JOB_XRUN_PAUSE sekunder (SIGSTOP/SIGCONT); nya
+  överspill förlänger pausen.
+
+Allt är Linux-specifikt och tyst utan effekt där det inte stöds.
+"""
+import os
+import time
+import shutil
+import signal
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Optional, Set, List
+
+logger = logging.getLogger(__name__)
+
+# Nice-värde för efterbearbetning (0 = oförändrat) och I/O-klass för ffmpeg ("idle", "best-effort" eller tomt)
+JOB_NICE = int(os.getenv("JOB_NICE", "10"))
+JOB_IOPRIO = os.getenv("JOB_IOPRIO", "idle").lower()
+# Kärnor för efterbearbetning och för arecord, t.ex. "2,3" eller "0-1" (tomt = alla)
+JOB_CPUS = os.getenv("JOB_CPUS", "")
+CAPTURE_CPUS = os.getenv("CAPTURE_CPUS", "")
+# SCHED_FIFO-prioritet för arecord (1-99, 0 = av)
+CAPTURE_RT_PRIORITY = int(os.getenv("CAPTURE_RT_PRIORITY", "0"))
+# Sekunder som kodningen pausas efter överspill i inspelningen (0 = av)
+JOB_XRUN_PAUSE = float(os.getenv("JOB_XRUN_PAUSE", "3"))
+
+_IONICE_CLASSES = {"idle": ["-c", "3"], "best-effort": ["-c", "2", "-n", "7"]}
+_warned: Set[str] = set()
+
+
+def _warn_once(key: str, message: str):
+    if key not in _warned:
+        _warned.add(key)
+        logger.warning(message)
+
+
+def parse_cpus(value: str) -> Optional[Set[int]]:
+    """
+    "2,3" eller "0-1,3" -> {kärnor}; tomt -> None
+
+    Raises:
+        ValueError: Vid ogiltig lista
+    """
+    cpus: Set[int] = set()
+    for part in (value or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition("-")
+        cpus.update(range(int(first), int(last) + 1) if sep else [int(first)])
+    return cpus or None
+
+
+def _set_affinity(pid: int, value: str, what: str):
+    if not value or not hasattr(os, "sched_setaffinity"):
+        return
+    try:
+        os.sched_setaffinity(pid, parse_cpus(value))
+    except (ValueError, OSError) as e:
+        _warn_once(f"affinity-{what}", f"Kunde inte låsa {what} till kärnorna {value}: {e}")
+
+
+def lower_thread_priority():
+    """
+    Sänk prioriteten för anropande tråd (initializer för arbetspoolen).
+
+    På Linux är nice och kärnaffinitet per tråd, och processer som
+    startas från tråden (ffmpeg) ärver dem.
+    """
+    if JOB_NICE and hasattr(os, "setpriority"):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), JOB_NICE)
+        except OSError as e:
+            _warn_once("nice-thread", f"Kunde inte sänka prioriteten för efterbearbetning: {e}")
+    _set_affinity(0, JOB_CPUS, "efterbearbetningen")
+
+
+def job_command(cmd: List[str]) -> List[str]:
+    """Kommando för ett bakgrundsjobb, med ionice om I/O-klass är vald och ionice finns"""
+    ionice = _IONICE_CLASSES.get(JOB_IOPRIO)
+    # Saknas programmet ska Popen ge FileNotFoundError för programmet, inte för ionice
+    if not ionice or not shutil.which("ionice") or not shutil.which(cmd[0]):
+        return cmd
+    return ["ionice", *ionice, *cmd]
+
+
+def apply_job_priority(pid: int):
+    """Sänk prioriteten för en startad jobbprocess (om den inte redan ärvt den)"""
+    if JOB_NICE and hasattr(os, "setpriority"):
+        try:
+            if os.getpriority(os.PRIO_PROCESS, pid) < JOB_NICE:
+                os.setpriority(os.PRIO_PROCESS, pid, JOB_NICE)
+        except OSError:
+            pass   # Processen hann avslutas
+    _set_affinity(pid, JOB_CPUS, "efterbearbetningen")
+
+
+def raise_capture_priority(pid: int):
+    """Realtidsprioritet och kärnaffinitet för en inspelningsprocess (arecord)"""
+    if CAPTURE_RT_PRIORITY > 0 and hasattr(os, "sched_setscheduler"):
+        try:
+            os.sched_setscheduler(pid, os.SCHED_FIFO, os.sched_param(min(99, CAPTURE_RT_PRIORITY)))
+        except PermissionError:
+            _warn_once("rt", "Realtidsprioritet för inspelning nekades "
+                             "(kräver CAP_SYS_NICE eller LimitRTPRIO i systemd-tjänsten)")
+        except OSError:
+            pass   # Processen hann avslutas
+    _set_affinity(pid, CAPTURE_CPUS, "inspelningen")
+
+
+class JobThrottle:
+    """
+    Pausar registrerade jobbprocesser när inspelningen får överspill.
+
+    xrun() är billig och kan anropas från ljud-callbacken; själva
+    pausandet sker i en egen tråd.
+    """
+
+    def __init__(self, pause_s: float = JOB_XRUN_PAUSE):
+        self.pause_s = pause_s
+        self.pauses = 0
+        self.paused_s = 0.0       # Total pausad tid
+        self._procs: Set = set()
+        self._lock = threading.Lock()
+        self._until = 0.0
+        self._paused = False
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def paused(self) -> bool:
+        return self._paused
+
+    def xrun(self):
+        """Inspelningen rapporterade överspill: pausa jobben (eller förläng pausen)"""
+        if self.pause_s <= 0 or not self._procs:
+            return
+        self._until = time.monotonic() + self.pause_s
+        self._wake.set()
+
+    def _signal(self, proc, signum: int):
+        try:
+            os.kill(proc.pid, signum)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def _loop(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            started = time.monotonic()
+            with self._lock:
+                for proc in self._procs:
+                    self._signal(proc, signal.SIGSTOP)
+                self._paused = True
+                self.pauses += 1
+            logger.info(f"Överspill i inspelningen: pausar {len(self._procs)} kodningsjobb")
+            while True:
+                remaining = self._until - time.monotonic()
+                if remaining <= 0:
+                    break
+                time.sleep(min(remaining, 0.5))
+            with self._lock:
+                # Överspill under pausen har redan förlängt den
+                self._wake.clear()
+                for proc in self._procs:
+                    self._signal(proc, signal.SIGCONT)
+                self._paused = False
+                self.paused_s += time.monotonic() - started
+            logger.info(f"Kodningsjobb återupptagna efter {time.monotonic() - started:.1f} s")
+
+    @contextmanager
+    def running(self, proc):
+        """Registrera en jobbprocess (t.ex. ffmpeg) medan den körs"""
+        with self._lock:
+            self._procs.add(proc)
+            if self._paused:
+                self._signal(proc, signal.SIGSTOP)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="job-throttle", daemon=True)
+                self._thread.start()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._procs.discard(proc)
+                if self._paused:
+                    # Annars kan processen inte avslutas eller väntas in
+                    self._signal(proc, signal.SIGCONT)
+
+
+# Gemensam för inspelningskärnan och pipelinen
+THROTTLE = JobThrottle()
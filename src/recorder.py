@@ -0,0 +1,1046 @@
+#!/usr/bin/env python3
+"""
+Inspelningskärna utan GUI-beroenden.
+
+Tillhandahåller:
+- Recorder: start/stopp av inspelning, nivåtest och efterbearbetning
+  (konvertering + uppladdning) i bakgrundstrådar
+- LevelMonitor: nivåmätning (RMS per kanal) från ljudenheten
+- Händelser till lyssnare (GUI, MQTT, IPC) i stället för direkta anrop
+
+Används både av den grafiska appen (meetrec_gui.py) och av den huvudlösa
+tjänsten (meetrec_daemon.py).
+"""
+import os
+import time
+import queue
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, Optional, Dict, Any, List, Tuple
+
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+
+from audio_source import create_audio_source
+from capture import AUDIO_DEVICES, CaptureStream, parse_devices
+from priority import THROTTLE, lower_thread_priority
+from capture_watchdog import (WATCHDOG_ENABLED, WATCHDOG_MAX_RESTARTS, CaptureWatchdog, retry_delay,
+                              write_gap_marker)
+from preroll import PREROLL_SECONDS, PrerollCapture
+from vad import (AUTO_RECORD, AUTO_START_SPEECH_S, AUTO_STOP_SILENCE_S, AUTO_REARM_SILENCE_S, VoiceActivation,
+                 start_window)
+from resample import ensure_samplerate
+from features import FEATURES_ENABLED, write_sidecar
+from encryption import ENCRYPTED_SUFFIX
+from integrity import digest_for
+from catalog import open_catalog
+from pipeline import (AUDIO_DIR, AUDIO_CODEC, AUDIO_CODECS, UPLOAD_TARGET, ts_name, encode_audio, upload_sidecars,
+                      upload_to_targets, upload_summary)
+from http_api import APIServer, get_http_config_from_env
+from tracing import JobTrace, maybe_profile
+
+# Import MQTT och konfigurationshantering
+try:
+    from mqtt_client import MQTTClient, get_mqtt_config_from_env
+    from config_manager import ConfigManager, UPLOAD_KEYS, MQTT_KEYS, PREROLL_KEYS, AUTO_KEYS
+    MQTT_SUPPORT = True
+except ImportError as e:
+    MQTT_SUPPORT = False
+    logging.warning(f"MQTT-stöd ej tillgängligt: {e}")
+
+logger = logging.getLogger(__name__)
+
+# ========= Konfig =========
+SAMPLE_RATE   = int(os.getenv("SAMPLE_RATE", "16000"))    # Målfrekvens; räcker fint för tal
+CAPTURE_RATE  = int(os.getenv("CAPTURE_RATE", "0"))       # Enhetens egen frekvens (0 = SAMPLE_RATE)
+FORMAT        = os.getenv("SAMPLE_FORMAT", "S16_LE")      # 16-bit PCM (S32_LE för 32-bit)
+CAPTURE_CHANNELS = int(os.getenv("CAPTURE_CHANNELS", "1"))  # >1 spelar in alla mikrofoner (t.ex. 6 för ReSpeaker)
+OUTPUT_CHANNEL   = int(os.getenv("OUTPUT_CHANNEL", "0"))    # Kanal som laddas upp vid flerkanalsinspelning
+CHANNELS_TEST = 4             # Antal kanaler att visa i "Testa nivåer" (ändra vid behov)
+ALSA_DEVICE   = None          # None => standard. Eller t.ex. "hw:1,0" för ReSpeaker
+MAX_HOURS     = 8
+# Efterbearbetningsjobb (komprimering + uppladdning) som körs samtidigt, delat av alla strömmar
+POSTPROCESS_WORKERS = int(os.getenv("POSTPROCESS_WORKERS", "2"))
+
+# Listener-signatur: callback(händelse, data)
+Listener = Callable[[str, Dict[str, Any]], None]
+
+
+# ========= Ljudnivåmätning (Testläge) =========
+class LevelMonitor:
+    """Nivåmätning (RMS per kanal) från en ljudkälla, utan GUI"""
+
+    def __init__(self, num_channels=CHANNELS_TEST, samplerate=SAMPLE_RATE, device=ALSA_DEVICE, gain=1.0,
+                 source=None):
+        """
+        Args:
+            source: AudioSource att mäta på (None = enligt AUDIO_SOURCE)
+        """
+        self.num_channels = num_channels  # Antal kanaler att visa i GUI
+        self.running = False
+        self.samplerate = samplerate
+        self.device = device
+        self.q = queue.Queue()
+        self.gain = gain  # Volymförstärkning (1.0 = normal, 2.0 = dubbel, etc.)
+
+        # Öppna källan med alla tillgängliga kanaler från enheten. Detta
+        # säkerställer att alla mikrofoner fångas, även om de är mappade
+        # till högre kanalnummer (t.ex. kanal 4-5 på ReSpeaker)
+        self.source = source or create_audio_source(device=device, samplerate=samplerate)
+        self.device_channels = self.source.channels
+
+    def _audio_callback(self, indata, frames, time_info, status):
+        if status:
+            pass
+        # Normalisera int16 data (-32768 till 32767) till float (-1.0 till 1.0)
+        # indata har form (frames, channels) där channels = device_channels
+        normalized = indata.astype(np.float32) / 32768.0
+        # Applicera gain
+        normalized = normalized * self.gain
+        # Beräkna RMS per kanal (axis=0 ger en RMS-värde per kanal)
+        # Detta beräknar RMS för ALLA kanaler från enheten
+        with np.errstate(invalid='ignore'):
+            rms = np.sqrt(np.mean(np.square(normalized), axis=0))
+        # Klipp till 0.0-1.0 efter gain är applicerad
+        rms = np.clip(rms, 0.0, 1.0)
+        self.q.put(rms)
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        try:
+            self.source.start(self._audio_callback)
+        except Exception as e:
+            self.running = False
+            raise e
+
+    def stop(self):
+        self.running = False
+        self.source.stop()
+
+    def read_levels(self, timeout: float = 0.1) -> Optional[np.ndarray]:
+        """
+        Hämta senaste RMS-värdena (äldre värden i kön hoppas över).
+
+        Returns:
+            Array med RMS per kanal, eller None om inget nytt värde kom inom timeout
+        """
+        try:
+            rms = self.q.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        try:
+            while True:
+                rms = self.q.get_nowait()
+        except queue.Empty:
+            pass
+        return rms
+
+    def set_gain(self, gain):
+        """Uppdatera gain-värdet"""
+        self.gain = max(0.1, min(10.0, gain))
+
+
+# ========= Inspelningskärna =========
+class Recorder:
+    """
+    Inspelningskärna: styr arecord, nivåtest och efterbearbetning.
+
+    Med AUDIO_DEVICES spelas flera ljudenheter in samtidigt (en
+    CaptureStream per enhet, se capture.py); start/stopp gäller alla
+    strömmar och varje ström blir ett eget efterbearbetningsjobb.
+
+    Alla publika metoder är trådsäkra och returnerar (ok, resultat) så att
+    de kan användas direkt som MQTT-kommandocallbacks. Tillståndsändringar
+    skickas som händelser till registrerade lyssnare:
+
+    - "status": {"status": ..., ...} - samma värden som MQTT-status
+    - "recording": {"active": bool, "filename": ..., "started_at": ..., "files": [...] (alla strömmar)}
+    - "test": {"active": bool, "device_channels": ..., "num_channels": ...}
+    - "levels": {"rms": [...]} - under nivåtest (~20 Hz)
+    - "gain": {"gain": ...}
+    - "message": {"text": ..., "warn": bool, "flash": bool} - för statusrad
+    - "recording_complete": {"filename": ..., "upload_result": ..., "features"/"peaks"/"spectrogram"/"gap": ... (sidofiler som laddats upp)}
+    - "incident": {"stream": ..., "device": ..., "reason": ..., ...} - avbrott och omstarter (capture_watchdog.py)
+    """
+
+    def __init__(self, config_manager=None, audio_dir: Path = AUDIO_DIR, device=ALSA_DEVICE,
+                 devices: Optional[str] = None):
+        """
+        Args:
+            config_manager: ConfigManager för standardvärden och hot-reload (valfri)
+            audio_dir: Katalog för inspelningar
+            device: ALSA-enhet (None = standard)
+            devices: Flera enheter som i AUDIO_DEVICES (None = miljövariabeln)
+        """
+        self.config_manager = config_manager
+        self.audio_dir = Path(audio_dir)
+        try:
+            streams = parse_devices(AUDIO_DEVICES if devices is None else devices, device)
+        except ValueError as e:
+            logger.error(f"Ogiltig AUDIO_DEVICES, spelar in från en enhet: {e}")
+            streams = parse_devices("", device)
+        # Överspill i någon ström pausar pågående kodning (priority.py)
+        self.streams = [CaptureStream(name, dev, on_xrun=THROTTLE.xrun) for name, dev in streams]
+        # Första strömmen används för nivåtest och pre-roll
+        self.device = self.streams[0].device
+
+        self._lock = threading.RLock()
+        self._listeners: List[Listener] = []
+
+        # Internt tillstånd
+        self.record_start = None
+        self.recording_codec = AUDIO_CODEC
+        self.recording_room = ""
+        self.recording_rate = SAMPLE_RATE
+        # Efterbearbetningen körs med lägre prioritet än inspelningen och GUI:t
+        self._jobs = ThreadPoolExecutor(max_workers=max(1, POSTPROCESS_WORKERS), thread_name_prefix="postprocess",
+                                        initializer=lower_thread_priority)
+        self._max_duration_timer: Optional[threading.Timer] = None
+        # Avbrutna strömmar startas om till nya segment (capture_watchdog.py)
+        self.watchdog = CaptureWatchdog(self._on_capture_failure, self._restart_stream,
+                                        self._on_capture_incident) if WATCHDOG_ENABLED else None
+        self._capture_settings: Optional[Tuple[int, str, int]] = None
+        self._segments: Dict[str, Dict[str, Any]] = {}     # ström -> {"first", "segment", "restarts"}
+        self._recovering: Dict[str, Dict[str, Any]] = {}   # ström -> avbrott som väntar på omstart
+        self.last_status: Dict[str, Any] = {"status": "ready"}
+
+        self.gain = float(config_manager.get("gain", 1.0)) if config_manager else 1.0
+        self.meter = LevelMonitor(num_channels=CHANNELS_TEST, samplerate=SAMPLE_RATE, device=self.device, gain=self.gain)
+        self.test_active = False
+        self._level_thread: Optional[threading.Thread] = None
+        self.preroll: Optional[PrerollCapture] = None
+        self._preroll_restart = False
+        # Röststyrd start/stopp (vad.py), lyssnar på pre-roll-källan
+        self.voice: Optional[VoiceActivation] = None
+
+        self.catalog = open_catalog(self.audio_dir)
+
+        self.mqtt_client = None
+        self.api_server = None
+        self._reverting_mqtt_config = False
+        if self.config_manager:
+            # Hot-reload: ändringar via MQTT slår igenom utan omstart
+            self.config_manager.add_listener(self._on_gain_config_changed, keys=("gain",))
+            self.config_manager.add_listener(self._on_mqtt_config_changed, keys=MQTT_KEYS)
+            self.config_manager.add_listener(self._on_preroll_config_changed, keys=PREROLL_KEYS + AUTO_KEYS)
+
+    # ---------- Händelser ----------
+    def add_listener(self, callback: Listener):
+        """Registrera lyssnare för händelser (anropas från valfri tråd)"""
+        with self._lock:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback: Listener):
+        with self._lock:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def _emit(self, event: str, data: Optional[Dict[str, Any]] = None):
+        with self._lock:
+            listeners = list(self._listeners)
+        for callback in listeners:
+            try:
+                callback(event, data or {})
+            except Exception as e:
+                logger.error(f"Fel i lyssnare för {event}: {e}")
+
+    def _set_status(self, status: str, extra: Optional[Dict[str, Any]] = None):
+        data = {"status": status}
+        if extra:
+            data.update(extra)
+        self.last_status = data
+        self._emit("status", data)
+
+    def _message(self, text: str, warn: bool = False, flash: bool = False):
+        self._emit("message", {"text": text, "warn": warn, "flash": flash or warn})
+
+    @property
+    def recording(self) -> bool:
+        # En ström som väntar på omstart räknas som pågående inspelning
+        return any(stream.active for stream in self.streams) or bool(self._recovering)
+
+    def status(self) -> Dict[str, Any]:
+        """Ögonblicksbild av tillståndet"""
+        with self._lock:
+            primary = self.streams[0]
+            status = {
+                **self.last_status,
+                "recording": self.recording,
+                "filename": primary.wav.name if primary.active else None,
+                "started_at": self.record_start,
+                "elapsed": time.time() - self.record_start if self.record_start else 0.0,
+                "test_active": self.test_active,
+                "gain": self.gain,
+            }
+            if len(self.streams) > 1:
+                status["streams"] = [stream.metrics() for stream in self.streams]
+            if self.watchdog and self.recording:
+                status["capture"] = self.watchdog.snapshot()
+            if self.voice:
+                status["voice"] = self.voice.snapshot()
+            return status
+
+    # ---------- Konfiguration ----------
+    def _default_codec(self):
+        if self.config_manager:
+            return self.config_manager.get("codec", AUDIO_CODEC)
+        return AUDIO_CODEC
+
+    def _default_max_duration(self):
+        if self.config_manager:
+            return float(self.config_manager.get("max_hours", MAX_HOURS)) * 3600
+        return MAX_HOURS * 3600
+
+    def _audio_settings(self) -> Tuple[int, int, str, int]:
+        """(inspelningsfrekvens, målfrekvens, sampelformat, kanaler) från konfigurationen"""
+        if self.config_manager:
+            target = int(self.config_manager.get("sample_rate", SAMPLE_RATE))
+            capture = int(self.config_manager.get("capture_rate", CAPTURE_RATE))
+            fmt = self.config_manager.get("sample_format", FORMAT)
+            channels = int(self.config_manager.get("capture_channels", CAPTURE_CHANNELS))
+        else:
+            target, capture, fmt, channels = SAMPLE_RATE, CAPTURE_RATE, FORMAT, CAPTURE_CHANNELS
+        return capture or target, target, fmt, channels
+
+    def _postprocess_settings(self, stream: CaptureStream) -> Dict[str, Any]:
+        """Inställningar för efterbearbetningen som gäller strömmens inspelning"""
+        if self.config_manager:
+            output_channel = int(self.config_manager.get("output_channel", OUTPUT_CHANNEL))
+            features = bool(self.config_manager.get("features_enabled", FEATURES_ENABLED))
+        else:
+            output_channel, features = OUTPUT_CHANNEL, FEATURES_ENABLED
+        return {
+            "gain": stream.gain,
+            "codec": self.recording_codec,
+            "rate": self.recording_rate,
+            # Flerkanalsinspelning: en kanal laddas upp, alla används för features
+            "channel": output_channel if stream.channels > 1 else None,
+            "features": features,
+        }
+
+    def _auto_settings(self) -> Tuple[bool, float, float, float]:
+        """(röststyrd inspelning på, sekunder tal för start, sekunder tystnad för stopp resp. ny start)"""
+        if self.config_manager:
+            return (bool(self.config_manager.get("auto_record", AUTO_RECORD)),
+                    float(self.config_manager.get("auto_start_speech_s", AUTO_START_SPEECH_S)),
+                    float(self.config_manager.get("auto_stop_silence_s", AUTO_STOP_SILENCE_S)),
+                    float(self.config_manager.get("auto_rearm_silence_s", AUTO_REARM_SILENCE_S)))
+        return AUTO_RECORD, AUTO_START_SPEECH_S, AUTO_STOP_SILENCE_S, AUTO_REARM_SILENCE_S
+
+    def _upload_settings(self):
+        """Aktuella uppladdningsinställningar från konfigurationen (None = miljövariabler)"""
+        if not self.config_manager:
+            return None
+        return {key: self.config_manager.get(key) for key in UPLOAD_KEYS}
+
+    def _mqtt_settings_from_config(self):
+        """MQTT-inställningar från ConfigManager med MQTTClient-nycklar (mqtt_broker -> broker)"""
+        if not self.config_manager:
+            return {}
+        return {key[len("mqtt_"):]: self.config_manager.get(key) for key in MQTT_KEYS}
+
+    def _on_gain_config_changed(self, changes):
+        """Ny standard-gain via konfiguration"""
+        _, gain = changes["gain"]
+        self.set_gain(gain)
+
+    def _on_mqtt_config_changed(self, changes):
+        """Nya MQTT-inställningar: återanslut i bakgrunden, återställ vid fel"""
+        if not self.mqtt_client or self._reverting_mqtt_config:
+            return
+        updates = {key[len("mqtt_"):]: new for key, (old, new) in changes.items()}
+        previous = {key: old for key, (old, new) in changes.items()}
+
+        def worker():
+            if not self.mqtt_client.reconfigure(updates):
+                # Den nya brokern svarade inte - återställ konfigurationen så att
+                # enheten inte hamnar på en onåbar broker efter omstart
+                self._reverting_mqtt_config = True
+                try:
+                    self.config_manager.update(previous)
+                finally:
+                    self._reverting_mqtt_config = False
+                self.mqtt_client.publish_config(self.config_manager.get_all())
+
+        # Körs i egen tråd: lyssnaren anropas från MQTT-nätverkstråden
+        threading.Thread(target=worker, name="mqtt-reconfigure", daemon=True).start()
+
+    def _on_preroll_config_changed(self, changes):
+        """Ny pre-roll-längd, ljudformat eller röststyrning: starta om ringbufferten"""
+        with self._lock:
+            if self.recording:
+                # Pågående inspelning läser från källan; byt efter stopp
+                self._preroll_restart = True
+                return
+        self.start_preroll()
+
+    def on_config_update(self, config_updates):
+        """Hantera konfigurationsuppdatering (från MQTT)"""
+        if not self.config_manager:
+            return
+
+        # Validera mot schemat; ogiltiga värden rapporteras tillbaka
+        valid, errors = self.config_manager.validate(config_updates)
+        if self.mqtt_client:
+            self.mqtt_client.publish_config_response(not errors, list(valid.keys()), errors)
+        if errors:
+            logger.warning(f"Ogiltig konfiguration via MQTT: {errors}")
+
+        # Uppdatera konfiguration (en skrivning för hela meddelandet)
+        with self.config_manager.transaction():
+            self.config_manager.update(valid)
+
+            # Hantera speciella konfigurationer
+            if "wifi_ssid" in valid and "wifi_password" in valid:
+                self.config_manager.set_wifi_credentials(
+                    valid["wifi_ssid"],
+                    valid["wifi_password"]
+                )
+
+        # Publicera uppdaterad konfiguration
+        if self.mqtt_client:
+            self.mqtt_client.publish_config(self.config_manager.get_all())
+
+        logger.info(f"Konfiguration uppdaterad via MQTT: {list(valid.keys())}")
+
+    # ---------- MQTT ----------
+    def start_mqtt(self):
+        """
+        Skapa MQTT-klient (om MQTT_ENABLED) och koppla den till inspelningskärnan.
+
+        Returns:
+            MQTTClient eller None
+        """
+        if not MQTT_SUPPORT:
+            return None
+        try:
+            mqtt_config = get_mqtt_config_from_env()
+            # Inställningar satta via MQTT (config.json) har företräde framför miljön
+            mqtt_config.update(self._mqtt_settings_from_config())
+            if not mqtt_config.get("enabled"):
+                return None
+            client = MQTTClient(mqtt_config)
+            self.attach_mqtt(client)
+            # Ansluter i bakgrunden; meddelanden buffras tills anslutningen är uppe
+            client.connect()
+            # Publicera initial konfiguration
+            if self.config_manager:
+                client.publish_config(self.config_manager.get_all())
+            logger.info("MQTT-klient initialiserad, ansluter i bakgrunden")
+            return client
+        except Exception as e:
+            logger.error(f"Kunde inte initiera MQTT-klient: {e}")
+            self.mqtt_client = None
+            return None
+
+    def attach_mqtt(self, client):
+        """Koppla kommandon och statuspublicering mellan MQTT-klient och inspelningskärna"""
+        self.mqtt_client = client
+        client.set_callbacks(
+            on_start=self.start,
+            on_stop=self.stop,
+            on_test=self.toggle_test,
+            on_config_update=self.on_config_update,
+            on_catalog=self.query_catalog,
+        )
+
+        def publish(event, data):
+            if event == "status":
+                status = dict(data)
+                client.publish_status(status.pop("status"), status or None)
+            elif event == "recording_complete":
+                client.publish_recording_complete(data["filename"], data["upload_result"])
+            elif event == "incident":
+                client.publish_incident(data)
+
+        self.add_listener(publish)
+
+    # ---------- Lokalt HTTP/WebSocket-API ----------
+    def start_api(self):
+        """
+        Starta lokalt HTTP/WebSocket-API (om HTTP_API_ENABLED).
+
+        Returns:
+            APIServer eller None
+        """
+        config = get_http_config_from_env()
+        if not config.get("enabled"):
+            return None
+        server = APIServer({**config, "audio_dir": self.audio_dir})
+        try:
+            server.start()
+        except (OSError, ValueError) as e:
+            logger.error(f"Kunde inte starta HTTP-API: {e}")
+            return None
+        self.attach_api(server)
+        return server
+
+    def attach_api(self, server):
+        """Koppla kommandon och händelseström mellan HTTP-API och inspelningskärna"""
+        self.api_server = server
+        server.set_callbacks(
+            on_start=self.start,
+            on_stop=self.stop,
+            on_test=self.toggle_test,
+            status=self.status,
+            catalog=self.query_catalog,
+        )
+        self.add_listener(server.broadcast)
+
+    # ---------- Pre-roll ----------
+    def start_preroll(self) -> bool:
+        """
+        Starta pre-roll enligt konfigurationen (preroll_seconds).
+
+        Ljudkällan hålls då öppen och de senaste sekunderna läggs först i
+        varje inspelning; nivåtestet och röststyrningen (auto_record)
+        lyssnar på samma källa.
+
+        Returns:
+            True om pre-roll är aktivt
+        """
+        self.stop_preroll()
+        if self.config_manager:
+            seconds = float(self.config_manager.get("preroll_seconds", PREROLL_SECONDS))
+        else:
+            seconds = PREROLL_SECONDS
+        auto, start_speech, stop_silence, rearm_silence = self._auto_settings()
+        if auto:
+            # Röststyrningen kräver en öppen källa, och bufferten ska rymma talet som startar inspelningen
+            seconds = max(seconds, start_window(start_speech))
+        if seconds <= 0:
+            return False
+        capture_rate, _, _, channels = self._audio_settings()
+        try:
+            source = create_audio_source(device=self.device, samplerate=capture_rate,
+                                         channels=channels if channels > 1 else None)
+            preroll = PrerollCapture(source, seconds)
+            preroll.start()
+        except Exception as e:
+            logger.error(f"Kunde inte starta pre-roll: {e}")
+            return False
+        with self._lock:
+            self.preroll = preroll
+            self.meter = LevelMonitor(num_channels=CHANNELS_TEST, samplerate=capture_rate, gain=self.gain,
+                                      source=preroll.tap(include_preroll=False))
+            if auto:
+                # Lyssna på samma kanal som laddas upp
+                output_channel = int(self.config_manager.get("output_channel", OUTPUT_CHANNEL)
+                                     if self.config_manager else OUTPUT_CHANNEL)
+                self.voice = VoiceActivation(self._voice_start, self.stop, lambda: self.recording,
+                                             start_speech, stop_silence, rearm_silence,
+                                             channel=output_channel if channels > 1 else 0)
+                self.voice.start(preroll.tap(include_preroll=False))
+        return True
+
+    def stop_preroll(self):
+        """Stoppa pre-roll och släpp ljudkällan"""
+        with self._lock:
+            preroll, self.preroll = self.preroll, None
+            if preroll is None:
+                return
+            if self.voice:
+                self.voice.stop()
+                self.voice = None
+            if self.test_active:
+                self._stop_test()
+                self._emit("test", {"active": False})
+            self.meter = LevelMonitor(num_channels=CHANNELS_TEST, samplerate=SAMPLE_RATE, device=self.device,
+                                      gain=self.gain)
+        preroll.stop()
+
+    # ---------- Kommandon ----------
+    def set_gain(self, gain) -> Tuple[bool, Any]:
+        """Sätt gain för nivåtest och kommande inspelningar"""
+        gain = max(0.1, min(5.0, float(gain)))
+        with self._lock:
+            self.gain = gain
+            self.meter.set_gain(gain)
+        self._emit("gain", {"gain": gain})
+        return True, {"gain": gain}
+
+    def toggle_test(self) -> Tuple[bool, Any]:
+        """Starta/stoppa nivåtest"""
+        with self._lock:
+            if self.recording:
+                self._message("Kan inte testa nivåer under inspelning", warn=True)
+                return False, "Kan inte testa nivåer under inspelning"
+            try:
+                if not self.test_active:
+                    self.meter.start()
+                    self.test_active = True
+                    self._level_thread = threading.Thread(target=self._level_loop, name="level-monitor", daemon=True)
+                    self._level_thread.start()
+                    # Visa information om hur många kanaler som fångas vs visas
+                    if self.meter.device_channels != self.meter.num_channels:
+                        self._message(f"Testläge: {self.meter.device_channels} ch fångade, {self.meter.num_channels} visas")
+                    else:
+                        self._message(f"Testläge: visa nivåer ({self.meter.num_channels} ch)")
+                else:
+                    self._stop_test()
+                    self._message("Klar")
+                self._emit("test", {
+                    "active": self.test_active,
+                    "device_channels": self.meter.device_channels,
+                    "num_channels": self.meter.num_channels,
+                })
+                return True, {"test_active": self.test_active, "channels": self.meter.device_channels}
+            except Exception as e:
+                self._message(f"Testfel: {e}", warn=True)
+                return False, f"Testfel: {e}"
+
+    def _stop_test(self):
+        self.meter.stop()
+        self.test_active = False
+
+    def _level_loop(self):
+        """Vidarebefordra nivåer från ljudtråden till lyssnare (utanför ljud-callbacken)"""
+        while self.test_active:
+            rms = self.meter.read_levels(timeout=0.05)
+            if rms is not None:
+                self._emit("levels", {"rms": [float(v) for v in rms]})
+
+    def start(self, params=None) -> Tuple[bool, Any]:
+        """
+        Starta inspelning.
+
+        Args:
+            params: Valfria parametrar (gain, gains per ström, room, codec, max_duration)
+        """
+        params = params or {}
+        if self.recording:
+            return False, "Inspelning pågår redan"
+        if "gain" in params:
+            self.set_gain(params["gain"])
+        with self._lock:
+            if self.recording:
+                return False, "Inspelning pågår redan"
+            codec = params.get("codec", self._default_codec())
+            if codec not in AUDIO_CODECS:
+                return False, f"Okänd codec: {codec}"
+            gains = params.get("gains") or {}
+            unknown = set(gains) - {stream.name for stream in self.streams}
+            if unknown:
+                return False, f"Okänd ström: {', '.join(sorted(unknown))}"
+            if self.test_active:
+                self._stop_test()
+                self._emit("test", {"active": False})
+
+            stamp = ts_name()
+            self.recording_codec = codec
+            self.recording_room = params.get("room") or (self.config_manager.get("room", "") if self.config_manager else "")
+            max_duration = params.get("max_duration", self._default_max_duration())
+
+            # Spela in i enhetens egen frekvens; resampling sker i efterbearbetningen
+            capture_rate, self.recording_rate, fmt, channels = self._audio_settings()
+            tap = None
+            errors = {}
+            for stream in self.streams:
+                if len(self.streams) > 1:
+                    wav = self.audio_dir / f"meeting-{stamp}-{stream.name}.wav"
+                else:
+                    wav = self.audio_dir / f"meeting-{stamp}.wav"
+                # Gain sparas per ström och används vid konvertering
+                gain = max(0.1, min(5.0, float(gains.get(stream.name, self.gain))))
+                stream_tap = None
+                if self.preroll is not None and stream is self.streams[0]:
+                    # Källan är redan öppen: bufferten skrivs först, sedan fortsätter strömmen
+                    stream_tap = self.preroll.tap()
+                try:
+                    stream.start(wav, capture_rate, fmt, channels, gain=gain, tap=stream_tap)
+                except Exception as e:
+                    # En frånkopplad enhet ska inte stoppa inspelningen från de andra
+                    logger.error(f"Kunde inte starta ström {stream.name} ({stream.device}): {e}")
+                    errors[stream.name] = str(e)
+                    continue
+                tap = stream_tap or tap
+            if not self.recording:
+                error = "; ".join(errors.values())
+                self._message(f"Kunde inte starta inspelning: {error}", warn=True)
+                return False, f"Kunde inte starta inspelning: {error}"
+
+            self.record_start = time.time()
+            active = [stream for stream in self.streams if stream.active]
+            for stream in active:
+                self._catalog_update(stream.wav.stem, status="recording", room=self.recording_room,
+                                     started_at=self.record_start, gain=stream.gain, codec=codec)
+            self._capture_settings = (capture_rate, fmt, channels)
+            self._segments = {stream.name: {"first": stream.wav.stem, "segment": 1, "restarts": 0}
+                              for stream in active}
+            if self.watchdog:
+                self.watchdog.start(active)
+            # Stoppa automatiskt efter max längd
+            self._max_duration_timer = threading.Timer(max_duration, self._on_max_duration)
+            self._max_duration_timer.daemon = True
+            self._max_duration_timer.start()
+            files = [stream.wav.name for stream in active]
+            filename = files[0]
+            result = {"filename": filename}
+            if len(self.streams) > 1:
+                result["files"] = files
+            if errors:
+                result["errors"] = errors
+            if tap is not None:
+                result["preroll_s"] = round(tap.preroll_frames / tap.samplerate, 2)
+
+        if errors:
+            self._message(f"Inspelning pågår → {len(files)} av {len(self.streams)} enheter "
+                          f"(fel: {', '.join(errors)})", warn=True)
+        elif len(files) > 1:
+            self._message(f"Inspelning pågår → {len(files)} enheter ({filename} …)")
+        elif tap is not None:
+            self._message(f"Inspelning pågår → {filename} (+{result['preroll_s']:g} s pre-roll)")
+        else:
+            self._message(f"Inspelning pågår → {filename}")
+        recording = {"active": True, "filename": filename, "started_at": self.record_start}
+        if len(self.streams) > 1:
+            recording["files"] = files
+        self._emit("recording", recording)
+        self._set_status("recording", {"filename": filename, "room": self.recording_room})
+        return True, result
+
+    def _voice_start(self):
+        """Start från röststyrningen (vad.py)"""
+        ok, result = self.start()
+        if ok:
+            self._message(f"Tal upptäckt, inspelning pågår → {result['filename']}")
+
+    def _on_max_duration(self):
+        logger.info("Max inspelningslängd nådd, stoppar")
+        self.stop()
+
+    def stop(self) -> Tuple[bool, Any]:
+        """Stoppa inspelning och lägg konvertering + uppladdning i arbetspoolen"""
+        with self._lock:
+            if not self.recording:
+                return False, "Ingen inspelning pågår"
+            self._message("Stoppar inspelning…")
+            jobs = [self._end_segment(stream) for stream in self.streams if stream.active]
+            self._stop_recording()
+
+        # Alla strömmar kan vara avbrutna och vänta på omstart
+        files = [job[0].name for job in jobs]
+        recording = {"active": False, "filename": files[0] if files else None}
+        if len(self.streams) > 1:
+            recording["files"] = files
+        self._emit("recording", recording)
+        self._set_status("processing")
+        for job in jobs:
+            self._jobs.submit(self._convert_and_upload, *job)
+        if self._preroll_restart:
+            # Konfigurationen ändrades under inspelningen
+            self._preroll_restart = False
+            self.start_preroll()
+        result = {"filename": files[0] if files else None}
+        if len(self.streams) > 1:
+            result["files"] = files
+        return True, result
+
+    def _end_segment(self, stream: CaptureStream, **attributes):
+        """
+        Stoppa strömmens aktuella fil (under låset).
+
+        Returns:
+            Argument till _convert_and_upload för filen
+        """
+        wav = stream.wav
+        started = stream.started
+        segment = self._segments.get(stream.name, {})
+        trace = JobTrace(wav.stem, {
+            "room": self.recording_room,
+            "codec": self.recording_codec,
+            "gain": stream.gain,
+            "stream": stream.name,
+            **attributes,
+        })
+        if segment.get("segment", 1) > 1:
+            trace.attributes.update(segment=segment["segment"], first_segment=segment["first"])
+        # arecord avslutas och skriver klart WAV-huvudet
+        with trace.span("converting") as span:
+            metrics = stream.stop()
+            span.set(overflows=metrics["overflows"], cpu_s=metrics["cpu_s"])
+            if wav.exists():
+                span.set(bytes=wav.stat().st_size)
+        stopped = time.time()
+        self._catalog_update(wav.stem, status="processing", stopped_at=stopped,
+                             duration_s=round(stopped - started, 3) if started else None,
+                             wav_bytes=wav.stat().st_size if wav.exists() else None)
+        return wav, self._postprocess_settings(stream), trace, trace.start_span("queued")
+
+    def _stop_recording(self):
+        """Stoppa strömmar som fortfarande spelar in och max-längd-timern"""
+        try:
+            if self.watchdog:
+                self.watchdog.stop()
+            self._recovering.clear()
+            for stream in self.streams:
+                if stream.active:
+                    stream.stop()
+        finally:
+            self.record_start = None
+            if self._max_duration_timer:
+                self._max_duration_timer.cancel()
+                self._max_duration_timer = None
+
+    def _convert_and_upload(self, wav, job, trace, queued):
+        queued.end()
+        if not wav or not wav.exists():
+            self._message("Fil saknas efter stopp", warn=True)
+            self._set_status("error", {"message": "Fil saknas efter stopp"})
+            self._finish_job(trace, "error", "Fil saknas efter stopp")
+            return
+
+        try:
+            with maybe_profile(wav.with_suffix(".prof")):
+                self._process_job(wav, job, trace)
+        except Exception as e:
+            # Arbetspoolen sväljer annars undantaget tyst
+            logger.exception(f"Efterbearbetning av {wav.name} misslyckades")
+            self._set_status("error", {"message": f"Efterbearbetning misslyckades: {e}"})
+            self._finish_job(trace, "error", str(e))
+
+    def _process_job(self, wav, job, trace):
+        codec = job["codec"]
+        self._message(f"Komprimerar och förbättrar ljud (WAV→{codec.upper()})…")
+        self._set_status("converting")
+
+        if job["features"]:
+            # Före resamplingen: full frekvens ger bättre riktningsupplösning
+            with trace.span("features") as span:
+                try:
+                    sidecar = write_sidecar(wav, reference_channel=job["channel"] or 0)
+                    span.set(bytes=sidecar.stat().st_size)
+                except Exception as e:
+                    logger.warning(f"Features kunde inte beräknas: {e}")
+                    span.end("error")
+
+        with trace.span("resampling", rate=job["rate"]) as span:
+            try:
+                original = ensure_samplerate(wav, job["rate"])
+            except Exception as e:
+                # Okonverterad fil är bättre än ingen; ffmpeg klarar alla frekvenser
+                logger.warning(f"Resampling misslyckades, behåller originalet: {e}")
+                span.end("error")
+            else:
+                if original:
+                    span.set(from_rate=original, bytes=wav.stat().st_size)
+
+        with trace.span("encoding", codec=codec, bytes_in=wav.stat().st_size) as span:
+            paused = THROTTLE.paused_s
+            ok, flac_path, msg = encode_audio(wav, gain=job["gain"], codec=codec, channel=job["channel"])
+            if THROTTLE.paused_s > paused:
+                # Kodningen pausades för att inspelningen fick överspill
+                span.set(throttled_s=round(THROTTLE.paused_s - paused, 2))
+            if ok:
+                digest = digest_for(flac_path)
+                span.set(bytes=digest.size, sha256=digest.sha256, file=flac_path.name)
+            else:
+                span.end("error")
+        if not ok:
+            self._message(msg, warn=True)
+            self._set_status("error", {"message": msg})
+            self._finish_job(trace, "error", msg)
+            return
+        if flac_path.suffix == ENCRYPTED_SUFFIX:
+            # Krypterad kopia finns; ingen okrypterad inspelning ska ligga kvar på disk
+            wav.unlink()
+
+        self._message("Laddar upp…")
+        self._set_status("uploading")
+
+        settings = self._upload_settings()
+        with trace.span("uploading", backend=(settings or {}).get("upload_target") or UPLOAD_TARGET,
+                        bytes=flac_path.stat().st_size) as span:
+            # Status per mål (ett eller flera, t.ex. "s3,n8n")
+            targets = upload_to_targets(flac_path, settings=settings)
+            ok, info = upload_summary(targets)
+            span.set(result=info, targets=targets)
+            if not ok:
+                span.end("error")
+        if ok:
+            complete = {"filename": flac_path.name, "upload_result": info}
+            # Features, vågformstoppar och spektrogram (skrivna under kodningen) och luckmarkering
+            complete.update(upload_sidecars(wav, trace, settings=settings))
+            self._message(f"Klar! Uppladdad: {info}", flash=True)
+            self._set_status("ready")
+            with trace.span("published"):
+                self._emit("recording_complete", complete)
+            self._finish_job(trace, "ok")
+        else:
+            self._message(f"Uppladdning misslyckades: {info}", warn=True)
+            self._set_status("error", {"message": f"Uppladdning misslyckades: {info}"})
+            self._finish_job(trace, "error", f"Uppladdning misslyckades: {info}")
+
+    def _finish_job(self, trace, status: str, error: Optional[str] = None):
+        """Avsluta jobbets spårning och för över resultatet till katalogen"""
+        record = trace.finish(status, error)
+        if self.catalog:
+            try:
+                self.catalog.record_job(record)
+            except Exception as e:
+                logger.error(f"Kunde inte uppdatera inspelningskatalogen: {e}")
+
+    # ---------- Vakthund ----------
+    def _incident(self, stream: CaptureStream, reason: str, **details):
+        self._emit("incident", {"stream": stream.name, "device": stream.device, "reason": reason, **details})
+
+    def _on_capture_incident(self, stream: CaptureStream, reason: str, details: Dict[str, Any]):
+        logger.warning(f"Ström {stream.name}: {reason} {details}")
+        self._incident(stream, reason, **details)
+
+    def _on_capture_failure(self, stream: CaptureStream, reason: str, gap_start: float, details: Dict[str, Any]):
+        """Strömmen avbröts: efterbearbeta segmentet och vänta på omstart (anropas av vakthunden)"""
+        with self._lock:
+            if not stream.active or stream.name not in self._segments:
+                return   # Hann stoppas
+            number = self._segments[stream.name]["segment"]
+            job = self._end_segment(stream, incident=reason)
+            self._recovering[stream.name] = {"reason": reason, "gap_start": gap_start, "previous": job[0].name,
+                                             "failures": 0, "retry_at": 0.0}
+            preroll = self.preroll is not None and stream is self.streams[0]
+        if preroll:
+            # Pre-roll-källan kan vara det som hängt: spela in direkt från enheten resten av mötet
+            self.stop_preroll()
+            self._preroll_restart = True
+        self._jobs.submit(self._convert_and_upload, *job)
+        self._incident(stream, reason, file=job[0].name, segment=number, **details)
+        self._message(f"Ljudet från {stream.name} avbröts ({reason}), startar om inspelningen…", warn=True)
+
+    def _restart_stream(self, stream: CaptureStream) -> bool:
+        """
+        Starta en avbruten ström till ett nytt segment (anropas av vakthunden).
+
+        Bara lyckade omstarter räknas mot WATCHDOG_MAX_RESTARTS; misslyckade
+        försök görs om med växande väntan (retry_delay) tills inspelningen
+        stoppas, precis som när enheten saknas.
+
+        Returns:
+            True när strömmen inte längre väntar (omstartad eller uppgiven)
+        """
+        with self._lock:
+            pending = self._recovering.get(stream.name)
+            if pending is None or stream.active:
+                return True
+            if time.monotonic() < pending["retry_at"]:
+                return False
+            segment = self._segments[stream.name]
+            gave_up = segment["restarts"] >= WATCHDOG_MAX_RESTARTS
+            error = None
+            if gave_up:
+                del self._recovering[stream.name]
+            else:
+                number = segment["segment"] + 1
+                wav = self.audio_dir / f"{segment['first']}-seg{number}.wav"
+                capture_rate, fmt, channels = self._capture_settings
+                try:
+                    stream.start(wav, capture_rate, fmt, channels, gain=stream.gain)
+                except Exception as e:
+                    error = str(e)
+                    pending["failures"] += 1
+                    delay = retry_delay(pending["failures"])
+                    pending["retry_at"] = time.monotonic() + delay
+                else:
+                    del self._recovering[stream.name]
+                    segment["restarts"] += 1
+                    segment["segment"] = number
+                    gap = {
+                        "stream": stream.name,
+                        "segment": number,
+                        "first": segment["first"],
+                        "previous": pending["previous"],
+                        "reason": pending["reason"],
+                        "gap_start": round(pending["gap_start"], 3),
+                        "gap_end": round(stream.started, 3),
+                        "gap_s": round(stream.started - pending["gap_start"], 3),
+                    }
+                    try:
+                        write_gap_marker(wav, gap)
+                    except OSError as e:
+                        logger.warning(f"Kunde inte skriva luckmarkering för {wav.name}: {e}")
+                    self._catalog_update(wav.stem, status="recording", room=self.recording_room,
+                                         started_at=stream.started, gain=stream.gain, codec=self.recording_codec)
+                    files = [s.wav.name for s in self.streams if s.active]
+            ended = gave_up and not self.recording
+            if ended:
+                self._stop_recording()
+
+        if gave_up:
+            logger.error(f"Ger upp ström {stream.name} efter {segment['restarts']} omstarter")
+            self._incident(stream, "gave_up", restarts=segment["restarts"])
+            self._message(f"Ljudet från {stream.name} kunde inte startas om", warn=True)
+            if ended:
+                self._emit("recording", {"active": False, "filename": None})
+                self._set_status("error", {"message": f"Inspelningen avbröts: {pending['reason']}"})
+            return True
+        if error:
+            logger.warning(f"Kunde inte starta om ström {stream.name} (försök {pending['failures']}, "
+                           f"nytt försök om {delay:g} s): {error}")
+            self._incident(stream, "restart_failed", error=error, attempt=pending["failures"], retry_in_s=delay)
+            return False
+        logger.info(f"Ström {stream.name} omstartad → {wav.name} (lucka {gap['gap_s']:.1f} s)")
+        self._incident(stream, "recovered", file=wav.name, segment=number, gap_s=gap["gap_s"])
+        self._message(f"Inspelning pågår → {wav.name} (lucka {gap['gap_s']:.1f} s)", warn=True)
+        recording = {"active": True, "filename": files[0], "started_at": self.record_start}
+        if len(self.streams) > 1:
+            recording["files"] = files
+        self._emit("recording", recording)
+        return True
+
+    # ---------- Katalog ----------
+    def _catalog_update(self, name: str, **fields):
+        """Uppdatera katalogen; fel får aldrig stoppa en inspelning"""
+        if not self.catalog:
+            return
+        try:
+            self.catalog.upsert(name, **fields)
+        except Exception as e:
+            logger.error(f"Kunde inte uppdatera inspelningskatalogen: {e}")
+
+    def query_catalog(self, query: Optional[Dict[str, Any]] = None) -> Tuple[bool, Any]:
+        """
+        Fråga inspelningskatalogen (MQTT list_recordings och /api/catalog).
+
+        Args:
+            query: Filter (status, room, codec, sha256, upload_target, since,
+                until, name), limit/offset, eller {"summary": true}
+        """
+        if not self.catalog:
+            return False, "Inspelningskatalogen är inte tillgänglig"
+        query = dict(query or {})
+        try:
+            if query.pop("summary", False):
+                return True, self.catalog.summary()
+            return True, self.catalog.query(**query)
+        except ValueError as e:
+            return False, str(e)
+
+    def shutdown(self):
+        """Stoppa pågående inspelning/test och koppla från MQTT"""
+        with self._lock:
+            if self.test_active:
+                self._stop_test()
+            if self.recording:
+                # Avsluta arecord snyggt så att WAV-filerna blir kompletta; de
+                # konverteras inte nu utan ligger kvar för senare uppladdning
+                wavs = [stream.wav for stream in self.streams if stream.active]
+                logger.warning(f"Avslutar under pågående inspelning: {', '.join(map(str, wavs))}")
+                self._stop_recording()
+                for wav in wavs:
+                    self._catalog_update(wav.stem, status="local", stopped_at=time.time())
+        self.stop_preroll()
+        # Jobb som inte hunnit starta ligger kvar som WAV-filer; pågående får bli klara
+        self._jobs.shutdown(wait=False, cancel_futures=True)
+        if self.config_manager:
+            self.config_manager.flush()
+        if self.api_server:
+            self.api_server.stop()
+        if self.mqtt_client:
+            try:
+                self.mqtt_client.disconnect()
+                logger.info("MQTT-klient frånkopplad")
+            except Exception as e:
+                logger.error(f"Fel vid frånkoppling av MQTT: {e}")
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Lokal schemaläggare för tidsstyrda kommandon.
+
+Används för att starta/stoppa inspelningar vid exakta tidpunkter
+(`start_at`/`stop_at` i JSON-kommandon eller ett kalenderflöde via MQTT),
+så att möten spelas in från första sekunden utan att någon behöver
+trycka på knappen i rätt ögonblick.
+
+Här finns också valideringen av kommandoparametrar och tolkningen av
+callbackresultat, som delas av MQTT (mqtt_client.py) och HTTP (http_api.py).
+"""
+import time
+import uuid
+import heapq
+import logging
+import threading
+from datetime import datetime
+from typing import Callable, Optional, Dict, Any, List, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Längsta tid schemaläggaren sover i ett svep. Väckningstiden räknas om mot
+# systemklockan efter varje svep, så att NTP-justeringar följs.
+MAX_WAIT = 30.0
+# Sista biten före deadline väntas ut i korta steg för millisekundprecision
+SPIN_WINDOW = 0.02
+
+# Tillåtna parametrar i JSON-kommandon: namn -> (typ, min, max)
+COMMAND_PARAMS = {
+    "gain": (float, 0.1, 10.0),
+    "max_duration": (float, 1.0, 24 * 3600.0),
+    "room": (str, None, None),
+    "codec": (str, None, None),
+    "gains": (dict, 0.1, 10.0),   # gain per ström vid flera enheter, t.ex. {"nord": 1.5}
+}
+
+
+def parse_timestamp(value: Union[str, int, float]) -> float:
+    """
+    Tolka tidsstämpel som Unix-tid (sekunder).
+
+    Accepterar Unix-tid (int/float, sekunder eller millisekunder) och
+    ISO 8601-strängar. Tidsstämplar utan tidszon tolkas som lokal tid.
+
+    Args:
+        value: Tidsstämpel
+
+    Returns:
+        Unix-tid i sekunder
+
+    Raises:
+        ValueError: Om värdet inte kan tolkas
+    """
+    if isinstance(value, bool):
+        raise ValueError(f"Ogiltig tidsstämpel: {value!r}")
+    if isinstance(value, (int, float)):
+        # Tidsstämplar i millisekunder (t.ex. från JavaScript Date.now())
+        return float(value) / 1000.0 if value > 1e11 else float(value)
+    if isinstance(value, str):
+        text = value.strip()
+        if text.endswith("Z"):
+            text = text[:-1] + "+00:00"
+        try:
+            return datetime.fromisoformat(text).timestamp()
+        except ValueError:
+            pass
+    raise ValueError(f"Ogiltig tidsstämpel: {value!r}")
+
+
+def validate_params(params: Any) -> Dict[str, Any]:
+    """
+    Validera kommandoparametrar mot COMMAND_PARAMS.
+
+    Raises:
+        ValueError: Vid okänd parameter eller ogiltigt värde
+    """
+    if params is None:
+        return {}
+    if not isinstance(params, dict):
+        raise ValueError("params måste vara ett objekt")
+    clean = {}
+    for key, value in params.items():
+        if key not in COMMAND_PARAMS:
+            raise ValueError(f"Okänd parameter: {key}")
+        kind, low, high = COMMAND_PARAMS[key]
+        if kind is dict:
+            if not isinstance(value, dict):
+                raise ValueError(f"{key} måste vara ett objekt")
+            try:
+                value = {str(name): float(v) for name, v in value.items()}
+            except (TypeError, ValueError):
+                raise ValueError(f"Ogiltigt värde för {key}: {value!r}")
+            if any(not (low <= v <= high) for v in value.values()):
+                raise ValueError(f"{key} måste vara mellan {low} och {high}")
+            clean[key] = value
+            continue
+        try:
+            value = kind(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Ogiltigt värde för {key}: {value!r}")
+        if low is not None and not (low <= value <= high):
+            raise ValueError(f"{key} måste vara mellan {low} och {high}")
+        clean[key] = value.strip().lower() if key == "codec" else value
+    return clean
+
+
+def normalize_result(result) -> Tuple[bool, Any]:
+    """
+    Tolka returvärdet från en kommandocallback.
+
+    Callbacks kan returnera None (accepterat), en bool eller en tuple
+    (ok, resultat) enligt samma mönster som wav_to_flac/upload_file.
+
+    Returns:
+        Tuple med (ok, resultat)
+    """
+    if result is None:
+        return True, None
+    if isinstance(result, bool):
+        return result, None
+    if isinstance(result, tuple) and len(result) == 2:
+        return bool(result[0]), result[1]
+    return True, result
+
+
+class ScheduledJob:
+    """Ett schemalagt kommando"""
+
+    def __init__(self, job_id: str, run_at: float, action: Callable[[], Any],
+                 command: str, source: str = "command", params: Optional[Dict] = None):
+        self.job_id = job_id
+        self.run_at = run_at
+        self.action = action
+        self.command = command
+        self.source = source
+        self.params = params or {}
+        self.cancelled = False
+
+    def __lt__(self, other: "ScheduledJob") -> bool:
+        return self.run_at < other.run_at
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Beskrivning av jobbet för publicering/kvittenser"""
+        return {
+            "job_id": self.job_id,
+            "command": self.command,
+            "run_at": datetime.fromtimestamp(self.run_at).isoformat(timespec="milliseconds"),
+            "source": self.source,
+            "params": self.params,
+        }
+
+
+class CommandScheduler:
+    """Schemaläggare som kör kommandon vid angivna tidpunkter"""
+
+    def __init__(self, on_change: Optional[Callable[[List[Dict[str, Any]]], None]] = None):
+        """
+        Initiera schemaläggare.
+
+        Args:
+            on_change: Anropas med aktuell jobblista när schemat ändras
+        """
+        self._heap: List[ScheduledJob] = []
+        self._jobs: Dict[str, ScheduledJob] = {}
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+        self.on_change = on_change
+
+    def start(self):
+        """Starta schemaläggartråden"""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="command-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stoppa schemaläggartråden (schemalagda jobb körs inte)"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2)
+        self._thread = None
+
+    def schedule(self, run_at: float, action: Callable[[], Any], command: str,
+                 source: str = "command", params: Optional[Dict] = None,
+                 job_id: Optional[str] = None) -> ScheduledJob:
+        """
+        Schemalägg ett kommando.
+
+        Args:
+            run_at: Unix-tid då kommandot ska köras
+            action: Funktion att anropa
+            command: Kommandonamn (för loggning/publicering)
+            source: Ursprung, t.ex. "command" eller "calendar"
+            params: Kommandoparametrar (för publicering)
+            job_id: Eget jobb-ID (genereras om det saknas)
+
+        Returns:
+            Det schemalagda jobbet
+        """
+        job = ScheduledJob(job_id or uuid.uuid4().hex[:12], run_at, action, command, source, params)
+        with self._cond:
+            old = self._jobs.pop(job.job_id, None)
+            if old:
+                old.cancelled = True
+            self._jobs[job.job_id] = job
+            heapq.heappush(self._heap, job)
+            self._cond.notify_all()
+        logger.info(f"Schemalagt '{command}' ({job.job_id}) till {job.to_dict()['run_at']}")
+        self._notify_change()
+        return job
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Avbryt ett schemalagt jobb.
+
+        Returns:
+            True om jobbet fanns och avbröts
+        """
+        with self._cond:
+            job = self._jobs.pop(job_id, None)
+            if job:
+                job.cancelled = True
+                self._cond.notify_all()
+        if job:
+            logger.info(f"Schemalagt jobb avbrutet: {job_id}")
+            self._notify_change()
+        return job is not None
+
+    def cancel_all(self, source: Optional[str] = None) -> int:
+        """
+        Avbryt alla jobb (eller alla från en viss källa).
+
+        Returns:
+            Antal avbrutna jobb
+        """
+        with self._cond:
+            victims = [j for j in self._jobs.values() if source is None or j.source == source]
+            for job in victims:
+                job.cancelled = True
+                del self._jobs[job.job_id]
+            self._cond.notify_all()
+        if victims:
+            self._notify_change()
+        return len(victims)
+
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        """Hämta schemalagda jobb sorterade på tid"""
+        with self._cond:
+            jobs = sorted(self._jobs.values())
+        return [j.to_dict() for j in jobs]
+
+    def _notify_change(self):
+        if self.on_change:
+            try:
+                self.on_change(self.list_jobs())
+            except Exception as e:
+                logger.error(f"Fel i on_change för schemaläggare: {e}")
+
+    def _next_due(self) -> Optional[ScheduledJob]:
+        """Vänta tills nästa jobb är förfallet (anropas med låset taget)"""
+        while self._running:
+            while self._heap and self._heap[0].cancelled:
+                heapq.heappop(self._heap)
+            if not self._heap:
+                self._cond.wait()
+                continue
+            remaining = self._heap[0].run_at - time.time()
+            if remaining <= 0:
+                job = heapq.heappop(self._heap)
+                self._jobs.pop(job.job_id, None)
+                return job
+            if remaining > SPIN_WINDOW:
+                self._cond.wait(min(remaining - SPIN_WINDOW, MAX_WAIT))
+            else:
+                # Släpp låset kort; time.sleep har bättre upplösning än Condition.wait
+                self._cond.release()
+                try:
+                    time.sleep(min(remaining, 0.001))
+                finally:
+                    self._cond.acquire()
+        return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                job = self._next_due()
+            if job is None:
+                return
+            skew_ms = (time.time() - job.run_at) * 1000.0
+            logger.info(f"Kör schemalagt '{job.command}' ({job.job_id}), avvikelse {skew_ms:.1f} ms")
+            # Kör i egen tråd så att ett långsamt kommando inte försenar nästa jobb
+            threading.Thread(target=self._execute, args=(job,), name=f"job-{job.job_id}", daemon=True).start()
+            self._notify_change()
+
+    @staticmethod
+    def _execute(job: ScheduledJob):
+        try:
+            job.action()
+        except Exception as e:
+            logger.error(f"Fel i schemalagt jobb {job.job_id} ({job.command}): {e}")
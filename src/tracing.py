@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Spårning och tidsmätning av efterbearbetningsjobb.
+
+Varje inspelning får en JobTrace med spann för stegen i kedjan
+(queued, converting, encoding, uploading, published) med varaktighet,
+antal byte och uppladdningsmål. Avslutade jobb skrivs som JSON-rader till
+en roterande metriklogg och kan exporteras som Prometheus-text eller
+OpenTelemetry-liknande JSON.
+
+Med TRACE_PROFILE=true profileras jobbet med cProfile och resultatet
+sparas som <inspelning>.prof bredvid inspelningen.
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import cProfile
+import threading
+import logging.handlers
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+
+logger = logging.getLogger(__name__)
+
+METRICS_LOG = os.path.expanduser(os.getenv("METRICS_LOG", "~/.meetrec/metrics.jsonl"))
+METRICS_LOG_MAX_BYTES = int(os.getenv("METRICS_LOG_MAX_BYTES", str(1024 * 1024)))
+METRICS_LOG_BACKUPS = int(os.getenv("METRICS_LOG_BACKUPS", "5"))
+# Fil för node_exporters textfile collector (skrivs om efter varje jobb)
+METRICS_PROMETHEUS_FILE = os.getenv("METRICS_PROMETHEUS_FILE")
+# Fil dit avslutade jobb läggs till som OpenTelemetry-liknande JSON (en rad per jobb)
+METRICS_OTEL_FILE = os.getenv("METRICS_OTEL_FILE")
+TRACE_PROFILE = os.getenv("TRACE_PROFILE", "false").lower() in ("true", "1", "yes")
+
+# Antal avslutade jobb som hålls i minnet (för /api/traces)
+RECENT_TRACES = 50
+
+_metrics_logger: Optional[logging.Logger] = None
+_metrics_lock = threading.Lock()
+
+
+def _get_metrics_logger() -> Optional[logging.Logger]:
+    """Separat logger med roterande fil för metrikrader"""
+    global _metrics_logger
+    with _metrics_lock:
+        if _metrics_logger is None:
+            metrics_logger = logging.getLogger("meetrec.metrics")
+            metrics_logger.propagate = False
+            metrics_logger.setLevel(logging.INFO)
+            try:
+                Path(METRICS_LOG).parent.mkdir(parents=True, exist_ok=True)
+                handler = logging.handlers.RotatingFileHandler(
+                    METRICS_LOG, maxBytes=METRICS_LOG_MAX_BYTES, backupCount=METRICS_LOG_BACKUPS,
+                    encoding="utf-8",
+                )
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                metrics_logger.addHandler(handler)
+            except OSError as e:
+                logger.error(f"Kan inte öppna metriklogg {METRICS_LOG}: {e}")
+            _metrics_logger = metrics_logger
+        return _metrics_logger
+
+
+class Span:
+    """Ett tidsatt steg i ett jobb"""
+
+    def __init__(self, name: str, attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.status = "ok"
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+
+    def set(self, **attributes):
+        """Lägg till attribut, t.ex. bytes eller backend"""
+        self.attributes.update(attributes)
+
+    def end(self, status: Optional[str] = None):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self._start
+        if status:
+            self.status = status
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "start": self.start_time,
+            "duration_s": round(self.duration, 6) if self.duration is not None else None,
+            "status": self.status,
+            **self.attributes,
+        }
+
+
+class JobTrace:
+    """Spårning av ett efterbearbetningsjobb (en inspelning)"""
+
+    def __init__(self, job_id: str, attributes: Optional[Dict[str, Any]] = None):
+        self.job_id = job_id
+        self.trace_id = uuid.uuid4().hex
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.spans: List[Span] = []
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.finished = False
+        self.status = "running"
+        self.error: Optional[str] = None
+        self.duration: Optional[float] = None
+
+    def start_span(self, name: str, **attributes) -> Span:
+        """Starta ett spann som avslutas med Span.end()"""
+        span = Span(name, attributes)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Spann som kontexthanterare; undantag markerar spannet som error"""
+        span = self.start_span(name, **attributes)
+        try:
+            yield span
+        except Exception as e:
+            span.set(error=str(e))
+            span.end("error")
+            raise
+        finally:
+            span.end()
+
+    def event(self, name: str, **attributes) -> Span:
+        """Spann utan varaktighet, t.ex. 'published'"""
+        span = self.start_span(name, **attributes)
+        span.end()
+        return span
+
+    def finish(self, status: str = "ok", error: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Avsluta jobbet och skriv till metriklogg och exporter.
+
+        Returns:
+            Jobbet som dictionary
+        """
+        with self._lock:
+            if self.finished:
+                return self.to_dict()
+            self.finished = True
+            for span in self.spans:
+                span.end()
+        self.status = status
+        self.error = error
+        self.duration = time.perf_counter() - self._start
+        record = self.to_dict()
+        REGISTRY.record(record)
+
+        metrics_logger = _get_metrics_logger()
+        if metrics_logger:
+            metrics_logger.info(json.dumps(record, ensure_ascii=False))
+        if METRICS_PROMETHEUS_FILE:
+            _write_text_atomic(METRICS_PROMETHEUS_FILE, REGISTRY.prometheus_text())
+        if METRICS_OTEL_FILE:
+            try:
+                with open(METRICS_OTEL_FILE, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(otel_json([record])) + "\n")
+            except OSError as e:
+                logger.error(f"Kan inte skriva {METRICS_OTEL_FILE}: {e}")
+
+        summary = ", ".join(f"{s['name']} {s['duration_s']:.2f}s" for s in record["spans"] if s["duration_s"])
+        logger.info(f"Jobb {self.job_id} {status} på {self.duration:.2f}s ({summary})")
+        return record
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = [s.to_dict() for s in self.spans]
+        return {
+            "job_id": self.job_id,
+            "trace_id": self.trace_id,
+            "start": self.start_time,
+            "duration_s": round(self.duration if self.duration is not None else time.perf_counter() - self._start, 6),
+            "status": self.status,
+            "error": self.error,
+            **self.attributes,
+            "spans": spans,
+        }
+
+
+class MetricsRegistry:
+    """Aggregerade mätvärden över avslutade jobb"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.jobs_total: Dict[str, int] = {}
+        self.span_seconds: Dict[str, float] = {}
+        self.span_count: Dict[str, int] = {}
+        self.span_bytes: Dict[str, int] = {}
+        self.upload_bytes: Dict[str, int] = {}
+        self.last_job: Optional[Dict[str, Any]] = None
+        self.recent = deque(maxlen=RECENT_TRACES)
+
+    def record(self, job: Dict[str, Any]):
+        with self._lock:
+            self.jobs_total[job["status"]] = self.jobs_total.get(job["status"], 0) + 1
+            for span in job["spans"]:
+                name = span["name"]
+                self.span_seconds[name] = self.span_seconds.get(name, 0.0) + (span["duration_s"] or 0.0)
+                self.span_count[name] = self.span_count.get(name, 0) + 1
+                if span.get("bytes"):
+                    self.span_bytes[name] = self.span_bytes.get(name, 0) + int(span["bytes"])
+                if name == "uploading" and span.get("backend") and span.get("bytes"):
+                    backend = span["backend"]
+                    self.upload_bytes[backend] = self.upload_bytes.get(backend, 0) + int(span["bytes"])
+            self.last_job = job
+            self.recent.appendleft(job)
+
+    def traces(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self.recent)
+
+    def prometheus_text(self) -> str:
+        """Mätvärden i Prometheus textformat"""
+        lines = []
+        with self._lock:
+            lines += [
+                "# HELP meetrec_jobs_total Avslutade efterbearbetningsjobb per status",
+                "# TYPE meetrec_jobs_total counter",
+            ]
+            lines += [f'meetrec_jobs_total{{status="{k}"}} {v}' for k, v in sorted(self.jobs_total.items())]
+            lines += [
+                "# HELP meetrec_span_duration_seconds Tid per steg i efterbearbetningen",
+                "# TYPE meetrec_span_duration_seconds summary",
+            ]
+            for name in sorted(self.span_count):
+                lines.append(f'meetrec_span_duration_seconds_sum{{span="{name}"}} {self.span_seconds[name]:.6f}')
+                lines.append(f'meetrec_span_duration_seconds_count{{span="{name}"}} {self.span_count[name]}')
+            lines += [
+                "# HELP meetrec_span_bytes_total Byte behandlade per steg",
+                "# TYPE meetrec_span_bytes_total counter",
+            ]
+            lines += [f'meetrec_span_bytes_total{{span="{k}"}} {v}' for k, v in sorted(self.span_bytes.items())]
+            lines += [
+                "# HELP meetrec_upload_bytes_total Uppladdade byte per mål",
+                "# TYPE meetrec_upload_bytes_total counter",
+            ]
+            lines += [f'meetrec_upload_bytes_total{{backend="{k}"}} {v}' for k, v in sorted(self.upload_bytes.items())]
+            if self.last_job:
+                lines += [
+                    "# HELP meetrec_last_job_duration_seconds Total tid för senaste jobbet",
+                    "# TYPE meetrec_last_job_duration_seconds gauge",
+                    f"meetrec_last_job_duration_seconds {self.last_job['duration_s']:.6f}",
+                    "# HELP meetrec_last_job_timestamp_seconds När senaste jobbet startade",
+                    "# TYPE meetrec_last_job_timestamp_seconds gauge",
+                    f"meetrec_last_job_timestamp_seconds {self.last_job['start']:.3f}",
+                ]
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def otel_json(jobs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Jobb i OpenTelemetry-liknande JSON (OTLP resourceSpans-struktur).
+
+    Varje jobb blir ett rotspann med stegen som barnspann.
+    """
+    def attributes(data: Dict[str, Any], skip=()) -> List[Dict[str, Any]]:
+        result = []
+        for key, value in data.items():
+            if key in skip or value is None or isinstance(value, (list, dict)):
+                continue
+            if isinstance(value, bool):
+                typed = {"boolValue": value}
+            elif isinstance(value, int):
+                typed = {"intValue": str(value)}
+            elif isinstance(value, float):
+                typed = {"doubleValue": value}
+            else:
+                typed = {"stringValue": str(value)}
+            result.append({"key": key, "value": typed})
+        return result
+
+    def nanos(seconds: float) -> str:
+        return str(int(seconds * 1e9))
+
+    spans = []
+    for job in jobs:
+        root_id = job["trace_id"][:16]
+        spans.append({
+            "traceId": job["trace_id"],
+            "spanId": root_id,
+            "name": "job",
+            "startTimeUnixNano": nanos(job["start"]),
+            "endTimeUnixNano": nanos(job["start"] + job["duration_s"]),
+            "status": {"code": "STATUS_CODE_OK" if job["status"] == "ok" else "STATUS_CODE_ERROR"},
+            "attributes": attributes(job, skip=("trace_id", "start", "spans")),
+        })
+        for span in job["spans"]:
+            duration = span["duration_s"] or 0.0
+            spans.append({
+                "traceId": job["trace_id"],
+                "spanId": span["span_id"],
+                "parentSpanId": root_id,
+                "name": span["name"],
+                "startTimeUnixNano": nanos(span["start"]),
+                "endTimeUnixNano": nanos(span["start"] + duration),
+                "status": {"code": "STATUS_CODE_OK" if span["status"] == "ok" else "STATUS_CODE_ERROR"},
+                "attributes": attributes(span, skip=("name", "span_id", "start", "status")),
+            })
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "meetrec"}}]},
+            "scopeSpans": [{"scope": {"name": "meetrec.tracing"}, "spans": spans}],
+        }]
+    }
+
+
+@contextmanager
+def maybe_profile(output: Path):
+    """Profilera blocket med cProfile om TRACE_PROFILE är satt"""
+    if not TRACE_PROFILE:
+        yield None
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        try:
+            profiler.dump_stats(str(output))
+            logger.info(f"Profil sparad: {output}")
+        except OSError as e:
+            logger.error(f"Kunde inte spara profil {output}: {e}")
+
+
+def _write_text_atomic(path: str, text: str):
+    tmp = f"{path}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.error(f"Kan inte skriva {path}: {e}")
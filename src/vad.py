@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Röststyrd start och stopp av inspelning (AUTO_RECORD).
+
+Möten startas ofta aldrig, eller stoppas aldrig och spelas in tills
+MAX_HOURS nås. Med AUTO_RECORD=true hålls ljudkällan öppen (samma väg som
+pre-roll och nivåmätaren, se preroll.py) och en enkel VAD räknar tal per
+ljudblock:
+
+- Inspelningen startar när det varit minst AUTO_START_SPEECH_S sekunder
+  tal inom dubbelt så lång tid. Pre-roll-bufferten är minst lika lång som
+  det fönstret, så talet som startade inspelningen kommer med.
+- En pågående inspelning (även manuellt startad) stoppas efter
+  AUTO_STOP_SILENCE_S sekunder utan tal.
+- Efter ett stopp (även manuellt, mitt i ett samtal) startar inget nytt
+  förrän det varit tyst i AUTO_REARM_SILENCE_S sekunder.
+
+VAD:n är samma princip som i features.py (energi över ett adaptivt
+brusgolv och andel energi i talbandet), men körs block för block: en
+medelkvadrat och en FFT på ~64 ms ljud i ljud-callbacken. Besluten fattas
+i en egen tråd.
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+from typing import Callable, Optional, Dict, Any
+
+import numpy as np
+
+from audio_source import AudioSource
+from features import VAD_MARGIN_DB, VAD_FLOOR_SECONDS, VAD_HANGOVER_S, SPEECH_BAND
+
+logger = logging.getLogger(__name__)
+
+AUTO_RECORD = os.getenv("AUTO_RECORD", "false").lower() in ("true", "1", "yes")
+# Sekunder tal som startar en inspelning och sekunder tystnad som stoppar den
+AUTO_START_SPEECH_S = float(os.getenv("AUTO_START_SPEECH_S", "3"))
+AUTO_STOP_SILENCE_S = float(os.getenv("AUTO_STOP_SILENCE_S", "300"))
+# Sekunder tystnad efter ett stopp innan tal får starta en ny inspelning
+AUTO_REARM_SILENCE_S = float(os.getenv("AUTO_REARM_SILENCE_S", "60"))
+
+# Under den här nivån räknas inget som tal (dBFS), oavsett brusgolv
+MIN_SPEECH_DBFS = -60.0
+# Hur fort brusgolvet får stiga (dB/s); det sjunker direkt till tystare block
+FLOOR_RISE_DB_PER_S = VAD_MARGIN_DB / VAD_FLOOR_SECONDS
+# Andel av blockets energi som måste ligga i talbandet
+MIN_SPEECH_RATIO = 0.5
+CHECK_INTERVAL_S = 0.5
+
+
+def start_window(start_speech_s: float) -> float:
+    """Fönster som talet för att starta räknas inom (och minsta pre-roll)"""
+    return 2 * start_speech_s
+
+
+class BlockVAD:
+    """Talaktivitet per ljudblock med adaptivt brusgolv"""
+
+    def __init__(self, samplerate: int):
+        self.samplerate = samplerate
+        self.floor_db: Optional[float] = None
+        self.level_db = MIN_SPEECH_DBFS
+
+    def is_speech(self, samples: np.ndarray) -> bool:
+        samples = samples.astype(np.float32) / 32768.0
+        power = float(np.mean(np.square(samples)))
+        self.level_db = level = float(10 * np.log10(power + 1e-12))
+        seconds = len(samples) / self.samplerate
+        if self.floor_db is None or level < self.floor_db:
+            self.floor_db = level
+        else:
+            self.floor_db += FLOOR_RISE_DB_PER_S * seconds
+        if level < MIN_SPEECH_DBFS or level < self.floor_db + VAD_MARGIN_DB:
+            return False
+        spectrum = np.square(np.abs(np.fft.rfft(samples)))
+        freqs = np.fft.rfftfreq(len(samples), 1.0 / self.samplerate)
+        band = (freqs >= SPEECH_BAND[0]) & (freqs <= SPEECH_BAND[1])
+        return spectrum[band].sum() > MIN_SPEECH_RATIO * (spectrum.sum() + 1e-12)
+
+
+class VoiceActivation:
+    """
+    Startar och stoppar inspelning efter talaktivitet på en öppen källa.
+
+    on_start/on_stop anropas från en egen tråd (aldrig från ljud-callbacken);
+    is_recording talar om ifall en inspelning pågår.
+    """
+
+    def __init__(self, on_start: Callable[[], Any], on_stop: Callable[[], Any],
+                 is_recording: Callable[[], bool], start_speech_s: float = AUTO_START_SPEECH_S,
+                 stop_silence_s: float = AUTO_STOP_SILENCE_S, rearm_silence_s: float = AUTO_REARM_SILENCE_S,
+                 channel: int = 0):
+        self.on_start = on_start
+        self.on_stop = on_stop
+        self.is_recording = is_recording
+        self.start_speech_s = start_speech_s
+        self.stop_silence_s = stop_silence_s
+        self.rearm_silence_s = rearm_silence_s
+        self.window_s = start_window(start_speech_s)
+        self.channel = channel
+        self.speech_s = 0.0                      # Tal inom fönstret
+        self.last_speech = time.monotonic()
+        self._blocks: deque = deque()            # (tid, sekunder tal)
+        self._reset = False                      # Töm fönstret (görs i ljud-callbacken)
+        self.armed = True                        # Falskt efter stopp tills det varit tyst
+        self._vad: Optional[BlockVAD] = None
+        self._source: Optional[AudioSource] = None
+        self._stop = threading.Event()
+
+    def start(self, source: AudioSource):
+        """Börja lyssna på källan (t.ex. PrerollCapture.tap(include_preroll=False))"""
+        self._vad = BlockVAD(source.samplerate)
+        self._source = source
+        self._stop = threading.Event()
+        source.start(self._callback)
+        threading.Thread(target=self._loop, args=(self._stop,), name="voice-activation", daemon=True).start()
+        logger.info(f"Röststyrd inspelning: start efter {self.start_speech_s:g} s tal, "
+                    f"stopp efter {self.stop_silence_s:g} s tystnad")
+
+    def stop(self):
+        """Sluta lyssna (väntar inte in tråden, kan anropas från on_start/on_stop)"""
+        self._stop.set()
+        if self._source is not None:
+            self._source.stop()
+            self._source = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "speech_s": round(self.speech_s, 1),
+            "silence_s": round(time.monotonic() - self.last_speech, 1),
+            "level_db": round(self._vad.level_db, 1) if self._vad else None,
+            "armed": self.armed,
+        }
+
+    def _callback(self, indata, frames, time_info, status):
+        channel = min(self.channel, indata.shape[1] - 1)
+        now = time.monotonic()
+        if self._vad.is_speech(indata[:, channel]):
+            self.last_speech = now
+        # Pauser mellan stavelser (kortare än VAD_HANGOVER_S) räknas som tal
+        speech = now - self.last_speech <= VAD_HANGOVER_S
+        seconds = frames / self._vad.samplerate if speech else 0.0
+        if self._reset:
+            self._reset = False
+            self._blocks.clear()
+            self.speech_s = 0.0
+        self._blocks.append((now, seconds))
+        self.speech_s += seconds
+        while self._blocks and now - self._blocks[0][0] > self.window_s:
+            self.speech_s -= self._blocks.popleft()[1]
+
+    def _loop(self, stop: threading.Event):
+        was_recording = self.is_recording()
+        while not stop.wait(CHECK_INTERVAL_S):
+            now = time.monotonic()
+            recording = self.is_recording()
+            if recording and not was_recording:
+                # Nyss startad (även manuellt): tystnaden räknas från starten
+                self.last_speech = max(self.last_speech, now)
+            elif was_recording and not recording:
+                # Nyss stoppad (även manuellt): talet som pågick ska inte starta en ny inspelning
+                self._reset = True
+                self.armed = False
+            was_recording = recording
+            if not self.armed and now - self.last_speech >= self.rearm_silence_s:
+                self.armed = True
+                self._reset = True
+            try:
+                if not recording and self.armed and self.speech_s >= self.start_speech_s:
+                    logger.info(f"Tal upptäckt ({self.speech_s:.1f} s), startar inspelning")
+                    self._reset = True
+                    self.on_start()
+                elif recording and now - self.last_speech >= self.stop_silence_s:
+                    logger.info(f"Tyst i {now - self.last_speech:.0f} s, stoppar inspelning")
+                    self._reset = True
+                    self.on_stop()
+            except Exception:
+                logger.exception("Röststyrd start/stopp misslyckades")
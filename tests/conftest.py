@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Modulerna ligger platt i src/ och importeras som i tjänsterna
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
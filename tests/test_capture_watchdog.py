@@ -0,0 +1,28 @@
+import pytest
+
+from capture_watchdog import WATCHDOG_RETRY_MAX, alsa_cards, parse_card, retry_delay
+
+
+@pytest.mark.parametrize("device, card", [
+    ("hw:1,0", "1"),
+    ("plughw:CARD=ArrayUAC10,DEV=0", "ArrayUAC10"),
+    ("default", None),
+    ("pulse", None),
+    (None, None),
+])
+def test_parse_card(device, card):
+    assert parse_card(device) == card
+
+
+def test_alsa_cards(tmp_path):
+    cards = tmp_path / "cards"
+    cards.write_text(" 0 [Headphones     ]: bcm2835_headpho - bcm2835 Headphones\n"
+                     "                      bcm2835 Headphones\n"
+                     " 1 [ArrayUAC10     ]: USB-Audio - ReSpeaker 4 Mic Array (UAC1.0)\n")
+    assert alsa_cards(str(cards)) == {"0", "Headphones", "1", "ArrayUAC10"}
+    assert alsa_cards(str(tmp_path / "missing")) is None
+
+
+def test_retry_delay_doubles_up_to_max():
+    assert [retry_delay(n, interval=2.0) for n in range(1, 5)] == [2.0, 4.0, 8.0, 16.0]
+    assert retry_delay(20, interval=2.0) == WATCHDOG_RETRY_MAX
@@ -0,0 +1,125 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from catalog import DEFAULT_LIMIT, MAX_LIMIT, Catalog, parse_query, started_from_name
+from tracing import JobTrace
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    catalog = Catalog(tmp_path / "catalog.db")
+    yield catalog
+    catalog.close()
+
+
+def test_parse_query_defaults():
+    assert parse_query(None) == {}
+    assert parse_query({}) == {"limit": DEFAULT_LIMIT}
+    # Tomma värden ignoreras (t.ex. tomma fält i ett formulär)
+    assert parse_query({"room": "", "status": None}) == {"limit": DEFAULT_LIMIT}
+
+
+def test_parse_query_limit():
+    assert parse_query({"limit": "20", "offset": 40}) == {"limit": 20, "offset": 40}
+    assert parse_query({"limit": MAX_LIMIT * 10})["limit"] == MAX_LIMIT
+    for bad in ({"limit": -1}, {"offset": "tio"}, {"limit": [5]}):
+        with pytest.raises(ValueError):
+            parse_query(bad)
+
+
+def test_parse_query_times():
+    utc = datetime(2026, 1, 1, 10, 0, tzinfo=timezone.utc).timestamp()
+    assert parse_query({"since": utc})["since"] == utc
+    assert parse_query({"since": str(utc)})["since"] == utc
+    assert parse_query({"since": "2026-01-01T10:00:00Z"})["since"] == utc
+    assert parse_query({"until": "2026-01-01T12:00:00+02:00"})["until"] == utc
+    # Utan tidszon: lokal tid
+    assert parse_query({"since": "2026-01-01"})["since"] == datetime(2026, 1, 1).timestamp()
+    with pytest.raises(ValueError, match="Ogiltig tidpunkt"):
+        parse_query({"since": "i går"})
+
+
+def test_parse_query_rejects():
+    with pytest.raises(ValueError, match="Okänt filter"):
+        parse_query({"sort": "name"})
+    with pytest.raises(ValueError, match="Okänd status"):
+        parse_query({"status": "done"})
+    with pytest.raises(ValueError):
+        parse_query(["status"])
+
+
+def test_started_from_name():
+    assert started_from_name("meeting-20260101-101010") == datetime(2026, 1, 1, 10, 10, 10).timestamp()
+    assert started_from_name("meeting-20260101-101010-ch2") == datetime(2026, 1, 1, 10, 10, 10).timestamp()
+    assert started_from_name("anteckningar") is None
+
+
+def finished_job(name: str, status="ok", error=None):
+    trace = JobTrace(name)
+    with trace.span("encoding", codec="flac") as span:
+        span.set(bytes=1234, sha256="ab" * 32, file=f"{name}.flac")
+    with trace.span("uploading", backend="s3") as span:
+        span.set(result=f"s3://bucket/meetings/{name}.flac")
+    return trace.finish(status, error)
+
+
+def test_record_job_round_trip(catalog):
+    name = "meeting-20260101-101010"
+    catalog.upsert(name, status="processing", room="A", started_at=started_from_name(name), codec="flac")
+    record = finished_job(name)
+    catalog.record_job(record)
+
+    item = catalog.get(name)
+    assert item["status"] == "uploaded" and item["error"] is None
+    assert (item["file"], item["size"], item["sha256"]) == (f"{name}.flac", 1234, "ab" * 32)
+    assert item["upload_target"] == "s3" and item["upload_result"] == f"s3://bucket/meetings/{name}.flac"
+    assert item["trace_id"] == record["trace_id"]
+    assert set(item["timings"]) == {"encoding", "uploading"}
+    # Fält som jobbet inte känner till behålls
+    assert item["room"] == "A" and item["codec"] == "flac"
+
+    assert catalog.query(sha256="ab" * 32)["items"] == [item]
+    assert catalog.query(status="uploaded", room="A")["total"] == 1
+    assert catalog.query(name=name) == {"total": 1, "items": [item]}
+    assert catalog.query(status="error") == {"total": 0, "items": []}
+
+
+def test_record_failed_job(catalog):
+    catalog.record_job(finished_job("meeting-20260101-111111", status="error", error="HTTP 500"))
+    item = catalog.get("meeting-20260101-111111")
+    assert item["status"] == "error" and item["error"] == "HTTP 500"
+    assert catalog.summary()["error"]["count"] == 1
+
+
+def test_query_order_and_paging(catalog):
+    names = [f"meeting-2026010{day}-090000" for day in range(1, 6)]
+    for name in names:
+        catalog.upsert(name, status="local", started_at=started_from_name(name), size=10)
+    page = catalog.query(limit=2, offset=1)
+    assert page["total"] == 5
+    assert [item["name"] for item in page["items"]] == [names[3], names[2]]
+    since = catalog.query(since=started_from_name(names[2]), until=started_from_name(names[4]))
+    assert [item["name"] for item in since["items"]] == [names[3], names[2]]
+    assert catalog.summary() == {"local": {"count": 5, "bytes": 50, "seconds": 0}}
+
+
+def test_upsert_rejects_unknown_fields(catalog):
+    with pytest.raises(ValueError, match="Okända fält: colour"):
+        catalog.upsert("meeting-20260101-101010", colour="blå")
+
+
+def test_import_directory(catalog, tmp_path):
+    audio = tmp_path / "audio"
+    audio.mkdir()
+    (audio / "meeting-20260101-101010.wav").write_bytes(b"x" * 100)
+    (audio / "meeting-20260101-101010.flac").write_bytes(b"x" * 40)
+    (audio / "meeting-20260102-101010.opus.enc").write_bytes(b"x" * 30)
+    (audio / "notes.txt").write_text("x")
+    assert catalog.import_directory(audio) == 2
+    first = catalog.get("meeting-20260101-101010")
+    assert (first["wav_bytes"], first["file"], first["size"], first["codec"]) == (100, "meeting-20260101-101010.flac",
+                                                                                   40, "flac")
+    assert catalog.get("meeting-20260102-101010")["codec"] == "opus"
+    # Redan importerade inspelningar läggs inte till igen
+    assert catalog.import_directory(audio) == 0
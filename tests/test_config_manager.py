@@ -0,0 +1,212 @@
+import os
+import json
+import time
+
+import pytest
+
+import config_manager
+from config_manager import CONFIG_SCHEMA, ConfigField, ConfigManager, write_json_atomic
+
+
+@pytest.fixture(autouse=True)
+def clean_env(monkeypatch):
+    # Standardvärdena ska komma från schemat, inte från testmaskinens miljö
+    for field in CONFIG_SCHEMA.values():
+        if field.env:
+            monkeypatch.delenv(field.env, raising=False)
+
+
+def make_manager(tmp_path, **kwargs) -> ConfigManager:
+    kwargs.setdefault("save_delay", 0)
+    return ConfigManager(tmp_path / "config.json", **kwargs)
+
+
+def read_config(tmp_path) -> dict:
+    return json.loads((tmp_path / "config.json").read_text())
+
+
+@pytest.fixture
+def writes(monkeypatch):
+    """Räkna skrivningar av konfigurationsfilen"""
+    calls = []
+
+    def counting_write(path, data, mode=None):
+        calls.append(dict(data))
+        write_json_atomic(path, data, mode)
+
+    monkeypatch.setattr(config_manager, "write_json_atomic", counting_write)
+    return calls
+
+
+@pytest.mark.parametrize("key, value, expected", [
+    ("gain", "1.5", 1.5),
+    ("gain", 2, 2.0),
+    ("mqtt_port", "8883", 8883),
+    ("features_enabled", "yes", True),
+    ("features_enabled", "0", False),
+    ("codec", " opus ", "opus"),
+    ("room", None, ""),
+    ("upload_target", "s3, n8n,s3", "s3,n8n"),
+])
+def test_coerce(key, value, expected):
+    assert CONFIG_SCHEMA[key].coerce(value) == expected
+
+
+@pytest.mark.parametrize("key, value", [
+    ("gain", 0.05),
+    ("gain", "hög"),
+    ("gain", True),
+    ("mqtt_port", 70000),
+    ("features_enabled", "kanske"),
+    ("codec", "mp3"),
+    ("sample_rate", 12345),
+    ("room", 12),
+    ("upload_target", "s3,ftp"),
+    ("upload_target", " , "),
+])
+def test_coerce_rejects(key, value):
+    with pytest.raises(ValueError):
+        CONFIG_SCHEMA[key].coerce(value)
+
+
+def test_default_from_env(monkeypatch):
+    field = ConfigField(float, 1.0, env="TEST_GAIN", min_value=0.1, max_value=5.0)
+    assert field.default_value() == 1.0
+    monkeypatch.setenv("TEST_GAIN", "2.5")
+    assert field.default_value() == 2.5
+    # Ogiltig miljövariabel: standardvärdet används
+    monkeypatch.setenv("TEST_GAIN", "99")
+    assert field.default_value() == 1.0
+
+
+def test_validate():
+    valid, errors = ConfigManager.validate({"gain": "2", "codec": "mp3", "volume": 3})
+    assert valid == {"gain": 2.0}
+    assert set(errors) == {"codec", "volume"} and errors["volume"] == "okänd parameter"
+    assert ConfigManager.validate([1]) == ({}, {"*": "konfigurationen måste vara ett JSON-objekt"})
+
+
+def test_update_rejects_bad_type(tmp_path):
+    manager = make_manager(tmp_path)
+    assert manager.update({"gain": "hög", "room": "A"}) is False
+    # Giltiga värden tillämpas ändå; det ogiltiga lämnar det gamla värdet orört
+    assert manager.get("gain") == 1.0 and manager.get("room") == "A"
+    assert read_config(tmp_path) == {"room": "A"}
+
+
+def test_listeners(tmp_path):
+    manager = make_manager(tmp_path)
+    everything, audio = [], []
+    manager.add_listener(everything.append)
+    manager.add_listener(audio.append, keys=("gain", "codec"))
+    manager.add_listener(lambda changes: 1 / 0)
+    manager.update({"gain": 2.0, "room": "A"})
+    assert everything == [{"gain": (1.0, 2.0), "room": ("", "A")}]
+    assert audio == [{"gain": (1.0, 2.0)}]
+    # Oförändrade värden ger ingen notis; en lyssnare som kastar stoppar inte de andra
+    manager.update({"gain": "2", "room": "B"})
+    assert everything[-1] == {"room": ("A", "B")}
+    assert len(audio) == 1
+
+
+def test_save_and_reload_keeps_unknown_keys(tmp_path):
+    (tmp_path / "config.json").write_text(json.dumps({
+        "room": "Styrelserummet",
+        "gain": "fel",
+        "future_option": {"a": 1},
+    }))
+    manager = make_manager(tmp_path)
+    assert manager.get("room") == "Styrelserummet"
+    assert manager.get("gain") == 1.0 and manager.get("future_option") is None
+    manager.set("email", "a@example.com")
+    # Okända och ogiltiga nycklar skrivs tillbaka oförändrade
+    assert read_config(tmp_path) == {"room": "Styrelserummet", "email": "a@example.com",
+                                     "gain": "fel", "future_option": {"a": 1}}
+
+    # Ett giltigt värde ersätter det ogiltiga i filen
+    manager.set("gain", 2.0)
+    reloaded = make_manager(tmp_path)
+    assert reloaded.get("gain") == 2.0 and reloaded.get("email") == "a@example.com"
+    assert read_config(tmp_path)["gain"] == 2.0 and read_config(tmp_path)["future_option"] == {"a": 1}
+
+
+def test_only_overrides_saved(tmp_path, monkeypatch):
+    manager = make_manager(tmp_path)
+    manager.update({"room": "A", "codec": "flac"})
+    assert read_config(tmp_path) == {"room": "A"}
+    # Ändrad miljövariabel slår igenom för det som inte satts explicit
+    monkeypatch.setenv("AUDIO_CODEC", "opus")
+    assert make_manager(tmp_path).get("codec") == "opus"
+
+
+def test_get_all_masks_secrets(tmp_path):
+    manager = make_manager(tmp_path)
+    manager.update({"mqtt_password": "hemligt", "room": "A"})
+    public = manager.get_all()
+    assert public["mqtt_password"] == "***" and public["http_auth_header"] == "" and public["room"] == "A"
+
+
+# ---------- Skrivningar (atomiska, fördröjda och batchade) ----------
+
+
+def test_transaction_writes_once(tmp_path, writes):
+    manager = make_manager(tmp_path)
+    with manager.transaction():
+        manager.set("room", "A")
+        manager.set("email", "a@example.com")
+        with manager.transaction():
+            manager.update({"gain": 2.0, "codec": "opus"})
+        assert writes == []
+    assert writes == [{"room": "A", "email": "a@example.com", "gain": 2.0, "codec": "opus"}]
+    # Inga ändringar i transaktionen: ingen skrivning
+    with manager.transaction():
+        manager.set("room", "A")
+    assert len(writes) == 1
+
+
+def test_delayed_save_writes_once(tmp_path, writes):
+    manager = make_manager(tmp_path, save_delay=0.5)
+    for n in range(5):
+        manager.set("room", f"rum {n}")
+        time.sleep(0.05)
+    # Varje ändring förlänger väntetiden
+    assert writes == []
+    time.sleep(1.0)
+    assert writes == [{"room": "rum 4"}]
+    assert read_config(tmp_path) == {"room": "rum 4"}
+    assert manager.flush() is True and len(writes) == 1
+
+
+def test_flush_writes_pending_changes(tmp_path, writes):
+    manager = make_manager(tmp_path, save_delay=60)
+    manager.set("room", "A")
+    assert writes == [] and manager.flush() is True
+    assert read_config(tmp_path) == {"room": "A"}
+    assert manager._save_timer is None
+
+
+def test_failed_write_keeps_old_file(tmp_path, monkeypatch):
+    manager = make_manager(tmp_path)
+    manager.set("room", "A")
+    before = (tmp_path / "config.json").read_bytes()
+
+    def failing_dump(data, f, **kwargs):
+        f.write('{"room": "B", "ema')
+        raise OSError("Disken är full")
+
+    monkeypatch.setattr(config_manager.json, "dump", failing_dump)
+    assert manager.set("room", "B") is False
+    monkeypatch.undo()
+    # Den gamla filen är orörd och den halva temporära filen är borta
+    assert (tmp_path / "config.json").read_bytes() == before
+    assert os.listdir(tmp_path) == ["config.json"]
+    # Ändringen finns kvar i minnet och skrivs vid nästa försök
+    assert manager.get("room") == "B" and manager.flush() is True
+    assert read_config(tmp_path) == {"room": "B"}
+
+
+def test_write_json_atomic_mode(tmp_path):
+    path = tmp_path / "secret.json"
+    write_json_atomic(path, {"a": 1}, mode=0o600)
+    assert json.loads(path.read_text()) == {"a": 1}
+    assert path.stat().st_mode & 0o777 == 0o600
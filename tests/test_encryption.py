@@ -0,0 +1,110 @@
+import io
+import os
+
+import pytest
+
+import encryption
+from encryption import (HEADER_SIZE, TAG_SIZE, EncryptingWriter, Encryptor, decrypt_stream,
+                        encrypted_size)
+from integrity import HashingWriter
+
+pytestmark = pytest.mark.skipif(not encryption.CRYPTOGRAPHY_AVAILABLE, reason="cryptography saknas")
+
+CHUNK = 1024
+DEVICE_KEY = bytes(range(32))
+
+
+def encrypt(tmp_path, plain: bytes, cipher: str = "aes-gcm", writes: int = 3) -> bytes:
+    writer = EncryptingWriter(HashingWriter(tmp_path / "rec.flac.enc"), Encryptor(DEVICE_KEY, cipher, CHUNK))
+    step = max(1, -(-len(plain) // writes))
+    for i in range(0, len(plain), step):
+        writer.write(plain[i:i + step])
+    digest = writer.commit()
+    data = (tmp_path / "rec.flac.enc").read_bytes()
+    assert writer.size == len(plain)
+    assert digest.size == len(data)
+    return data
+
+
+def decrypt(data: bytes, key: bytes = DEVICE_KEY) -> bytes:
+    out = io.BytesIO()
+    assert decrypt_stream(io.BytesIO(data), out, key) == len(out.getvalue())
+    return out.getvalue()
+
+
+def blocks(data: bytes):
+    body = data[HEADER_SIZE:]
+    size = CHUNK + TAG_SIZE
+    return data[:HEADER_SIZE], [body[i:i + size] for i in range(0, len(body), size)]
+
+
+@pytest.mark.parametrize("cipher", ["aes-gcm", "chacha20"])
+@pytest.mark.parametrize("size", [0, 1, CHUNK, CHUNK + 1, 3 * CHUNK])
+def test_round_trip(tmp_path, cipher, size):
+    plain = os.urandom(size)
+    data = encrypt(tmp_path, plain, cipher)
+    assert len(data) == encrypted_size(size, CHUNK)
+    assert decrypt(data) == plain
+
+
+def test_encrypted_size():
+    assert encrypted_size(0, CHUNK) == HEADER_SIZE + TAG_SIZE
+    assert encrypted_size(CHUNK, CHUNK) == HEADER_SIZE + CHUNK + TAG_SIZE
+    assert encrypted_size(CHUNK + 1, CHUNK) == HEADER_SIZE + CHUNK + 1 + 2 * TAG_SIZE
+
+
+def test_truncated_at_block_boundary(tmp_path):
+    data = encrypt(tmp_path, os.urandom(3 * CHUNK))
+    header, parts = blocks(data)
+    assert len(parts) == 3
+    # Ett helt block bortkapat: det nya sista blocket är inte märkt som sista
+    with pytest.raises(ValueError):
+        decrypt(header + b"".join(parts[:-1]))
+    with pytest.raises(ValueError):
+        decrypt(header)
+
+
+def test_truncated_inside_block(tmp_path):
+    data = encrypt(tmp_path, os.urandom(2 * CHUNK))
+    with pytest.raises(ValueError):
+        decrypt(data[:-1])
+
+
+def test_reordered_blocks(tmp_path):
+    data = encrypt(tmp_path, os.urandom(3 * CHUNK))
+    header, parts = blocks(data)
+    with pytest.raises(ValueError):
+        decrypt(header + parts[1] + parts[0] + parts[2])
+
+
+def test_modified_header(tmp_path):
+    data = bytearray(encrypt(tmp_path, os.urandom(CHUNK)))
+    # Sista byten i huvudet (blockstorleken) är associerad data till alla block
+    data[HEADER_SIZE - 1] ^= 1
+    with pytest.raises(ValueError):
+        decrypt(bytes(data))
+
+
+def test_wrong_device_key(tmp_path):
+    data = encrypt(tmp_path, os.urandom(CHUNK))
+    with pytest.raises(ValueError, match="annan enhetsnyckel"):
+        decrypt(data, key=bytes(32))
+
+
+def test_not_encrypted():
+    with pytest.raises(ValueError):
+        decrypt(b"fLaC" + bytes(HEADER_SIZE))
+
+
+def test_unknown_cipher():
+    with pytest.raises(ValueError):
+        Encryptor(DEVICE_KEY, "rot13", CHUNK)
+
+
+def test_device_key_file(tmp_path):
+    path = tmp_path / "keys" / "device.key"
+    with pytest.raises(FileNotFoundError):
+        encryption.load_device_key(str(path), create=False)
+    key = encryption.load_device_key(str(path))
+    assert encryption.load_device_key(str(path), create=False) == key
+    assert path.stat().st_mode & 0o777 == 0o600
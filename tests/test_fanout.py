@@ -0,0 +1,79 @@
+import os
+import time
+import hashlib
+
+import pytest
+
+from fanout import fan_out
+
+PAYLOAD = os.urandom(1_000_000)
+CHUNK = 64 * 1024
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = tmp_path / "meeting.flac"
+    path.write_bytes(PAYLOAD)
+    return path
+
+
+def reader(read_size: int, delay: float = 0.0, fail_after: int = None):
+    """Uppladdning som läser strömmen i block och returnerar SHA-256 för det lästa"""
+    def upload(target, stream):
+        assert stream.size == len(PAYLOAD)
+        digest, total = hashlib.sha256(), 0
+        while True:
+            data = stream.read(read_size)
+            if not data:
+                break
+            digest.update(data)
+            total += len(data)
+            if fail_after is not None and total >= fail_after:
+                raise ConnectionError("anslutningen bröts")
+            time.sleep(delay)
+        return True, f"{total}:{digest.hexdigest()}"
+    return upload
+
+
+def run(path, uploads):
+    return fan_out(path, list(uploads), lambda target, stream: uploads[target](target, stream), chunk_size=CHUNK)
+
+
+def expected() -> str:
+    return f"{len(PAYLOAD)}:{hashlib.sha256(PAYLOAD).hexdigest()}"
+
+
+def test_all_targets_get_identical_bytes(path):
+    results = run(path, {"s3": reader(8192), "http": reader(CHUNK * 3), "n8n": reader(-1)})
+    assert results == {target: (True, expected()) for target in ("s3", "http", "n8n")}
+
+
+def test_slow_target_does_not_corrupt_others(path):
+    results = run(path, {"slow": reader(4096, delay=0.001), "fast": reader(CHUNK)})
+    assert results == {"slow": (True, expected()), "fast": (True, expected())}
+
+
+def test_failing_target_is_disconnected(path):
+    start = time.monotonic()
+    results = run(path, {"broken": reader(CHUNK, fail_after=CHUNK * 2), "ok": reader(CHUNK, delay=0.001)})
+    assert results["broken"] == (False, "broken-fel: anslutningen bröts")
+    assert results["ok"] == (True, expected())
+    assert time.monotonic() - start < 10
+
+
+def test_target_that_already_has_file(path):
+    # T.ex. S3 där objektet redan finns: strömmen läses aldrig
+    results = run(path, {"s3": lambda target, stream: (True, "fanns redan"), "n8n": reader(CHUNK)})
+    assert results == {"s3": (True, "fanns redan"), "n8n": (True, expected())}
+
+
+def test_all_targets_failing_stops_reading(path):
+    results = run(path, {"a": reader(CHUNK, fail_after=1), "b": reader(CHUNK, fail_after=1)})
+    assert {ok for ok, _ in results.values()} == {False}
+
+
+def test_read_error_reaches_every_target(tmp_path):
+    # En katalog går att stat:a men inte öppna som fil
+    results = fan_out(tmp_path, ["a", "b"], lambda target, stream: (True, stream.read()))
+    assert set(results) == {"a", "b"}
+    assert all(not ok and "Läsfel vid uppladdning" in info for ok, info in results.values())
@@ -0,0 +1,212 @@
+import io
+import json
+import hashlib
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+import pytest
+
+import pipeline
+import meetrec_gateway
+from meetrec_gateway import (ChunkedReader, Forwarder, LimitedReader, MultipartReader, Spool,
+                             StubBackendHandler, start_stub_backend)
+
+BOUNDARY = "meetrec-test-boundary"
+
+
+class TrickleStream(io.BytesIO):
+    """Returnerar högst `step` byte per read(), som en långsam socket"""
+
+    def __init__(self, data: bytes, step: int):
+        super().__init__(data)
+        self.step = step
+
+    def read(self, size=-1):
+        return super().read(min(self.step, size if size >= 0 else self.step))
+
+
+def multipart(*parts) -> bytes:
+    body = b""
+    for headers, data in parts:
+        body += f"--{BOUNDARY}\r\n".encode()
+        for key, value in headers.items():
+            body += f"{key}: {value}\r\n".encode()
+        body += b"\r\n" + data + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+def file_part(filename: str, data: bytes):
+    return {"Content-Disposition": f'form-data; name="file"; filename="{filename}"'}, data
+
+
+def field_part(name: str, value: str):
+    return {"Content-Disposition": f'form-data; name="{name}"'}, value.encode()
+
+
+def read_parts(stream, chunk_size):
+    reader = MultipartReader(stream, BOUNDARY, chunk_size=chunk_size)
+    return [(headers, b"".join(data)) for headers, data in reader.parts()]
+
+
+def chunked(data: bytes, size: int) -> bytes:
+    out = b""
+    for i in range(0, len(data), size):
+        chunk = data[i:i + size]
+        out += f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n"
+    return out + b"0\r\n\r\n"
+
+
+# Filinnehåll som liknar gränsen utan att vara den
+PAYLOAD = b"\r\n--meetrec-test\r\n-" + bytes(range(256)) * 40 + b"\r\n--"
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, len(BOUNDARY) + 3, 4096])
+def test_multipart_boundary_split_across_reads(chunk_size):
+    body = multipart(field_part("sha256", "abc"), file_part("a.flac", PAYLOAD))
+    parts = read_parts(io.BytesIO(body), chunk_size)
+    assert [p[1] for p in parts] == [b"abc", PAYLOAD]
+    assert parts[1][0]["content-disposition"].endswith('filename="a.flac"')
+
+
+def test_multipart_trickling_stream():
+    body = multipart(file_part("a.flac", PAYLOAD))
+    parts = read_parts(LimitedReader(TrickleStream(body, 5), len(body)), 64)
+    assert parts[0][1] == PAYLOAD
+
+
+def test_multipart_unread_part_is_skipped():
+    body = multipart(file_part("a.flac", PAYLOAD), field_part("room", "A"))
+    reader = MultipartReader(io.BytesIO(body), BOUNDARY, chunk_size=13)
+    names = [headers["content-disposition"] for headers, _data in reader.parts()]
+    assert len(names) == 2 and names[1] == 'form-data; name="room"'
+
+
+def test_multipart_truncated_body():
+    body = multipart(file_part("a.flac", PAYLOAD))[:-40]
+    with pytest.raises(ValueError):
+        read_parts(io.BytesIO(body), 64)
+
+
+@pytest.mark.parametrize("size", [1, 10, 1000])
+def test_multipart_over_chunked_body(size):
+    body = multipart(field_part("sha256", "abc"), file_part("a.flac", PAYLOAD))
+    parts = read_parts(ChunkedReader(io.BytesIO(chunked(body, size))), 17)
+    assert [p[1] for p in parts] == [b"abc", PAYLOAD]
+
+
+def test_chunked_reader_rejects_garbage():
+    with pytest.raises(ValueError):
+        ChunkedReader(io.BytesIO(b"zz\r\nabc\r\n")).read(10)
+
+
+def receive(spool: Spool, filename: str, data: bytes):
+    tmp, digest = spool.receive(filename, iter([data[:10], data[10:]]))
+    return spool.add(tmp, filename, digest, "127.0.0.1")
+
+
+def test_spool_dedupes_identical_content(tmp_path):
+    spool = Spool(tmp_path)
+    first = receive(spool, "a.flac", PAYLOAD)
+    second = receive(spool, "b.flac", PAYLOAD)
+    assert first["duplicate"] is False and second["duplicate"] is True
+    assert first["sha256"] == second["sha256"] == hashlib.sha256(PAYLOAD).hexdigest()
+    assert spool.pending_count() == 1
+    assert list((tmp_path / "incoming").iterdir()) == []
+
+
+def test_spool_rejects_wrong_md5(tmp_path):
+    spool = Spool(tmp_path)
+    with pytest.raises(ValueError):
+        spool.receive("a.flac", iter([PAYLOAD]), content_md5="AAAAAAAAAAAAAAAAAAAAAA==")
+    assert list((tmp_path / "incoming").iterdir()) == []
+
+
+def test_spool_recovers_after_restart(tmp_path):
+    spool = Spool(tmp_path)
+    pending = receive(spool, "a.flac", PAYLOAD)
+    done = receive(spool, "b.flac", b"other content")
+    spool.update(done["sha256"], status="forwarded", forwarded_at=0.0)
+    # Avbruten mottagning från förra körningen
+    (tmp_path / "incoming" / "half-c.flac").write_bytes(b"partial")
+
+    restarted = Spool(tmp_path)
+    assert list((tmp_path / "incoming").iterdir()) == []
+    assert restarted.pending_count() == 1
+    assert [item["sha256"] for item in restarted.due(10)] == [pending["sha256"]]
+    # Redan vidarebefordrat innehåll tas inte emot igen
+    assert receive(restarted, "b.flac", b"other content")["duplicate"] is True
+    assert restarted.prune(0) == 1
+    assert not restarted.path_for(json.loads((tmp_path / done["sha256"] / "meta.json").read_text())).exists()
+
+
+@pytest.fixture
+def stub_backend():
+    StubBackendHandler.received = []
+    server, url = start_stub_backend()
+    yield url
+    server.shutdown()
+    server.server_close()
+
+
+def test_forwarder_round_trip(tmp_path, stub_backend):
+    spool = Spool(tmp_path)
+    items = [receive(spool, f"{n}.flac", PAYLOAD + bytes([n])) for n in range(3)]
+    forwarder = Forwarder(spool, settings={"upload_target": "http", "http_upload_url": stub_backend,
+                                           "http_auth_header": ""}, batch_size=2, concurrency=2)
+    try:
+        assert forwarder.forward_batch() == 2
+        assert forwarder.forward_batch() == 1
+        assert forwarder.forward_batch() == 0
+    finally:
+        forwarder.stop()
+    assert sorted(r["sha256"] for r in StubBackendHandler.received) == sorted(i["sha256"] for i in items)
+    assert all(r["bytes"] >= len(PAYLOAD) for r in StubBackendHandler.received)
+    assert spool.summary()["items"] == {"forwarded": {"count": 3, "bytes": 3 * (len(PAYLOAD) + 1)}}
+
+
+def test_forwarder_backs_off_on_failure(tmp_path, monkeypatch):
+    monkeypatch.setattr(meetrec_gateway, "GATEWAY_RETRY_DELAY", 30.0)
+    monkeypatch.setattr(pipeline, "UPLOAD_RETRIES", 0)
+    spool = Spool(tmp_path)
+    item = receive(spool, "a.flac", PAYLOAD)
+    # Ingen lyssnar på porten
+    forwarder = Forwarder(spool, settings={"upload_target": "http", "http_upload_url": "http://127.0.0.1:9/x",
+                                           "http_auth_header": ""})
+    try:
+        assert forwarder.forward_batch() == 1
+        assert forwarder.forward_batch() == 0
+    finally:
+        forwarder.stop()
+    meta = json.loads((tmp_path / item["sha256"] / "meta.json").read_text())
+    assert meta["status"] == "pending" and meta["attempts"] == 1 and meta["error"]
+
+
+def post_upload(url: str, body: bytes, headers: dict):
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=5)
+    conn.request("POST", "/upload", body, {"Content-Type": f"multipart/form-data; boundary={BOUNDARY}",
+                                            **headers})
+    response = conn.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def test_gateway_requires_token_off_loopback(tmp_path):
+    with pytest.raises(ValueError):
+        meetrec_gateway.create_gateway(tmp_path, host="0.0.0.0", port=0, token=None)
+
+
+def test_gateway_checks_token(tmp_path):
+    server, forwarder = meetrec_gateway.create_gateway(tmp_path, host="127.0.0.1", port=0, token="s3cret")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    body = multipart(file_part("a.flac", PAYLOAD))
+    try:
+        assert post_upload(url, body, {})[0] == 401
+        assert post_upload(url, body, {"Authorization": "Bearer wrong"})[0] == 401
+        status, result = post_upload(url, body, {"Authorization": "Bearer s3cret"})
+        assert status == 200 and result["sha256"] == hashlib.sha256(PAYLOAD).hexdigest()
+    finally:
+        server.shutdown()
+        server.server_close()
+        forwarder.stop()
@@ -0,0 +1,139 @@
+import json
+import socket
+import http.client
+
+import pytest
+
+from http_api import APIServer, is_loopback
+from scheduler import normalize_result, validate_params
+
+TOKEN = "s3cret"
+WS_HEADERS = {"Upgrade": "websocket", "Connection": "Upgrade",
+              "Sec-WebSocket-Key": "dGhlIHNhbXBsZSBub25jZQ==", "Sec-WebSocket-Version": "13"}
+
+
+@pytest.fixture
+def api():
+    server = APIServer({"host": "127.0.0.1", "port": 0, "token": TOKEN, "origins": ["http://panel.local"]})
+    server.port = free_port()
+    calls = []
+    server.set_callbacks(on_start=lambda params: calls.append(("start", params)) or (True, "started"),
+                         on_stop=lambda: calls.append(("stop", None)),
+                         status=lambda: {"state": "ready"})
+    server.calls = calls
+    server.start()
+    yield server
+    server.stop()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def request(api, method, path, body=None, headers=None):
+    conn = http.client.HTTPConnection("127.0.0.1", api.port, timeout=5)
+    conn.request(method, path, body, headers or {})
+    response = conn.getresponse()
+    data = response.read()
+    conn.close()
+    return response.status, response, data
+
+
+def auth(**headers):
+    return {"Authorization": f"Bearer {TOKEN}", **headers}
+
+
+def upgrade(api, path, origin=None) -> bytes:
+    """Status-raden för en WebSocket-uppgradering"""
+    with socket.create_connection(("127.0.0.1", api.port), timeout=5) as sock:
+        lines = [f"GET {path} HTTP/1.1", f"Host: 127.0.0.1:{api.port}"]
+        lines += [f"{key}: {value}" for key, value in WS_HEADERS.items()]
+        if origin:
+            lines.append(f"Origin: {origin}")
+        sock.sendall(("\r\n".join(lines) + "\r\n\r\n").encode())
+        return sock.recv(1024).split(b"\r\n")[0]
+
+
+def test_is_loopback():
+    assert is_loopback("127.0.0.1") and is_loopback("::1") and is_loopback("localhost")
+    assert not is_loopback("0.0.0.0") and not is_loopback("192.168.1.10") and not is_loopback("meetrec.local")
+
+
+def test_refuses_lan_without_token():
+    with pytest.raises(ValueError):
+        APIServer({"host": "0.0.0.0", "port": 0}).start()
+
+
+def test_bearer_token_required(api):
+    assert request(api, "GET", "/api/status")[0] == 401
+    assert request(api, "GET", "/api/status", headers={"Authorization": "Bearer wrong"})[0] == 401
+    status, _, data = request(api, "GET", "/api/status", headers=auth())
+    assert status == 200 and json.loads(data) == {"state": "ready"}
+
+
+def test_query_token_only_on_websocket(api):
+    assert request(api, "GET", f"/api/status?token={TOKEN}")[0] == 401
+    status = request(api, "POST", f"/api/stop?token={TOKEN}", "{}", {"Content-Type": "application/json"})[0]
+    assert status == 401 and api.calls == []
+    assert upgrade(api, "/ws?token=wrong") == b"HTTP/1.1 401 Unauthorized"
+    assert upgrade(api, f"/ws?token={TOKEN}") == b"HTTP/1.1 101 Switching Protocols"
+
+
+def test_post_requires_json_content_type(api):
+    status = request(api, "POST", "/api/start", '{"room": "A"}', auth(**{"Content-Type": "text/plain"}))[0]
+    assert status == 415 and api.calls == []
+    status, _, data = request(api, "POST", "/api/start", '{"room": "A"}',
+                              auth(**{"Content-Type": "application/json; charset=utf-8"}))
+    assert status == 200 and json.loads(data)["result"] == "started"
+    assert api.calls == [("start", {"room": "A"})]
+
+
+def test_post_rejects_foreign_origin(api):
+    headers = auth(**{"Content-Type": "application/json", "Origin": "http://evil.example"})
+    assert request(api, "POST", "/api/stop", "{}", headers)[0] == 403
+    assert api.calls == []
+
+
+def test_cors_only_for_listed_origins(api):
+    _, response, _ = request(api, "GET", "/api/status", headers=auth(Origin="http://panel.local"))
+    assert response.getheader("Access-Control-Allow-Origin") == "http://panel.local"
+    _, response, _ = request(api, "GET", "/api/status", headers=auth(Origin="http://evil.example"))
+    assert response.getheader("Access-Control-Allow-Origin") is None
+    _, response, _ = request(api, "OPTIONS", "/api/start", headers={"Origin": "http://evil.example"})
+    assert response.getheader("Access-Control-Allow-Origin") is None
+
+
+def test_websocket_origin(api):
+    path = f"/ws?token={TOKEN}"
+    assert upgrade(api, path, origin="http://evil.example") == b"HTTP/1.1 403 Forbidden"
+    assert upgrade(api, path, origin="http://panel.local") == b"HTTP/1.1 101 Switching Protocols"
+    # Sida som serveras från samma värd som API:t
+    assert upgrade(api, path, origin=f"http://127.0.0.1:{api.port}") == b"HTTP/1.1 101 Switching Protocols"
+
+
+def test_run_command(api):
+    assert api.run_command("start", {"gain": "1.5", "codec": " OPUS "}) == (True, "started")
+    assert api.calls[-1] == ("start", {"gain": 1.5, "codec": "opus"})
+    assert api.run_command("stop") == (True, None)
+    assert api.run_command("start", {"gain": 50})[0] is False
+    assert api.run_command("start", {"volume": 1})[0] is False
+    assert api.run_command("reboot") == (False, "Okänt kommando: reboot")
+    assert api.run_command("test") == (False, "Kommandot stöds inte av enheten")
+
+
+def test_validate_params():
+    assert validate_params(None) == {}
+    assert validate_params({"gains": {"nord": "2"}, "max_duration": 60}) == {"gains": {"nord": 2.0},
+                                                                           "max_duration": 60.0}
+    for bad in ([1], {"gain": "loud"}, {"gains": {"nord": 20}}, {"gains": 1}, {"unknown": 1}):
+        with pytest.raises(ValueError):
+            validate_params(bad)
+
+
+def test_normalize_result():
+    assert normalize_result(None) == (True, None)
+    assert normalize_result(False) == (False, None)
+    assert normalize_result((0, "fel")) == (False, "fel")
+    assert normalize_result({"a": 1}) == (True, {"a": 1})
@@ -0,0 +1,190 @@
+import os
+import hashlib
+import logging
+import threading
+import multiprocessing
+
+import pytest
+
+import pipeline
+import integrity
+from integrity import HashingWriter, UploadIndex, digest_for
+from meetrec_gateway import StubBackendHandler, start_stub_backend
+
+PAYLOAD = os.urandom(200_000)
+
+
+def sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_hashing_writer_commit(tmp_path):
+    path = tmp_path / "a.flac"
+    writer = HashingWriter(path)
+    for i in range(0, len(PAYLOAD), 65536):
+        writer.write(PAYLOAD[i:i + 65536])
+    # Inget slutligt namn förrän commit()
+    assert not path.exists() and (tmp_path / "a.flac.tmp").exists()
+    digest = writer.commit()
+    assert path.read_bytes() == PAYLOAD and not (tmp_path / "a.flac.tmp").exists()
+    assert digest.sha256 == sha256(PAYLOAD)
+    assert digest.md5 == hashlib.md5(PAYLOAD).digest()
+    assert digest.size == len(PAYLOAD)
+    # Hashen från kodningen återanvänds utan att filen läses
+    assert digest_for(path) is digest
+
+
+def test_hashing_writer_abort(tmp_path):
+    writer = HashingWriter(tmp_path / "a.flac")
+    writer.write(PAYLOAD)
+    writer.abort()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_digest_for_rehashes_changed_file(tmp_path):
+    path = tmp_path / "a.flac"
+    writer = HashingWriter(path)
+    writer.write(PAYLOAD)
+    first = writer.commit()
+    path.write_bytes(PAYLOAD + b"x")
+    digest = digest_for(path)
+    assert digest is not first and digest.sha256 == sha256(PAYLOAD + b"x")
+
+
+def test_upload_index_persists(tmp_path):
+    path = tmp_path / "uploads.json"
+    digest = integrity.Digest(sha256(b"a"), b"", 1)
+    index = UploadIndex(path)
+    assert index.lookup("http://x", digest.sha256) is None
+    index.add("http://x", digest, "a.flac", "HTTP 200")
+    assert index.lookup("http://x", digest.sha256)["filename"] == "a.flac"
+    # Samma innehåll till ett annat mål är inte levererat
+    assert index.lookup("s3://bucket", digest.sha256) is None
+    # En annan process (t.ex. meetrec_backlog.py) ser leveransen
+    assert UploadIndex(path).lookup("http://x", digest.sha256)["info"] == "HTTP 200"
+
+
+def test_upload_index_drops_oldest(tmp_path):
+    index = UploadIndex(tmp_path / "uploads.json", max_entries=3)
+    digests = [integrity.Digest(sha256(bytes([n])), b"", 1) for n in range(5)]
+    for n, digest in enumerate(digests):
+        index.add("t", digest, f"{n}.flac", "ok")
+    assert [index.lookup("t", d.sha256) is not None for d in digests] == [False, False, True, True, True]
+
+
+def add_entries(path, start, count):
+    index = UploadIndex(path)
+    for n in range(start, start + count):
+        index.add("t", integrity.Digest(sha256(str(n).encode()), b"", n), f"{n}.flac", "ok")
+
+
+def test_upload_index_concurrent_writers(tmp_path):
+    path = tmp_path / "uploads.json"
+    # Två trådar i samma process och två processer med egna instanser
+    threads = [threading.Thread(target=add_entries, args=(path, n * 20, 20)) for n in range(2)]
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=add_entries, args=(path, 100 + n * 20, 20)) for n in range(2)]
+    for worker in threads + processes:
+        worker.start()
+    for worker in threads + processes:
+        worker.join(30)
+    assert all(p.exitcode == 0 for p in processes)
+    # Läs-ändra-skriv under fillåset: ingen leverans skrivs över av en annan skrivare
+    index = UploadIndex(path)
+    numbers = list(range(40)) + list(range(100, 140))
+    assert all(index.lookup("t", sha256(str(n).encode())) for n in numbers)
+
+
+# ---------- Hoppa över innehåll som redan levererats (pipeline.py) ----------
+
+
+@pytest.fixture
+def uploads(tmp_path, monkeypatch):
+    index = UploadIndex(tmp_path / "uploads.json")
+    monkeypatch.setattr(pipeline, "UPLOADS", index)
+    monkeypatch.setattr(pipeline, "UPLOAD_RETRIES", 0)
+    return index
+
+
+@pytest.fixture
+def stub_backend():
+    StubBackendHandler.received = []
+    server, url = start_stub_backend()
+    yield {"upload_target": "http", "http_upload_url": url, "http_auth_header": ""}
+    server.shutdown()
+    server.server_close()
+
+
+def test_upload_skips_delivered_content(tmp_path, uploads, stub_backend):
+    path = tmp_path / "meeting.flac"
+    path.write_bytes(PAYLOAD)
+    result = pipeline.upload_to_targets(path, stub_backend)
+    assert result["http"]["ok"] and result["http"]["attempts"] == 1
+    assert [r["sha256"] for r in StubBackendHandler.received] == [sha256(PAYLOAD)]
+
+    # Samma innehåll igen (t.ex. ett jobb som köats om): ingen ny uppladdning
+    result = pipeline.upload_to_targets(path, stub_backend)
+    assert result["http"]["ok"] and result["http"]["attempts"] == 0
+    assert result["http"]["info"].startswith("Redan uppladdad (meeting.flac)")
+    assert len(StubBackendHandler.received) == 1
+
+    # Ändrat innehåll under samma namn laddas upp igen
+    path.write_bytes(PAYLOAD + b"x")
+    result = pipeline.upload_to_targets(path, stub_backend)
+    assert result["http"]["attempts"] == 1
+    assert [r["sha256"] for r in StubBackendHandler.received] == [sha256(PAYLOAD), sha256(PAYLOAD + b"x")]
+
+
+def test_failed_upload_not_indexed(tmp_path, uploads):
+    path = tmp_path / "meeting.flac"
+    path.write_bytes(PAYLOAD)
+    settings = {"upload_target": "http", "http_upload_url": "http://127.0.0.1:9/x", "http_auth_header": ""}
+    assert not pipeline.upload_to_targets(path, settings)["http"]["ok"]
+    assert uploads.lookup("http://127.0.0.1:9/x", sha256(PAYLOAD)) is None
+
+
+# ---------- Kontrollen mot S3 innan uppladdning ----------
+
+
+@pytest.fixture
+def s3_stub(monkeypatch):
+    boto3 = pytest.importorskip("boto3")
+    from botocore.stub import Stubber
+    client = boto3.session.Session(region_name="eu-north-1", aws_access_key_id="test",
+                                   aws_secret_access_key="test").client("s3")
+    stubber = Stubber(client)
+
+    class Session:
+        def __init__(self, region_name=None):
+            pass
+
+        def client(self, service, endpoint_url=None):
+            return client
+
+    monkeypatch.setattr(boto3.session, "Session", Session)
+    with stubber:
+        yield stubber
+
+
+def s3_upload(tmp_path):
+    path = tmp_path / "meeting.flac"
+    path.write_bytes(PAYLOAD)
+    cfg = {"aws_region": "eu-north-1", "s3_endpoint_url": None, "s3_bucket": "bucket"}
+    return pipeline._upload_to_target(path, cfg, "s3", digest_for(path))
+
+
+def test_s3_existing_object_skipped(tmp_path, s3_stub):
+    s3_stub.add_response("head_object", {"Metadata": {"sha256": sha256(PAYLOAD)}},
+                         {"Bucket": "bucket", "Key": "meetings/meeting.flac"})
+    assert s3_upload(tmp_path) == (True, "s3://bucket/meetings/meeting.flac (fanns redan)")
+
+
+@pytest.mark.parametrize("code, status, warned", [("404", 404, False), ("NoSuchKey", 404, False),
+                                                  ("403", 403, True)])
+def test_s3_head_errors(tmp_path, s3_stub, caplog, code, status, warned):
+    s3_stub.add_client_error("head_object", service_error_code=code, http_status_code=status)
+    with caplog.at_level(logging.WARNING, logger="pipeline"):
+        ok, info = s3_upload(tmp_path)
+    # Kontrollen stoppar inte uppladdningen (som här misslyckas eftersom stubben saknar svar)
+    assert not ok and info.startswith("S3-fel:")
+    assert ("Kunde inte kontrollera s3://bucket/meetings/meeting.flac" in caplog.text) is warned
@@ -0,0 +1,86 @@
+import io
+import os
+
+import pytest
+
+from multipart import MultipartEncoder
+from meetrec_gateway import MultipartReader
+
+PAYLOAD = os.urandom(300_000)
+
+
+class SizedStream(io.BytesIO):
+    """Ström med känd storlek, som fanout.TeeStream"""
+
+    def __init__(self, data: bytes):
+        super().__init__(data)
+        self.size = len(data)
+
+
+def make_encoder(tmp_path, chunk_size=65536, **extra_files):
+    path = tmp_path / "meeting.flac"
+    path.write_bytes(PAYLOAD)
+    files = {"file": ("meeting.flac", path, "audio/flac", {"Content-MD5": "abc=="}), **extra_files}
+    return MultipartEncoder({"room": "Styrelserummet", "duration": 12.5}, files, chunk_size=chunk_size), path
+
+
+def parse(encoder, body: bytes):
+    reader = MultipartReader(io.BytesIO(body), encoder.boundary)
+    return [(headers, b"".join(data)) for headers, data in reader.parts()]
+
+
+@pytest.mark.parametrize("chunk_size", [1000, 65536])
+def test_length_matches_streamed_bytes(tmp_path, chunk_size):
+    encoder, _ = make_encoder(tmp_path, chunk_size=chunk_size,
+                              features=("meeting.features.json.gz", SizedStream(b"x" * 5000), "application/gzip", None))
+    body = b"".join(encoder)
+    assert len(encoder) == len(body)
+    parts = parse(encoder, body)
+    assert [data for _, data in parts] == [b"Styrelserummet", b"12.5", PAYLOAD, b"x" * 5000]
+    headers = parts[2][0]
+    assert headers["content-type"] == "audio/flac" and headers["content-md5"] == "abc=="
+    assert 'filename="meeting.flac"' in headers["content-disposition"]
+
+
+def test_read_sizes(tmp_path):
+    encoder, _ = make_encoder(tmp_path)
+    pieces = []
+    for size in (1, 10, 100000, 7):
+        pieces.append(encoder.read(size))
+        assert len(pieces[-1]) == size
+    pieces.append(encoder.read())
+    assert encoder.read(10) == b""
+    assert len(b"".join(pieces)) == len(encoder)
+
+
+def test_quotes_names(tmp_path):
+    encoder = MultipartEncoder(files={"file": ('a"b\r\n.flac', SizedStream(b"x"), "audio/flac", None)})
+    assert b'filename="a\\"b.flac"' in b"".join(encoder)
+
+
+def test_file_shrinks_during_upload(tmp_path):
+    encoder, path = make_encoder(tmp_path, chunk_size=1000)
+    first = encoder.read(2000)
+    assert first
+    # Content-Length är redan satt när filen trunkeras
+    path.write_bytes(PAYLOAD[:1000])
+    with pytest.raises(IOError, match="ändrades under uppladdning"):
+        b"".join(encoder)
+
+
+def test_file_grows_during_upload(tmp_path):
+    encoder, path = make_encoder(tmp_path, chunk_size=1000)
+    encoder.read(2000)
+    with open(path, "ab") as f:
+        f.write(b"mer ljud")
+    # Bara den storlek som angavs i Content-Length skickas
+    body = encoder.read(2000) + encoder.read()
+    assert len(body) + 2000 == len(encoder)
+
+
+def test_stream_shorter_than_size():
+    stream = SizedStream(b"x" * 100)
+    stream.size = 200
+    encoder = MultipartEncoder(files={"file": ("a.flac", stream, "audio/flac", None)})
+    with pytest.raises(IOError):
+        encoder.read()
@@ -0,0 +1,135 @@
+import sys
+import time
+import subprocess
+
+import pytest
+
+import priority
+from priority import JobThrottle, job_command, parse_cpus
+
+needs_proc = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="kräver /proc")
+
+
+@pytest.mark.parametrize("value, cpus", [
+    ("2,3", {2, 3}),
+    ("0-1,3", {0, 1, 3}),
+    (" 1 , 1-2 ", {1, 2}),
+    ("", None),
+    (",", None),
+    (None, None),
+])
+def test_parse_cpus(value, cpus):
+    assert parse_cpus(value) == cpus
+
+
+@pytest.mark.parametrize("value", ["a", "1-", "2,x-3"])
+def test_parse_cpus_invalid(value):
+    with pytest.raises(ValueError):
+        parse_cpus(value)
+
+
+def test_job_command(monkeypatch):
+    monkeypatch.setattr(priority.shutil, "which", lambda name: f"/usr/bin/{name}")
+    monkeypatch.setattr(priority, "JOB_IOPRIO", "idle")
+    assert job_command(["ffmpeg", "-i", "a.wav"]) == ["ionice", "-c", "3", "ffmpeg", "-i", "a.wav"]
+    monkeypatch.setattr(priority, "JOB_IOPRIO", "")
+    assert job_command(["ffmpeg"]) == ["ffmpeg"]
+    # Saknas programmet ska felet gälla programmet, inte ionice
+    monkeypatch.setattr(priority, "JOB_IOPRIO", "idle")
+    monkeypatch.setattr(priority.shutil, "which", lambda name: None if name == "ffmpeg" else f"/usr/bin/{name}")
+    assert job_command(["ffmpeg"]) == ["ffmpeg"]
+
+
+# ---------- Paus av kodningsjobb vid överspill ----------
+
+
+def stopped(proc) -> bool:
+    """Processen är stoppad (SIGSTOP) enligt /proc"""
+    with open(f"/proc/{proc.pid}/stat") as f:
+        return f.read().rsplit(")", 1)[1].split()[0] in ("T", "t")
+
+
+def wait_for(condition, timeout=3.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def job():
+    proc = subprocess.Popen(["sleep", "60"])
+    yield proc
+    proc.kill()
+    proc.wait()
+
+
+@needs_proc
+def test_xrun_pauses_and_resumes(job):
+    throttle = JobThrottle(pause_s=0.3)
+    with throttle.running(job):
+        started = time.monotonic()
+        throttle.xrun()
+        assert wait_for(lambda: stopped(job))
+        assert wait_for(lambda: not stopped(job))
+        assert time.monotonic() - started >= 0.3
+        assert wait_for(lambda: not throttle.paused)
+    assert throttle.pauses == 1 and throttle.paused_s >= 0.3
+
+
+@needs_proc
+def test_new_xrun_extends_pause(job):
+    throttle = JobThrottle(pause_s=0.4)
+    with throttle.running(job):
+        started = time.monotonic()
+        throttle.xrun()
+        assert wait_for(lambda: stopped(job))
+        time.sleep(0.25)
+        throttle.xrun()
+        # Den första pausen skulle ha tagit slut här
+        time.sleep(0.25)
+        assert stopped(job) and throttle.paused
+        assert wait_for(lambda: not stopped(job))
+        assert time.monotonic() - started >= 0.65
+        assert wait_for(lambda: not throttle.paused)
+    assert throttle.pauses == 1
+
+
+@needs_proc
+def test_unregistered_job_continues(job):
+    throttle = JobThrottle(pause_s=5)
+    with throttle.running(job):
+        throttle.xrun()
+        assert wait_for(lambda: stopped(job))
+    # Processen som lämnar throttlingen mitt i pausen får SIGCONT direkt
+    assert throttle.paused
+    assert wait_for(lambda: not stopped(job), timeout=1)
+
+
+@needs_proc
+def test_job_started_during_pause_is_stopped(job):
+    throttle = JobThrottle(pause_s=0.5)
+    first = subprocess.Popen(["sleep", "60"])
+    try:
+        with throttle.running(first):
+            throttle.xrun()
+            assert wait_for(lambda: throttle.paused)
+            with throttle.running(job):
+                assert wait_for(lambda: stopped(job))
+                assert wait_for(lambda: not stopped(job))
+    finally:
+        first.kill()
+        first.wait()
+
+
+def test_xrun_without_jobs_or_disabled(job):
+    throttle = JobThrottle(pause_s=1)
+    throttle.xrun()
+    disabled = JobThrottle(pause_s=0)
+    with disabled.running(job):
+        disabled.xrun()
+        time.sleep(0.1)
+        assert not disabled.paused
+    assert throttle.pauses == 0 and disabled.pauses == 0
@@ -0,0 +1,110 @@
+import time
+import wave
+import shutil
+
+import pytest
+
+import capture
+import catalog
+import pipeline
+import audio_source
+from config_manager import ConfigManager
+from integrity import UploadIndex
+from meetrec_gateway import StubBackendHandler, start_stub_backend
+from recorder import Recorder
+
+needs_ffmpeg = pytest.mark.skipif(not shutil.which("ffmpeg"), reason="ffmpeg saknas")
+
+
+def wait_for(condition, timeout=30.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+@pytest.fixture
+def stub_backend():
+    StubBackendHandler.received = []
+    server, url = start_stub_backend()
+    yield url
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def recorder(tmp_path, monkeypatch, stub_backend):
+    # Emulerad mikrofonmatris i stället för arecord
+    monkeypatch.setattr(capture, "AUDIO_SOURCE", "synthetic")
+    monkeypatch.setattr(audio_source, "AUDIO_SOURCE", "synthetic")
+    monkeypatch.setattr(catalog, "CATALOG_DB", str(tmp_path / "catalog.db"))
+    monkeypatch.setattr(pipeline, "UPLOADS", UploadIndex(tmp_path / "uploads.json"))
+    monkeypatch.setattr(pipeline, "UPLOAD_RETRIES", 0)
+    config = ConfigManager(tmp_path / "config.json", save_delay=0)
+    config.update({"room": "Styrelserummet", "codec": "flac", "sample_rate": 16000, "capture_rate": 48000,
+                   "capture_channels": 1, "features_enabled": False, "upload_target": "http",
+                   "http_upload_url": stub_backend, "http_auth_header": ""})
+    audio_dir = tmp_path / "audio"
+    audio_dir.mkdir()
+    recorder = Recorder(config, audio_dir=audio_dir, devices="")
+    recorder.events = []
+    recorder.add_listener(lambda event, data: recorder.events.append((event, data)))
+    yield recorder
+    recorder.shutdown()
+
+
+def statuses(recorder):
+    return [data["status"] for event, data in recorder.events if event == "status"]
+
+
+def record(recorder, seconds=1.0):
+    ok, result = recorder.start({"gain": 1.5})
+    assert ok, result
+    status = recorder.status()
+    assert status["recording"] and status["status"] == "recording"
+    assert status["filename"] == result["filename"] and status["room"] == "Styrelserummet"
+    assert status["gain"] == 1.5
+    assert recorder.start() == (False, "Inspelning pågår redan")
+    time.sleep(seconds)
+    assert recorder.status()["elapsed"] >= seconds
+    ok, stopped = recorder.stop()
+    assert ok and stopped["filename"] == result["filename"]
+    assert not recorder.status()["recording"]
+    assert recorder.stop() == (False, "Ingen inspelning pågår")
+    # Efterbearbetningen körs klart i arbetspoolen
+    assert wait_for(lambda: statuses(recorder)[-1] in ("ready", "error"))
+    return recorder.audio_dir / result["filename"]
+
+
+def test_record_start_stop_status(recorder):
+    wav = record(recorder)
+    assert statuses(recorder)[:3] == ["recording", "processing", "converting"]
+    recordings = [data for event, data in recorder.events if event == "recording"]
+    assert [item["active"] for item in recordings] == [True, False]
+
+    # Inspelad i 48 kHz och resamplad till målfrekvensen före kodningen
+    with wave.open(str(wav), "rb") as w:
+        assert (w.getframerate(), w.getnchannels(), w.getsampwidth()) == (16000, 1, 2)
+        assert 0.8 * 16000 <= w.getnframes() <= 2.0 * 16000
+
+    item = recorder.catalog.get(wav.stem)
+    assert item["room"] == "Styrelserummet" and item["gain"] == 1.5 and item["codec"] == "flac"
+    assert 0.8 <= item["duration_s"] <= 2.0 and item["wav_bytes"] > 0
+    assert item["timings"]["resampling"] >= 0
+    if not shutil.which("ffmpeg"):
+        # Kodningen kräver ffmpeg; jobbet slutar med fel men WAV-filen ligger kvar
+        assert statuses(recorder)[-1] == "error" and item["status"] == "error"
+
+
+@needs_ffmpeg
+def test_record_encode_and_upload(recorder):
+    wav = record(recorder)
+    assert statuses(recorder)[-1] == "ready", recorder.last_status
+    complete = [data for event, data in recorder.events if event == "recording_complete"]
+    assert [data["filename"] for data in complete] == [f"{wav.stem}.flac"]
+    assert len(StubBackendHandler.received) == 1
+    item = recorder.catalog.get(wav.stem)
+    assert item["status"] == "uploaded" and item["file"] == f"{wav.stem}.flac"
+    assert item["sha256"] == StubBackendHandler.received[0]["sha256"]
@@ -0,0 +1,109 @@
+import wave
+
+import numpy as np
+import pytest
+
+from resample import PolyphaseResampler, ensure_samplerate, read_frames
+
+AMPLITUDE = 10000.0
+RATES = [44100, 48000]
+
+
+def tone(rate: int, freq: float, seconds: float = 1.0) -> np.ndarray:
+    t = np.arange(int(rate * seconds)) / rate
+    return AMPLITUDE * np.sin(2 * np.pi * freq * t)
+
+
+def resample(samples: np.ndarray, in_rate: int, out_rate: int, block: int = 4000) -> np.ndarray:
+    resampler = PolyphaseResampler(in_rate, out_rate)
+    out = [resampler.process(samples[i:i + block]) for i in range(0, len(samples), block)]
+    return np.concatenate(out + [resampler.flush()])[:, 0]
+
+
+def steady(samples: np.ndarray, margin: int = 2000) -> np.ndarray:
+    """Utan in- och utsvängningen vid filens början och slut"""
+    return samples[margin:-margin]
+
+
+def fit_tone(samples: np.ndarray, rate: int, freq: float, margin: int = 2000):
+    """Amplitud för tonen och nivån på resten (dB relativt insignalen)"""
+    t = steady(np.arange(len(samples)) / rate, margin)
+    basis = np.stack([np.sin(2 * np.pi * freq * t), np.cos(2 * np.pi * freq * t)], axis=1)
+    coef, *_ = np.linalg.lstsq(basis, steady(samples, margin), rcond=None)
+    rest = steady(samples, margin) - basis @ coef
+    return db(np.hypot(*coef) / AMPLITUDE), db(rms(rest) / rms_of_tone())
+
+
+def rms(samples: np.ndarray) -> float:
+    return float(np.sqrt(np.mean(samples ** 2)))
+
+
+def rms_of_tone() -> float:
+    return AMPLITUDE / np.sqrt(2)
+
+
+def db(ratio: float) -> float:
+    return 20 * np.log10(max(ratio, 1e-12))
+
+
+@pytest.mark.parametrize("in_rate", RATES)
+@pytest.mark.parametrize("freq", [100, 1000, 4000, 6000])
+def test_passband(in_rate, freq):
+    out = resample(tone(in_rate, freq), in_rate, 16000)
+    assert len(out) == 16000
+    gain, rest = fit_tone(out, 16000, freq)
+    assert abs(gain) < 0.05
+    # Ingen distorsion eller vikning av betydelse
+    assert rest < -90
+
+
+@pytest.mark.parametrize("in_rate", RATES)
+@pytest.mark.parametrize("freq", [9000, 10000, 12000, 15000, 20000])
+def test_stopband(in_rate, freq):
+    # Över målets Nyquist: skulle annars vikas ner i det hörbara bandet
+    out = resample(tone(in_rate, freq), in_rate, 16000)
+    assert db(rms(steady(out)) / rms_of_tone()) < -80
+
+
+@pytest.mark.parametrize("in_rate", RATES)
+def test_blocks_match_single_pass(in_rate):
+    samples = np.random.default_rng(1).normal(0, 3000, in_rate // 2)
+    whole = resample(samples, in_rate, 16000, block=len(samples))
+    for block in (1, 333, 4096):
+        np.testing.assert_allclose(resample(samples, in_rate, 16000, block=block), whole, atol=0.05)
+    # ceil(n_in * out_rate / in_rate) sampel
+    assert len(whole) == -(-len(samples) * 16000 // in_rate)
+
+
+def write_wav(path, rate: int, samples: np.ndarray, channels: int = 1):
+    with wave.open(str(path), "wb") as w:
+        w.setnchannels(channels)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(np.rint(samples).astype("<i2").tobytes())
+
+
+def test_ensure_samplerate_noop(tmp_path):
+    path = tmp_path / "meeting.wav"
+    write_wav(path, 16000, tone(16000, 1000))
+    before = path.read_bytes()
+    mtime = path.stat().st_mtime_ns
+    assert ensure_samplerate(path, 16000) is None
+    assert path.read_bytes() == before and path.stat().st_mtime_ns == mtime
+
+
+@pytest.mark.parametrize("in_rate", RATES)
+def test_ensure_samplerate_converts_in_place(tmp_path, in_rate):
+    path = tmp_path / "meeting.wav"
+    left, right = tone(in_rate, 1000), tone(in_rate, 3000)
+    write_wav(path, in_rate, np.stack([left, right], axis=1).ravel(), channels=2)
+    assert ensure_samplerate(path, 16000) == in_rate
+    assert not (tmp_path / "meeting.wav.tmp").exists()
+    with wave.open(str(path), "rb") as w:
+        assert (w.getframerate(), w.getnchannels(), w.getsampwidth()) == (16000, 2, 2)
+        frames = read_frames(w, w.getnframes())
+    assert len(frames) == 16000
+    # Kanalerna hålls isär; avrundningen till 16 bit sätter golvet för resten
+    for channel, freq in ((0, 1000), (1, 3000)):
+        gain, rest = fit_tone(frames[:, channel], 16000, freq)
+        assert abs(gain) < 0.05 and rest < -70
@@ -0,0 +1,188 @@
+import json
+import time
+import threading
+from datetime import datetime, timezone
+
+import pytest
+
+import mqtt_client
+from scheduler import CommandScheduler, parse_timestamp
+
+needs_mqtt = pytest.mark.skipif(not mqtt_client.MQTT_AVAILABLE, reason="paho-mqtt saknas")
+
+
+def test_parse_timestamp_numbers():
+    assert parse_timestamp(1767261600) == 1767261600.0
+    assert parse_timestamp(1767261600.5) == 1767261600.5
+    # Millisekunder (JavaScript Date.now())
+    assert parse_timestamp(1767261600123) == pytest.approx(1767261600.123)
+
+
+def test_parse_timestamp_iso():
+    utc = datetime(2026, 1, 1, 10, 0, tzinfo=timezone.utc).timestamp()
+    assert parse_timestamp("2026-01-01T10:00:00Z") == utc
+    assert parse_timestamp(" 2026-01-01T10:00:00+00:00 ") == utc
+    assert parse_timestamp("2026-01-01T12:00:00+02:00") == utc
+    assert parse_timestamp("2026-01-01T10:00:00.250Z") == utc + 0.25
+    # Utan tidszon: lokal tid
+    assert parse_timestamp("2026-01-01T10:00:00") == datetime(2026, 1, 1, 10, 0).timestamp()
+
+
+@pytest.mark.parametrize("value", [True, None, "", "i morgon", "2026-13-01T10:00:00", [1]])
+def test_parse_timestamp_invalid(value):
+    with pytest.raises(ValueError):
+        parse_timestamp(value)
+
+
+def test_scheduler_runs_in_time_order():
+    ran = []
+    done = threading.Event()
+    scheduler = CommandScheduler()
+    now = time.time()
+    scheduler.schedule(now + 0.15, lambda: (ran.append("c"), done.set()), "c")
+    scheduler.schedule(now + 0.05, lambda: ran.append("a"), "a")
+    scheduler.schedule(now + 0.10, lambda: ran.append("b"), "b")
+    assert [job["command"] for job in scheduler.list_jobs()] == ["a", "b", "c"]
+    scheduler.start()
+    try:
+        assert done.wait(2)
+    finally:
+        scheduler.stop()
+    assert ran == ["a", "b", "c"]
+    assert scheduler.list_jobs() == []
+
+
+def test_scheduler_cancel_and_replace():
+    ran = []
+    changes = []
+    done = threading.Event()
+    scheduler = CommandScheduler(on_change=changes.append)
+    now = time.time()
+    scheduler.schedule(now + 0.05, lambda: ran.append("cancelled"), "x", job_id="x")
+    scheduler.schedule(now + 0.05, lambda: ran.append("old"), "y", job_id="y")
+    # Samma jobb-ID ersätter det tidigare jobbet
+    scheduler.schedule(now + 0.10, lambda: ran.append("new"), "y", job_id="y")
+    scheduler.schedule(now + 0.05, lambda: ran.append("calendar"), "z", source="calendar")
+    scheduler.schedule(now + 0.15, done.set, "done")
+    assert scheduler.cancel("x") is True
+    assert scheduler.cancel("x") is False
+    assert scheduler.cancel_all(source="calendar") == 1
+    assert [job["command"] for job in changes[-1]] == ["y", "done"]
+    scheduler.start()
+    try:
+        assert done.wait(2)
+    finally:
+        scheduler.stop()
+    assert ran == ["new"]
+
+
+# ---------- Kommandoprotokollet och kalendern (mqtt_client.py) ----------
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(mqtt_client, "CALENDAR_STATE", str(tmp_path / "calendar.json"))
+    return make_client()
+
+
+def make_client():
+    client = mqtt_client.MQTTClient({"enabled": False})
+    client.starts, client.stops = [], []
+    client.on_start_callback = lambda params: client.starts.append(params) or (True, "started")
+    client.on_stop_callback = lambda: client.stops.append(True) or (True, "stopped")
+    return client
+
+
+def run_due(client):
+    """Låt schemaläggaren köra jobb som redan är förfallna"""
+    client.scheduler.start()
+    time.sleep(0.2)
+    client.scheduler.stop()
+
+
+@needs_mqtt
+def test_parse_command():
+    parse = mqtt_client.MQTTClient._parse_command
+    assert parse(" START ") == {"command": "start"}
+    assert parse('{"command": "Stop", "id": 7}') == {"command": "stop", "id": 7}
+    for bad in ("", "{}", '{"command": "start"', "{]"):
+        with pytest.raises(ValueError):
+            parse(bad)
+
+
+@needs_mqtt
+def test_dispatch_start_now_and_scheduled_stop(client):
+    stop_at = time.time() + 3600
+    ok, result = client._dispatch_command({"command": "start", "params": {"room": "A"}, "stop_at": stop_at})
+    assert ok and result["result"] == "started" and client.starts == [{"room": "A"}]
+    assert [job["command"] for job in result["scheduled"]] == ["stop"]
+    ok, result = client._dispatch_command({"command": "list_schedule"})
+    assert [job["command"] for job in result["jobs"]] == ["stop"]
+    assert client._dispatch_command({"command": "cancel", "all": True}) == (True, {"cancelled": 1})
+
+
+@needs_mqtt
+def test_dispatch_rejects_invalid(client):
+    with pytest.raises(ValueError):
+        client._dispatch_command({"command": "start", "start_at": time.time() + 60, "stop_at": time.time() + 30})
+    with pytest.raises(ValueError):
+        client._dispatch_command({"command": "start", "params": {"gain": 99}})
+    with pytest.raises(ValueError):
+        client._dispatch_command({"command": "cancel"})
+    assert client._dispatch_command({"command": "reboot"})[0] is False
+    assert client.starts == []
+
+
+def calendar_feed(**events):
+    return json.dumps({"events": [{"id": event_id, **times} for event_id, times in events.items()]})
+
+
+@needs_mqtt
+def test_calendar_event_in_progress_starts_once(client):
+    now = time.time()
+    feed = calendar_feed(m1={"start_at": now - 600, "stop_at": now + 3600})
+    client._handle_schedule_set(feed)
+    run_due(client)
+    assert len(client.starts) == 1
+    # Samma flöde igen (retained vid återanslutning): ingenting ändras
+    jobs = client.scheduler.list_jobs()
+    client._handle_schedule_set(feed)
+    assert client.scheduler.list_jobs() == jobs
+
+    # Omstart av tjänsten (t.ex. efter ett manuellt stopp) och flödet levereras igen
+    restarted = make_client()
+    restarted._handle_schedule_set(feed)
+    run_due(restarted)
+    assert restarted.starts == []
+    assert [job["job_id"] for job in restarted.scheduler.list_jobs()] == ["m1-stop"]
+
+
+@needs_mqtt
+def test_calendar_moved_event_starts_again(client):
+    now = time.time()
+    client._handle_schedule_set(calendar_feed(m1={"start_at": now - 600, "stop_at": now + 3600}))
+    run_due(client)
+    # Samma id men nya tider är en ny händelse
+    client._handle_schedule_set(calendar_feed(m1={"start_at": now - 60, "stop_at": now + 7200}))
+    run_due(client)
+    assert len(client.starts) == 2
+
+
+@needs_mqtt
+def test_calendar_without_stop_at(client):
+    now = time.time()
+    ok, result = client._apply_calendar({"events": [
+        {"id": "past", "start_at": now - 60},
+        {"id": "future", "start_at": now + 3600},
+        {"id": "over", "start_at": now - 7200, "stop_at": now - 3600},
+        {"id": "bad"},
+    ]})
+    assert ok
+    assert [job["job_id"] for job in result["scheduled"]] == ["future-start"]
+    assert {item["id"]: item["reason"] for item in result["skipped"]} == {
+        "past": "passerat (saknar stop_at)",
+        "over": "passerat",
+        "bad": "start_at saknas",
+    }
+    run_due(client)
+    assert client.starts == []
@@ -0,0 +1,16 @@
+from pipeline import recording_sidecars
+
+
+def test_recording_sidecars_found_without_wav(tmp_path):
+    wav = tmp_path / "meeting-20250101-101010.wav"
+    assert recording_sidecars(wav) == {}
+    names = {
+        "features": "meeting-20250101-101010.features.json.gz",
+        "peaks": "meeting-20250101-101010.peaks.json.gz",
+        "spectrogram": "meeting-20250101-101010.spectrogram.png",
+        "gap": "meeting-20250101-101010.gap.json",
+    }
+    for name in names.values():
+        (tmp_path / name).write_bytes(b"x")
+    found = recording_sidecars(wav)
+    assert {kind: path.name for kind, path in found.items()} == names
@@ -0,0 +1,46 @@
+import time
+import threading
+
+import vad
+from vad import VoiceActivation
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_no_restart_after_manual_stop_until_silence(monkeypatch):
+    monkeypatch.setattr(vad, "CHECK_INTERVAL_S", 0.02)
+    state = {"recording": True, "starts": 0}
+
+    def on_start():
+        state["starts"] += 1
+        state["recording"] = True
+
+    voice = VoiceActivation(on_start, lambda: None, lambda: state["recording"],
+                            start_speech_s=1.0, stop_silence_s=300, rearm_silence_s=0.3)
+    stop = threading.Event()
+    threading.Thread(target=voice._loop, args=(stop,), daemon=True).start()
+    try:
+        time.sleep(0.1)
+        # Manuellt stopp mitt i ett samtal som fortsätter
+        state["recording"] = False
+        assert wait_for(lambda: not voice.armed)
+        assert voice._reset
+        for _ in range(10):
+            voice.speech_s, voice.last_speech = 2.0, time.monotonic()
+            time.sleep(0.02)
+        assert state["starts"] == 0
+        # Tystnad (ljud-callbacken har tömt fönstret): röststyrningen laddas om
+        voice.speech_s = 0.0
+        assert wait_for(lambda: voice.armed)
+        assert state["starts"] == 0
+        voice.speech_s = 2.0
+        assert wait_for(lambda: state["starts"] == 1)
+    finally:
+        stop.set()